@@ -0,0 +1,200 @@
+"""
+Controle de admissão das requisições que chegam ao GA4 e ao Search Console.
+
+Em rajadas, aceitar tudo só transforma a cota esgotada do Google em erros
+500 para todos. Aqui cada API tem um limite de chamadas simultâneas com uma
+fila de espera curta, e cada cliente tem um limite de requisições
+simultâneas e de taxa (token bucket). O que não cabe é recusado na hora,
+com o motivo e uma estimativa de quando tentar de novo (Retry-After).
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+ADMISSAO_GA4_MAX_EM_VOO = int(os.getenv("ADMISSAO_GA4_MAX_EM_VOO", "8"))
+ADMISSAO_SC_MAX_EM_VOO = int(os.getenv("ADMISSAO_SC_MAX_EM_VOO", "8"))
+ADMISSAO_FILA_MAX = int(os.getenv("ADMISSAO_FILA_MAX", "16"))
+ADMISSAO_ESPERA_MAX_SEGUNDOS = float(os.getenv("ADMISSAO_ESPERA_MAX_SEGUNDOS", "5"))
+CLIENTE_MAX_SIMULTANEAS = int(os.getenv("CLIENTE_MAX_SIMULTANEAS", "4"))
+CLIENTE_TAXA_POR_MINUTO = float(os.getenv("CLIENTE_TAXA_POR_MINUTO", "60"))
+CLIENTE_RAJADA = int(os.getenv("CLIENTE_RAJADA", "10"))
+# Proxies reversos à frente da API; cada um acrescenta o IP de quem o chamou ao X-Forwarded-For
+ADMISSAO_PROXIES_CONFIAVEIS = int(os.getenv("ADMISSAO_PROXIES_CONFIAVEIS", "0"))
+# Clientes guardados antes de descartar os que estão ociosos
+MAX_CLIENTES_RASTREADOS = 10000
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"ADMISSION DEBUG: {message}", file=sys.stderr)
+
+
+class Sobrecarga(Exception):
+    """Levantada quando a requisição é recusada; traz o motivo e os segundos sugeridos para nova tentativa."""
+
+    def __init__(self, mensagem: str, motivo: str, retry_after: int):
+        super().__init__(mensagem)
+        self.motivo = motivo
+        self.retry_after = retry_after
+
+
+class LimiteUpstream:
+    """Chamadas simultâneas a uma API, com fila de espera limitada em tamanho e tempo."""
+
+    def __init__(self, nome: str, max_em_voo: int, max_fila: int = ADMISSAO_FILA_MAX,
+                 espera_max_segundos: float = ADMISSAO_ESPERA_MAX_SEGUNDOS):
+        self.nome = nome
+        self.max_em_voo = max_em_voo
+        self.max_fila = max_fila
+        self.espera_max_segundos = espera_max_segundos
+        self._cond = threading.Condition()
+        self.em_voo = 0
+        self.na_fila = 0
+        self.duracao_media = None
+        self.admitidas = 0
+        self.esperaram = 0
+        self.recusadas = 0
+
+    def retry_after(self) -> int:
+        """Segundos estimados até uma vaga: a fila atual escoando na duração média das chamadas."""
+        duracao = self.duracao_media or 1.0
+        return max(1, math.ceil(duracao * (self.na_fila + 1) / self.max_em_voo))
+
+    def _recusar(self, mensagem: str, motivo: str):
+        self.recusadas += 1
+        raise Sobrecarga(mensagem, motivo, self.retry_after())
+
+    @contextmanager
+    def admitir(self):
+        """Ocupa uma vaga durante o bloco, esperando na fila se preciso."""
+        with self._cond:
+            if self.em_voo >= self.max_em_voo:
+                if self.na_fila >= self.max_fila:
+                    self._recusar(f"{self.nome}: limite de chamadas simultâneas e fila de espera cheios", "fila_cheia")
+                self.na_fila += 1
+                self.esperaram += 1
+                limite = time.monotonic() + self.espera_max_segundos
+                try:
+                    while self.em_voo >= self.max_em_voo:
+                        restante = limite - time.monotonic()
+                        if restante <= 0:
+                            self._recusar(f"{self.nome}: sem vaga após {self.espera_max_segundos:g}s na fila", "espera_excedida")
+                        self._cond.wait(restante)
+                finally:
+                    self.na_fila -= 1
+            self.em_voo += 1
+            self.admitidas += 1
+
+        inicio = time.monotonic()
+        try:
+            yield
+        finally:
+            duracao = time.monotonic() - inicio
+            with self._cond:
+                self.em_voo -= 1
+                self.duracao_media = duracao if self.duracao_media is None else 0.8 * self.duracao_media + 0.2 * duracao
+                self._cond.notify()
+
+    def estatisticas(self) -> dict:
+        with self._cond:
+            return {
+                "max_em_voo": self.max_em_voo,
+                "em_voo": self.em_voo,
+                "na_fila": self.na_fila,
+                "max_fila": self.max_fila,
+                "duracao_media_segundos": round(self.duracao_media, 3) if self.duracao_media is not None else None,
+                "admitidas": self.admitidas,
+                "esperaram": self.esperaram,
+                "recusadas": self.recusadas
+            }
+
+
+class LimitesCliente:
+    """Taxa (token bucket) e requisições simultâneas por cliente."""
+
+    def __init__(self, max_simultaneas: int = CLIENTE_MAX_SIMULTANEAS, taxa_por_minuto: float = CLIENTE_TAXA_POR_MINUTO,
+                 rajada: int = CLIENTE_RAJADA):
+        self.max_simultaneas = max_simultaneas
+        self.taxa_por_segundo = taxa_por_minuto / 60
+        self.rajada = rajada
+        self._lock = threading.Lock()
+        self._clientes = {}
+        self.recusadas = {"taxa": 0, "simultaneas": 0}
+
+    def _podar(self, agora: float):
+        """Descarta clientes sem requisições em andamento e com o balde cheio (chamar com o lock)."""
+        for cliente in [c for c, e in self._clientes.items() if not e["em_andamento"] and self._fichas(e, agora) >= self.rajada]:
+            del self._clientes[cliente]
+
+    def _fichas(self, estado: dict, agora: float) -> float:
+        return min(self.rajada, estado["fichas"] + (agora - estado["atualizado"]) * self.taxa_por_segundo)
+
+    @contextmanager
+    def admitir(self, cliente: str):
+        """Consome uma ficha e ocupa uma vaga do cliente durante o bloco."""
+        agora = time.monotonic()
+        with self._lock:
+            estado = self._clientes.get(cliente)
+            if estado is None:
+                if len(self._clientes) >= MAX_CLIENTES_RASTREADOS:
+                    self._podar(agora)
+                estado = self._clientes[cliente] = {"fichas": self.rajada, "atualizado": agora, "em_andamento": 0}
+            estado["fichas"] = self._fichas(estado, agora)
+            estado["atualizado"] = agora
+            if estado["em_andamento"] >= self.max_simultaneas:
+                self.recusadas["simultaneas"] += 1
+                raise Sobrecarga(f"Limite de {self.max_simultaneas} requisições simultâneas por cliente atingido", "cliente_simultaneas", 1)
+            if estado["fichas"] < 1:
+                self.recusadas["taxa"] += 1
+                espera = math.ceil((1 - estado["fichas"]) / self.taxa_por_segundo) if self.taxa_por_segundo else 60
+                raise Sobrecarga(f"Limite de taxa do cliente atingido ({self.taxa_por_segundo * 60:g}/min)", "cliente_taxa", max(1, espera))
+            estado["fichas"] -= 1
+            estado["em_andamento"] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                estado["em_andamento"] -= 1
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "max_simultaneas": self.max_simultaneas,
+                "taxa_por_minuto": self.taxa_por_segundo * 60,
+                "rajada": self.rajada,
+                "clientes_rastreados": len(self._clientes),
+                "recusadas": dict(self.recusadas)
+            }
+
+
+class ControleAdmissao:
+    """Limites por API do Google e por cliente."""
+
+    def __init__(self, limites_upstream: dict = None, limites_cliente: LimitesCliente = None):
+        self.upstream = limites_upstream or {
+            "ga4": LimiteUpstream("GA4", ADMISSAO_GA4_MAX_EM_VOO),
+            "search_console": LimiteUpstream("Search Console", ADMISSAO_SC_MAX_EM_VOO)
+        }
+        self.clientes = limites_cliente or LimitesCliente()
+
+    def admitir_upstream(self, api: str):
+        """Context manager que ocupa uma vaga da API ("ga4" ou "search_console")."""
+        return self.upstream[api].admitir()
+
+    def admitir_cliente(self, cliente: str):
+        """Context manager que aplica os limites do cliente."""
+        return self.clientes.admitir(cliente)
+
+    def estatisticas(self) -> dict:
+        return {
+            "upstream": {api: limite.estatisticas() for api, limite in self.upstream.items()},
+            "clientes": self.clientes.estatisticas()
+        }
+
+
+# Instância compartilhada pelas rotas que chamam o Google
+controle_admissao = ControleAdmissao()
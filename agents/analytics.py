@@ -4,12 +4,31 @@ import sys
 from google.oauth2 import service_account
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
 from google.analytics.data_v1beta.types import (
-    RunReportRequest, RunPivotReportRequest,
+    RunReportRequest, RunPivotReportRequest, BatchRunReportsRequest,
     DateRange, Dimension, Metric,
-    FilterExpression, Filter, Pivot, OrderBy
+    FilterExpression, Filter, Pivot, OrderBy,
+    GetMetadataRequest, RunRealtimeReportRequest, MinuteRange
 )
 from google.analytics.data_v1beta.types import Filter as GAFilter
 
+from agents.batching import agrupador_relatorios
+from agents.comparison import DIMENSAO_PERIODO, comparar_periodos, nomes_periodos
+from agents.credentials import pool_clientes, renovador_tokens
+from agents.ga4_rows import cabecalhos, linhas_tipadas, valores_texto
+from agents.resilience import mensagem_erro_upstream
+
+# Escopo explícito: sem ele a biblioteca cria outra cópia das credenciais ao abrir o canal
+ESCOPOS_GA4 = ["https://www.googleapis.com/auth/analytics.readonly"]
+
+def credenciais_ga4(creds_dict: dict):
+    """Credenciais da conta de serviço com o escopo de leitura do GA4."""
+    return service_account.Credentials.from_service_account_info(creds_dict, scopes=ESCOPOS_GA4)
+
+def acompanhar_token(nome: str, cliente):
+    """Entrega ao renovador as credenciais que o cliente usa de fato (a biblioteca guarda uma cópia)."""
+    renovador_tokens.acompanhar(nome, getattr(cliente.transport, "_credentials", None))
+    return cliente
+
 # Funções de diagnóstico
 def init_analytics_client():
     try:
@@ -31,7 +50,7 @@ def init_analytics_client():
             
         # Cria as credenciais
         try:
-            credentials = service_account.Credentials.from_service_account_info(creds_dict)
+            credentials = credenciais_ga4(creds_dict)
             print("DIAGNÓSTICO: Credenciais criadas com sucesso", file=sys.stderr)
         except Exception as e:
             print(f"ERRO: Falha ao criar credenciais: {e}", file=sys.stderr)
@@ -39,7 +58,7 @@ def init_analytics_client():
             
         # Cria o cliente
         try:
-            client = BetaAnalyticsDataClient(credentials=credentials)
+            client = acompanhar_token("padrão:ga4_data", BetaAnalyticsDataClient(credentials=credentials))
             print("DIAGNÓSTICO: Cliente GA4 criado com sucesso", file=sys.stderr)
             return client
         except Exception as e:
@@ -52,31 +71,44 @@ def init_analytics_client():
 # Inicializa o cliente GA4
 client = init_analytics_client()
 
-def listar_contas_ga4():
+def cliente_ga4(tenant: str = None):
+    """Cliente GA4 Data do tenant (do pool) ou o cliente padrão de GOOGLE_CREDENTIALS."""
+    if not tenant:
+        return client
+    return pool_clientes.obter(
+        tenant,
+        "ga4_data",
+        lambda creds: acompanhar_token(f"{tenant}:ga4_data", BetaAnalyticsDataClient(credentials=credenciais_ga4(creds)))
+    )
+
+def cliente_admin_ga4(tenant: str = None):
+    """Cliente GA4 Admin do tenant (ou padrão), reaproveitado entre requisições pelo pool."""
+    from google.analytics.admin_v1alpha import AnalyticsAdminServiceClient
+    return pool_clientes.obter(
+        tenant,
+        "ga4_admin",
+        lambda creds: acompanhar_token(f"{tenant or 'padrão'}:ga4_admin", AnalyticsAdminServiceClient(credentials=credenciais_ga4(creds)))
+    )
+
+def listar_contas_ga4(tenant: str = None):
     """
     Lista todas as contas do Google Analytics 4 e suas propriedades associadas.
     
+    Args:
+        tenant: Tenant cujas credenciais são usadas (padrão: GOOGLE_CREDENTIALS)
+    
     Returns:
         dict: Dicionário com informações sobre contas e propriedades ou erro
     """
     try:
-        from google.analytics.admin_v1alpha import AnalyticsAdminServiceClient
         from google.analytics.admin_v1alpha.types import ListPropertiesRequest
         
-        # Verifica se as credenciais existem (usa as mesmas credenciais do cliente de dados)
-        creds_json = os.getenv("GOOGLE_CREDENTIALS")
-        if not creds_json:
-            return {"erro": "Credenciais do Google não encontradas na variável GOOGLE_CREDENTIALS"}
-        
+        # Cliente Admin do pool (usa as mesmas credenciais do cliente de dados)
         try:
-            creds_dict = json.loads(creds_json)
-            credentials = service_account.Credentials.from_service_account_info(creds_dict)
+            admin_client = cliente_admin_ga4(tenant)
         except Exception as e:
             return {"erro": f"Erro ao processar credenciais: {str(e)}"}
         
-        # Inicializa o cliente Admin
-        admin_client = AnalyticsAdminServiceClient(credentials=credentials)
-        
         print("DIAGNÓSTICO: Listando contas GA4...", file=sys.stderr)
         
         # Lista todas as contas
@@ -134,6 +166,96 @@ def listar_contas_ga4():
         print(f"Erro ao listar contas GA4: {str(e)}\n{error_details}", file=sys.stderr)
         return {"erro": f"Erro ao listar contas GA4: {str(e)}"}
 
+def obter_metadados_ga4(property_id: str, tenant: str = None) -> dict:
+    """
+    Busca as dimensões e métricas disponíveis em uma propriedade GA4.
+    
+    Inclui as definições personalizadas (customEvent:, customUser:) e os nomes
+    antigos ainda aceitos pela API.
+    
+    Args:
+        property_id: ID da propriedade GA4
+        tenant: Tenant cujas credenciais são usadas (padrão: GOOGLE_CREDENTIALS)
+    
+    Returns:
+        dict: {"dimensoes": {api_name: ui_name}, "metricas": {...}, "personalizadas": [...]} ou erro
+    """
+    try:
+        cliente = cliente_ga4(tenant)
+        if cliente is None:
+            return {"erro": "Cliente GA4 não inicializado corretamente. Verifique as credenciais."}
+        
+        if not property_id.startswith("properties/"):
+            property_id = f"properties/{property_id}"
+        
+        metadata = cliente.get_metadata(request=GetMetadataRequest(name=f"{property_id}/metadata"))
+        
+        def indexar(campos):
+            nomes = {}
+            for campo in campos:
+                nomes[campo.api_name] = campo.ui_name
+                for antigo in campo.deprecated_api_names:
+                    nomes.setdefault(antigo, campo.ui_name)
+            return nomes
+        
+        return {
+            "dimensoes": indexar(metadata.dimensions),
+            "metricas": indexar(metadata.metrics),
+            "personalizadas": [
+                campo.api_name for campo in list(metadata.dimensions) + list(metadata.metrics)
+                if campo.custom_definition
+            ]
+        }
+    
+    except Exception as e:
+        print(f"Erro ao buscar metadados GA4: {str(e)}", file=sys.stderr)
+        return {"erro": f"Erro ao buscar metadados GA4: {str(e)}"}
+
+def consulta_ga4_realtime(
+    property_id: str,
+    dimensoes: list[str],
+    metricas: list[str],
+    minutos: int = 30,
+    limite: int = 100,
+    tenant: str = None
+) -> dict:
+    """
+    Consulta o relatório em tempo real do GA4 (últimos minutos).
+    
+    Args:
+        property_id: ID da propriedade GA4
+        dimensoes: Dimensões de tempo real (ex: country, unifiedScreenName)
+        metricas: Métricas de tempo real (ex: activeUsers)
+        minutos: Janela em minutos até agora (1 a 30; 60 em propriedades 360)
+        limite: Número máximo de linhas
+        tenant: Tenant cujas credenciais são usadas (padrão: GOOGLE_CREDENTIALS)
+    
+    Returns:
+        dict: {"colunas", "linhas"} ou erro
+    """
+    try:
+        cliente = cliente_ga4(tenant)
+        if cliente is None:
+            return {"erro": "Cliente GA4 não inicializado corretamente. Verifique as credenciais."}
+        
+        if not property_id.startswith("properties/"):
+            property_id = f"properties/{property_id}"
+        
+        response = cliente.run_realtime_report(RunRealtimeReportRequest(
+            property=property_id,
+            dimensions=[Dimension(name=d.strip()) for d in dimensoes if d.strip()],
+            metrics=[Metric(name=m.strip()) for m in metricas if m.strip()],
+            minute_ranges=[MinuteRange(start_minutes_ago=max(0, minutos - 1), end_minutes_ago=0)],
+            limit=limite
+        ))
+        
+        dimensoes, metricas = cabecalhos(response)
+        return {"colunas": dimensoes + metricas, "linhas": valores_texto(response)}
+    
+    except Exception as e:
+        print(f"Erro na consulta GA4 em tempo real: {str(e)}", file=sys.stderr)
+        return {"erro": f"Erro na consulta GA4 em tempo real: {str(e)}"}
+
 def responder(pergunta):
     """
     Função para compatibilidade com o sistema de agentes.
@@ -149,6 +271,56 @@ def responder(pergunta):
     return {"response": "Comando não reconhecido. Tente perguntar sobre 'listar contas ga4'."}
 
 
+def montar_date_ranges(periodo: str, data_fim: str, periodos: list[dict] = None) -> list:
+    """
+    Monta a lista de DateRange da requisição.
+
+    Sem períodos de comparação, usa um único intervalo periodo..data_fim.
+    Com períodos, cada um recebe um nome (informado ou "periodo_N"), que o
+    GA4 devolve na dimensão "dateRange".
+    """
+    if not periodos:
+        return [DateRange(start_date=periodo, end_date=data_fim)]
+    return [
+        DateRange(start_date=p["data_inicio"], end_date=p["data_fim"], name=nome)
+        for p, nome in zip(periodos, nomes_periodos(periodos))
+    ]
+
+# Condições textuais de filtro aceitas e os enums correspondentes do GA4
+CONDICOES_FILTRO_GA4 = {
+    "igual": GAFilter.StringFilter.MatchType.EXACT,
+    "contem": GAFilter.StringFilter.MatchType.CONTAINS,  # Corrigido de "contém" para "contem"
+    "começa com": GAFilter.StringFilter.MatchType.BEGINS_WITH,
+    "termina com": GAFilter.StringFilter.MatchType.ENDS_WITH,
+    "regex": GAFilter.StringFilter.MatchType.PARTIAL_REGEXP,
+    "regex completa": GAFilter.StringFilter.MatchType.FULL_REGEXP,
+    # Variantes sem acentos e em inglês, para mais robustez
+    "contém": GAFilter.StringFilter.MatchType.CONTAINS,
+    "comeca com": GAFilter.StringFilter.MatchType.BEGINS_WITH,
+    "comeca_com": GAFilter.StringFilter.MatchType.BEGINS_WITH,
+    "termina_com": GAFilter.StringFilter.MatchType.ENDS_WITH,
+    "contains": GAFilter.StringFilter.MatchType.CONTAINS,
+    "begins_with": GAFilter.StringFilter.MatchType.BEGINS_WITH,
+    "ends_with": GAFilter.StringFilter.MatchType.ENDS_WITH,
+    "exact": GAFilter.StringFilter.MatchType.EXACT,
+    "regexp": GAFilter.StringFilter.MatchType.PARTIAL_REGEXP,
+    "full_regexp": GAFilter.StringFilter.MatchType.FULL_REGEXP,
+}
+
+def filtro_dimensao_ga4(campo: str, valor: str, condicao: str = "igual"):
+    """FilterExpression de um filtro de texto, ou None se campo ou valor estiverem vazios."""
+    if not campo or not valor:
+        return None
+    return FilterExpression(
+        filter=Filter(
+            field_name=campo.strip(),
+            string_filter=Filter.StringFilter(
+                value=str(valor).strip(),
+                match_type=CONDICOES_FILTRO_GA4.get(condicao.lower(), GAFilter.StringFilter.MatchType.EXACT)
+            )
+        )
+    )
+
 def consulta_ga4(
     dimensao: str = "country",
     metrica: str = "sessions",
@@ -157,7 +329,10 @@ def consulta_ga4(
     filtro_campo: str = "",
     filtro_valor: str = "",
     filtro_condicao: str = "igual",
-    property_id: str = "properties/254018746"
+    property_id: str = "properties/254018746",
+    limite: int = 100,
+    periodos: list[dict] = None,
+    tenant: str = None
 ) -> str:
     """
     Consulta sessões segmentadas por dimensões no GA4.
@@ -171,10 +346,15 @@ def consulta_ga4(
         filtro_valor: Valor do filtro
         filtro_condicao: Condição do filtro
         property_id: ID da propriedade GA4
+        limite: Número máximo de linhas retornadas (padrão: 100)
+        periodos: Lista de períodos para comparação, cada um com data_inicio, data_fim
+            e nome opcional. Substitui periodo/data_fim e adiciona a coluna "dateRange"
+        tenant: Tenant cujas credenciais são usadas (padrão: GOOGLE_CREDENTIALS)
     """
     try:
         # Verifica se o cliente está inicializado
-        if client is None:
+        cliente = cliente_ga4(tenant)
+        if cliente is None:
             return "Erro: Cliente GA4 não inicializado corretamente. Verifique as credenciais."
 
         print(f"DIAGNÓSTICO: Iniciando consulta GA4 - dimensão: {dimensao}, métrica: {metrica}", file=sys.stderr)
@@ -188,81 +368,104 @@ def consulta_ga4(
         lista_dimensoes = [Dimension(name=d.strip()) for d in dimensao.split(",")]
         lista_metricas = [Metric(name=m.strip()) for m in metrica.split(",")]
 
-        # Mapeia condição textual para enums do GA4
-        condicoes = {
-            "igual": GAFilter.StringFilter.MatchType.EXACT,
-            "contem": GAFilter.StringFilter.MatchType.CONTAINS,  # Corrigido de "contém" para "contem"
-            "começa com": GAFilter.StringFilter.MatchType.BEGINS_WITH,
-            "termina com": GAFilter.StringFilter.MatchType.ENDS_WITH,
-            "regex": GAFilter.StringFilter.MatchType.PARTIAL_REGEXP,
-            "regex completa": GAFilter.StringFilter.MatchType.FULL_REGEXP,
-        }
-
-        # Adiciona variantes sem acentos e em maiúsculas para melhorar a robustez
-        condicoes_extras = {
-            "contém": GAFilter.StringFilter.MatchType.CONTAINS,
-            "comeca com": GAFilter.StringFilter.MatchType.BEGINS_WITH,
-            "comeca_com": GAFilter.StringFilter.MatchType.BEGINS_WITH,
-            "termina_com": GAFilter.StringFilter.MatchType.ENDS_WITH,
-            "contains": GAFilter.StringFilter.MatchType.CONTAINS,
-            "begins_with": GAFilter.StringFilter.MatchType.BEGINS_WITH,
-            "ends_with": GAFilter.StringFilter.MatchType.ENDS_WITH,
-            "exact": GAFilter.StringFilter.MatchType.EXACT,
-            "regexp": GAFilter.StringFilter.MatchType.PARTIAL_REGEXP,
-            "full_regexp": GAFilter.StringFilter.MatchType.FULL_REGEXP,
-        }
-        
-        # Mescla os dicionários
-        condicoes.update(condicoes_extras)
-
         print(f"DIAGNÓSTICO: Condição de filtro usada: '{filtro_condicao.lower()}'", file=sys.stderr)
-        match_type = condicoes.get(filtro_condicao.lower(), GAFilter.StringFilter.MatchType.EXACT)
-        print(f"DIAGNÓSTICO: Match type selecionado: {match_type}", file=sys.stderr)
 
         # Monta filtro se informado
-        dimension_filter = None
-        if filtro_campo and filtro_valor:
-            dimension_filter = FilterExpression(
-                filter=Filter(
-                    field_name=filtro_campo.strip(),
-                    string_filter=Filter.StringFilter(
-                        value=filtro_valor.strip(),
-                        match_type=match_type
-                    )
-                )
-            )
+        dimension_filter = filtro_dimensao_ga4(filtro_campo, filtro_valor, filtro_condicao)
 
-        # Monta requisição com datas dinâmicas
+        # Monta requisição com datas dinâmicas (vários períodos vão na mesma requisição)
         request = RunReportRequest(
             property=property_id,
-            date_ranges=[DateRange(start_date=periodo, end_date=data_fim)],  # Agora ambas são dinâmicas
+            date_ranges=montar_date_ranges(periodo, data_fim, periodos),
             dimensions=lista_dimensoes,
             metrics=lista_metricas,
-            dimension_filter=dimension_filter
+            dimension_filter=dimension_filter,
+            limit=limite
         )
 
         print("DIAGNÓSTICO: Enviando requisição ao GA4", file=sys.stderr)
-        response = client.run_report(request)
+        # Relatórios simultâneos da mesma propriedade podem seguir juntos em um batchRunReports
+        response = agrupador_relatorios.executar(
+            (tenant or "", property_id),
+            request,
+            cliente.run_report,
+            lambda pedidos: cliente.batch_run_reports(BatchRunReportsRequest(property=property_id, requests=pedidos)).reports
+        )
         print("DIAGNÓSTICO: Resposta recebida do GA4", file=sys.stderr)
 
         if not response.rows:
             return "Nenhum dado encontrado com esse filtro."
 
-        # Cabeçalho
-        headers = [d.name for d in request.dimensions] + [m.name for m in request.metrics]
-        resultado = [" | ".join(headers)]
-
-        # Limita a 30 linhas
-        for row in response.rows[:100]:
-            dim_vals = [d.value for d in row.dimension_values]
-            met_vals = [m.value for m in row.metric_values]
-            resultado.append(" | ".join(dim_vals + met_vals))
+        # Cabeçalho (a resposta inclui "dateRange" quando há mais de um período)
+        dimensoes, metricas = cabecalhos(response)
+        resultado = [" | ".join(dimensoes + metricas)]
+        # Linhas lidas direto do protobuf, sem os wrappers proto-plus
+        resultado.extend(" | ".join(valores) for valores in valores_texto(response, limite))
 
         return "\n".join(resultado)
 
     except Exception as e:
         print(f"ERRO na consulta GA4: {e}", file=sys.stderr)
-        return f"[Erro] Consulta GA4 falhou: {e}"
+        return mensagem_erro_upstream("Consulta GA4 falhou", e)
+
+def estimar_linhas_ga4(
+    dimensao: str = "country",
+    metrica: str = "sessions",
+    periodo: str = "7daysAgo",
+    data_fim: str = "today",
+    filtro_campo: str = "",
+    filtro_valor: str = "",
+    filtro_condicao: str = "igual",
+    property_id: str = "properties/254018746",
+    periodos: list[dict] = None,
+    tenant: str = None
+) -> dict:
+    """
+    Sondagem barata do tamanho de um relatório: pede uma linha e lê o row_count.
+    
+    Recebe os mesmos argumentos de consulta_ga4 (sem o limite).
+    
+    Returns:
+        dict: {"linhas": total de linhas do relatório, "exato": True}, ou {"erro": ...}
+    """
+    try:
+        cliente = cliente_ga4(tenant)
+        if cliente is None:
+            return {"erro": "Cliente GA4 não inicializado corretamente. Verifique as credenciais."}
+        if not property_id.startswith("properties/"):
+            property_id = f"properties/{property_id}"
+        response = cliente.run_report(RunReportRequest(
+            property=property_id,
+            date_ranges=montar_date_ranges(periodo, data_fim, periodos),
+            dimensions=[Dimension(name=d.strip()) for d in dimensao.split(",")],
+            metrics=[Metric(name=m.strip()) for m in metrica.split(",")],
+            dimension_filter=filtro_dimensao_ga4(filtro_campo, filtro_valor, filtro_condicao),
+            limit=1
+        ))
+        return {"linhas": response.row_count, "exato": True}
+    except Exception as e:
+        print(f"ERRO na sondagem GA4: {e}", file=sys.stderr)
+        return {"erro": f"Sondagem GA4 falhou: {e}"}
+
+def interpretar_resultado_ga4(resultado_texto: str):
+    """
+    Converte o texto retornado por consulta_ga4 em (cabecalhos, linhas).
+
+    Linhas com quantidade de colunas diferente do cabeçalho são descartadas.
+    Sem dados, retorna ([], []).
+    """
+    linhas = resultado_texto.split('\n')
+    if len(linhas) < 2:
+        return [], []
+
+    cabecalhos = linhas[0].split(' | ')
+    valores_linhas = []
+    for linha in linhas[1:]:
+        if linha.strip():
+            valores = linha.split(' | ')
+            if len(valores) == len(cabecalhos):
+                valores_linhas.append(valores)
+    return cabecalhos, valores_linhas
 
 def consulta_ga4_pivot(
     dimensao: str = "country",
@@ -274,7 +477,9 @@ def consulta_ga4_pivot(
     filtro_valor: str = "",
     filtro_condicao: str = "igual",
     limite_linhas: int = 30,
-    property_id: str = "properties/254018746"
+    property_id: str = "properties/254018746",
+    periodos: list[dict] = None,
+    tenant: str = None
 ) -> str:
     """
     Consulta GA4 com tabela pivot para análise cruzada de dimensões.
@@ -290,10 +495,14 @@ def consulta_ga4_pivot(
         filtro_condicao: Condição do filtro
         limite_linhas: Limite de linhas no resultado
         property_id: ID da propriedade GA4
+        periodos: Lista de períodos para comparação (data_inicio, data_fim, nome opcional).
+            Substitui periodo/data_fim e acrescenta uma seção com os deltas
+        tenant: Tenant cujas credenciais são usadas (padrão: GOOGLE_CREDENTIALS)
     """
     try:
         # Verifica se o cliente está inicializado
-        if client is None:
+        cliente = cliente_ga4(tenant)
+        if cliente is None:
             return "Erro: Cliente GA4 não inicializado corretamente. Verifique as credenciais."
             
         print(f"DIAGNÓSTICO: Iniciando consulta GA4 Pivot - período: {periodo} a {data_fim}", file=sys.stderr)
@@ -310,55 +519,22 @@ def consulta_ga4_pivot(
         # Lista de métricas
         lista_metricas = [Metric(name=m.strip()) for m in metrica.split(",")]
 
-        # Mapeia condição textual para enums do GA4
-        condicoes = {
-            "igual": GAFilter.StringFilter.MatchType.EXACT,
-            "contem": GAFilter.StringFilter.MatchType.CONTAINS,  # Corrigido de "contém" para "contem"
-            "começa com": GAFilter.StringFilter.MatchType.BEGINS_WITH,
-            "termina com": GAFilter.StringFilter.MatchType.ENDS_WITH,
-            "regex": GAFilter.StringFilter.MatchType.PARTIAL_REGEXP,
-            "regex completa": GAFilter.StringFilter.MatchType.FULL_REGEXP,
-        }
-
-        # Adiciona variantes sem acentos e em maiúsculas para melhorar a robustez
-        condicoes_extras = {
-            "contém": GAFilter.StringFilter.MatchType.CONTAINS,
-            "comeca com": GAFilter.StringFilter.MatchType.BEGINS_WITH,
-            "comeca_com": GAFilter.StringFilter.MatchType.BEGINS_WITH,
-            "termina_com": GAFilter.StringFilter.MatchType.ENDS_WITH,
-            "contains": GAFilter.StringFilter.MatchType.CONTAINS,
-            "begins_with": GAFilter.StringFilter.MatchType.BEGINS_WITH,
-            "ends_with": GAFilter.StringFilter.MatchType.ENDS_WITH,
-            "exact": GAFilter.StringFilter.MatchType.EXACT,
-            "regexp": GAFilter.StringFilter.MatchType.PARTIAL_REGEXP,
-            "full_regexp": GAFilter.StringFilter.MatchType.FULL_REGEXP,
-        }
-        
-        # Mescla os dicionários
-        condicoes.update(condicoes_extras)
-
         print(f"DIAGNÓSTICO: Condição de filtro usada (pivot): '{filtro_condicao.lower()}'", file=sys.stderr)
-        match_type = condicoes.get(filtro_condicao.lower(), GAFilter.StringFilter.MatchType.EXACT)
-        print(f"DIAGNÓSTICO: Match type selecionado (pivot): {match_type}", file=sys.stderr)
 
         # Monta filtro se informado
-        dimension_filter = None
-        if filtro_campo and filtro_valor:
-            dimension_filter = FilterExpression(
-                filter=Filter(
-                    field_name=filtro_campo.strip(),
-                    string_filter=Filter.StringFilter(
-                        value=filtro_valor.strip(),
-                        match_type=match_type
-                    )
-                )
-            )
+        dimension_filter = filtro_dimensao_ga4(filtro_campo, filtro_valor, filtro_condicao)
 
         # Cria objetos Pivot conforme exemplo da documentação
         # Primeiro pivot para dimensão principal
+        # Com vários períodos, o GA4 exige "dateRange" entre os campos de um pivot
+        campos_principais = [d.strip() for d in dimensao.split(",")]
+        date_ranges = montar_date_ranges(periodo, data_fim, periodos)
+        if len(date_ranges) > 1:
+            campos_principais.append(DIMENSAO_PERIODO)
+        
         pivot_principal = Pivot(
-            field_names=[d.strip() for d in dimensao.split(",")],
-            limit=limite_linhas
+            field_names=campos_principais,
+            limit=limite_linhas * len(date_ranges)
         )
         
         # Segundo pivot para a dimensão de cruzamento
@@ -379,7 +555,7 @@ def consulta_ga4_pivot(
         # Monta a requisição de pivot seguindo o exemplo da documentação
         request = RunPivotReportRequest(
             property=property_id,
-            date_ranges=[DateRange(start_date=periodo, end_date=data_fim)],  # Agora ambas são dinâmicas
+            date_ranges=date_ranges,
             dimensions=todas_dimensoes,  # Todas as dimensões (primária e pivot)
             metrics=lista_metricas,  # Métricas
             pivots=[pivot_principal, pivot_secundario],  # Pivots na ordem correta
@@ -387,7 +563,7 @@ def consulta_ga4_pivot(
         )
 
         # Executa a consulta de pivot
-        response = client.run_pivot_report(request)
+        response = cliente.run_pivot_report(request)
         
         # Processamento da resposta
         resultado = ["Resultados da consulta pivot:"]
@@ -412,15 +588,97 @@ def consulta_ga4_pivot(
         # Processa linhas de dados
         if response.rows:
             resultado.append("\nDados:")
-            for i, row in enumerate(response.rows[:50]):  # Limita a 50 linhas para exibição
-                dim_values = [dim_val.value for dim_val in row.dimension_values]
-                metric_values = [metric_val.value for metric_val in row.metric_values]
-                resultado.append(f"Linha {i+1}: {' | '.join(dim_values)} => {' | '.join(metric_values)}")
+            n_dimensoes = len(dimensoes)
+            for i, valores in enumerate(valores_texto(response, 50)):  # Limita a 50 linhas para exibição
+                resultado.append(f"Linha {i+1}: {' | '.join(valores[:n_dimensoes])} => {' | '.join(valores[n_dimensoes:])}")
         else:
             resultado.append("\nNenhum dado encontrado.")
+        
+        # Comparação entre períodos: deltas em relação ao primeiro período
+        if len(date_ranges) > 1 and response.rows:
+            resultado.extend(formatar_comparacao_pivot(response, nomes_periodos(periodos)))
             
         return "\n".join(resultado)
 
     except Exception as e:
         print(f"ERRO na consulta GA4 Pivot: {e}", file=sys.stderr)
-        return f"[Erro] Consulta GA4 Pivot falhou: {str(e)}"
+        return mensagem_erro_upstream("Consulta GA4 Pivot falhou", e)
+
+def formatar_comparacao_pivot(response, nomes: list[str]) -> list[str]:
+    """Gera as linhas de texto com os deltas entre períodos de uma resposta pivot."""
+    nomes_dimensoes, metricas = cabecalhos(response)
+    comparacao = comparar_periodos(nomes_dimensoes + metricas, valores_texto(response), metricas, nomes)
+
+    texto = [f"\nComparação entre períodos (base: {nomes[0]}):"]
+    for registro in comparacao["comparacao"][:50]:
+        dimensoes = " | ".join(str(v) for k, v in registro.items() if k not in metricas)
+        partes = []
+        for metrica in metricas:
+            valores = registro.get(metrica)
+            if valores is None:
+                continue
+            for nome in nomes[1:]:
+                variacao = valores[f"variacao_pct_{nome}"]
+                variacao_texto = "n/d" if variacao is None else f"{variacao:+.2f}%"
+                partes.append(
+                    f"{metrica}: {valores[nomes[0]]} vs {valores[nome]} ({nome}) "
+                    f"Δ {valores[f'delta_{nome}']} ({variacao_texto})"
+                )
+        texto.append(f"{dimensoes} => {'; '.join(partes)}")
+    return texto
+
+def paginas_relatorio_ga4(parametros: dict, inicio: int = 0, linhas_por_pagina: int = 50000):
+    """
+    Percorre um relatório GA4 completo com limit/offset, uma página por vez.
+    
+    Args:
+        parametros: property_id, dimensoes, metricas, data_inicio, data_fim,
+            filtros, periodos (como em /ga4/query) e tenant
+        inicio: Offset da primeira linha (para retomar uma exportação)
+        linhas_por_pagina: Linhas pedidas por requisição (a API aceita até 250000)
+    
+    Yields:
+        dict: {"colunas", "tipos", "linhas", "proximo", "total"}, com métricas numéricas;
+            "proximo" é o offset da página seguinte, ou None na última
+    """
+    cliente = cliente_ga4(parametros.get("tenant"))
+    if cliente is None:
+        raise RuntimeError("Cliente GA4 não inicializado corretamente. Verifique as credenciais.")
+    
+    property_id = str(parametros["property_id"])
+    if not property_id.startswith("properties/"):
+        property_id = f"properties/{property_id}"
+    
+    filtro = (parametros.get("filtros") or [None])[0] or {}
+    dimension_filter = filtro_dimensao_ga4(filtro.get("campo"), filtro.get("valor"), filtro.get("condicao", "igual"))
+    
+    dimensoes = [d.strip() for d in parametros["dimensoes"]]
+    # Sem ordem explícita o GA4 não garante a mesma ordem entre requisições, e
+    # limit/offset (e a retomada de uma exportação) poderiam repetir ou pular linhas
+    ordem = [OrderBy(dimension=OrderBy.DimensionOrderBy(dimension_name=d)) for d in dimensoes]
+    
+    offset = inicio
+    while True:
+        response = cliente.run_report(RunReportRequest(
+            property=property_id,
+            date_ranges=montar_date_ranges(parametros.get("data_inicio", "7daysAgo"), parametros.get("data_fim", "today"), parametros.get("periodos")),
+            dimensions=[Dimension(name=d) for d in dimensoes],
+            metrics=[Metric(name=m.strip()) for m in parametros["metricas"]],
+            dimension_filter=dimension_filter,
+            order_bys=ordem,
+            limit=linhas_por_pagina,
+            offset=offset
+        ))
+        
+        colunas, tipos, linhas = linhas_tipadas(response)
+        offset += len(linhas)
+        proximo = offset if linhas and offset < response.row_count else None
+        yield {
+            "colunas": colunas,
+            "tipos": tipos,
+            "linhas": linhas,
+            "proximo": proximo,
+            "total": response.row_count
+        }
+        if proximo is None:
+            return
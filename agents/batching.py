@@ -0,0 +1,152 @@
+"""
+Agrupamento de relatórios GA4 simultâneos em uma chamada batchRunReports.
+
+Chamadas paralelas de ferramentas de um GPT costumam disparar várias
+consultas para a mesma propriedade com poucos milissegundos de diferença.
+Com a janela ativada (GA4_LOTE_JANELA_MS > 0), a primeira consulta de uma
+propriedade espera a janela; as que chegam nesse meio-tempo entram no mesmo
+lote, que segue em uma única chamada (até GA4_LOTE_MAX relatórios, o limite
+da API) e tem as respostas devolvidas a cada requisição. Se o lote falhar por
+causa de um relatório (um pedido inválido derruba o lote inteiro), cada
+requisição repete a sua consulta sozinha. Falhas do lote como um todo (cota
+esgotada, prazo estourado) são devolvidas a todas as requisições: repetir
+cada uma sozinha só multiplicaria as chamadas que já falharam.
+"""
+
+import os
+import sys
+import threading
+from concurrent.futures import Future
+
+from agents.resilience import status_upstream
+
+# 0 desativa o agrupamento: cada relatório vai direto para run_report
+GA4_LOTE_JANELA_MS = float(os.getenv("GA4_LOTE_JANELA_MS", "0"))
+# Máximo de relatórios por batchRunReports aceito pela API
+GA4_LOTE_MAX = 5
+# Status gRPC de erros causados por um relatório do lote, não pelo lote inteiro
+STATUS_ERRO_POR_RELATORIO = ("INVALID_ARGUMENT",)
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"BATCHING DEBUG: {message}", file=sys.stderr)
+
+
+class LoteFalhou(Exception):
+    """Sinaliza às requisições do lote que a chamada em lote falhou e devem consultar sozinhas."""
+
+
+class LoteIncompleto(Exception):
+    """O lote devolveu um número de respostas diferente do de pedidos."""
+
+
+class AgrupadorRelatorios:
+    """Junta pedidos simultâneos com a mesma chave em lotes de até max_lote."""
+
+    def __init__(self, janela_ms: float = GA4_LOTE_JANELA_MS, max_lote: int = GA4_LOTE_MAX):
+        self.janela_segundos = janela_ms / 1000
+        self.max_lote = max_lote
+        self._lock = threading.Lock()
+        self._abertos = {}
+        self.contadores = {
+            "individuais": 0,
+            "lotes": 0,
+            "relatorios_em_lote": 0,
+            "chamadas_evitadas": 0,
+            "falhas_lote": 0
+        }
+
+    def _contar(self, nome: str, quantidade: int = 1):
+        with self._lock:
+            self.contadores[nome] += quantidade
+
+    def executar(self, chave, pedido, individual, em_lote):
+        """
+        Executa o pedido, possivelmente junto com outros da mesma chave.
+
+        Args:
+            chave: Pedidos com a mesma chave podem ir no mesmo lote (ex: tenant e propriedade)
+            pedido: O pedido (ex: RunReportRequest)
+            individual: Função pedido -> resposta
+            em_lote: Função [pedidos] -> [respostas], na mesma ordem
+
+        Returns:
+            A resposta do pedido
+        """
+        if self.janela_segundos <= 0:
+            self._contar("individuais")
+            return individual(pedido)
+
+        with self._lock:
+            lote = self._abertos.get(chave)
+            if lote is not None:
+                futuro = Future()
+                lote["pedidos"].append((pedido, futuro))
+                if len(lote["pedidos"]) >= self.max_lote:
+                    # Lote cheio: quem chegar depois abre outro
+                    del self._abertos[chave]
+                    lote["cheio"].set()
+            else:
+                lote = self._abertos[chave] = {"pedidos": [(pedido, None)], "cheio": threading.Event()}
+                futuro = None
+
+        if futuro is not None:
+            try:
+                return futuro.result()
+            except LoteFalhou:
+                self._contar("individuais")
+                return individual(pedido)
+
+        # Primeiro do lote: espera a janela (ou o lote encher) e faz a chamada por todos
+        lote["cheio"].wait(self.janela_segundos)
+        with self._lock:
+            if self._abertos.get(chave) is lote:
+                del self._abertos[chave]
+            pedidos = list(lote["pedidos"])
+
+        if len(pedidos) == 1:
+            self._contar("individuais")
+            return individual(pedido)
+
+        seguidores = [futuro for _, futuro in pedidos[1:]]
+        try:
+            respostas = list(em_lote([p for p, _ in pedidos]))
+            if len(respostas) != len(pedidos):
+                raise LoteIncompleto(f"lote com {len(pedidos)} pedidos devolveu {len(respostas)} respostas")
+        except Exception as e:
+            self._contar("falhas_lote")
+            if not isinstance(e, LoteIncompleto) and status_upstream(e) not in STATUS_ERRO_POR_RELATORIO:
+                log_debug(f"Lote de {len(pedidos)} relatórios falhou ({e}); erro devolvido a todos")
+                for futuro in seguidores:
+                    futuro.set_exception(e)
+                raise
+            log_debug(f"Lote de {len(pedidos)} relatórios falhou ({e}); consultando um a um")
+            for futuro in seguidores:
+                futuro.set_exception(LoteFalhou(str(e)))
+            self._contar("individuais")
+            return individual(pedido)
+        except BaseException:
+            for futuro in seguidores:
+                futuro.set_exception(LoteFalhou("lote interrompido"))
+            raise
+
+        with self._lock:
+            self.contadores["lotes"] += 1
+            self.contadores["relatorios_em_lote"] += len(pedidos)
+            self.contadores["chamadas_evitadas"] += len(pedidos) - 1
+        for futuro, resposta in zip(seguidores, respostas[1:]):
+            futuro.set_result(resposta)
+        return respostas[0]
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "janela_ms": self.janela_segundos * 1000,
+                "max_lote": self.max_lote,
+                **self.contadores
+            }
+
+
+# Instância compartilhada pelas consultas GA4
+agrupador_relatorios = AgrupadorRelatorios()
@@ -0,0 +1,329 @@
+"""
+Cache de resultados das consultas e contagem de consultas frequentes.
+
+Cada consulta é identificada por uma assinatura canônica (tipo + argumentos
+serializados com chaves ordenadas). A assinatura conta os acessos, o que
+permite ao pré-aquecimento reexecutar as consultas mais usadas. No cache, a
+chave inclui o dia atual, porque datas relativas ("7daysAgo", "today")
+mudam de significado na virada do dia.
+
+O último resultado bom de cada assinatura também é guardado, sem o dia na
+chave, para ser servido marcado como vencido quando o serviço falha,
+estoura o prazo ou a chamada é recusada pelo controle de admissão.
+
+Atrás do cache em memória de cada processo fica o cache em disco do host
+(agents.disk_cache), compartilhado pelos workers e mantido entre reinícios.
+"""
+
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack
+from contextvars import ContextVar
+from datetime import date, datetime
+
+from agents.admission import Sobrecarga
+from agents.disk_cache import CACHE_DISCO_CAMINHO, CacheDisco
+from agents.resilience import PrazoExcedido, chamadas_upstream
+from agents.responses import serializar_json
+
+CACHE_TTL_SEGUNDOS = int(os.getenv("CACHE_TTL_SEGUNDOS", str(6 * 3600)))
+# Consultas cujo período vai até hoje (ou depois) mudam ao longo do dia: validade curta
+CACHE_TTL_HOJE_SEGUNDOS = int(os.getenv("CACHE_TTL_HOJE_SEGUNDOS", "900"))
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", "256"))
+# Assinaturas sem uso há mais tempo que isso deixam de contar como frequentes
+JANELA_FREQUENCIA_DIAS = int(os.getenv("CACHE_JANELA_FREQUENCIA_DIAS", "7"))
+MAX_ASSINATURAS = 1000
+# Idade máxima de um resultado servido como vencido
+CACHE_VENCIDO_MAX_SEGUNDOS = int(os.getenv("CACHE_VENCIDO_MAX_SEGUNDOS", str(7 * 86400)))
+
+# Aviso do resultado vencido servido na última consulta da thread atual
+resultado_vencido = ContextVar("resultado_vencido", default=None)
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"CACHE DEBUG: {message}", file=sys.stderr)
+
+
+def assinatura_consulta(tipo: str, argumentos: dict) -> str:
+    """Assinatura canônica de uma consulta (independe da ordem das chaves)."""
+    return hashlib.sha256(serializar_json({"tipo": tipo, "argumentos": argumentos})).hexdigest()[:32]
+
+
+def termina_hoje_ou_depois(data_fim) -> bool:
+    """Indica se a data final ("today", "NdaysAgo", "yesterday" ou YYYY-MM-DD) é hoje ou no futuro."""
+    texto = str(data_fim).strip()
+    if texto in ("today", "0daysAgo"):
+        return True
+    try:
+        return date.fromisoformat(texto) >= date.today()
+    except ValueError:
+        # "yesterday" e "NdaysAgo" (N > 0) já terminaram
+        return False
+
+
+def ttl_consulta(argumentos: dict):
+    """Validade do resultado em segundos: curta se algum período termina hoje; None para a padrão."""
+    fins = [argumentos.get("data_fim")] + [
+        periodo.get("data_fim") for periodo in argumentos.get("periodos") or [] if isinstance(periodo, dict)
+    ]
+    if any(termina_hoje_ou_depois(fim) for fim in fins if fim):
+        return CACHE_TTL_HOJE_SEGUNDOS
+    return None
+
+
+def resultado_com_erro(resultado) -> bool:
+    """Indica se o retorno de uma consulta é um erro (e não deve ir para o cache)."""
+    if isinstance(resultado, dict):
+        return "erro" in resultado
+    if isinstance(resultado, str):
+        return resultado.startswith(("[Erro]", "Erro:"))
+    return resultado is None
+
+
+class CacheResultados:
+    """
+    Cache em memória com expiração por idade e limite de entradas (LRU).
+
+    Com um CacheDisco, o que falta na memória é buscado no disco (e trazido
+    para a memória com a expiração original) e tudo o que é guardado também
+    vai para o disco.
+    """
+
+    def __init__(self, ttl_segundos: int = CACHE_TTL_SEGUNDOS, max_entradas: int = CACHE_MAX_ENTRADAS,
+                 disco: CacheDisco = None):
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas = max_entradas
+        self.disco = disco
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self._ultimos = OrderedDict()
+        self.acertos = 0
+        self.acertos_disco = 0
+        self.falhas = 0
+
+    def _inserir(self, chave: str, expira_em: float, valor):
+        """Insere na memória, descartando as entradas menos usadas além do limite (chamar com o lock)."""
+        self._entradas[chave] = (expira_em, valor)
+        self._entradas.move_to_end(chave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+    def obter(self, chave: str):
+        """Retorna o valor guardado ou None se ausente ou expirado."""
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and entrada[0] >= time.time():
+                self._entradas.move_to_end(chave)
+                self.acertos += 1
+                return entrada[1]
+            if entrada is not None:
+                del self._entradas[chave]
+
+        do_disco = self.disco.obter(chave) if self.disco is not None else None
+        with self._lock:
+            if do_disco is None:
+                self.falhas += 1
+                return None
+            expira_em, valor = do_disco
+            self._inserir(chave, expira_em, valor)
+            self.acertos += 1
+            self.acertos_disco += 1
+            return valor
+
+    def guardar(self, chave: str, valor, assinatura: str = None, ttl_segundos: int = None):
+        """
+        Guarda o valor; com a assinatura, ele também passa a ser o último resultado bom dela.
+
+        ttl_segundos substitui a validade padrão do cache para este valor.
+        """
+        expira_em = time.time() + (self.ttl_segundos if ttl_segundos is None else ttl_segundos)
+        with self._lock:
+            self._inserir(chave, expira_em, valor)
+            if assinatura is not None:
+                self._ultimos[assinatura] = (time.time(), valor)
+                self._ultimos.move_to_end(assinatura)
+                while len(self._ultimos) > self.max_entradas:
+                    self._ultimos.popitem(last=False)
+        if self.disco is not None:
+            self.disco.guardar(chave, valor, expira_em, assinatura)
+
+    def obter_ultimo(self, assinatura: str, idade_maxima: int = CACHE_VENCIDO_MAX_SEGUNDOS):
+        """Retorna (guardado_em, valor) do último resultado bom, ou None se antigo demais."""
+        with self._lock:
+            entrada = self._ultimos.get(assinatura)
+        if entrada is None and self.disco is not None:
+            entrada = self.disco.obter_ultimo(assinatura)
+        if entrada is None or time.time() - entrada[0] > idade_maxima:
+            return None
+        return entrada
+
+    def limpar(self):
+        """Remove todas as entradas, inclusive as do disco."""
+        with self._lock:
+            self._entradas.clear()
+            self._ultimos.clear()
+        if self.disco is not None:
+            self.disco.limpar()
+
+    def estatisticas(self) -> dict:
+        """Tamanho e taxa de acerto do cache (acertos incluem os vindos do disco)."""
+        with self._lock:
+            consultas = self.acertos + self.falhas
+            estatisticas = {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "ttl_segundos": self.ttl_segundos,
+                "acertos": self.acertos,
+                "acertos_disco": self.acertos_disco,
+                "falhas": self.falhas,
+                "taxa_acerto": round(self.acertos / consultas, 4) if consultas else 0.0
+            }
+        estatisticas["disco"] = self.disco.estatisticas() if self.disco is not None else None
+        return estatisticas
+
+
+class ContadorConsultas:
+    """Conta os acessos por assinatura e guarda os argumentos para reexecução."""
+
+    def __init__(self, janela_dias: int = JANELA_FREQUENCIA_DIAS, max_assinaturas: int = MAX_ASSINATURAS):
+        self.janela_segundos = janela_dias * 86400
+        self.max_assinaturas = max_assinaturas
+        self._lock = threading.Lock()
+        self._assinaturas = {}
+
+    def registrar(self, tipo: str, argumentos: dict) -> str:
+        """Registra um acesso e retorna a assinatura da consulta."""
+        assinatura = assinatura_consulta(tipo, argumentos)
+        agora = time.time()
+        with self._lock:
+            registro = self._assinaturas.get(assinatura)
+            if registro is None:
+                registro = {"tipo": tipo, "argumentos": argumentos, "acessos": 0}
+                self._assinaturas[assinatura] = registro
+            registro["acessos"] += 1
+            registro["ultimo_acesso"] = agora
+            if len(self._assinaturas) > self.max_assinaturas:
+                self._podar(agora)
+        return assinatura
+
+    def _podar(self, agora: float):
+        """Remove assinaturas antigas e, se preciso, as menos acessadas (chamar com o lock)."""
+        limite = agora - self.janela_segundos
+        for assinatura in [a for a, r in self._assinaturas.items() if r["ultimo_acesso"] < limite]:
+            del self._assinaturas[assinatura]
+        excedente = len(self._assinaturas) - self.max_assinaturas
+        if excedente > 0:
+            menos_usadas = sorted(self._assinaturas, key=lambda a: self._assinaturas[a]["acessos"])[:excedente]
+            for assinatura in menos_usadas:
+                del self._assinaturas[assinatura]
+
+    def mais_frequentes(self, n: int) -> list[dict]:
+        """As n assinaturas mais acessadas dentro da janela, da mais usada para a menos."""
+        limite = time.time() - self.janela_segundos
+        with self._lock:
+            recentes = [
+                dict(registro, assinatura=assinatura)
+                for assinatura, registro in self._assinaturas.items()
+                if registro["ultimo_acesso"] >= limite
+            ]
+        recentes.sort(key=lambda r: (r["acessos"], r["ultimo_acesso"]), reverse=True)
+        return recentes[:n]
+
+
+cache_resultados = CacheResultados(
+    disco=CacheDisco(CACHE_DISCO_CAMINHO, idade_maxima_ultimo=CACHE_VENCIDO_MAX_SEGUNDOS) if CACHE_DISCO_CAMINHO else None
+)
+contador_consultas = ContadorConsultas()
+
+
+def servir_vencido(assinatura: str, motivo: str):
+    """Último resultado bom da assinatura, registrando o aviso de vencido (ou None)."""
+    ultimo = cache_resultados.obter_ultimo(assinatura)
+    if ultimo is None:
+        return None
+    guardado_em, valor = ultimo
+    chamadas_upstream.contar(f"vencidos_por_{motivo}")
+    resultado_vencido.set({
+        "motivo": motivo,
+        "gerado_em": datetime.fromtimestamp(guardado_em).strftime("%Y-%m-%dT%H:%M:%S"),
+        "idade_segundos": int(time.time() - guardado_em)
+    })
+    log_debug(f"Servindo resultado vencido de {assinatura} ({motivo})")
+    return valor
+
+
+def consultar_com_cache(tipo: str, funcao, argumentos: dict, forcar: bool = False, registrar: bool = True,
+                        prazo_segundos: float = None, admissao=None):
+    """
+    Executa funcao(**argumentos) passando pelo cache.
+
+    Args:
+        tipo: Tipo da consulta ("ga4_query", "ga4_pivot", "search_console_query")
+        funcao: Função de consulta
+        argumentos: Argumentos da função
+        forcar: Ignora o valor em cache e o substitui (usado pelo pré-aquecimento)
+        registrar: Conta o acesso para o ranking de consultas frequentes
+        prazo_segundos: Ativa o modo interativo: hedging, prazo máximo e, em caso de
+            erro ou prazo estourado, o último resultado bom marcado em resultado_vencido
+        admissao: No modo interativo, função que retorna o context manager da vaga
+            no serviço; só é usada quando a consulta não está em cache
+
+    Returns:
+        O resultado da função; erros não são guardados
+
+    Raises:
+        PrazoExcedido: No modo interativo, se o prazo estourar sem resultado anterior
+        Sobrecarga: Se a admissão recusar a chamada e não houver resultado anterior
+    """
+    resultado_vencido.set(None)
+    assinatura = contador_consultas.registrar(tipo, argumentos) if registrar else assinatura_consulta(tipo, argumentos)
+    chave = f"{assinatura}:{date.today().isoformat()}"
+
+    def guardar(resultado):
+        cache_resultados.guardar(chave, resultado, assinatura, ttl_consulta(argumentos))
+
+    if not forcar:
+        resultado = cache_resultados.obter(chave)
+        if resultado is not None:
+            log_debug(f"Acerto no cache para {tipo} ({assinatura})")
+            return resultado
+
+    if prazo_segundos is None:
+        resultado = funcao(**argumentos)
+    else:
+        try:
+            vaga = ExitStack()
+            if admissao is not None:
+                vaga.enter_context(admissao())
+            # A vaga só é devolvida quando a última tentativa termina: uma tentativa
+            # que passou do prazo (ou um hedge perdedor) ainda ocupa o serviço
+            resultado = chamadas_upstream.executar(
+                tipo, funcao, argumentos, resultado_com_erro,
+                prazo_segundos=prazo_segundos,
+                ao_concluir_tarde=lambda tardio: None if resultado_com_erro(tardio) else guardar(tardio),
+                ao_encerrar=vaga.close
+            )
+        except PrazoExcedido:
+            vencido = servir_vencido(assinatura, "prazo")
+            if vencido is None:
+                raise
+            return vencido
+        except Sobrecarga:
+            # Recusada antes de gastar cota: o último resultado bom ainda serve
+            vencido = servir_vencido(assinatura, "sobrecarga")
+            if vencido is None:
+                raise
+            return vencido
+
+    if not resultado_com_erro(resultado):
+        guardar(resultado)
+    elif prazo_segundos is not None:
+        vencido = servir_vencido(assinatura, "erro")
+        if vencido is not None:
+            return vencido
+    return resultado
@@ -0,0 +1,108 @@
+"""
+Layout colunar compacto para respostas de consulta.
+
+No layout padrão ("linhas") cada registro é um dicionário que repete o nome
+de todas as colunas. No layout colunar os nomes são enviados uma única vez,
+cada coluna vira um array tipado e dimensões com muitos valores repetidos
+são codificadas por dicionário (o array guarda índices para a lista de
+valores distintos).
+"""
+
+LAYOUT_LINHAS = "linhas"
+LAYOUT_COLUNAR = "columnar"
+LAYOUTS_VALIDOS = (LAYOUT_LINHAS, LAYOUT_COLUNAR)
+
+# Só vale a pena codificar por dicionário quando há repetição suficiente
+LIMIAR_DICIONARIO = 0.5
+
+
+def converter_numero(valor):
+    """Converte um valor de métrica (str, int ou float) para int ou float."""
+    if isinstance(valor, (int, float)):
+        return valor
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return valor
+
+
+def tipo_coluna(valores):
+    """Identifica o tipo JSON de uma coluna já convertida (valores nulos são ignorados)."""
+    tipo = "integer"
+    for valor in valores:
+        if valor is None:
+            continue
+        if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+            return "string"
+        if isinstance(valor, float):
+            tipo = "number"
+    return tipo
+
+
+def montar_colunar(colunas, linhas, colunas_dimensao=(), limiar_dicionario=LIMIAR_DICIONARIO) -> dict:
+    """
+    Monta a representação colunar de um conjunto de linhas.
+
+    Args:
+        colunas: Nomes das colunas, na ordem das linhas
+        linhas: Sequência de linhas (listas ou tuplas alinhadas com colunas)
+        colunas_dimensao: Colunas tratadas como texto; as demais são convertidas em números
+        limiar_dicionario: Fração máxima de valores distintos para aplicar dicionário
+
+    Returns:
+        dict: Colunas, tipos, arrays de valores e dicionários de codificação
+    """
+    colunas = list(colunas)
+    dimensoes = set(colunas_dimensao)
+    total = len(linhas)
+
+    tipos = []
+    valores = []
+    dicionarios = {}
+
+    for i, coluna in enumerate(colunas):
+        if coluna in dimensoes:
+            brutos = [linha[i] for linha in linhas]
+            distintos = {}
+            for valor in brutos:
+                if valor not in distintos:
+                    distintos[valor] = len(distintos)
+
+            tipos.append("string")
+            if total > 1 and len(distintos) <= total * limiar_dicionario:
+                dicionarios[coluna] = list(distintos)
+                valores.append([distintos[valor] for valor in brutos])
+            else:
+                valores.append(brutos)
+        else:
+            convertidos = [converter_numero(linha[i]) for linha in linhas]
+            tipos.append(tipo_coluna(convertidos))
+            valores.append(convertidos)
+
+    return {
+        "layout": LAYOUT_COLUNAR,
+        "colunas": colunas,
+        "tipos": tipos,
+        "valores": valores,
+        "dicionarios": dicionarios,
+        "total_linhas": total
+    }
+
+
+def expandir_colunar(tabela: dict) -> list[dict]:
+    """Reconstrói a lista de registros (layout de linhas) a partir da tabela colunar."""
+    colunas = tabela["colunas"]
+    dicionarios = tabela.get("dicionarios", {})
+
+    arrays = []
+    for coluna, valores in zip(colunas, tabela["valores"]):
+        if coluna in dicionarios:
+            dicionario = dicionarios[coluna]
+            valores = [dicionario[indice] for indice in valores]
+        arrays.append(valores)
+
+    return [dict(zip(colunas, linha)) for linha in zip(*arrays)]
@@ -0,0 +1,122 @@
+"""
+Comparação entre períodos de um mesmo relatório GA4.
+
+Com vários DateRange em uma única RunReportRequest o GA4 devolve uma
+dimensão extra "dateRange" com o nome de cada período. Aqui as linhas são
+separadas por período e unidas pelas demais dimensões, com deltas de cada
+período em relação ao primeiro (o período base).
+"""
+
+from agents.columnar import converter_numero
+from agents.summary import metrica_aditiva
+
+DIMENSAO_PERIODO = "dateRange"
+MAXIMO_PERIODOS = 4  # limite de date ranges por requisição no GA4
+
+
+def nomes_periodos(periodos: list[dict]) -> list[str]:
+    """Nome de cada período: o informado em "nome" ou "periodo_N"."""
+    return [p.get("nome") or f"periodo_{i + 1}" for i, p in enumerate(periodos)]
+
+
+def validar_periodos(periodos) -> str:
+    """Valida a lista de períodos; retorna a mensagem de erro ou string vazia."""
+    if not isinstance(periodos, list) or not periodos:
+        return "periodos deve ser uma lista não vazia"
+    if len(periodos) > MAXIMO_PERIODOS:
+        return f"O GA4 aceita no máximo {MAXIMO_PERIODOS} períodos por requisição"
+    for periodo in periodos:
+        if not isinstance(periodo, dict) or not periodo.get("data_inicio") or not periodo.get("data_fim"):
+            return "Cada período precisa de data_inicio e data_fim"
+        if not isinstance(periodo["data_inicio"], str) or not isinstance(periodo["data_fim"], str):
+            return "data_inicio e data_fim dos períodos devem ser textos"
+        nome = periodo.get("nome") or ""
+        if not isinstance(nome, str):
+            return "O nome de cada período deve ser um texto"
+        if nome.startswith(("date_range_", "RESERVED_")):
+            return f"Nome de período reservado pelo GA4: '{nome}'"
+    nomes = nomes_periodos(periodos)
+    if len(set(nomes)) != len(nomes):
+        return "Os nomes dos períodos devem ser únicos"
+    return ""
+
+
+def variacao_percentual(atual, anterior):
+    """Variação percentual de anterior para atual (None quando anterior é zero)."""
+    if not anterior:
+        return None
+    return round((atual - anterior) * 100.0 / anterior, 2)
+
+
+def comparar_valores(valores: dict, nomes: list[str]) -> dict:
+    """
+    Monta {nome: valor, delta_<outro>: ..., variacao_pct_<outro>: ...} para uma métrica.
+
+    O primeiro nome é o período base; períodos ausentes contam como zero. Os
+    deltas são sempre o primeiro período menos cada um dos outros
+    (delta_<outro> = base - outro), e variacao_pct_<outro> é a variação do
+    outro período até a base, em % do outro: positivo quando a base é maior.
+    """
+    base = valores.get(nomes[0], 0)
+    comparacao = {nome: valores.get(nome, 0) for nome in nomes}
+    for nome in nomes[1:]:
+        outro = valores.get(nome, 0)
+        comparacao[f"delta_{nome}"] = round(base - outro, 6)
+        comparacao[f"variacao_pct_{nome}"] = variacao_percentual(base, outro)
+    return comparacao
+
+
+def comparar_periodos(cabecalhos, linhas, colunas_metrica, nomes: list[str]) -> dict:
+    """
+    Separa as linhas por período e calcula os deltas em relação ao período base.
+
+    Args:
+        cabecalhos: Colunas do relatório, incluindo "dateRange"
+        linhas: Linhas com valores em texto (como vindas do GA4)
+        colunas_metrica: Colunas de métrica; as demais (exceto "dateRange") são dimensões
+        nomes: Nomes dos períodos; o primeiro é a base da comparação
+
+    Returns:
+        dict: "por_periodo" (registros de cada período), "comparacao" (uma
+        entrada por combinação de dimensões) e "totais" das métricas somáveis
+    """
+    i_periodo = cabecalhos.index(DIMENSAO_PERIODO)
+    colunas_metrica = set(colunas_metrica)
+    dimensoes = [i for i, c in enumerate(cabecalhos) if c != DIMENSAO_PERIODO and c not in colunas_metrica]
+    metricas = [i for i, c in enumerate(cabecalhos) if c in colunas_metrica]
+
+    por_periodo = {nome: [] for nome in nomes}
+    agrupado = {}
+    # Totais só para métricas somáveis; taxas e médias aparecem apenas por linha
+    totais = {cabecalhos[i]: {} for i in metricas if metrica_aditiva(cabecalhos[i])}
+
+    for linha in linhas:
+        nome = linha[i_periodo]
+        chave = tuple(linha[i] for i in dimensoes)
+        registro = {cabecalhos[i]: linha[i] for i in dimensoes}
+        valores = {cabecalhos[i]: converter_numero(linha[i]) for i in metricas}
+        registro.update(valores)
+        por_periodo.setdefault(nome, []).append(registro)
+
+        grupo = agrupado.setdefault(chave, {})
+        for metrica, valor in valores.items():
+            grupo.setdefault(metrica, {})[nome] = valor
+            if metrica in totais:
+                totais[metrica][nome] = totais[metrica].get(nome, 0) + valor
+
+    comparacao = []
+    for chave, grupo in agrupado.items():
+        registro = {cabecalhos[i]: valor for i, valor in zip(dimensoes, chave)}
+        for metrica, valores in grupo.items():
+            registro[metrica] = comparar_valores(valores, nomes)
+        comparacao.append(registro)
+
+    if metricas:
+        primeira = cabecalhos[metricas[0]]
+        comparacao.sort(key=lambda r: r[primeira][nomes[0]], reverse=True)
+
+    return {
+        "por_periodo": por_periodo,
+        "comparacao": comparacao,
+        "totais": {metrica: comparar_valores(valores, nomes) for metrica, valores in totais.items()}
+    }
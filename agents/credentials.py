@@ -0,0 +1,356 @@
+"""
+Credenciais por tenant e pool de clientes Google.
+
+Cada tenant tem sua conta de serviço, lida de um diretório local
+(TENANT_CREDENTIALS_DIR/<tenant>.json) ou do mapa JSON em TENANT_CREDENTIALS.
+Sem tenant, vale a conta de GOOGLE_CREDENTIALS, como antes.
+
+Os clientes (GA4 Data, GA4 Admin, Search Console) são caros de construir,
+então ficam em um pool LRU limitado por (tenant, tipo de cliente): o menos
+usado sai quando o pool enche, assim como clientes ociosos há muito tempo.
+Quem sai do pool não é fechado: outra thread pode ainda estar no meio de uma
+chamada com ele, e suas conexões são liberadas pelo coletor de lixo quando a
+última referência cai.
+
+Os tokens de acesso das credenciais em uso são renovados em segundo plano,
+antes de expirar; sem isso, a cada hora alguma requisição pagaria a troca
+de token com o Google dentro do seu próprio tempo de resposta.
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+TENANT_CREDENTIALS_DIR = os.getenv("TENANT_CREDENTIALS_DIR", "")
+TENANT_POOL_MAX = int(os.getenv("TENANT_POOL_MAX", "32"))
+TENANT_POOL_IDLE_SEGUNDOS = int(os.getenv("TENANT_POOL_IDLE_SEGUNDOS", "1800"))
+# Precisa ser maior que a folga com que o google-auth já considera o token
+# vencido (3min45s); senão a renovação preguiçosa na requisição vem antes
+TOKEN_RENOVAR_ANTES_SEGUNDOS = int(os.getenv("TOKEN_RENOVAR_ANTES_SEGUNDOS", "600"))
+TOKEN_ESPERA_FALHA_SEGUNDOS = int(os.getenv("TOKEN_ESPERA_FALHA_SEGUNDOS", "30"))
+# Latências guardadas para a média e o p95 das renovações
+AMOSTRAS_RENOVACAO = 100
+
+# IDs de tenant viram nomes de arquivo: só letras, números, "-" e "_"
+PADRAO_TENANT = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"CREDENTIALS DEBUG: {message}", file=sys.stderr)
+
+
+class TenantDesconhecido(KeyError):
+    """Levantada quando não há credenciais para o tenant pedido."""
+
+    def __str__(self):
+        return f"Tenant '{self.args[0]}' não encontrado"
+
+
+def tenant_valido(tenant: str) -> bool:
+    """Indica se o ID de tenant tem formato aceito."""
+    return bool(PADRAO_TENANT.match(tenant or ""))
+
+
+# Último TENANT_CREDENTIALS lido e seu mapa, para não refazer o parse a cada requisição
+_ambiente_lido = ("", {})
+
+
+def credenciais_do_ambiente() -> dict:
+    """Mapa {tenant: credenciais} da variável TENANT_CREDENTIALS (JSON), se houver."""
+    global _ambiente_lido
+    texto = os.getenv("TENANT_CREDENTIALS", "")
+    if texto == _ambiente_lido[0]:
+        return _ambiente_lido[1]
+    try:
+        mapa = json.loads(texto)
+    except json.JSONDecodeError as e:
+        log_debug(f"TENANT_CREDENTIALS não é um JSON válido: {e}")
+        mapa = {}
+    _ambiente_lido = (texto, mapa)
+    return mapa
+
+
+def tenant_configurado(tenant: str) -> bool:
+    """Indica se o tenant tem credenciais, sem listar o diretório inteiro."""
+    if not tenant_valido(tenant):
+        return False
+    if tenant in credenciais_do_ambiente():
+        return True
+    return bool(TENANT_CREDENTIALS_DIR) and os.path.isfile(os.path.join(TENANT_CREDENTIALS_DIR, f"{tenant}.json"))
+
+
+def listar_tenants() -> list[str]:
+    """IDs dos tenants configurados (diretório e variável de ambiente)."""
+    tenants = set(credenciais_do_ambiente())
+    if TENANT_CREDENTIALS_DIR and os.path.isdir(TENANT_CREDENTIALS_DIR):
+        tenants.update(
+            nome[:-len(".json")] for nome in os.listdir(TENANT_CREDENTIALS_DIR)
+            if nome.endswith(".json") and tenant_valido(nome[:-len(".json")])
+        )
+    return sorted(tenants)
+
+
+def carregar_credenciais(tenant: str = None) -> dict:
+    """
+    Credenciais (JSON da conta de serviço) do tenant.
+
+    Sem tenant, usa GOOGLE_CREDENTIALS. Levanta TenantDesconhecido se o
+    tenant não tiver credenciais configuradas.
+    """
+    if not tenant:
+        texto = os.getenv("GOOGLE_CREDENTIALS")
+        if not texto:
+            raise ValueError("Credenciais do Google não encontradas na variável GOOGLE_CREDENTIALS")
+        return json.loads(texto)
+
+    if not tenant_valido(tenant):
+        raise TenantDesconhecido(tenant)
+
+    do_ambiente = credenciais_do_ambiente()
+    if tenant in do_ambiente:
+        return do_ambiente[tenant]
+
+    if TENANT_CREDENTIALS_DIR:
+        caminho = os.path.join(TENANT_CREDENTIALS_DIR, f"{tenant}.json")
+        if os.path.isfile(caminho):
+            with open(caminho, encoding="utf-8") as arquivo:
+                return json.load(arquivo)
+
+    raise TenantDesconhecido(tenant)
+
+
+class PoolClientes:
+    """Pool LRU de clientes por (tenant, tipo), com remoção de clientes ociosos."""
+
+    def __init__(self, max_clientes: int = TENANT_POOL_MAX, ociosidade_segundos: int = TENANT_POOL_IDLE_SEGUNDOS):
+        self.max_clientes = max_clientes
+        self.ociosidade_segundos = ociosidade_segundos
+        self._lock = threading.Lock()
+        self._clientes = OrderedDict()
+        self._construindo = {}
+        self.construidos = 0
+        self.reutilizados = 0
+        self.removidos = 0
+
+    def obter(self, tenant: str, tipo: str, fabrica):
+        """
+        Cliente do tipo para o tenant, construído com fabrica(credenciais) na primeira vez.
+
+        Requisições simultâneas para o mesmo (tenant, tipo) esperam uma única construção.
+        """
+        chave = (tenant or "", tipo)
+        while True:
+            with self._lock:
+                self._remover_ociosos()
+                entrada = self._clientes.get(chave)
+                if entrada is not None:
+                    entrada["ultimo_uso"] = time.time()
+                    self._clientes.move_to_end(chave)
+                    self.reutilizados += 1
+                    return entrada["cliente"]
+                evento = self._construindo.get(chave)
+                if evento is None:
+                    evento = self._construindo[chave] = threading.Event()
+                    break
+            evento.wait()
+
+        try:
+            cliente = fabrica(carregar_credenciais(tenant))
+        except BaseException:
+            with self._lock:
+                self._construindo.pop(chave).set()
+            raise
+
+        with self._lock:
+            self._clientes[chave] = {"cliente": cliente, "criado_em": time.time(), "ultimo_uso": time.time()}
+            self.construidos += 1
+            # Sem fechar: quem ainda usa o cliente removido termina a chamada normalmente
+            while len(self._clientes) > self.max_clientes:
+                self._clientes.popitem(last=False)
+                self.removidos += 1
+            self._construindo.pop(chave).set()
+
+        log_debug(f"Cliente {tipo} criado para o tenant '{tenant or 'padrão'}'")
+        return cliente
+
+    def _remover_ociosos(self):
+        """Tira do pool clientes sem uso há mais de ociosidade_segundos (chamar com o lock)."""
+        limite = time.time() - self.ociosidade_segundos
+        ociosos = [chave for chave, entrada in self._clientes.items() if entrada["ultimo_uso"] < limite]
+        for chave in ociosos:
+            del self._clientes[chave]
+        self.removidos += len(ociosos)
+
+    def estatisticas(self) -> dict:
+        """Clientes no pool e contadores de construção e reuso."""
+        with self._lock:
+            return {
+                "clientes": [f"{tenant or 'padrão'}:{tipo}" for tenant, tipo in self._clientes],
+                "max_clientes": self.max_clientes,
+                "ociosidade_segundos": self.ociosidade_segundos,
+                "construidos": self.construidos,
+                "reutilizados": self.reutilizados,
+                "removidos": self.removidos
+            }
+
+
+def requisicao_google():
+    """Transporte HTTP usado pelo google-auth para trocar tokens."""
+    from google.auth.transport.requests import Request
+    return Request()
+
+
+def segundos_ate_expirar(credenciais):
+    """Segundos até o token expirar; None sem token ou sem expiração conhecida."""
+    if not getattr(credenciais, "token", None) or getattr(credenciais, "expiry", None) is None:
+        return None
+    # O google-auth guarda a expiração em UTC sem fuso
+    agora = datetime.now(timezone.utc).replace(tzinfo=None)
+    return (credenciais.expiry - agora).total_seconds()
+
+
+class RenovadorTokens:
+    """
+    Renova em segundo plano os tokens das credenciais acompanhadas.
+
+    Cada credencial é renovada antecedencia_segundos antes de expirar (ou
+    logo ao ser acompanhada, se ainda não tem token). Como os clientes
+    guardam o próprio objeto de credenciais, o token novo vale na hora para
+    todos eles e para as threads que os usam. Uma falha mantém o token atual,
+    ainda válido, e é repetida após espera_falha_segundos. As credenciais são
+    guardadas por referência fraca: quando o cliente sai do pool, saem daqui.
+    """
+
+    def __init__(self, antecedencia_segundos: int = TOKEN_RENOVAR_ANTES_SEGUNDOS,
+                 espera_falha_segundos: int = TOKEN_ESPERA_FALHA_SEGUNDOS, requisicao=None):
+        self.antecedencia_segundos = antecedencia_segundos
+        self.espera_falha_segundos = espera_falha_segundos
+        self._requisicao = requisicao
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._entradas = {}
+        self._thread = None
+        self._latencias = deque(maxlen=AMOSTRAS_RENOVACAO)
+        self.renovacoes = 0
+        self.falhas = 0
+
+    def acompanhar(self, nome: str, credenciais):
+        """Passa a renovar as credenciais (substitui as anteriores com o mesmo nome) e as retorna."""
+        if credenciais is None or not hasattr(credenciais, "refresh"):
+            return credenciais
+        with self._lock:
+            self._entradas[nome] = {
+                "credenciais": weakref.ref(credenciais),
+                "tentar_apos": 0.0,
+                "renovado_em": None,
+                "validade": None,
+                "ultimo_erro": None
+            }
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="renovador-tokens", daemon=True)
+                self._thread.start()
+        self._acordar.set()
+        return credenciais
+
+    def _proxima(self, entrada: dict, credenciais) -> float:
+        """Instante (time.time) em que a entrada deve ser renovada."""
+        restante = segundos_ate_expirar(credenciais)
+        # Tokens curtos são renovados na metade da validade, não a cada rodada
+        antecedencia = min(self.antecedencia_segundos, (entrada["validade"] or 0) / 2 or self.antecedencia_segundos)
+        vencimento = time.time() if restante is None else time.time() + restante - antecedencia
+        return max(vencimento, entrada["tentar_apos"])
+
+    def renovar(self, nome: str) -> bool:
+        """Renova agora o token da entrada; retorna False se a renovação falhar."""
+        with self._lock:
+            entrada = self._entradas.get(nome)
+        credenciais = entrada["credenciais"]() if entrada else None
+        if credenciais is None:
+            return False
+
+        if self._requisicao is None:
+            self._requisicao = requisicao_google()
+        inicio = time.monotonic()
+        try:
+            credenciais.refresh(self._requisicao)
+        except Exception as e:
+            with self._lock:
+                self.falhas += 1
+                entrada["ultimo_erro"] = str(e)
+                entrada["tentar_apos"] = time.time() + self.espera_falha_segundos
+            log_debug(f"Falha ao renovar o token de {nome}: {e}")
+            return False
+
+        with self._lock:
+            self._latencias.append(time.monotonic() - inicio)
+            self.renovacoes += 1
+            entrada["renovado_em"] = time.time()
+            entrada["validade"] = segundos_ate_expirar(credenciais)
+            entrada["ultimo_erro"] = None
+            entrada["tentar_apos"] = 0.0
+        return True
+
+    def executar_rodada(self) -> float:
+        """Renova as entradas vencidas e retorna os segundos até a próxima renovação."""
+        with self._lock:
+            # Credenciais de clientes descartados somem da lista
+            for nome in [n for n, e in self._entradas.items() if e["credenciais"]() is None]:
+                del self._entradas[nome]
+            entradas = list(self._entradas.items())
+
+        proxima = None
+        for nome, entrada in entradas:
+            credenciais = entrada["credenciais"]()
+            if credenciais is None:
+                continue
+            if self._proxima(entrada, credenciais) <= time.time():
+                self.renovar(nome)
+            instante = self._proxima(entrada, credenciais)
+            proxima = instante if proxima is None else min(proxima, instante)
+        return 3600.0 if proxima is None else max(1.0, proxima - time.time())
+
+    def _loop(self):
+        while True:
+            espera = self.executar_rodada()
+            self._acordar.wait(espera)
+            self._acordar.clear()
+
+    def estatisticas(self) -> dict:
+        """Renovações, falhas e latência das trocas de token, e a validade de cada credencial."""
+        with self._lock:
+            latencias = sorted(self._latencias)
+            entradas = list(self._entradas.items())
+            resumo = {
+                "renovacoes": self.renovacoes,
+                "falhas": self.falhas,
+                "latencia_media_segundos": round(sum(latencias) / len(latencias), 3) if latencias else None,
+                "latencia_p95_segundos": round(latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))], 3) if latencias else None,
+                "renovar_antes_segundos": self.antecedencia_segundos
+            }
+        credenciais = []
+        for nome, entrada in entradas:
+            atual = entrada["credenciais"]()
+            if atual is None:
+                continue
+            restante = segundos_ate_expirar(atual)
+            credenciais.append({
+                "nome": nome,
+                "expira_em_segundos": round(restante) if restante is not None else None,
+                "renovado_em": datetime.fromtimestamp(entrada["renovado_em"]).strftime("%Y-%m-%dT%H:%M:%S") if entrada["renovado_em"] else None,
+                "ultimo_erro": entrada["ultimo_erro"]
+            })
+        return {**resumo, "credenciais": credenciais}
+
+
+# Instância compartilhada pelos módulos de GA4 e Search Console
+pool_clientes = PoolClientes()
+
+# Renova os tokens das credenciais usadas pelos clientes
+renovador_tokens = RenovadorTokens()
@@ -0,0 +1,206 @@
+"""
+Cache de resultados em disco, compartilhado pelos workers do mesmo host.
+
+Com vários processos, o cache em memória fica dividido e cada worker busca
+de novo o que outro já buscou. Aqui os resultados ficam em um arquivo
+SQLite em modo WAL (leitores não bloqueiam o escritor), que todos os
+workers do host abrem, e que sobrevive a reinícios e deploys. Cada linha
+guarda o resultado mais recente de uma assinatura: ele vale como acerto
+até expirar e, depois disso, ainda serve como último resultado bom. Quando
+o arquivo passa do tamanho máximo, saem primeiro as linhas menos acessadas.
+Falhas do SQLite nunca derrubam a consulta: contam como falta no cache.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+# Desativado por padrão: cada implantação aponta para o seu próprio arquivo
+CACHE_DISCO_CAMINHO = os.getenv("CACHE_DISCO_CAMINHO", "")
+CACHE_DISCO_MAX_MB = float(os.getenv("CACHE_DISCO_MAX_MB", "256"))
+# Espera por outro worker que esteja escrevendo
+ESPERA_BLOQUEIO_SEGUNDOS = 5
+# O horário de acesso (usado no descarte) só é regravado depois desse intervalo
+INTERVALO_ATUALIZAR_ACESSO = 60
+NIVEL_ZLIB = 1
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS resultados (
+    chave TEXT PRIMARY KEY,
+    assinatura TEXT,
+    guardado_em REAL NOT NULL,
+    expira_em REAL NOT NULL,
+    acessado_em REAL NOT NULL,
+    tamanho INTEGER NOT NULL,
+    valor BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS resultados_assinatura ON resultados (assinatura);
+CREATE INDEX IF NOT EXISTS resultados_acesso ON resultados (acessado_em);
+"""
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"DISK_CACHE DEBUG: {message}", file=sys.stderr)
+
+
+def serializar(valor) -> bytes:
+    """JSON comprimido; a ordem das chaves é preservada."""
+    return zlib.compress(json.dumps(valor, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), NIVEL_ZLIB)
+
+
+def desserializar(dados: bytes):
+    return json.loads(zlib.decompress(dados).decode("utf-8"))
+
+
+class CacheDisco:
+    """Resultados serializados em SQLite (WAL), com expiração e limite de tamanho."""
+
+    def __init__(self, caminho: str = CACHE_DISCO_CAMINHO, max_mb: float = CACHE_DISCO_MAX_MB,
+                 idade_maxima_ultimo: int = 7 * 86400):
+        self.caminho = caminho
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.idade_maxima_ultimo = idade_maxima_ultimo
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.gravacoes = 0
+        self.descartes = 0
+        self.erros = 0
+
+    def _conexao(self) -> sqlite3.Connection:
+        """Conexão da thread atual; refeita após um fork, que não pode herdar conexões."""
+        conexao = getattr(self._local, "conexao", None)
+        if conexao is not None and self._local.pid == os.getpid():
+            return conexao
+        diretorio = os.path.dirname(self.caminho)
+        if diretorio:
+            os.makedirs(diretorio, mode=0o700, exist_ok=True)
+        # Os resultados podem ter dados de clientes: só o dono do processo lê o arquivo
+        # (o SQLite cria o -wal e o -shm com as mesmas permissões)
+        os.close(os.open(self.caminho, os.O_RDWR | os.O_CREAT, 0o600))
+        conexao = sqlite3.connect(self.caminho, timeout=ESPERA_BLOQUEIO_SEGUNDOS, isolation_level=None)
+        conexao.execute("PRAGMA journal_mode=WAL")
+        conexao.execute("PRAGMA synchronous=NORMAL")
+        conexao.executescript(ESQUEMA)
+        self._local.conexao = conexao
+        self._local.pid = os.getpid()
+        return conexao
+
+    def _contar(self, nome: str, quantidade: int = 1):
+        with self._lock:
+            setattr(self, nome, getattr(self, nome) + quantidade)
+
+    def _falhou(self, operacao: str, erro: Exception):
+        self._contar("erros")
+        log_debug(f"Falha ao {operacao} no cache em disco: {erro}")
+
+    def obter(self, chave: str):
+        """Retorna (expira_em, valor) se a chave estiver no disco e não expirada; senão None."""
+        agora = time.time()
+        try:
+            conexao = self._conexao()
+            linha = conexao.execute(
+                "SELECT expira_em, acessado_em, valor FROM resultados WHERE chave = ? AND expira_em > ?",
+                (chave, agora)
+            ).fetchone()
+            if linha is None:
+                self._contar("falhas")
+                return None
+            expira_em, acessado_em, dados = linha
+            if agora - acessado_em > INTERVALO_ATUALIZAR_ACESSO:
+                conexao.execute("UPDATE resultados SET acessado_em = ? WHERE chave = ?", (agora, chave))
+            valor = desserializar(dados)
+        except (sqlite3.Error, OSError, ValueError, zlib.error) as e:
+            self._falhou("ler", e)
+            return None
+        self._contar("acertos")
+        return expira_em, valor
+
+    def obter_ultimo(self, assinatura: str):
+        """Retorna (guardado_em, valor) do resultado mais recente da assinatura, mesmo expirado, ou None."""
+        try:
+            linha = self._conexao().execute(
+                "SELECT guardado_em, valor FROM resultados WHERE assinatura = ? ORDER BY guardado_em DESC LIMIT 1",
+                (assinatura,)
+            ).fetchone()
+            return None if linha is None else (linha[0], desserializar(linha[1]))
+        except (sqlite3.Error, OSError, ValueError, zlib.error) as e:
+            self._falhou("ler", e)
+            return None
+
+    def guardar(self, chave: str, valor, expira_em: float, assinatura: str = None):
+        """Grava o valor; com a assinatura, substitui os resultados anteriores dela (de outros dias)."""
+        agora = time.time()
+        try:
+            dados = serializar(valor)
+            conexao = self._conexao()
+            conexao.execute("BEGIN IMMEDIATE")
+            try:
+                if assinatura is not None:
+                    conexao.execute("DELETE FROM resultados WHERE assinatura = ? AND chave <> ?", (assinatura, chave))
+                conexao.execute(
+                    "INSERT OR REPLACE INTO resultados (chave, assinatura, guardado_em, expira_em, acessado_em, tamanho, valor) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (chave, assinatura, agora, expira_em, agora, len(dados), dados)
+                )
+                descartadas = self._descartar(conexao, agora)
+                conexao.execute("COMMIT")
+            except BaseException:
+                conexao.execute("ROLLBACK")
+                raise
+        except (sqlite3.Error, OSError, TypeError, ValueError) as e:
+            self._falhou("gravar", e)
+            return
+        self._contar("gravacoes")
+        self._contar("descartes", descartadas)
+
+    def _descartar(self, conexao: sqlite3.Connection, agora: float) -> int:
+        """Remove o que não serve nem como último resultado e, acima do tamanho máximo, os menos acessados."""
+        removidas = conexao.execute(
+            "DELETE FROM resultados WHERE guardado_em < ? OR (assinatura IS NULL AND expira_em <= ?)",
+            (agora - self.idade_maxima_ultimo, agora)
+        ).rowcount
+        excedente = conexao.execute("SELECT COALESCE(SUM(tamanho), 0) FROM resultados").fetchone()[0] - self.max_bytes
+        if excedente <= 0:
+            return removidas
+        chaves = []
+        for chave, tamanho in conexao.execute("SELECT chave, tamanho FROM resultados ORDER BY acessado_em"):
+            if excedente <= 0:
+                break
+            chaves.append((chave,))
+            excedente -= tamanho
+        conexao.executemany("DELETE FROM resultados WHERE chave = ?", chaves)
+        return removidas + len(chaves)
+
+    def limpar(self):
+        """Remove todos os resultados (de todos os workers)."""
+        try:
+            self._conexao().execute("DELETE FROM resultados")
+        except (sqlite3.Error, OSError) as e:
+            self._falhou("limpar", e)
+
+    def estatisticas(self) -> dict:
+        """Tamanho do arquivo e contadores deste worker."""
+        try:
+            entradas, total = self._conexao().execute("SELECT COUNT(*), COALESCE(SUM(tamanho), 0) FROM resultados").fetchone()
+        except (sqlite3.Error, OSError) as e:
+            self._falhou("ler", e)
+            entradas, total = None, None
+        with self._lock:
+            return {
+                "caminho": self.caminho,
+                "entradas": entradas,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "gravacoes": self.gravacoes,
+                "descartes": self.descartes,
+                "erros": self.erros
+            }
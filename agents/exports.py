@@ -0,0 +1,309 @@
+"""
+Exportação em massa do GA4 e do Search Console para arquivos CSV ou Parquet.
+
+A exportação percorre o relatório completo página por página e grava cada
+página em um arquivo de parte no disco, então a memória usada não depende
+do tamanho do relatório. Depois de cada parte, o manifesto (manifest.json)
+registra as partes prontas e onde começa a próxima página: se o processo
+cair, a exportação é retomada desse ponto. No fim, as partes são unidas em
+um único arquivo, copiado parte a parte.
+"""
+
+import csv
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from agents.jobs import reportar_progresso
+
+# Parquet é opcional: sem pyarrow, só CSV
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+EXPORTS_DIR = os.getenv("EXPORTS_DIR", os.path.join(tempfile.gettempdir(), "dex_exports"))
+EXPORTS_TTL_SEGUNDOS = int(os.getenv("EXPORTS_TTL_SEGUNDOS", str(3 * 24 * 3600)))
+# Linhas pedidas por página (o Search Console tem limite próprio de 25000)
+EXPORTS_LINHAS_POR_PAGINA = int(os.getenv("EXPORTS_LINHAS_POR_PAGINA", "50000"))
+
+FORMATOS = ("csv", "parquet")
+TIPOS_MIME = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+STATUS_PENDENTE = "pendente"
+STATUS_EXECUTANDO = "executando"
+STATUS_INTERROMPIDO = "interrompido"
+STATUS_CONCLUIDO = "concluido"
+STATUS_ERRO = "erro"
+
+ARQUIVO_MANIFESTO = "manifest.json"
+# IDs viram nomes de diretório: só o formato gerado por criar()
+PADRAO_EXPORT_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"EXPORTS DEBUG: {message}", file=sys.stderr)
+
+
+def formatos_disponiveis() -> list[str]:
+    """Formatos suportados com as dependências instaladas."""
+    return [formato for formato in FORMATOS if formato != "parquet" or pa is not None]
+
+
+def agora_iso() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+class EscritorCSV:
+    """Partes sem cabeçalho; o arquivo final é o cabeçalho seguido das partes."""
+
+    extensao = "csv"
+
+    def gravar_parte(self, caminho: str, colunas: list[str], tipos: dict, linhas: list):
+        with open(caminho, "w", newline="", encoding="utf-8") as arquivo:
+            csv.writer(arquivo).writerows(linhas)
+
+    def unir(self, destino: str, colunas: list[str], tipos: dict, partes: list[str]):
+        with open(destino, "w", newline="", encoding="utf-8") as saida:
+            csv.writer(saida).writerow(colunas)
+            for parte in partes:
+                with open(parte, encoding="utf-8", newline="") as entrada:
+                    shutil.copyfileobj(entrada, saida)
+
+
+class EscritorParquet:
+    """Uma parte por página; o arquivo final tem um row group por parte."""
+
+    extensao = "parquet"
+    TIPOS_ARROW = {"texto": "string", "inteiro": "int64", "decimal": "float64"}
+
+    def esquema(self, colunas: list[str], tipos: dict):
+        return pa.schema([(coluna, pa.type_for_alias(self.TIPOS_ARROW[tipos.get(coluna, "texto")])) for coluna in colunas])
+
+    def gravar_parte(self, caminho: str, colunas: list[str], tipos: dict, linhas: list):
+        esquema = self.esquema(colunas, tipos)
+        valores = list(zip(*linhas)) if linhas else [()] * len(colunas)
+        tabela = pa.Table.from_arrays(
+            [pa.array(coluna, type=campo.type) for coluna, campo in zip(valores, esquema)],
+            schema=esquema
+        )
+        pq.write_table(tabela, caminho)
+
+    def unir(self, destino: str, colunas: list[str], tipos: dict, partes: list[str]):
+        # Lê uma parte por vez: a memória fica limitada ao tamanho de uma página
+        with pq.ParquetWriter(destino, self.esquema(colunas, tipos)) as escritor:
+            for parte in partes:
+                escritor.write_table(pq.read_table(parte))
+
+
+ESCRITORES = {"csv": EscritorCSV(), "parquet": EscritorParquet()}
+
+
+class GerenciadorExportacoes:
+    """Exportações no disco, cada uma com seu diretório, manifesto e partes."""
+
+    def __init__(self, diretorio: str = EXPORTS_DIR, ttl_segundos: int = EXPORTS_TTL_SEGUNDOS,
+                 linhas_por_pagina: int = EXPORTS_LINHAS_POR_PAGINA):
+        self.diretorio = diretorio
+        self.ttl_segundos = ttl_segundos
+        self.linhas_por_pagina = linhas_por_pagina
+        # Fonte -> função paginar(parametros, inicio, linhas_por_pagina) que gera páginas
+        # {"colunas", "tipos", "linhas", "proximo", "total"}; configuradas quando o Google está disponível
+        self.fontes = {}
+        self._lock = threading.Lock()
+        self._em_execucao = set()
+
+    def _pasta(self, export_id: str) -> str:
+        return os.path.join(self.diretorio, export_id)
+
+    def _ler_manifesto(self, export_id: str):
+        if not PADRAO_EXPORT_ID.match(export_id or ""):
+            return None
+        try:
+            with open(os.path.join(self._pasta(export_id), ARQUIVO_MANIFESTO), encoding="utf-8") as arquivo:
+                return json.load(arquivo)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def _gravar_manifesto(self, manifesto: dict):
+        # Grava em um temporário e troca: um processo derrubado no meio não corrompe o checkpoint
+        manifesto["atualizado_em"] = agora_iso()
+        caminho = os.path.join(self._pasta(manifesto["export_id"]), ARQUIVO_MANIFESTO)
+        with open(caminho + ".tmp", "w", encoding="utf-8") as arquivo:
+            json.dump(manifesto, arquivo, ensure_ascii=False, indent=2)
+        os.replace(caminho + ".tmp", caminho)
+
+    def criar(self, fonte: str, formato: str, parametros: dict, tenant: str = None) -> dict:
+        """Cria o diretório e o manifesto de uma nova exportação (ainda não iniciada)."""
+        self.limpar()
+        export_id = uuid.uuid4().hex
+        os.makedirs(self._pasta(export_id))
+        manifesto = {
+            "export_id": export_id,
+            "fonte": fonte,
+            "formato": formato,
+            "parametros": parametros,
+            "tenant": tenant,
+            "status": STATUS_PENDENTE,
+            "colunas": None,
+            "tipos": None,
+            "partes": [],
+            "proximo_inicio": 0,
+            "linhas": 0,
+            "total_estimado": None,
+            "arquivo": None,
+            "tamanho_bytes": None,
+            "erro": None,
+            "criado_em": agora_iso(),
+            "concluido_em": None
+        }
+        self._gravar_manifesto(manifesto)
+        log_debug(f"Exportação {export_id} criada ({fonte}, {formato})")
+        return self._publico(manifesto)
+
+    def obter(self, export_id: str, tenant: str = None):
+        """Manifesto público da exportação, ou None se não existir para o tenant."""
+        manifesto = self._ler_manifesto(export_id)
+        if manifesto is None or (manifesto["tenant"] or None) != (tenant or None):
+            return None
+        return self._publico(manifesto)
+
+    def caminho_arquivo(self, export_id: str, tenant: str = None):
+        """Caminho do arquivo final de uma exportação concluída, ou None."""
+        manifesto = self.obter(export_id, tenant)
+        if manifesto is None or manifesto["status"] != STATUS_CONCLUIDO:
+            return None
+        return os.path.join(self._pasta(export_id), manifesto["arquivo"])
+
+    def _reservar(self, export_id: str) -> bool:
+        """Marca a exportação como em execução; False se já estiver rodando ou concluída."""
+        with self._lock:
+            manifesto = self._ler_manifesto(export_id)
+            if manifesto is None or manifesto["status"] == STATUS_CONCLUIDO or export_id in self._em_execucao:
+                return False
+            self._em_execucao.add(export_id)
+            return True
+
+    def _liberar(self, export_id: str):
+        with self._lock:
+            self._em_execucao.discard(export_id)
+
+    def executar(self, export_id: str) -> dict:
+        """
+        Executa (ou retoma) a exportação a partir do último checkpoint.
+
+        Returns:
+            dict: Manifesto público ao final, com status concluido ou erro
+                (ou o estado atual, se a exportação já estiver rodando ou concluída)
+        """
+        if not self._reservar(export_id):
+            return self._publico(self._ler_manifesto(export_id))
+        manifesto = self._ler_manifesto(export_id)
+        try:
+            manifesto.update({"status": STATUS_EXECUTANDO, "erro": None})
+            self._gravar_manifesto(manifesto)
+            self._exportar(manifesto)
+        except Exception as e:
+            log_debug(f"Exportação {export_id} falhou: {e}")
+            manifesto.update({"status": STATUS_ERRO, "erro": str(e)})
+            self._gravar_manifesto(manifesto)
+        finally:
+            self._liberar(export_id)
+        return self._publico(manifesto)
+
+    def _exportar(self, manifesto: dict):
+        export_id = manifesto["export_id"]
+        pasta = self._pasta(export_id)
+        escritor = ESCRITORES[manifesto["formato"]]
+        if manifesto["formato"] == "parquet" and pa is None:
+            raise RuntimeError("Formato parquet requer o pacote pyarrow")
+        paginar = self.fontes.get(manifesto["fonte"])
+        if paginar is None:
+            raise RuntimeError(f"Fonte '{manifesto['fonte']}' indisponível")
+
+        if manifesto["proximo_inicio"] is not None:
+            if manifesto["partes"]:
+                log_debug(f"Retomando {export_id} na linha {manifesto['proximo_inicio']} ({len(manifesto['partes'])} partes prontas)")
+            parametros = {**manifesto["parametros"], "tenant": manifesto["tenant"]}
+            for pagina in paginar(parametros, manifesto["proximo_inicio"], self.linhas_por_pagina):
+                if manifesto["colunas"] is None:
+                    manifesto["colunas"], manifesto["tipos"] = pagina["colunas"], pagina["tipos"]
+                elif pagina["colunas"] != manifesto["colunas"]:
+                    raise RuntimeError("As colunas do relatório mudaram durante a exportação")
+
+                # A parte só entra no manifesto depois de gravada por inteiro
+                nome = f"parte-{len(manifesto['partes']):05d}.{escritor.extensao}"
+                caminho = os.path.join(pasta, nome)
+                escritor.gravar_parte(caminho + ".tmp", manifesto["colunas"], manifesto["tipos"], pagina["linhas"])
+                os.replace(caminho + ".tmp", caminho)
+                manifesto["partes"].append({"arquivo": nome, "linhas": len(pagina["linhas"]), "bytes": os.path.getsize(caminho)})
+                manifesto["linhas"] += len(pagina["linhas"])
+                manifesto["proximo_inicio"] = pagina["proximo"]
+                if pagina.get("total") is not None:
+                    manifesto["total_estimado"] = pagina["total"]
+                self._gravar_manifesto(manifesto)
+
+                total = manifesto["total_estimado"]
+                reportar_progresso(
+                    0.95 * manifesto["linhas"] / total if total else 0.0,
+                    f"{manifesto['linhas']} linhas exportadas em {len(manifesto['partes'])} partes"
+                )
+                if pagina["proximo"] is None:
+                    break
+            else:
+                # Fonte sem nenhuma página: nada mais a buscar
+                manifesto["proximo_inicio"] = None
+
+        nome_final = f"{export_id}.{escritor.extensao}"
+        destino = os.path.join(pasta, nome_final)
+        escritor.unir(destino + ".tmp", manifesto["colunas"] or [], manifesto["tipos"] or {},
+                      [os.path.join(pasta, parte["arquivo"]) for parte in manifesto["partes"]])
+        os.replace(destino + ".tmp", destino)
+
+        manifesto.update({
+            "status": STATUS_CONCLUIDO,
+            "arquivo": nome_final,
+            "tamanho_bytes": os.path.getsize(destino),
+            "concluido_em": agora_iso()
+        })
+        self._gravar_manifesto(manifesto)
+        # Só apaga as partes com o manifesto já concluído: uma queda antes disso refaz a união
+        for parte in manifesto["partes"]:
+            os.remove(os.path.join(pasta, parte["arquivo"]))
+        log_debug(f"Exportação {export_id} concluída: {manifesto['linhas']} linhas, {manifesto['tamanho_bytes']} bytes")
+
+    def limpar(self):
+        """Remove exportações finalizadas há mais de ttl_segundos."""
+        if not os.path.isdir(self.diretorio):
+            return
+        limite = time.time() - self.ttl_segundos
+        for export_id in os.listdir(self.diretorio):
+            manifesto = self._ler_manifesto(export_id)
+            if manifesto is None or manifesto["status"] not in (STATUS_CONCLUIDO, STATUS_ERRO):
+                continue
+            caminho = os.path.join(self._pasta(export_id), ARQUIVO_MANIFESTO)
+            if os.path.getmtime(caminho) < limite:
+                shutil.rmtree(self._pasta(export_id), ignore_errors=True)
+
+    def _publico(self, manifesto: dict) -> dict:
+        """Manifesto sem a lista de partes; execuções perdidas (processo reiniciado) aparecem como interrompidas."""
+        publico = {k: v for k, v in manifesto.items() if k != "partes"}
+        publico["partes_prontas"] = len(manifesto["partes"])
+        with self._lock:
+            em_execucao = manifesto["export_id"] in self._em_execucao
+        if manifesto["status"] == STATUS_EXECUTANDO and not em_execucao:
+            publico["status"] = STATUS_INTERROMPIDO
+        return publico
+
+
+# Instância compartilhada pelo app; as fontes são configuradas quando o Google está disponível
+gerenciador_exportacoes = GerenciadorExportacoes()
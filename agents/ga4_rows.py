@@ -0,0 +1,67 @@
+"""
+Conversão das linhas de respostas do GA4 direto das mensagens protobuf.
+
+As respostas do cliente GA4 são wrappers proto-plus: cada acesso a
+response.rows, row.dimension_values ou v.value cria um novo wrapper e
+converte o valor, o que em relatórios de 100 mil linhas vira boa parte do
+tempo de CPU da consulta. Aqui as linhas são lidas da mensagem protobuf
+por trás do wrapper (a mesma memória, sem cópia), cujos campos são acessados
+diretamente pela implementação nativa do protobuf. O resultado é o mesmo
+do caminho proto-plus; bench_ga4_rows.py compara os dois.
+"""
+
+import proto
+
+from google.analytics.data_v1beta.types import MetricType
+
+
+def mensagem_protobuf(resposta):
+    """Mensagem protobuf por trás de um wrapper proto-plus (ou a própria mensagem, se já for protobuf)."""
+    if isinstance(resposta, proto.Message):
+        return type(resposta).pb(resposta)
+    return resposta
+
+
+def cabecalhos(resposta) -> tuple[list[str], list[str]]:
+    """Nomes das dimensões e das métricas da resposta."""
+    mensagem = mensagem_protobuf(resposta)
+    return [h.name for h in mensagem.dimension_headers], [h.name for h in mensagem.metric_headers]
+
+
+def valores_texto(resposta, limite: int = None) -> list[list[str]]:
+    """
+    Linhas como listas de textos: valores das dimensões seguidos dos das métricas.
+
+    Serve para RunReportResponse, RunPivotReportResponse e RunRealtimeReportResponse.
+    """
+    linhas = mensagem_protobuf(resposta).rows
+    if limite is not None:
+        linhas = linhas[:limite]
+    return [
+        [v.value for v in row.dimension_values] + [v.value for v in row.metric_values]
+        for row in linhas
+    ]
+
+
+def linhas_tipadas(resposta) -> tuple[list[str], dict, list[tuple]]:
+    """
+    Colunas, tipos ("texto", "inteiro" ou "decimal") e linhas com métricas numéricas.
+
+    Returns:
+        tuple: (colunas, {coluna: tipo}, [tupla por linha])
+    """
+    mensagem = mensagem_protobuf(resposta)
+    dimensoes = [h.name for h in mensagem.dimension_headers]
+    metricas = [h.name for h in mensagem.metric_headers]
+    inteiras = [h.type_ == MetricType.TYPE_INTEGER for h in mensagem.metric_headers]
+    tipos = {nome: "texto" for nome in dimensoes}
+    tipos.update({nome: "inteiro" if inteira else "decimal" for nome, inteira in zip(metricas, inteiras)})
+
+    conversores = [int if inteira else float for inteira in inteiras]
+    linhas = [
+        tuple(v.value for v in row.dimension_values) + tuple(
+            converter(v.value) for converter, v in zip(conversores, row.metric_values)
+        )
+        for row in mensagem.rows
+    ]
+    return dimensoes + metricas, tipos, linhas
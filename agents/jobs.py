@@ -0,0 +1,251 @@
+"""
+Execução assíncrona de relatórios longos.
+
+Consultas pesadas são enviadas a um pool limitado de threads e ganham um
+job_id. O cliente acompanha o status/progresso e busca o resultado depois.
+Resultados ficam em um armazenamento com limite de tamanho total e
+expiração; quando o limite estoura, os resultados mais antigos saem primeiro.
+"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+
+from agents.responses import serializar_json
+
+JOBS_MAX_WORKERS = int(os.getenv("JOBS_MAX_WORKERS", "2"))
+JOBS_MAX_PENDENTES = int(os.getenv("JOBS_MAX_PENDENTES", "20"))
+JOBS_MAX_BYTES = int(os.getenv("JOBS_MAX_BYTES", str(50 * 1024 * 1024)))
+JOBS_TTL_SEGUNDOS = int(os.getenv("JOBS_TTL_SEGUNDOS", "3600"))
+
+STATUS_PENDENTE = "pendente"
+STATUS_EXECUTANDO = "executando"
+STATUS_CONCLUIDO = "concluido"
+STATUS_ERRO = "erro"
+STATUS_CANCELADO = "cancelado"
+STATUS_EXPIRADO = "expirado"
+STATUS_FINAIS = (STATUS_CONCLUIDO, STATUS_ERRO, STATUS_CANCELADO, STATUS_EXPIRADO)
+
+# Job em execução na thread atual, usado por reportar_progresso
+_job_atual = ContextVar("job_atual", default=None)
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"JOBS DEBUG: {message}", file=sys.stderr)
+
+
+class FilaJobsCheia(Exception):
+    """Levantada quando já há jobs pendentes demais aguardando execução."""
+
+
+def reportar_progresso(fracao: float, mensagem: str = ""):
+    """
+    Atualiza o progresso do job em execução na thread atual.
+
+    Pode ser chamada de qualquer função executada por um job (por exemplo,
+    a cada página ou fatia de datas); fora de um job não faz nada.
+    """
+    job = _job_atual.get()
+    if job is None:
+        return
+    job["progresso"] = max(0.0, min(1.0, round(fracao, 4)))
+    if mensagem:
+        job["mensagem"] = mensagem
+
+
+class GerenciadorJobs:
+    """Pool limitado de workers com armazenamento de resultados por tamanho e idade."""
+
+    def __init__(
+        self,
+        max_workers: int = JOBS_MAX_WORKERS,
+        max_pendentes: int = JOBS_MAX_PENDENTES,
+        max_bytes: int = JOBS_MAX_BYTES,
+        ttl_segundos: int = JOBS_TTL_SEGUNDOS
+    ):
+        self.max_pendentes = max_pendentes
+        self.max_bytes = max_bytes
+        self.ttl_segundos = ttl_segundos
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._futuros = {}
+        # Resultados guardados, na ordem de conclusão (o mais antigo sai primeiro)
+        self._resultados = OrderedDict()
+        self._bytes_armazenados = 0
+
+    def submeter(self, tipo: str, funcao, parametros: dict, tenant: str = None) -> dict:
+        """
+        Enfileira a execução de funcao(parametros) e retorna o status inicial do job.
+
+        A função deve retornar (payload, status_http); o payload é guardado
+        como resultado do job. Só o mesmo tenant consegue consultar ou cancelar o job.
+        """
+        with self._lock:
+            self._expirar()
+            pendentes = sum(1 for job in self._jobs.values() if job["status"] == STATUS_PENDENTE)
+            if pendentes >= self.max_pendentes:
+                raise FilaJobsCheia(f"Fila de jobs cheia ({pendentes} pendentes)")
+
+            job_id = uuid.uuid4().hex
+            job = {
+                "job_id": job_id,
+                "tipo": tipo,
+                "tenant": tenant or "",
+                "status": STATUS_PENDENTE,
+                "progresso": 0.0,
+                "mensagem": "Aguardando worker disponível",
+                "criado_em": time.time(),
+                "iniciado_em": None,
+                "concluido_em": None,
+                "status_http": None,
+                "tamanho_resultado": None
+            }
+            self._jobs[job_id] = job
+            self._futuros[job_id] = self._executor.submit(self._executar, job, funcao, parametros)
+
+        log_debug(f"Job {job_id} ({tipo}) enfileirado")
+        return self._publico(job)
+
+    def _executar(self, job: dict, funcao, parametros: dict):
+        """Executa o job em uma thread do pool e guarda o resultado."""
+        token = _job_atual.set(job)
+        job["status"] = STATUS_EXECUTANDO
+        job["iniciado_em"] = time.time()
+        job["mensagem"] = "Em execução"
+        try:
+            payload, status_http = funcao(parametros)
+            job_status = STATUS_CONCLUIDO if status_http < 400 else STATUS_ERRO
+            mensagem = "Concluído" if job_status == STATUS_CONCLUIDO else payload.get("erro", "Falha na consulta")
+        except Exception as e:
+            log_debug(f"Job {job['job_id']} falhou: {e}")
+            payload, status_http = {"erro": f"Erro interno: {str(e)}", "sucesso": False}, 500
+            job_status, mensagem = STATUS_ERRO, str(e)
+        finally:
+            _job_atual.reset(token)
+
+        self._armazenar(job, payload, status_http, job_status, mensagem)
+
+    def _armazenar(self, job: dict, payload: dict, status_http: int, job_status: str, mensagem: str):
+        """Guarda o resultado respeitando o limite total de bytes."""
+        tamanho = len(serializar_json(payload))
+        with self._lock:
+            self._futuros.pop(job["job_id"], None)
+            job.update({
+                "status": job_status,
+                "progresso": 1.0,
+                "mensagem": mensagem,
+                "concluido_em": time.time(),
+                "status_http": status_http,
+                "tamanho_resultado": tamanho
+            })
+
+            if tamanho > self.max_bytes:
+                job["status"] = STATUS_ERRO
+                job["status_http"] = 413
+                job["mensagem"] = f"Resultado de {tamanho} bytes excede o limite de armazenamento ({self.max_bytes})"
+                return
+
+            self._resultados[job["job_id"]] = payload
+            self._bytes_armazenados += tamanho
+            # Libera os resultados mais antigos até caber no limite
+            while self._bytes_armazenados > self.max_bytes and self._resultados:
+                antigo_id, _ = self._resultados.popitem(last=False)
+                self._descartar_resultado(antigo_id, STATUS_EXPIRADO, "Resultado removido por limite de armazenamento")
+
+        log_debug(f"Job {job['job_id']} finalizado: {job['status']} ({tamanho} bytes)")
+
+    def _descartar_resultado(self, job_id: str, status: str, mensagem: str):
+        """Remove o resultado guardado e marca o job (chamar com o lock adquirido)."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        self._bytes_armazenados -= job.get("tamanho_resultado") or 0
+        job["status"] = status
+        job["mensagem"] = mensagem
+
+    def _expirar(self):
+        """Remove jobs finalizados há mais de ttl_segundos (chamar com o lock adquirido)."""
+        limite = time.time() - self.ttl_segundos
+        expirados = [
+            job_id for job_id, job in self._jobs.items()
+            if job["concluido_em"] is not None and job["concluido_em"] < limite
+        ]
+        for job_id in expirados:
+            if self._resultados.pop(job_id, None) is not None:
+                self._bytes_armazenados -= self._jobs[job_id].get("tamanho_resultado") or 0
+            del self._jobs[job_id]
+
+    def _job_do_tenant(self, job_id: str, tenant: str = None):
+        """Job pelo id, ou None se não existir ou for de outro tenant (chamar com o lock adquirido)."""
+        job = self._jobs.get(job_id)
+        if job is None or job["tenant"] != (tenant or ""):
+            return None
+        return job
+
+    def status(self, job_id: str, tenant: str = None):
+        """Status público do job, ou None se não existir, tiver expirado ou for de outro tenant."""
+        with self._lock:
+            self._expirar()
+            job = self._job_do_tenant(job_id, tenant)
+            return self._publico(job) if job else None
+
+    def resultado(self, job_id: str, tenant: str = None):
+        """
+        Retorna (status do job, payload, status_http).
+
+        O payload só vem preenchido para jobs finalizados com resultado guardado.
+        Jobs de outro tenant são tratados como inexistentes.
+        """
+        with self._lock:
+            self._expirar()
+            job = self._job_do_tenant(job_id, tenant)
+            if job is None:
+                return None, None, None
+            return self._publico(job), self._resultados.get(job_id), job["status_http"]
+
+    def cancelar(self, job_id: str, tenant: str = None) -> bool:
+        """Cancela um job do tenant que ainda não começou a executar."""
+        with self._lock:
+            job = self._job_do_tenant(job_id, tenant)
+            futuro = self._futuros.get(job_id)
+            if job is None or futuro is None or not futuro.cancel():
+                return False
+            self._futuros.pop(job_id, None)
+            job.update({
+                "status": STATUS_CANCELADO,
+                "mensagem": "Cancelado antes da execução",
+                "concluido_em": time.time()
+            })
+            return True
+
+    def estatisticas(self) -> dict:
+        """Contagem de jobs por status e uso do armazenamento."""
+        with self._lock:
+            por_status = {}
+            for job in self._jobs.values():
+                por_status[job["status"]] = por_status.get(job["status"], 0) + 1
+            return {
+                "jobs_por_status": por_status,
+                "bytes_armazenados": self._bytes_armazenados,
+                "limite_bytes": self.max_bytes
+            }
+
+    @staticmethod
+    def _publico(job: dict) -> dict:
+        """Cópia do job sem campos internos (status HTTP e tenant), com datas em ISO."""
+        publico = {k: v for k, v in job.items() if k not in ("status_http", "tenant")}
+        for campo in ("criado_em", "iniciado_em", "concluido_em"):
+            if publico[campo] is not None:
+                publico[campo] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(publico[campo]))
+        return publico
+
+
+# Instância compartilhada pelo app
+gerenciador_jobs = GerenciadorJobs()
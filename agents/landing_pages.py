@@ -0,0 +1,256 @@
+"""
+Relatório de landing pages combinando Search Console e GA4.
+
+Busca as duas fontes em paralelo (Search Console por "page" e GA4 por
+"hostName" e "landingPage"), normaliza as URLs para uma chave comum e faz
+um hash join no servidor, devolvendo uma única tabela por página.
+
+O GA4 registra a landing page sem o host; o host vem de hostName, já que em
+propriedades de domínio (sc-domain:) as URLs do Search Console trazem o
+subdomínio real (www., blog. etc.), que não dá para deduzir da propriedade.
+"""
+
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from agents.analytics import consulta_ga4, interpretar_resultado_ga4
+from agents.columnar import LAYOUT_COLUNAR, converter_numero, expandir_colunar, montar_colunar
+from agents.search_console import consulta_search_console_custom, formatar_site_url
+from agents.summary import agregar_linhas, metrica_aditiva
+
+METRICAS_GA4_PADRAO = ["sessions", "engagedSessions", "totalUsers"]
+METRICAS_SEARCH_CONSOLE = ["Cliques", "Impressões", "CTR", "Posição Média"]
+TIPOS_JUNCAO = ("interna", "completa")
+
+# Valores que o GA4 usa quando a landing page não é conhecida
+LANDING_PAGES_IGNORADAS = {"", "(not set)", "(other)"}
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"LANDING_PAGES DEBUG: {message}", file=sys.stderr)
+
+
+def host_do_site(site_url: str) -> str:
+    """Extrai o host de uma propriedade do Search Console (URL ou sc-domain:)."""
+    site_url = formatar_site_url(site_url)
+    if site_url.startswith("sc-domain:"):
+        return site_url[len("sc-domain:"):].strip().lower()
+    return urlsplit(site_url).netloc.lower()
+
+
+def normalizar_url(url: str, host_padrao: str):
+    """
+    Normaliza uma URL ou caminho para a chave de junção "host/caminho/".
+
+    Remove esquema, query string, fragmento e porta padrão, coloca o host em
+    minúsculas e garante a barra final (como formatar_site_url faz com o site).
+    Caminhos sem host (landingPage do GA4) herdam o host do site.
+    Retorna None para valores sem página definida.
+    """
+    url = (url or "").strip()
+    if url in LANDING_PAGES_IGNORADAS:
+        return None
+
+    partes = urlsplit(url if "://" in url else f"https://{host_padrao}{'' if url.startswith('/') else '/'}{url}")
+    host = partes.netloc.lower()
+    for porta in (":80", ":443"):
+        if host.endswith(porta):
+            host = host[:-len(porta)]
+
+    caminho = partes.path or "/"
+    if not caminho.endswith("/"):
+        caminho = f"{caminho}/"
+    return f"{host}{caminho}"
+
+
+def indexar_por_url(colunas, linhas, coluna_url, host_padrao, aditivas, ponderadas=None, razoes=None, coluna_host=None) -> dict:
+    """
+    Monta a tabela hash {chave_url: registro} de uma fonte.
+
+    Com coluna_host, caminhos sem host usam o host da própria linha (e
+    host_padrao quando ele não é conhecido). URLs que normalizam para a mesma
+    chave são agregadas: métricas somáveis são somadas e taxas recalculadas;
+    métricas sem regra de agregação mantêm o valor da primeira ocorrência.
+    """
+    i_url = colunas.index(coluna_url)
+    i_host = colunas.index(coluna_host) if coluna_host else None
+    grupos = {}
+    for linha in linhas:
+        host = host_padrao
+        if i_host is not None and (linha[i_host] or "").strip() not in LANDING_PAGES_IGNORADAS:
+            host = linha[i_host].strip()
+        chave = normalizar_url(linha[i_url], host)
+        if chave is not None:
+            grupos.setdefault(chave, []).append(linha)
+
+    indice = {}
+    for chave, grupo in grupos.items():
+        registro = {c: v for c, v in zip(colunas, grupo[0]) if c not in (coluna_url, coluna_host)}
+        if len(grupo) > 1:
+            registro.update(agregar_linhas(colunas, grupo, aditivas, ponderadas, razoes))
+        indice[chave] = registro
+    return indice
+
+
+def juntar_por_url(indice_search_console: dict, indice_ga4: dict, tipo_juncao: str = "completa") -> list[dict]:
+    """
+    Hash join das duas fontes pela chave de URL.
+
+    A tabela hash já está montada para as duas fontes; a menor é usada como
+    lado de construção e a maior é percorrida. Na junção completa, páginas
+    presentes em só uma das fontes entram com as métricas da outra nulas.
+    """
+    vazio_sc = dict.fromkeys(c for registro in indice_search_console.values() for c in registro)
+    vazio_ga4 = dict.fromkeys(c for registro in indice_ga4.values() for c in registro)
+
+    if len(indice_search_console) <= len(indice_ga4):
+        construcao, sonda = indice_search_console, indice_ga4
+    else:
+        construcao, sonda = indice_ga4, indice_search_console
+
+    def combinar(chave):
+        registro_sc = indice_search_console.get(chave)
+        registro_ga4 = indice_ga4.get(chave)
+        linha = {"pagina": f"https://{chave}"}
+        linha.update(registro_sc if registro_sc is not None else vazio_sc)
+        linha.update(registro_ga4 if registro_ga4 is not None else vazio_ga4)
+        return linha
+
+    linhas = []
+    encontrados = set()
+    for chave in sonda:
+        if chave in construcao:
+            encontrados.add(chave)
+        elif tipo_juncao == "interna":
+            continue
+        linhas.append(combinar(chave))
+
+    if tipo_juncao == "completa":
+        linhas.extend(combinar(chave) for chave in construcao if chave not in encontrados)
+
+    return linhas
+
+
+def consultar_direto(tipo: str, argumentos: dict):
+    """Executa a consulta chamando a função da fonte, sem cache."""
+    funcao = consulta_ga4 if tipo == "ga4_query" else consulta_search_console_custom
+    return funcao(**argumentos)
+
+
+def relatorio_landing_pages(
+    property_id: str,
+    site_url: str,
+    data_inicio: str = "28daysAgo",
+    data_fim: str = "today",
+    metricas_ga4: list[str] = None,
+    limite: int = 1000,
+    tipo_juncao: str = "completa",
+    layout: str = "linhas",
+    tenant: str = None,
+    consultar=None
+) -> dict:
+    """
+    Relatório de landing pages com métricas do Search Console e do GA4.
+
+    Args:
+        property_id: ID da propriedade GA4
+        site_url: URL do site no Search Console
+        data_inicio: Data de início (padrão: "28daysAgo")
+        data_fim: Data de fim (padrão: "today")
+        metricas_ga4: Métricas do GA4 (padrão: sessions, engagedSessions, totalUsers)
+        limite: Máximo de linhas buscadas em cada fonte (padrão: 1000)
+        tipo_juncao: "completa" (padrão) mantém páginas de só uma fonte; "interna" só as presentes nas duas
+        layout: Formato de "dados": "linhas" (padrão) ou "columnar"
+        tenant: Tenant cujas credenciais são usadas nas duas fontes (padrão: GOOGLE_CREDENTIALS)
+        consultar: Função (tipo, argumentos) -> resultado, com tipo "ga4_query" ou
+            "search_console_query" (padrão: chama consulta_ga4 e consulta_search_console_custom)
+
+    Returns:
+        dict: Tabela combinada por página, ordenada por cliques, ou erro
+    """
+    if tipo_juncao not in TIPOS_JUNCAO:
+        return {"erro": f"tipo_juncao inválido: '{tipo_juncao}'. Use um de: {', '.join(TIPOS_JUNCAO)}"}
+
+    metricas_ga4 = [m.strip() for m in (metricas_ga4 or METRICAS_GA4_PADRAO)]
+    site_url = formatar_site_url(site_url)
+    host = host_do_site(site_url)
+    consultar = consultar or consultar_direto
+
+    log_debug(f"Buscando Search Console ({site_url}) e GA4 ({property_id}) em paralelo")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futuro_sc = executor.submit(consultar, "search_console_query", {
+            "site_url": site_url,
+            "data_inicio": data_inicio,
+            "data_fim": data_fim,
+            "dimensoes": ["page"],
+            "limite": limite,
+            "layout": LAYOUT_COLUNAR,
+            "tenant": tenant
+        })
+        futuro_ga4 = executor.submit(consultar, "ga4_query", {
+            "dimensao": "hostName,landingPage",
+            "metrica": ",".join(metricas_ga4),
+            "periodo": data_inicio,
+            "data_fim": data_fim,
+            "property_id": property_id,
+            "limite": limite,
+            "tenant": tenant
+        })
+        resultado_sc = futuro_sc.result()
+        resultado_ga4 = futuro_ga4.result()
+
+    if "erro" in resultado_sc:
+        return {"erro": resultado_sc["erro"]}
+    if resultado_ga4.startswith(("[Erro]", "Erro:")):
+        return {"erro": resultado_ga4}
+
+    # Search Console: métricas já numéricas no layout colunar
+    linhas_sc = [[registro[c] for c in ["Página"] + METRICAS_SEARCH_CONSOLE]
+                 for registro in expandir_colunar(resultado_sc["dados"])]
+    indice_sc = indexar_por_url(
+        ["Página"] + METRICAS_SEARCH_CONSOLE,
+        linhas_sc,
+        "Página",
+        host,
+        aditivas=["Cliques", "Impressões"],
+        ponderadas={"Posição Média": "Impressões"},
+        razoes={"CTR": ("Cliques", "Impressões")}
+    )
+
+    # GA4: texto "hostName | landingPage | métricas..." convertido para números
+    cabecalhos, valores_ga4 = interpretar_resultado_ga4(resultado_ga4)
+    indice_ga4 = {}
+    if cabecalhos:
+        linhas_ga4 = [valores[:2] + [converter_numero(v) for v in valores[2:]] for valores in valores_ga4]
+        indice_ga4 = indexar_por_url(
+            cabecalhos,
+            linhas_ga4,
+            "landingPage",
+            host,
+            aditivas=[m for m in cabecalhos[2:] if metrica_aditiva(m)],
+            coluna_host="hostName"
+        )
+
+    linhas = juntar_por_url(indice_sc, indice_ga4, tipo_juncao)
+    linhas.sort(key=lambda linha: (linha.get("Cliques") or 0, linha.get(metricas_ga4[0]) or 0), reverse=True)
+
+    colunas = ["pagina"] + METRICAS_SEARCH_CONSOLE + metricas_ga4
+    if layout == LAYOUT_COLUNAR:
+        dados = montar_colunar(colunas, [[linha.get(c) for c in colunas] for linha in linhas], colunas_dimensao=["pagina"])
+    else:
+        dados = linhas
+
+    log_debug(f"Junção concluída: {len(indice_sc)} páginas no Search Console, {len(indice_ga4)} no GA4, {len(linhas)} combinadas")
+    return {
+        "sucesso": True,
+        "site": site_url,
+        "property_id": property_id,
+        "periodo": f"{data_inicio} a {data_fim}",
+        "tipo_juncao": tipo_juncao,
+        "paginas_search_console": len(indice_sc),
+        "paginas_ga4": len(indice_ga4),
+        "total_resultados": len(linhas),
+        "dados": dados
+    }
@@ -0,0 +1,160 @@
+"""
+Cache de metadados GA4 para validar dimensões e métricas localmente.
+
+Nomes digitados errado custam uma ida ao GA4 (e cota) só para voltar como
+"[Erro]". Com as dimensões e métricas de cada propriedade em memória
+(inclusive as personalizadas), a requisição é rejeitada antes, com
+sugestões de nomes parecidos. Metadados vencidos continuam sendo usados
+enquanto uma thread os atualiza em segundo plano.
+"""
+
+import difflib
+import os
+import sys
+import threading
+import time
+
+METADATA_TTL_SEGUNDOS = int(os.getenv("GA4_METADATA_TTL_SEGUNDOS", str(6 * 3600)))
+# Após uma falha ao buscar os metadados, espera isso antes de tentar de novo
+ESPERA_APOS_FALHA_SEGUNDOS = 60
+MAXIMO_SUGESTOES = 3
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"METADATA DEBUG: {message}", file=sys.stderr)
+
+
+def normalizar_property_id(property_id: str) -> str:
+    """Remove o prefixo "properties/" para usar o ID como chave."""
+    property_id = str(property_id).strip()
+    return property_id[len("properties/"):] if property_id.startswith("properties/") else property_id
+
+
+class CacheMetadados:
+    """Metadados por propriedade, atualizados em segundo plano quando vencem."""
+
+    def __init__(self, ttl_segundos: int = METADATA_TTL_SEGUNDOS):
+        # Função (property_id, tenant) -> {"dimensoes", "metricas", "personalizadas"} ou {"erro"}
+        self.carregador = None
+        self.ttl_segundos = ttl_segundos
+        self._lock = threading.Lock()
+        self._entradas = {}
+        self._falhas = {}
+        self._carregando = {}
+
+    def obter(self, property_id: str, tenant: str = None):
+        """
+        Retorna os metadados da propriedade, ou None se indisponíveis.
+
+        A chave inclui o tenant, já que cada conta de serviço enxerga suas propriedades.
+
+        A primeira consulta de uma propriedade espera a busca; depois disso,
+        metadados vencidos são devolvidos na hora e atualizados em segundo plano.
+        """
+        if self.carregador is None:
+            return None
+        chave = (tenant or "", normalizar_property_id(property_id))
+
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None:
+                if time.time() - entrada["carregado_em"] > self.ttl_segundos and chave not in self._carregando:
+                    self._carregando[chave] = threading.Event()
+                    threading.Thread(target=self._carregar, args=(chave,), name=f"metadata-{chave[1]}", daemon=True).start()
+                return entrada
+            if time.time() - self._falhas.get(chave, 0) < ESPERA_APOS_FALHA_SEGUNDOS:
+                return None
+            evento = self._carregando.get(chave)
+            dono = evento is None
+            if dono:
+                evento = self._carregando[chave] = threading.Event()
+
+        # Só uma thread busca; as demais esperam o mesmo resultado
+        if dono:
+            self._carregar(chave)
+        else:
+            evento.wait()
+        with self._lock:
+            return self._entradas.get(chave)
+
+    def _carregar(self, chave: tuple):
+        """Busca os metadados e atualiza a entrada (falhas mantêm a entrada antiga)."""
+        tenant, property_id = chave
+        try:
+            metadados = self.carregador(property_id, tenant or None)
+        except Exception as e:
+            metadados = {"erro": str(e)}
+
+        with self._lock:
+            if "erro" in metadados:
+                log_debug(f"Falha ao carregar metadados de {property_id}: {metadados['erro']}")
+                self._falhas[chave] = time.time()
+            else:
+                metadados["carregado_em"] = time.time()
+                self._entradas[chave] = metadados
+                self._falhas.pop(chave, None)
+                log_debug(f"Metadados de {property_id}: {len(metadados['dimensoes'])} dimensões, {len(metadados['metricas'])} métricas")
+            self._carregando.pop(chave).set()
+
+    def invalidar(self, property_id: str = None, tenant: str = None):
+        """Descarta os metadados de uma propriedade (ou de todas)."""
+        with self._lock:
+            if property_id is None:
+                self._entradas.clear()
+            else:
+                self._entradas.pop((tenant or "", normalizar_property_id(property_id)), None)
+
+
+def sugerir_nomes(nome: str, candidatos) -> list[str]:
+    """Nomes parecidos com o informado, começando por diferenças só de maiúsculas."""
+    candidatos = list(candidatos)
+    iguais = [c for c in candidatos if c.lower() == nome.lower()]
+    parecidos = difflib.get_close_matches(nome, candidatos, n=MAXIMO_SUGESTOES, cutoff=0.6)
+    return list(dict.fromkeys(iguais + parecidos))[:MAXIMO_SUGESTOES]
+
+
+def validar_campos(metadados: dict, dimensoes=(), metricas=()) -> list[dict]:
+    """
+    Confere dimensões e métricas contra os metadados da propriedade.
+
+    Returns:
+        list: Um item por campo inválido, com o tipo esperado e sugestões
+    """
+    problemas = []
+    for tipo, nomes, validos, outros in (
+        ("dimensão", dimensoes, metadados["dimensoes"], metadados["metricas"]),
+        ("métrica", metricas, metadados["metricas"], metadados["dimensoes"])
+    ):
+        for nome in nomes:
+            # Valores que não são texto nunca são nomes válidos (e não têm sugestões)
+            if not isinstance(nome, str):
+                problemas.append({"campo": str(nome), "tipo": tipo, "tipo_correto": None, "sugestoes": []})
+                continue
+            nome = nome.strip()
+            if not nome or nome in validos:
+                continue
+            problemas.append({
+                "campo": nome,
+                "tipo": tipo,
+                "tipo_correto": ("métrica" if tipo == "dimensão" else "dimensão") if nome in outros else None,
+                "sugestoes": sugerir_nomes(nome, validos)
+            })
+    return problemas
+
+
+def mensagem_campos_invalidos(problemas: list[dict]) -> str:
+    """Mensagem de erro legível listando os campos inválidos e as sugestões."""
+    partes = []
+    for problema in problemas:
+        texto = f"{problema['tipo']} '{problema['campo']}' não existe na propriedade"
+        if problema["tipo_correto"]:
+            texto = f"'{problema['campo']}' é uma {problema['tipo_correto']}, não uma {problema['tipo']}"
+        elif problema["sugestoes"]:
+            texto += f" (você quis dizer {', '.join(repr(s) for s in problema['sugestoes'])}?)"
+        partes.append(texto)
+    return "Campos inválidos: " + "; ".join(partes)
+
+
+# Instância compartilhada pelo app; o carregador é configurado quando o GA4 está disponível
+cache_metadados_ga4 = CacheMetadados()
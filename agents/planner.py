@@ -0,0 +1,111 @@
+"""
+Escolha do modo de execução de uma consulta pelo tamanho estimado do resultado.
+
+Um relatório de 10 linhas e um de 500 mil passavam pelo mesmo caminho:
+síncrono, inteiro em memória e serializado de uma vez. Aqui, consultas com
+limite pequeno seguem direto (sem custo extra); nas demais, uma sondagem
+barata estima quantas linhas virão (row_count do GA4 pedindo uma linha;
+no Search Console, se existe linha no início de cada faixa) e o resultado
+vai inline, em streaming (NDJSON, página a página) ou para um job em
+segundo plano, conforme os limiares configurados.
+"""
+
+import os
+import sys
+import threading
+
+PLANO_LIMIAR_STREAMING = int(os.getenv("PLANO_LIMIAR_STREAMING", "10000"))
+PLANO_LIMIAR_JOB = int(os.getenv("PLANO_LIMIAR_JOB", "100000"))
+# Linhas buscadas por requisição no streaming
+PLANO_LINHAS_POR_PAGINA = int(os.getenv("PLANO_LINHAS_POR_PAGINA", "10000"))
+
+MODO_AUTOMATICO = "automatico"
+MODO_INLINE = "inline"
+MODO_STREAMING = "streaming"
+MODO_JOB = "job"
+MODOS_EXECUCAO = (MODO_AUTOMATICO, MODO_INLINE, MODO_STREAMING, MODO_JOB)
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"PLANNER DEBUG: {message}", file=sys.stderr)
+
+
+class PlanejadorConsultas:
+    """Decide entre inline, streaming e job pelo limite pedido e pela estimativa da sondagem."""
+
+    def __init__(self, limiar_streaming: int = PLANO_LIMIAR_STREAMING, limiar_job: int = PLANO_LIMIAR_JOB):
+        self.limiar_streaming = limiar_streaming
+        self.limiar_job = limiar_job
+        self._lock = threading.Lock()
+        self.contadores = {
+            MODO_INLINE: 0,
+            MODO_STREAMING: 0,
+            MODO_JOB: 0,
+            "sondagens": 0,
+            "falhas_sondagem": 0
+        }
+
+    def _contar(self, nome: str):
+        with self._lock:
+            self.contadores[nome] += 1
+
+    def marcos(self, limite: int) -> list[int]:
+        """Limiares abaixo do limite: só eles mudam a decisão (usados na sondagem por faixas)."""
+        return [marco for marco in (self.limiar_streaming, self.limiar_job) if marco < limite]
+
+    def escolher(self, linhas: int) -> str:
+        if linhas <= self.limiar_streaming:
+            return MODO_INLINE
+        return MODO_STREAMING if linhas <= self.limiar_job else MODO_JOB
+
+    def planejar(self, limite: int, modo_pedido: str = MODO_AUTOMATICO, sondar=None, streaming_possivel: bool = True) -> dict:
+        """
+        Escolhe o modo de execução.
+
+        Args:
+            limite: Máximo de linhas pedido pelo cliente
+            modo_pedido: MODO_AUTOMATICO ou um modo fixo escolhido pelo cliente
+            sondar: Função () -> {"linhas", "exato"} ou None se a sondagem falhar;
+                só é chamada quando o limite passa do limiar de streaming
+            streaming_possivel: False quando a consulta pede opções que o streaming não
+                aplica; o que iria para streaming vai para um job, que as aplica
+
+        Returns:
+            dict: {"modo", "motivo", "linhas_estimadas", "estimativa_exata"}
+        """
+        plano = {"modo": modo_pedido, "motivo": "pedido", "linhas_estimadas": None, "estimativa_exata": None}
+        if modo_pedido == MODO_AUTOMATICO:
+            if limite <= self.limiar_streaming:
+                plano.update(modo=MODO_INLINE, motivo="limite_pequeno")
+            else:
+                self._contar("sondagens")
+                estimativa = sondar() if sondar is not None else None
+                if estimativa is None:
+                    # Sem estimativa, vale o pior caso: o limite inteiro
+                    self._contar("falhas_sondagem")
+                    plano.update(motivo="sondagem_falhou", linhas_estimadas=limite, estimativa_exata=False)
+                else:
+                    plano.update(
+                        motivo="sondagem",
+                        linhas_estimadas=min(limite, estimativa["linhas"]),
+                        estimativa_exata=estimativa["exato"] or estimativa["linhas"] >= limite
+                    )
+                plano["modo"] = self.escolher(plano["linhas_estimadas"])
+                if plano["modo"] == MODO_STREAMING and not streaming_possivel:
+                    plano.update(modo=MODO_JOB, motivo="opcoes_sem_streaming")
+        self._contar(plano["modo"])
+        log_debug(f"Plano {plano['modo']} ({plano['motivo']}, {plano['linhas_estimadas']} linhas estimadas)")
+        return plano
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "limiar_streaming": self.limiar_streaming,
+                "limiar_job": self.limiar_job,
+                **self.contadores
+            }
+
+
+# Instância compartilhada pelas rotas de consulta
+planejador_consultas = PlanejadorConsultas()
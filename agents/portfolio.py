@@ -0,0 +1,180 @@
+"""
+Relatório de portfólio: o mesmo relatório GA4 em várias propriedades.
+
+As propriedades são consultadas em paralelo (com limite de workers e de
+requisições simultâneas por propriedade) e os resultados são unidos em uma
+única tabela com a coluna da propriedade, mais totais entre propriedades.
+Propriedades com cota esgotada ficam em espera por um tempo, em vez de
+receberem novas requisições que só voltariam com erro.
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from agents.columnar import LAYOUT_COLUNAR, montar_colunar
+from agents.resilience import status_da_mensagem
+from agents.summary import agregar_linhas, metrica_aditiva, normalizar_metricas
+
+PORTFOLIO_MAX_WORKERS = int(os.getenv("PORTFOLIO_MAX_WORKERS", "8"))
+PORTFOLIO_MAX_PROPRIEDADES = int(os.getenv("PORTFOLIO_MAX_PROPRIEDADES", "100"))
+# Requisições simultâneas por propriedade (o GA4 permite 10 no plano padrão)
+GA4_CONCORRENCIA_POR_PROPRIEDADE = int(os.getenv("GA4_CONCORRENCIA_POR_PROPRIEDADE", "3"))
+ESPERA_COTA_SEGUNDOS = int(os.getenv("PORTFOLIO_ESPERA_COTA_SEGUNDOS", "300"))
+
+COLUNA_PROPRIEDADE = "property_id"
+COLUNA_NOME_PROPRIEDADE = "propriedade"
+
+# Status gRPC do GA4 para cota esgotada
+STATUS_COTA = "RESOURCE_EXHAUSTED"
+
+_lock = threading.Lock()
+_semaforos = {}
+_cota_esgotada_ate = {}
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"PORTFOLIO DEBUG: {message}", file=sys.stderr)
+
+
+def semaforo_propriedade(property_id: str) -> threading.BoundedSemaphore:
+    """Semáforo compartilhado que limita as requisições simultâneas a uma propriedade."""
+    with _lock:
+        if property_id not in _semaforos:
+            _semaforos[property_id] = threading.BoundedSemaphore(GA4_CONCORRENCIA_POR_PROPRIEDADE)
+        return _semaforos[property_id]
+
+
+def propriedades_da_conta(catalogo: dict, conta: str) -> list[dict]:
+    """
+    Propriedades de uma conta no catálogo de listar_contas_ga4.
+
+    A conta pode ser informada como "accounts/123", "123" ou pelo nome exibido.
+    """
+    conta = str(conta).strip()
+    for info in catalogo.get("contas", []):
+        if conta in (info.get("id_conta"), info.get("nome_conta")) or info.get("id_conta") == f"accounts/{conta}":
+            return [
+                {"property_id": p["property_id"], "nome": p.get("nome_propriedade", "")}
+                for p in info.get("propriedades", [])
+            ]
+    return []
+
+
+def consultar_propriedade(propriedade: dict, consultar):
+    """Executa a consulta de uma propriedade respeitando concorrência e cota."""
+    property_id = propriedade["property_id"]
+    espera = _cota_esgotada_ate.get(property_id, 0) - time.time()
+    if espera > 0:
+        return None, f"Cota da propriedade esgotada; nova tentativa em {int(espera)}s", True
+
+    with semaforo_propriedade(property_id):
+        resultado = consultar(property_id)
+
+    if resultado.startswith(("[Erro]", "Erro:")):
+        # Pelo status do erro, não pelo texto: "quota" pode aparecer em outros erros
+        cota = status_da_mensagem(resultado) == STATUS_COTA
+        if cota:
+            with _lock:
+                _cota_esgotada_ate[property_id] = time.time() + ESPERA_COTA_SEGUNDOS
+        return None, resultado, cota
+    return resultado, None, False
+
+
+def relatorio_portfolio(
+    propriedades: list[dict],
+    consultar,
+    interpretar,
+    metricas: list[str],
+    layout: str = "linhas",
+    max_workers: int = PORTFOLIO_MAX_WORKERS
+) -> dict:
+    """
+    Executa o mesmo relatório em várias propriedades e une os resultados.
+
+    Args:
+        propriedades: Lista de {"property_id", "nome"}
+        consultar: Função property_id -> texto do GA4 ("h1 | h2" + linhas)
+        interpretar: Função texto -> (cabecalhos, linhas), como interpretar_resultado_ga4
+        metricas: Métricas consultadas (as demais colunas são dimensões)
+        layout: Formato de "dados": "linhas" (padrão) ou "columnar"
+        max_workers: Máximo de propriedades consultadas ao mesmo tempo
+
+    Returns:
+        dict: Tabela unida com a coluna da propriedade, totais por propriedade,
+        totais entre propriedades por combinação de dimensões e erros por propriedade
+    """
+    # Uma propriedade repetida na lista é consultada uma vez só
+    propriedades = list({p["property_id"]: p for p in propriedades}.values())
+    nomes = {p["property_id"]: p.get("nome", "") for p in propriedades}
+
+    log_debug(f"Consultando {len(propriedades)} propriedades com até {max_workers} em paralelo")
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(propriedades)))) as executor:
+        resultados = list(executor.map(lambda p: consultar_propriedade(p, consultar), propriedades))
+
+    cabecalhos = None
+    linhas = []
+    erros = []
+    for propriedade, (texto, erro, cota) in zip(propriedades, resultados):
+        property_id = propriedade["property_id"]
+        if erro:
+            erros.append({"property_id": property_id, "erro": erro, "cota_esgotada": cota})
+            continue
+        cabecalhos_propriedade, valores = interpretar(texto)
+        if not cabecalhos_propriedade:
+            continue
+        if cabecalhos is None:
+            cabecalhos = cabecalhos_propriedade
+        dimensoes = [c for c in cabecalhos_propriedade if c not in metricas]
+        for linha in normalizar_metricas(valores, cabecalhos_propriedade, dimensoes):
+            linhas.append([property_id, nomes[property_id]] + linha)
+
+    colunas = [COLUNA_PROPRIEDADE, COLUNA_NOME_PROPRIEDADE] + (cabecalhos or [])
+    colunas_dimensao = [c for c in colunas if c not in metricas]
+    aditivas = [c for c in (cabecalhos or []) if c in metricas and metrica_aditiva(c)]
+
+    # Totais por propriedade e, entre propriedades, por combinação de dimensões
+    por_propriedade = {}
+    por_dimensao = {}
+    indices_dimensao = [i for i, c in enumerate(colunas) if c in colunas_dimensao[2:]]
+    for linha in linhas:
+        por_propriedade.setdefault(linha[0], []).append(linha)
+        por_dimensao.setdefault(tuple(linha[i] for i in indices_dimensao), []).append(linha)
+
+    totais_por_propriedade = [
+        {COLUNA_PROPRIEDADE: property_id, COLUNA_NOME_PROPRIEDADE: nomes[property_id],
+         **agregar_linhas(colunas, grupo, aditivas)}
+        for property_id, grupo in por_propriedade.items()
+    ]
+    totais_por_dimensao = []
+    for chave, grupo in por_dimensao.items():
+        registro = {colunas[i]: valor for i, valor in zip(indices_dimensao, chave)}
+        registro.update(agregar_linhas(colunas, grupo, aditivas))
+        registro["propriedades"] = len({linha[0] for linha in grupo})
+        totais_por_dimensao.append(registro)
+
+    if aditivas:
+        principal = aditivas[0]
+        i_principal = colunas.index(principal)
+        linhas.sort(key=lambda linha: linha[i_principal], reverse=True)
+        totais_por_propriedade.sort(key=lambda r: r[principal], reverse=True)
+        totais_por_dimensao.sort(key=lambda r: r[principal], reverse=True)
+
+    if layout == LAYOUT_COLUNAR:
+        dados = montar_colunar(colunas, linhas, colunas_dimensao=colunas_dimensao)
+    else:
+        dados = [dict(zip(colunas, linha)) for linha in linhas]
+
+    log_debug(f"Portfólio concluído: {len(linhas)} linhas, {len(erros)} propriedades com erro")
+    return {
+        "propriedades_consultadas": len(propriedades),
+        "propriedades_com_erro": erros,
+        "total_resultados": len(linhas),
+        "dados": dados,
+        "totais": agregar_linhas(colunas, linhas, aditivas),
+        "totais_por_propriedade": totais_por_propriedade,
+        "totais_por_dimensao": totais_por_dimensao
+    }
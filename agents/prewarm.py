@@ -0,0 +1,157 @@
+"""
+Pré-aquecimento do cache com as consultas mais frequentes.
+
+Uma thread em segundo plano acorda nos horários configurados (logo após a
+atualização diária dos dados do GA4 e do Search Console) e reexecuta as
+top-N assinaturas registradas pelo contador, para que a primeira consulta
+do dia já encontre o resultado em cache.
+
+Consultas com algum período terminando hoje (ou depois) ficam de fora: o
+cache as guarda por CACHE_TTL_HOJE_SEGUNDOS, e o resultado aquecido de
+madrugada venceria antes do expediente.
+"""
+
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from agents.cache import consultar_com_cache, contador_consultas, resultado_com_erro, ttl_consulta
+
+# Horários locais "HH:MM" separados por vírgula; vazio desativa o agendador
+PREWARM_HORARIOS = os.getenv("PREWARM_HORARIOS", "07:00")
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", "10"))
+# Consultas com menos acessos que isso não são pré-aquecidas
+PREWARM_MIN_ACESSOS = int(os.getenv("PREWARM_MIN_ACESSOS", "2"))
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"PREWARM DEBUG: {message}", file=sys.stderr)
+
+
+def interpretar_horarios(texto: str) -> list[tuple[int, int]]:
+    """Converte "07:00,13:30" em [(7, 0), (13, 30)], ignorando entradas inválidas."""
+    horarios = []
+    for parte in (texto or "").split(","):
+        parte = parte.strip()
+        if not parte:
+            continue
+        try:
+            hora, minuto = (int(v) for v in parte.split(":"))
+        except ValueError:
+            log_debug(f"Horário inválido ignorado: '{parte}'")
+            continue
+        if 0 <= hora < 24 and 0 <= minuto < 60:
+            horarios.append((hora, minuto))
+    return sorted(set(horarios))
+
+
+def proxima_execucao(horarios: list[tuple[int, int]], agora: datetime) -> datetime:
+    """Próximo horário agendado estritamente depois de agora."""
+    candidatos = []
+    for hora, minuto in horarios:
+        momento = agora.replace(hour=hora, minute=minuto, second=0, microsecond=0)
+        if momento <= agora:
+            momento += timedelta(days=1)
+        candidatos.append(momento)
+    return min(candidatos)
+
+
+class AgendadorPreaquecimento:
+    """Reexecuta as consultas mais frequentes nos horários configurados."""
+
+    def __init__(self, horarios: str = PREWARM_HORARIOS, top_n: int = PREWARM_TOP_N,
+                 min_acessos: int = PREWARM_MIN_ACESSOS):
+        """
+        Args:
+            horarios: Horários locais "HH:MM" separados por vírgula
+            top_n: Quantidade de assinaturas reexecutadas por rodada
+            min_acessos: Acessos mínimos para uma assinatura ser reexecutada
+        """
+        self.consultas = {}
+        self.horarios = interpretar_horarios(horarios)
+        self.top_n = top_n
+        self.min_acessos = min_acessos
+        self.proxima = None
+        self.ultima_rodada = None
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self, consultas: dict) -> bool:
+        """
+        Inicia a thread do agendador; retorna False se não houver horários.
+
+        Args:
+            consultas: {tipo: função de consulta} para os tipos que podem ser reexecutados
+        """
+        self.consultas = consultas
+        if not self.horarios or self._thread is not None:
+            return False
+        self._thread = threading.Thread(target=self._loop, name="prewarm", daemon=True)
+        self._thread.start()
+        log_debug(f"Agendador iniciado: {', '.join(f'{h:02d}:{m:02d}' for h, m in self.horarios)}, top {self.top_n}")
+        return True
+
+    def parar(self):
+        """Sinaliza a thread para encerrar."""
+        self._parar.set()
+
+    def _loop(self):
+        while not self._parar.is_set():
+            self.proxima = proxima_execucao(self.horarios, datetime.now())
+            espera = (self.proxima - datetime.now()).total_seconds()
+            if self._parar.wait(max(0.0, espera)):
+                break
+            self.executar_rodada()
+
+    def executar_rodada(self) -> dict:
+        """Reexecuta as top-N consultas (exceto as que terminam hoje), substituindo o que estiver em cache."""
+        frequentes = [
+            registro for registro in contador_consultas.mais_frequentes(self.top_n)
+            if registro["acessos"] >= self.min_acessos and registro["tipo"] in self.consultas
+        ]
+        # Terminam hoje: o resultado teria validade curta e venceria antes de ser usado
+        ignoradas = sum(1 for registro in frequentes if ttl_consulta(registro["argumentos"]) is not None)
+        frequentes = [registro for registro in frequentes if ttl_consulta(registro["argumentos"]) is None]
+        inicio = datetime.now()
+        aquecidas = 0
+        falhas = 0
+        for registro in frequentes:
+            try:
+                resultado = consultar_com_cache(
+                    registro["tipo"],
+                    self.consultas[registro["tipo"]],
+                    registro["argumentos"],
+                    forcar=True,
+                    registrar=False
+                )
+                if resultado_com_erro(resultado):
+                    falhas += 1
+                    log_debug(f"Pré-aquecimento de {registro['assinatura']} retornou erro")
+                else:
+                    aquecidas += 1
+            except Exception as e:
+                falhas += 1
+                log_debug(f"Falha ao pré-aquecer {registro['assinatura']}: {e}")
+
+        self.ultima_rodada = {
+            "inicio": inicio.strftime("%Y-%m-%dT%H:%M:%S"),
+            "duracao_segundos": round((datetime.now() - inicio).total_seconds(), 2),
+            "aquecidas": aquecidas,
+            "falhas": falhas,
+            "ignoradas_terminam_hoje": ignoradas
+        }
+        log_debug(f"Rodada concluída: {aquecidas} consultas aquecidas, {falhas} falhas, {ignoradas} terminam hoje")
+        return self.ultima_rodada
+
+    def estado(self) -> dict:
+        """Configuração, próxima execução e resumo da última rodada."""
+        return {
+            "ativo": self._thread is not None and not self._parar.is_set(),
+            "horarios": [f"{h:02d}:{m:02d}" for h, m in self.horarios],
+            "top_n": self.top_n,
+            "min_acessos": self.min_acessos,
+            "proxima_execucao": self.proxima.strftime("%Y-%m-%dT%H:%M:%S") if self.proxima else None,
+            "ultima_rodada": self.ultima_rodada
+        }
@@ -0,0 +1,257 @@
+"""
+Relatórios em tempo real do GA4 com um único poller por relatório.
+
+Cada combinação (tenant, propriedade, especificação do relatório) tem uma
+thread que consulta run_realtime_report e distribui o resultado para todos
+os assinantes (conexões Server-Sent Events), em vez de cada painel ou
+sessão consultar o GA4 por conta própria. Só mudanças são publicadas. Sem
+assinantes, o intervalo entre consultas dobra a cada rodada e, depois de um
+tempo ocioso, o poller é encerrado; erros também aumentam o intervalo.
+"""
+
+import hashlib
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+
+from agents.responses import serializar_json
+
+REALTIME_INTERVALO_SEGUNDOS = float(os.getenv("REALTIME_INTERVALO_SEGUNDOS", "15"))
+REALTIME_INTERVALO_MAX_SEGUNDOS = float(os.getenv("REALTIME_INTERVALO_MAX_SEGUNDOS", "300"))
+# Sem assinantes por esse tempo, o poller é encerrado
+REALTIME_OCIOSO_SEGUNDOS = float(os.getenv("REALTIME_OCIOSO_SEGUNDOS", "600"))
+REALTIME_MAX_POLLERS = int(os.getenv("REALTIME_MAX_POLLERS", "50"))
+# Eventos pendentes por assinante; um assinante lento perde os mais antigos
+EVENTOS_POR_ASSINANTE = 5
+# Linhas por relatório: o poller guarda e reenvia o resultado inteiro a cada mudança
+REALTIME_MAX_LINHAS = 10000
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"REALTIME DEBUG: {message}", file=sys.stderr)
+
+
+class LimitePollers(Exception):
+    """Levantada quando já há pollers demais ativos."""
+
+
+def entregar(fila: queue.Queue, evento: dict):
+    """Coloca o evento na fila do assinante, descartando o mais antigo se estiver cheia."""
+    while True:
+        try:
+            fila.put_nowait(evento)
+            return
+        except queue.Full:
+            try:
+                fila.get_nowait()
+            except queue.Empty:
+                pass
+
+
+class PollerRealtime:
+    """Consulta um relatório em tempo real e publica as mudanças para os assinantes."""
+
+    def __init__(self, chave: str, consultar, ao_encerrar=None,
+                 intervalo_segundos: float = REALTIME_INTERVALO_SEGUNDOS,
+                 intervalo_max_segundos: float = REALTIME_INTERVALO_MAX_SEGUNDOS,
+                 ocioso_segundos: float = REALTIME_OCIOSO_SEGUNDOS):
+        self.chave = chave
+        self.consultar = consultar
+        self.ao_encerrar = ao_encerrar
+        self.intervalo_base = intervalo_segundos
+        self.intervalo_max = intervalo_max_segundos
+        self.ocioso_segundos = ocioso_segundos
+        self.intervalo = intervalo_segundos
+        self._lock = threading.Lock()
+        self._assinantes = set()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._sem_assinantes_desde = time.time()
+        self.ultimo_evento = None
+        self._ultimo_hash = None
+        self._ultima_consulta = 0.0
+        self._dados_em = 0.0
+        self.consultas = 0
+        self.publicacoes = 0
+        self._thread = threading.Thread(target=self._loop, name=f"realtime-{chave[:8]}", daemon=True)
+
+    def iniciar(self):
+        self._thread.start()
+
+    def assinar(self) -> queue.Queue:
+        """
+        Nova fila de eventos.
+
+        O intervalo volta ao normal. Se o último resultado é recente, ele é
+        entregue na hora; senão (poller espaçando as consultas, ou ainda sem
+        dados), o assinante recebe o resultado da próxima consulta, que
+        acontece no máximo intervalo_base depois da anterior.
+        """
+        fila = queue.Queue(maxsize=EVENTOS_POR_ASSINANTE)
+        with self._lock:
+            self._assinantes.add(fila)
+            fresco = self.ultimo_evento is not None and time.time() - self._dados_em < self.intervalo_base
+            ultimo = self.ultimo_evento if fresco else None
+            if not fresco:
+                # A próxima rodada publica mesmo sem mudança, para o novo assinante
+                self._ultimo_hash = None
+            acordar = not fresco or self.intervalo > self.intervalo_base
+            self.intervalo = self.intervalo_base
+        if ultimo is not None:
+            entregar(fila, ultimo)
+        if acordar:
+            self._acordar.set()
+        return fila
+
+    def cancelar(self, fila: queue.Queue):
+        with self._lock:
+            self._assinantes.discard(fila)
+            if not self._assinantes:
+                self._sem_assinantes_desde = time.time()
+
+    def assinantes(self) -> int:
+        with self._lock:
+            return len(self._assinantes)
+
+    def parar(self):
+        self._parar.set()
+        self._acordar.set()
+
+    def executar_rodada(self):
+        """Consulta o relatório uma vez e publica se o resultado mudou."""
+        self.consultas += 1
+        self._ultima_consulta = time.time()
+        try:
+            resultado = self.consultar()
+        except Exception as e:
+            resultado = {"erro": str(e)}
+
+        agora = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        if "erro" in resultado:
+            # Erros (inclusive cota) afastam a próxima consulta
+            self.intervalo = min(self.intervalo * 2, self.intervalo_max)
+            # O próximo resultado bom é publicado mesmo que igual ao anterior ao erro
+            self._ultimo_hash = None
+            self._publicar({"tipo": "erro", "erro": resultado["erro"], "atualizado_em": agora})
+            return
+
+        self._dados_em = time.time()
+        if self.assinantes():
+            self.intervalo = self.intervalo_base
+        else:
+            self.intervalo = min(self.intervalo * 2, self.intervalo_max)
+
+        digest = hashlib.sha256(serializar_json(resultado)).hexdigest()
+        if digest == self._ultimo_hash:
+            return
+        self._ultimo_hash = digest
+        colunas = resultado["colunas"]
+        self._publicar({
+            "tipo": "dados",
+            "atualizado_em": agora,
+            "colunas": colunas,
+            "dados": [dict(zip(colunas, linha)) for linha in resultado["linhas"]],
+            "total_resultados": len(resultado["linhas"])
+        })
+
+    def _publicar(self, evento: dict):
+        with self._lock:
+            # Novos assinantes recebem o último resultado; erros só vão para quem está conectado
+            if evento["tipo"] == "dados":
+                self.ultimo_evento = evento
+            assinantes = list(self._assinantes)
+        self.publicacoes += 1
+        for fila in assinantes:
+            entregar(fila, evento)
+
+    def ocioso(self) -> bool:
+        with self._lock:
+            return not self._assinantes and time.time() - self._sem_assinantes_desde > self.ocioso_segundos
+
+    def _loop(self):
+        while not self._parar.is_set():
+            # ao_encerrar confirma sob o lock do gerenciador que ninguém assinou nesse meio-tempo
+            if self.ocioso() and (self.ao_encerrar is None or self.ao_encerrar(self)):
+                break
+            self.executar_rodada()
+            self._esperar_proxima_rodada()
+        log_debug(f"Poller {self.chave} encerrado após {self.consultas} consultas")
+
+    def _esperar_proxima_rodada(self):
+        # Acordar só recalcula a espera: consultas nunca ficam a menos de intervalo_base uma da outra
+        while not self._parar.is_set():
+            restante = self._ultima_consulta + self.intervalo - time.time()
+            if restante <= 0:
+                return
+            self._acordar.wait(restante)
+            self._acordar.clear()
+
+    def estado(self) -> dict:
+        return {
+            "chave": self.chave,
+            "assinantes": self.assinantes(),
+            "intervalo_segundos": self.intervalo,
+            "consultas": self.consultas,
+            "publicacoes": self.publicacoes,
+            "atualizado_em": self.ultimo_evento["atualizado_em"] if self.ultimo_evento else None
+        }
+
+
+class GerenciadorRealtime:
+    """Um poller por relatório, compartilhado por todos os assinantes."""
+
+    def __init__(self, max_pollers: int = REALTIME_MAX_POLLERS):
+        self.max_pollers = max_pollers
+        self._lock = threading.Lock()
+        self._pollers = {}
+
+    def assinar(self, chave: str, consultar):
+        """
+        Assina o relatório, criando o poller se ainda não existir.
+
+        Returns:
+            tuple: (poller, fila de eventos)
+
+        Raises:
+            LimitePollers: Se o relatório for novo e já houver max_pollers ativos
+        """
+        with self._lock:
+            poller = self._pollers.get(chave)
+            if poller is None:
+                if len(self._pollers) >= self.max_pollers:
+                    raise LimitePollers(f"Limite de {self.max_pollers} relatórios em tempo real ativos atingido")
+                poller = PollerRealtime(chave, consultar, ao_encerrar=self._remover)
+                self._pollers[chave] = poller
+                # Assina antes de iniciar: a primeira consulta já tem para quem publicar
+                fila = poller.assinar()
+                poller.iniciar()
+                log_debug(f"Poller {chave} iniciado")
+            else:
+                # Assina ainda com o lock: o poller não é removido como ocioso entre a busca e a assinatura
+                fila = poller.assinar()
+        return poller, fila
+
+    def _remover(self, poller: PollerRealtime) -> bool:
+        """Remove um poller ocioso; retorna False se ele ganhou assinantes."""
+        with self._lock:
+            if poller.assinantes():
+                return False
+            if self._pollers.get(poller.chave) is poller:
+                del self._pollers[poller.chave]
+            return True
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            pollers = list(self._pollers.values())
+        return {
+            "max_pollers": self.max_pollers,
+            "pollers": [poller.estado() for poller in pollers]
+        }
+
+
+# Instância compartilhada pelas conexões de tempo real
+gerenciador_realtime = GerenciadorRealtime()
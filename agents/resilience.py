@@ -0,0 +1,246 @@
+"""
+Chamadas ao GA4 e ao Search Console protegidas contra lentidão.
+
+Algumas chamadas ficam presas por dezenas de segundos enquanto as demais
+respondem em poucos. Quando a primeira tentativa passa do percentil de
+latência recente do seu tipo, uma segunda tentativa igual é disparada e
+vale a que responder primeiro (hedging). Se nenhuma responder dentro do
+prazo, a chamada desiste com PrazoExcedido; a tentativa atrasada continua
+em segundo plano e seu resultado ainda pode ser aproveitado pelo cache.
+"""
+
+import contextvars
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    from google.api_core import exceptions as excecoes_google
+except ImportError:
+    excecoes_google = None
+
+UPSTREAM_PRAZO_SEGUNDOS = float(os.getenv("UPSTREAM_PRAZO_SEGUNDOS", "25"))
+HEDGE_PERCENTIL = float(os.getenv("HEDGE_PERCENTIL", "95"))
+# Nunca dispara a segunda tentativa antes disso, mesmo com latências baixas
+HEDGE_ATRASO_MIN_SEGUNDOS = float(os.getenv("HEDGE_ATRASO_MIN_SEGUNDOS", "1.0"))
+HEDGE_MAX_WORKERS = int(os.getenv("HEDGE_MAX_WORKERS", "16"))
+# Sem amostras suficientes o percentil não é confiável e não há hedging
+HEDGE_MIN_AMOSTRAS = 20
+AMOSTRAS_POR_TIPO = 200
+
+# Status gRPC gravado no início das mensagens de erro: "[Erro] [RESOURCE_EXHAUSTED] ..."
+PADRAO_STATUS_ERRO = re.compile(r"^\[Erro\] \[([A-Z_]+)\]")
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"RESILIENCE DEBUG: {message}", file=sys.stderr)
+
+
+def status_upstream(erro) -> str:
+    """Status gRPC de um erro das APIs do Google (ex: "RESOURCE_EXHAUSTED"); vazio para outros erros."""
+    if excecoes_google is None or not isinstance(erro, excecoes_google.GoogleAPICallError):
+        return ""
+    if erro.grpc_status_code is not None:
+        return getattr(erro.grpc_status_code, "name", "")
+    # Pelo transporte REST, um 429 sem status gRPC também é cota esgotada
+    return "RESOURCE_EXHAUSTED" if isinstance(erro, excecoes_google.TooManyRequests) else ""
+
+
+def mensagem_erro_upstream(descricao: str, erro) -> str:
+    """Texto de erro das consultas ("[Erro] ..."), com o status gRPC do erro quando houver."""
+    status = status_upstream(erro)
+    return f"[Erro] [{status}] {descricao}: {erro}" if status else f"[Erro] {descricao}: {erro}"
+
+
+def status_da_mensagem(texto: str) -> str:
+    """Status gRPC gravado por mensagem_erro_upstream; vazio se a mensagem não tiver."""
+    correspondencia = PADRAO_STATUS_ERRO.match(texto or "")
+    return correspondencia.group(1) if correspondencia else ""
+
+
+class PrazoExcedido(Exception):
+    """Levantada quando nenhuma tentativa responde dentro do prazo."""
+
+
+class HistoricoLatencias:
+    """Latências recentes das chamadas bem-sucedidas, por tipo de consulta."""
+
+    def __init__(self, max_amostras: int = AMOSTRAS_POR_TIPO):
+        self.max_amostras = max_amostras
+        self._lock = threading.Lock()
+        self._amostras = {}
+
+    def registrar(self, tipo: str, segundos: float):
+        with self._lock:
+            if tipo not in self._amostras:
+                self._amostras[tipo] = deque(maxlen=self.max_amostras)
+            self._amostras[tipo].append(segundos)
+
+    def percentil(self, tipo: str, p: float, min_amostras: int = HEDGE_MIN_AMOSTRAS):
+        """Percentil p (0-100) das latências do tipo, ou None com poucas amostras."""
+        with self._lock:
+            amostras = sorted(self._amostras.get(tipo, ()))
+        if len(amostras) < min_amostras:
+            return None
+        return amostras[min(len(amostras) - 1, int(len(amostras) * p / 100))]
+
+    def tipos(self) -> list[str]:
+        with self._lock:
+            return list(self._amostras)
+
+
+class ChamadasProtegidas:
+    """Executa chamadas com hedging pelo percentil de latência e prazo máximo."""
+
+    def __init__(self, max_workers: int = HEDGE_MAX_WORKERS, percentil: float = HEDGE_PERCENTIL,
+                 atraso_min_segundos: float = HEDGE_ATRASO_MIN_SEGUNDOS, min_amostras: int = HEDGE_MIN_AMOSTRAS):
+        self.percentil = percentil
+        self.atraso_min_segundos = atraso_min_segundos
+        self.min_amostras = min_amostras
+        self.latencias = HistoricoLatencias()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upstream")
+        self._lock = threading.Lock()
+        self.contadores = {
+            "chamadas": 0,
+            "hedges_disparados": 0,
+            "hedges_vencedores": 0,
+            "prazos_excedidos": 0,
+            "erros_upstream": 0,
+            "vencidos_por_erro": 0,
+            "vencidos_por_prazo": 0,
+            "vencidos_por_sobrecarga": 0
+        }
+
+    def contar(self, nome: str):
+        with self._lock:
+            self.contadores[nome] += 1
+
+    def atraso_hedge(self, tipo: str):
+        """Espera antes da segunda tentativa, ou None se ainda não há histórico."""
+        limiar = self.latencias.percentil(tipo, self.percentil, self.min_amostras)
+        return None if limiar is None else max(self.atraso_min_segundos, limiar)
+
+    def _tentativa(self, tipo: str, funcao, argumentos: dict, com_erro):
+        inicio = time.monotonic()
+        resultado = funcao(**argumentos)
+        if not com_erro(resultado):
+            self.latencias.registrar(tipo, time.monotonic() - inicio)
+        return resultado
+
+    def _submeter(self, tipo: str, funcao, argumentos: dict, com_erro):
+        # Copia o contexto para que ContextVars (como o progresso de jobs) sigam a tentativa
+        contexto = contextvars.copy_context()
+        return self._executor.submit(contexto.run, self._tentativa, tipo, funcao, argumentos, com_erro)
+
+    @staticmethod
+    def _ao_terminar_todas(tentativas: list, ao_encerrar):
+        """Chama ao_encerrar() uma vez, quando a última das tentativas terminar (na hora, se já terminaram)."""
+        restantes = [len(tentativas)]
+        lock = threading.Lock()
+
+        def concluida(_):
+            with lock:
+                restantes[0] -= 1
+                ultima = restantes[0] == 0
+            if ultima:
+                ao_encerrar()
+
+        if not tentativas:
+            ao_encerrar()
+        for futuro in tentativas:
+            futuro.add_done_callback(concluida)
+
+    def executar(self, tipo: str, funcao, argumentos: dict, com_erro, prazo_segundos: float = UPSTREAM_PRAZO_SEGUNDOS,
+                 ao_concluir_tarde=None, ao_encerrar=None):
+        """
+        Executa funcao(**argumentos), com uma segunda tentativa se a primeira demorar.
+
+        Args:
+            tipo: Tipo da consulta (cada tipo tem seu próprio histórico de latência)
+            funcao: Função de consulta
+            argumentos: Argumentos da função
+            com_erro: Função resultado -> bool que reconhece retornos de erro
+            prazo_segundos: Tempo máximo de espera pela resposta
+            ao_concluir_tarde: Chamada com o resultado de uma tentativa que termina após o prazo
+            ao_encerrar: Chamada sem argumentos quando todas as tentativas terminam, mesmo
+                depois do retorno ou do PrazoExcedido (usada para devolver a vaga da admissão)
+
+        Returns:
+            O primeiro resultado sem erro, ou o último erro se todas as tentativas falharem
+
+        Raises:
+            PrazoExcedido: Se nenhuma tentativa terminar dentro do prazo
+        """
+        self.contar("chamadas")
+        tentativas = []
+        try:
+            return self._executar(tipo, funcao, argumentos, com_erro, prazo_segundos, ao_concluir_tarde, tentativas)
+        finally:
+            if ao_encerrar is not None:
+                self._ao_terminar_todas(tentativas, ao_encerrar)
+
+    def _executar(self, tipo: str, funcao, argumentos: dict, com_erro, prazo_segundos: float, ao_concluir_tarde,
+                  tentativas: list):
+        limite = time.monotonic() + prazo_segundos
+        primeira = self._submeter(tipo, funcao, argumentos, com_erro)
+        tentativas.append(primeira)
+        pendentes = {primeira}
+
+        atraso = self.atraso_hedge(tipo)
+        if atraso is not None and atraso < prazo_segundos:
+            concluidas, _ = wait(pendentes, timeout=atraso)
+            if not concluidas:
+                log_debug(f"{tipo} passou de {atraso:.2f}s; disparando segunda tentativa")
+                self.contar("hedges_disparados")
+                tentativas.append(self._submeter(tipo, funcao, argumentos, com_erro))
+                pendentes.add(tentativas[-1])
+
+        ultimo_erro = None
+        while pendentes:
+            concluidas, pendentes = wait(pendentes, timeout=max(0.0, limite - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not concluidas:
+                break
+            for futuro in concluidas:
+                try:
+                    resultado = futuro.result()
+                except Exception as e:
+                    resultado = {"erro": str(e)}
+                if com_erro(resultado):
+                    ultimo_erro = resultado
+                    continue
+                if futuro is not primeira:
+                    self.contar("hedges_vencedores")
+                return resultado
+
+        if ultimo_erro is not None and not pendentes:
+            self.contar("erros_upstream")
+            return ultimo_erro
+
+        self.contar("prazos_excedidos")
+        if ao_concluir_tarde is not None:
+            for futuro in pendentes:
+                futuro.add_done_callback(lambda f: f.exception() is None and ao_concluir_tarde(f.result()))
+        raise PrazoExcedido(f"Sem resposta do serviço em {prazo_segundos:g}s")
+
+    def estatisticas(self) -> dict:
+        """Contadores de cada caminho e limiar atual de hedging por tipo."""
+        with self._lock:
+            contadores = dict(self.contadores)
+        limiares = {}
+        for tipo in self.latencias.tipos():
+            atraso = self.atraso_hedge(tipo)
+            limiares[tipo] = round(atraso, 3) if atraso is not None else None
+        return {
+            **contadores,
+            "percentil_hedge": self.percentil,
+            "limiar_hedge_segundos": limiares
+        }
+
+
+# Instância compartilhada pelas consultas interativas
+chamadas_upstream = ChamadasProtegidas()
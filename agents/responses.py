@@ -0,0 +1,98 @@
+"""
+Respostas condicionais (ETag / If-None-Match) e compressão negociada.
+
+O corpo JSON é serializado de forma canônica (chaves ordenadas, sem espaços),
+então o mesmo resultado sempre gera o mesmo hash. O ETag é fraco porque a
+representação transmitida muda conforme a codificação negociada.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+
+try:
+    import brotli
+except ImportError:  # brotli é opcional; sem ele só gzip é oferecido
+    brotli = None
+
+# Respostas menores que isso não compensam o custo de comprimir
+LIMIAR_COMPRESSAO = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+NIVEL_GZIP = 6
+QUALIDADE_BROTLI = 5
+
+
+def serializar_json(payload) -> bytes:
+    """Serializa o payload de forma estável para que o hash seja reprodutível."""
+    return json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def calcular_etag(corpo: bytes) -> str:
+    """Gera um ETag fraco a partir do hash SHA-256 do corpo."""
+    return f'W/"{hashlib.sha256(corpo).hexdigest()[:32]}"'
+
+
+def etag_corresponde(if_none_match: str, etag: str) -> bool:
+    """Verifica se o cabeçalho If-None-Match contém o ETag (comparação fraca)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    alvo = etag[2:] if etag.startswith("W/") else etag
+    for candidato in if_none_match.split(","):
+        candidato = candidato.strip()
+        if candidato.startswith("W/"):
+            candidato = candidato[2:]
+        if candidato == alvo:
+            return True
+    return False
+
+
+def codificacoes_disponiveis() -> list[str]:
+    """Codificações suportadas, na ordem de preferência do servidor."""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def escolher_codificacao(accept_encoding: str):
+    """
+    Escolhe a codificação a partir do cabeçalho Accept-Encoding.
+
+    Respeita q-values (q=0 recusa a codificação) e, em caso de empate,
+    usa a ordem de preferência do servidor. Retorna None se nada servir.
+    """
+    if not accept_encoding:
+        return None
+
+    pesos = {}
+    for parte in accept_encoding.split(","):
+        campos = [c.strip() for c in parte.split(";")]
+        nome = campos[0].lower()
+        if not nome:
+            continue
+        peso = 1.0
+        for campo in campos[1:]:
+            if campo.startswith("q="):
+                try:
+                    peso = float(campo[2:])
+                except ValueError:
+                    peso = 0.0
+        pesos[nome] = peso
+
+    melhor = None
+    melhor_peso = 0.0
+    for codificacao in codificacoes_disponiveis():
+        peso = pesos.get(codificacao, pesos.get("*", 0.0))
+        if peso > melhor_peso:
+            melhor = codificacao
+            melhor_peso = peso
+    return melhor
+
+
+def comprimir(corpo: bytes, codificacao: str) -> bytes:
+    """Comprime o corpo com a codificação escolhida."""
+    if codificacao == "br":
+        return brotli.compress(corpo, quality=QUALIDADE_BROTLI)
+    if codificacao == "gzip":
+        return gzip.compress(corpo, compresslevel=NIVEL_GZIP)
+    return corpo
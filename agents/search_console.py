@@ -1,16 +1,36 @@
 import os
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+import httplib2
 from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 import sys
 
+from agents.columnar import LAYOUT_COLUNAR, montar_colunar
+from agents.credentials import pool_clientes, renovador_tokens
+from agents.jobs import reportar_progresso
+from agents.sharding import fatiar_periodo, mesclar_linhas_search_console
+from agents.summary import TOP_K_PADRAO, resumir_tabela
+
+# Máximo de linhas que a API devolve por requisição
+LIMITE_LINHAS_API = 25000
+SC_MAX_WORKERS_FATIAS = int(os.getenv("SC_MAX_WORKERS_FATIAS", "4"))
+SC_MAX_LINHAS_POR_FATIA = int(os.getenv("SC_MAX_LINHAS_POR_FATIA", "100000"))
+
+SCOPES_SEARCH_CONSOLE = ["https://www.googleapis.com/auth/webmasters.readonly"]
+
+credenciais = None
+
 def log_debug(message):
     """Função para log de depuração."""
     print(f"SEARCH_CONSOLE DEBUG: {message}", file=sys.stderr)
 
 def init_search_console_service():
     """Inicializa o serviço do Search Console usando credenciais de variável de ambiente."""
+    global credenciais
     try:
         # Lê credenciais do JSON como string (vinda de variável de ambiente)
         creds_json = os.getenv("GOOGLE_CREDENTIALS")
@@ -28,8 +48,8 @@ def init_search_console_service():
             
         # Cria as credenciais
         try:
-            SCOPES = ["https://www.googleapis.com/auth/webmasters.readonly"]
-            credentials = service_account.Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
+            credentials = service_account.Credentials.from_service_account_info(creds_dict, scopes=SCOPES_SEARCH_CONSOLE)
+            credenciais = renovador_tokens.acompanhar("padrão:search_console", credentials)
             log_debug("Credenciais Search Console criadas com sucesso")
         except Exception as e:
             log_debug(f"Falha ao criar credenciais: {e}")
@@ -50,6 +70,41 @@ def init_search_console_service():
 # Inicializa o serviço uma vez
 service = init_search_console_service()
 
+def criar_conexao_search_console(creds_dict: dict, tenant: str = None) -> dict:
+    """Cria serviço e credenciais do Search Console para uma conta de serviço."""
+    credentials = service_account.Credentials.from_service_account_info(creds_dict, scopes=SCOPES_SEARCH_CONSOLE)
+    renovador_tokens.acompanhar(f"{tenant or 'padrão'}:search_console", credentials)
+    return {"servico": build("searchconsole", "v1", credentials=credentials), "credenciais": credentials}
+
+def obter_conexao(tenant: str = None):
+    """
+    Serviço do Search Console do tenant (do pool) ou o padrão de GOOGLE_CREDENTIALS.
+    
+    Returns:
+        tuple: ({"servico", "credenciais"}, None) ou (None, dict de erro)
+    """
+    if not tenant:
+        if service is None:
+            return None, {"erro": "Serviço Search Console não inicializado. Verifique as credenciais."}
+        return {"servico": service, "credenciais": credenciais}, None
+    try:
+        return pool_clientes.obter(tenant, "search_console", lambda creds: criar_conexao_search_console(creds, tenant)), None
+    except Exception as e:
+        return None, {"erro": f"Credenciais do tenant indisponíveis: {str(e)}"}
+
+# Cliente HTTP de cada thread: httplib2 não é thread-safe
+_threads = threading.local()
+
+def http_da_thread(credenciais_conexao):
+    """Cliente HTTP autorizado exclusivo da thread atual, usado nas consultas em paralelo."""
+    clientes = getattr(_threads, "clientes", None)
+    if clientes is None:
+        clientes = _threads.clientes = {}
+    http = clientes.get(id(credenciais_conexao))
+    if http is None or http.credentials is not credenciais_conexao:
+        http = clientes[id(credenciais_conexao)] = AuthorizedHttp(credenciais_conexao, http=httplib2.Http())
+    return http
+
 def resolver_data(d: str):
     """Converte strings de data relativa para formato YYYY-MM-DD"""
     if "daysAgo" in d:
@@ -59,20 +114,37 @@ def resolver_data(d: str):
         return datetime.today().strftime("%Y-%m-%d")
     return d
 
-def listar_sites_search_console() -> dict:
+def formatar_site_url(site_url: str) -> str:
+    """Garante o formato de URL esperado pelo Search Console: com esquema e barra final."""
+    # Propriedades de domínio ("sc-domain:exemplo.com") não têm esquema nem barra
+    if site_url.startswith('sc-domain:'):
+        return site_url
+    
+    if not site_url.startswith(('http://', 'https://')):
+        site_url = f"https://{site_url}"
+    
+    if not site_url.endswith('/'):
+        site_url = f"{site_url}/"
+    return site_url
+
+def listar_sites_search_console(tenant: str = None) -> dict:
     """
     Lista todos os sites disponíveis no Search Console para a conta de serviço.
     
+    Args:
+        tenant: Tenant cujas credenciais são usadas (padrão: GOOGLE_CREDENTIALS)
+    
     Returns:
         dict: Lista de sites disponíveis ou erro
     """
-    if service is None:
-        return {"erro": "Serviço Search Console não inicializado. Verifique as credenciais."}
+    conexao, erro = obter_conexao(tenant)
+    if erro:
+        return erro
     
     try:
         log_debug("Listando sites disponíveis no Search Console...")
         # Lista todos os sites disponíveis
-        sites_list = service.sites().list().execute()
+        sites_list = conexao["servico"].sites().list().execute()
         
         sites = []
         for site in sites_list.get('siteEntry', []):
@@ -94,6 +166,165 @@ def listar_sites_search_console() -> dict:
         log_debug(f"Erro ao listar sites: {str(e)}\n{error_details}")
         return {"erro": f"Erro ao listar sites do Search Console: {str(e)}"}
 
+# Nomes amigáveis das dimensões usados nas colunas de resposta
+NOMES_DIMENSOES = {
+    "query": "Consulta",
+    "page": "Página",
+    "country": "País",
+    "device": "Dispositivo",
+    "date": "Data"
+}
+
+# Nomes da API aceitos como métrica de ranking do resumo
+NOMES_METRICAS = {
+    "clicks": "Cliques",
+    "impressions": "Impressões",
+    "ctr": "CTR",
+    "position": "Posição Média"
+}
+
+def tabela_search_console(rows: list, dimensoes: list[str], metrica_extra: bool):
+    """
+    Converte as linhas da API em (colunas, colunas_dimensao, linhas) com métricas numéricas.
+
+    Os nomes das colunas são calculados uma única vez e cada linha é uma tupla
+    alinhada com eles. CTR permanece como fração (0.0523) e posição média
+    como float; a formatação em texto fica para montar_linhas_search_console.
+    """
+    colunas_dimensao = [NOMES_DIMENSOES.get(d, f"Dimensão {d}") for d in dimensoes]
+    colunas = colunas_dimensao + ["Cliques", "Impressões"]
+    if metrica_extra:
+        colunas += ["CTR", "Posição Média"]
+
+    total_dimensoes = len(dimensoes)
+    preenchimento = ("",) * total_dimensoes
+    linhas = []
+    adicionar = linhas.append
+    for row in rows:
+        chaves = row.get("keys", preenchimento)
+        if len(chaves) != total_dimensoes:
+            chaves = (*chaves, *preenchimento)[:total_dimensoes]
+        if metrica_extra:
+            adicionar((*chaves, row.get("clicks", 0), row.get("impressions", 0), row.get("ctr", 0.0), row.get("position", 0.0)))
+        else:
+            adicionar((*chaves, row.get("clicks", 0), row.get("impressions", 0)))
+
+    return colunas, colunas_dimensao, linhas
+
+def montar_linhas_search_console(colunas: list[str], linhas: list[tuple], metrica_extra: bool) -> list[dict]:
+    """Converte a tabela em registros com nomes amigáveis, formatando CTR e posição média só na saída."""
+    if not metrica_extra:
+        return [dict(zip(colunas, linha)) for linha in linhas]
+
+    formatar_ctr = "{:.2%}".format
+    formatar_posicao = "{:.2f}".format
+    return [
+        dict(zip(colunas, (*linha[:-2], formatar_ctr(linha[-2]), formatar_posicao(linha[-1]))))
+        for linha in linhas
+    ]
+
+def resumir_search_console(
+    colunas: list[str],
+    colunas_dimensao: list[str],
+    linhas: list[tuple],
+    metrica_extra: bool,
+    metrica_ranking: str = "Cliques",
+    top_k: int = TOP_K_PADRAO,
+    orcamento_linhas: int = None,
+    orcamento_bytes: int = None
+) -> dict:
+    """Resume a tabela em top-K + "outros", recalculando CTR e posição ponderada na cauda."""
+    metrica_ranking = NOMES_METRICAS.get(metrica_ranking, metrica_ranking)
+
+    ponderadas = {"Posição Média": "Impressões"} if metrica_extra else None
+    razoes = {"CTR": ("Cliques", "Impressões")} if metrica_extra else None
+    return resumir_tabela(
+        colunas,
+        linhas,
+        metrica_ranking,
+        colunas_dimensao=colunas_dimensao,
+        top_k=top_k,
+        orcamento_linhas=orcamento_linhas,
+        orcamento_bytes=orcamento_bytes,
+        ponderadas=ponderadas,
+        razoes=razoes
+    )
+
+def consultar_fatia(conexao: dict, site_url: str, body: dict, inicio: str, fim: str, max_linhas: int):
+    """
+    Busca todas as linhas de uma fatia, paginando com startRow.
+
+    Returns:
+        tuple: (linhas no formato da API, se a fatia foi cortada em max_linhas)
+    """
+    linhas = []
+    while len(linhas) < max_linhas:
+        pagina = min(LIMITE_LINHAS_API, max_linhas - len(linhas))
+        corpo = dict(body, startDate=inicio, endDate=fim, rowLimit=pagina, startRow=len(linhas))
+        resposta = conexao["servico"].searchanalytics().query(siteUrl=site_url, body=corpo).execute(
+            http=http_da_thread(conexao["credenciais"])
+        )
+        recebidas = resposta.get("rows", [])
+        linhas.extend(recebidas)
+        if len(recebidas) < pagina:
+            return linhas, False
+    return linhas, True
+
+def consultar_em_fatias(conexao: dict, site_url: str, body: dict, unidade: str, max_linhas_fatia: int = SC_MAX_LINHAS_POR_FATIA):
+    """
+    Divide o período do body em fatias, consulta as fatias em paralelo e mescla as linhas.
+
+    Returns:
+        tuple: (linhas mescladas no formato da API, informações sobre as fatias)
+    """
+    fatias = fatiar_periodo(body["startDate"], body["endDate"], unidade)
+    log_debug(f"Consultando {len(fatias)} fatias ({unidade}) com até {SC_MAX_WORKERS_FATIAS} em paralelo")
+
+    with ThreadPoolExecutor(max_workers=max(1, min(SC_MAX_WORKERS_FATIAS, len(fatias)))) as executor:
+        futuros = [
+            executor.submit(consultar_fatia, conexao, site_url, body, inicio, fim, max_linhas_fatia)
+            for inicio, fim in fatias
+        ]
+        for concluidas, _ in enumerate(as_completed(futuros), start=1):
+            reportar_progresso(0.9 * concluidas / len(futuros), f"{concluidas}/{len(futuros)} fatias consultadas")
+        resultados = [futuro.result() for futuro in futuros]
+
+    linhas = mesclar_linhas_search_console(linhas for linhas, _ in resultados)
+    return linhas, {
+        "unidade": unidade,
+        "quantidade": len(fatias),
+        "linhas_buscadas": sum(len(linhas_fatia) for linhas_fatia, _ in resultados),
+        "fatias_truncadas": [f"{inicio} a {fim}" for (inicio, fim), (_, cortada) in zip(fatias, resultados) if cortada]
+    }
+
+def montar_filtros(filtros: list[dict] = None, query_filtro: str = "", pagina_filtro: str = "") -> list[dict]:
+    """Filtros da API: "contém" automáticos para query e página, seguidos dos filtros customizados."""
+    # Construir filtros automáticos para query e página se fornecidos
+    filtros_automaticos = []
+    
+    if query_filtro:
+        filtros_automaticos.append({
+            "dimension": "query",
+            "operator": "contains",
+            "expression": query_filtro
+        })
+        log_debug(f"Adicionado filtro de query: contém '{query_filtro}'")
+    
+    if pagina_filtro:
+        filtros_automaticos.append({
+            "dimension": "page",
+            "operator": "contains", 
+            "expression": pagina_filtro
+        })
+        log_debug(f"Adicionado filtro de página: contém '{pagina_filtro}'")
+    
+    # Combinar filtros automáticos com filtros customizados
+    todos_filtros = filtros_automaticos[:]
+    if filtros:
+        todos_filtros.extend(filtros)
+        log_debug(f"Adicionados {len(filtros)} filtros customizados")
+    return todos_filtros
+
 def consulta_search_console_custom(
     site_url: str,
     data_inicio: str = "30daysAgo",
@@ -103,7 +334,16 @@ def consulta_search_console_custom(
     filtros: list[dict] = None,
     limite: int = 100,
     query_filtro: str = "",
-    pagina_filtro: str = ""
+    pagina_filtro: str = "",
+    layout: str = "linhas",
+    metrica_ranking: str = "Cliques",
+    top_k: int = TOP_K_PADRAO,
+    orcamento_linhas: int = None,
+    orcamento_bytes: int = None,
+    incluir_dados: bool = True,
+    fatiar_por: str = "",
+    tenant: str = None,
+    incluir_tabela: bool = False
 ) -> dict:
     """
     Consulta customizada ao Search Console com suporte a múltiplas dimensões e filtros.
@@ -118,17 +358,24 @@ def consulta_search_console_custom(
         limite: Número máximo de resultados (padrão: 100)
         query_filtro: Filtro específico para queries - usa condição 'contém' (opcional)
         pagina_filtro: Filtro específico para páginas - usa condição 'contém' (opcional)
+        layout: Formato de "dados": "linhas" (padrão) ou "columnar", com métricas numéricas
+        metrica_ranking: Métrica usada no top-K do resumo (padrão: "Cliques")
+        top_k: Quantidade de linhas no topo do resumo (padrão: 10)
+        orcamento_linhas: Máximo de linhas no resumo, incluindo o bucket "outros" (opcional)
+        orcamento_bytes: Tamanho máximo do resumo em bytes de JSON (opcional)
+        incluir_dados: Se deve retornar "dados" completos além do resumo (padrão: True)
+        fatiar_por: "semana" ou "mes" divide o período em fatias consultadas em paralelo,
+            cada uma com seu próprio limite de linhas; "limite" vale para o resultado mesclado
+        tenant: Tenant cujas credenciais são usadas (padrão: GOOGLE_CREDENTIALS)
+        incluir_tabela: Inclui em "tabela" as colunas e linhas numéricas, para recortes locais
     """
     # Verificar se o serviço foi inicializado corretamente
-    if service is None:
-        return {"erro": "Serviço Search Console não inicializado. Verifique as credenciais."}
+    conexao, erro = obter_conexao(tenant)
+    if erro:
+        return erro
     
     # Garantir que a URL do site tenha o formato correto
-    if not site_url.startswith(('http://', 'https://')):
-        site_url = f"https://{site_url}"
-    
-    if not site_url.endswith('/'):
-        site_url = f"{site_url}/"
+    site_url = formatar_site_url(site_url)
         
     try:
         log_debug(f"Iniciando consulta para site: {site_url}")
@@ -145,71 +392,49 @@ def consulta_search_console_custom(
             "rowLimit": limite
         }
 
-        # Construir filtros automáticos para query e página se fornecidos
-        filtros_automaticos = []
-        
-        if query_filtro:
-            filtros_automaticos.append({
-                "dimension": "query",
-                "operator": "contains",
-                "expression": query_filtro
-            })
-            log_debug(f"Adicionado filtro de query: contém '{query_filtro}'")
-        
-        if pagina_filtro:
-            filtros_automaticos.append({
-                "dimension": "page",
-                "operator": "contains", 
-                "expression": pagina_filtro
-            })
-            log_debug(f"Adicionado filtro de página: contém '{pagina_filtro}'")
-        
-        # Combinar filtros automáticos com filtros customizados
-        todos_filtros = filtros_automaticos[:]
-        if filtros:
-            todos_filtros.extend(filtros)
-            log_debug(f"Adicionados {len(filtros)} filtros customizados")
-        
         # Aplicar filtros se existirem
+        todos_filtros = montar_filtros(filtros, query_filtro, pagina_filtro)
         if todos_filtros:
             body["dimensionFilterGroups"] = [{"filters": todos_filtros}]
 
-        log_debug("Enviando requisição ao Search Console...")
-        response = service.searchanalytics().query(siteUrl=site_url, body=body).execute()
+        info_fatias = None
+        if fatiar_por:
+            rows, info_fatias = consultar_em_fatias(conexao, site_url, body, fatiar_por)
+            rows = rows[:limite]
+        else:
+            log_debug("Enviando requisição ao Search Console...")
+            # Cliente HTTP da thread: com hedging, duas tentativas podem rodar ao mesmo tempo
+            response = conexao["servico"].searchanalytics().query(siteUrl=site_url, body=body).execute(
+                http=http_da_thread(conexao["credenciais"])
+            )
+            rows = response.pop("rows", [])
 
-        resultados = []
-        for row in response.get("rows", []):
-            registro = {}
-            
-            # Mapear dimensões com nomes mais amigáveis
-            for i, dimensao in enumerate(dimensoes):
-                if i < len(row.get("keys", [])):
-                    nome_dimensao = {
-                        "query": "Consulta",
-                        "page": "Página", 
-                        "country": "País",
-                        "device": "Dispositivo",
-                        "date": "Data"
-                    }.get(dimensao, f"Dimensão {dimensao}")
-                    
-                    registro[nome_dimensao] = row["keys"][i]
-            
-            # Adicionar métricas se solicitado
-            if metrica_extra:
-                registro.update({
-                    "Cliques": row.get("clicks", 0),
-                    "Impressões": row.get("impressions", 0),
-                    "CTR": f"{row.get('ctr', 0):.2%}",
-                    "Posição Média": f"{row.get('position', 0):.2f}"
-                })
+        # A tabela compacta é montada uma vez e usada pelo resumo e pelos dois layouts;
+        # as linhas da API (um dict por linha) são liberadas logo em seguida
+        total_resultados = len(rows)
+        colunas, colunas_dimensao, linhas = tabela_search_console(rows, dimensoes, metrica_extra)
+        del rows
+        
+        try:
+            resumo = resumir_search_console(
+                colunas,
+                colunas_dimensao,
+                linhas,
+                metrica_extra,
+                metrica_ranking=metrica_ranking,
+                top_k=top_k,
+                orcamento_linhas=orcamento_linhas,
+                orcamento_bytes=orcamento_bytes
+            )
+        except ValueError as e:
+            return {"erro": f"Erro no resumo da consulta Search Console: {str(e)}"}
+        
+        resultados = None
+        if incluir_dados:
+            if layout == LAYOUT_COLUNAR:
+                resultados = montar_colunar(colunas, linhas, colunas_dimensao=colunas_dimensao)
             else:
-                # Apenas métricas básicas
-                registro.update({
-                    "Cliques": row.get("clicks", 0),
-                    "Impressões": row.get("impressions", 0)
-                })
-                
-            resultados.append(registro)
+                resultados = montar_linhas_search_console(colunas, linhas, metrica_extra)
 
         # Informações sobre filtros aplicados
         filtros_info = []
@@ -222,16 +447,23 @@ def consulta_search_console_custom(
                 operador = filtro.get('operator', 'equals')
                 filtros_info.append(f"{filtro.get('dimension')} {operador} '{filtro.get('expression')}'")
 
-        log_debug(f"Consulta concluída: {len(resultados)} resultados encontrados")
-        return {
+        log_debug(f"Consulta concluída: {total_resultados} resultados encontrados")
+        resposta = {
             "sucesso": True,
             "site": site_url,
             "periodo": f"{data_inicio} a {data_fim}",
             "dimensoes": dimensoes,
             "filtros_aplicados": filtros_info,
-            "total_resultados": len(resultados),
-            "dados": resultados
+            "total_resultados": total_resultados,
+            "resumo": resumo
         }
+        if info_fatias:
+            resposta["fatias"] = info_fatias
+        if incluir_dados:
+            resposta["dados"] = resultados
+        if incluir_tabela:
+            resposta["tabela"] = {"colunas": colunas, "colunas_dimensao": colunas_dimensao, "linhas": linhas}
+        return resposta
 
     except Exception as e:
         import traceback
@@ -239,30 +471,121 @@ def consulta_search_console_custom(
         log_debug(f"Erro na consulta_search_console_custom: {str(e)}\n{error_details}")
         return {"erro": f"Erro na consulta Search Console: {str(e)}"}
 
-def verificar_propriedade_site_search_console(site_url: str) -> dict:
+def corpo_paginas(parametros: dict):
+    """URL formatada, dimensões e corpo da consulta paginada (sem rowLimit e startRow)."""
+    dimensoes = parametros.get("dimensoes") or ["query"]
+    body = {
+        "startDate": resolver_data(parametros.get("data_inicio", "30daysAgo")),
+        "endDate": resolver_data(parametros.get("data_fim", "today")),
+        "dimensions": dimensoes
+    }
+    todos_filtros = montar_filtros(parametros.get("filtros"), parametros.get("query_filtro", ""), parametros.get("pagina_filtro", ""))
+    if todos_filtros:
+        body["dimensionFilterGroups"] = [{"filters": todos_filtros}]
+    return formatar_site_url(parametros["site_url"]), dimensoes, body
+
+def estimar_linhas_search_console(
+    site_url: str,
+    data_inicio: str = "30daysAgo",
+    data_fim: str = "today",
+    dimensoes: list[str] = None,
+    filtros: list[dict] = None,
+    query_filtro: str = "",
+    pagina_filtro: str = "",
+    marcos: list[int] = (),
+    tenant: str = None
+) -> dict:
+    """
+    Sondagem barata do tamanho de uma consulta, por faixas.
+    
+    A API não informa o total de linhas: para cada marco (em ordem crescente)
+    pede uma única linha a partir da posição do marco, até não vir nenhuma.
+    
+    Returns:
+        dict: {"linhas": marco + 1 do maior marco com linha (mais de marco linhas),
+            ou o primeiro marco se nenhum tiver (até marco linhas), "exato": False},
+            ou {"erro": ...}
+    """
+    conexao, erro = obter_conexao(tenant)
+    if erro:
+        return erro
+    try:
+        site_url, _, body = corpo_paginas({
+            "site_url": site_url, "data_inicio": data_inicio, "data_fim": data_fim, "dimensoes": dimensoes,
+            "filtros": filtros, "query_filtro": query_filtro, "pagina_filtro": pagina_filtro
+        })
+        linhas = min(marcos) if marcos else 0
+        for marco in sorted(marcos):
+            resposta = conexao["servico"].searchanalytics().query(
+                siteUrl=site_url, body=dict(body, rowLimit=1, startRow=marco)
+            ).execute(http=http_da_thread(conexao["credenciais"]))
+            if not resposta.get("rows"):
+                break
+            linhas = marco + 1
+        log_debug(f"Sondagem de {site_url}: {linhas} linhas pelos marcos {list(marcos)}")
+        return {"linhas": linhas, "exato": False}
+    except Exception as e:
+        log_debug(f"Erro na sondagem do Search Console: {str(e)}")
+        return {"erro": f"Erro na sondagem do Search Console: {str(e)}"}
+
+def paginas_search_console(parametros: dict, inicio: int = 0, linhas_por_pagina: int = LIMITE_LINHAS_API):
+    """
+    Percorre todas as linhas de uma consulta do Search Console com startRow, uma página por vez.
+    
+    Args:
+        parametros: site_url, data_inicio, data_fim, dimensoes, filtros,
+            query_filtro, pagina_filtro (como em /search-console/query) e tenant
+        inicio: startRow da primeira página (para retomar uma exportação)
+        linhas_por_pagina: Linhas por requisição (limitado a LIMITE_LINHAS_API)
+    
+    Yields:
+        dict: {"colunas", "tipos", "linhas", "proximo", "total"}, com CTR em fração;
+            "proximo" é o startRow da página seguinte, ou None na última
+    """
+    conexao, erro = obter_conexao(parametros.get("tenant"))
+    if erro:
+        raise RuntimeError(erro["erro"])
+    
+    site_url, dimensoes, body = corpo_paginas(parametros)
+    pagina = min(linhas_por_pagina, LIMITE_LINHAS_API)
+    linha_inicial = inicio
+    while True:
+        resposta = conexao["servico"].searchanalytics().query(
+            siteUrl=site_url, body=dict(body, rowLimit=pagina, startRow=linha_inicial)
+        ).execute(http=http_da_thread(conexao["credenciais"]))
+        colunas, colunas_dimensao, linhas = tabela_search_console(resposta.get("rows", []), dimensoes, True)
+        # Cliques e impressões chegam como número JSON; no arquivo ficam inteiros
+        linhas = [(*linha[:-4], int(linha[-4]), int(linha[-3]), linha[-2], linha[-1]) for linha in linhas]
+        linha_inicial += len(linhas)
+        proximo = linha_inicial if len(linhas) == pagina else None
+        tipos = {coluna: "texto" for coluna in colunas_dimensao}
+        tipos.update({"Cliques": "inteiro", "Impressões": "inteiro", "CTR": "decimal", "Posição Média": "decimal"})
+        yield {"colunas": colunas, "tipos": tipos, "linhas": linhas, "proximo": proximo, "total": None}
+        if proximo is None:
+            return
+
+def verificar_propriedade_site_search_console(site_url: str, tenant: str = None) -> dict:
     """
     Verifica se um site específico está disponível no Search Console.
     
     Args:
         site_url: URL do site para verificar
+        tenant: Tenant cujas credenciais são usadas (padrão: GOOGLE_CREDENTIALS)
         
     Returns:
         dict: Informações sobre a disponibilidade do site
     """
-    if service is None:
-        return {"erro": "Serviço Search Console não inicializado. Verifique as credenciais."}
+    conexao, erro = obter_conexao(tenant)
+    if erro:
+        return erro
     
     # Garantir formato correto da URL
-    if not site_url.startswith(('http://', 'https://')):
-        site_url = f"https://{site_url}"
-    
-    if not site_url.endswith('/'):
-        site_url = f"{site_url}/"
+    site_url = formatar_site_url(site_url)
     
     try:
         log_debug(f"Verificando propriedade do site: {site_url}")
         # Obter informações do site específico
-        site_info = service.sites().get(siteUrl=site_url).execute()
+        site_info = conexao["servico"].sites().get(siteUrl=site_url).execute()
         
         return {
             "sucesso": True,
@@ -0,0 +1,74 @@
+"""
+Fatiamento de períodos longos do Search Console.
+
+Um período longo é dividido em fatias (semanas ou meses) consultadas em
+paralelo; cada fatia tem seu próprio limite de linhas, então o resultado
+cobre o período inteiro. As linhas das fatias são mescladas pelas chaves
+de dimensão: cliques e impressões são somados, o CTR é recalculado e a
+posição média é ponderada pelas impressões.
+"""
+
+from datetime import date, timedelta
+
+UNIDADE_SEMANA = "semana"
+UNIDADE_MES = "mes"
+UNIDADES_FATIA = (UNIDADE_SEMANA, UNIDADE_MES)
+
+
+def fatiar_periodo(inicio: str, fim: str, unidade: str) -> list[tuple[str, str]]:
+    """
+    Divide o período [inicio, fim] (YYYY-MM-DD) em fatias contíguas.
+
+    Semanas vão de segunda a domingo e meses seguem o calendário; a primeira
+    e a última fatia são cortadas nas datas do período.
+    """
+    atual = date.fromisoformat(inicio)
+    ultimo = date.fromisoformat(fim)
+    if unidade not in UNIDADES_FATIA:
+        raise ValueError(f"Unidade de fatia inválida: '{unidade}'. Use uma de: {', '.join(UNIDADES_FATIA)}")
+
+    fatias = []
+    while atual <= ultimo:
+        if unidade == UNIDADE_SEMANA:
+            fim_fatia = atual + timedelta(days=6 - atual.weekday())
+        else:
+            proximo_mes = (atual.replace(day=28) + timedelta(days=4)).replace(day=1)
+            fim_fatia = proximo_mes - timedelta(days=1)
+        fim_fatia = min(fim_fatia, ultimo)
+        fatias.append((atual.isoformat(), fim_fatia.isoformat()))
+        atual = fim_fatia + timedelta(days=1)
+    return fatias
+
+
+def mesclar_linhas_search_console(linhas_por_fatia) -> list[dict]:
+    """
+    Mescla as linhas das fatias (no formato da API) pelas chaves de dimensão.
+
+    Returns:
+        list: Linhas no formato da API, ordenadas por cliques (decrescente)
+    """
+    agregado = {}
+    for linhas in linhas_por_fatia:
+        for row in linhas:
+            chave = tuple(row.get("keys", ()))
+            impressoes = row.get("impressions", 0)
+            acumulado = agregado.get(chave)
+            if acumulado is None:
+                agregado[chave] = [row.get("clicks", 0), impressoes, row.get("position", 0.0) * impressoes]
+            else:
+                acumulado[0] += row.get("clicks", 0)
+                acumulado[1] += impressoes
+                acumulado[2] += row.get("position", 0.0) * impressoes
+
+    mescladas = [
+        {
+            "keys": list(chave),
+            "clicks": cliques,
+            "impressions": impressoes,
+            "ctr": cliques / impressoes if impressoes else 0.0,
+            "position": posicao_ponderada / impressoes if impressoes else 0.0
+        }
+        for chave, (cliques, impressoes, posicao_ponderada) in agregado.items()
+    ]
+    mescladas.sort(key=lambda row: (row["clicks"], row["impressions"]), reverse=True)
+    return mescladas
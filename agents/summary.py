@@ -0,0 +1,195 @@
+"""
+Resumo compacto de resultados para consumo pelo GPT.
+
+Seleciona o top-K por uma métrica (via heap), agrupa a cauda em um bucket
+"outros", calcula a participação de cada linha no total e respeita um
+orçamento de saída em linhas ou bytes.
+"""
+
+import heapq
+
+from agents.columnar import converter_numero
+from agents.responses import serializar_json
+
+TOP_K_PADRAO = 10
+ROTULO_OUTROS = "(outros)"
+
+# Métricas GA4 que são taxas, médias ou razões (não somáveis entre linhas). Contagens,
+# receitas e durações totais (userEngagementDuration é uma soma de segundos) são somáveis.
+METRICAS_NAO_ADITIVAS = frozenset({
+    "advertiserAdCostPerClick", "advertiserAdCostPerConversion", "advertiserAdCostPerKeyEvent",
+    "averagePurchaseRevenue", "averagePurchaseRevenuePerPayingUser", "averagePurchaseRevenuePerUser",
+    "averageRevenuePerUser", "averageSessionDuration", "bounceRate", "cartToViewRate",
+    "crashFreeUsersRate", "dauPerMau", "dauPerWau", "engagementRate", "eventCountPerUser",
+    "eventsPerSession", "firstTimePurchasersPerNewUser", "itemListClickThroughRate",
+    "itemPromotionClickThroughRate", "organicGoogleSearchAveragePosition",
+    "organicGoogleSearchClickThroughRate", "purchaserRate", "purchaseToViewRate", "returnOnAdSpend",
+    "screenPageViewsPerSession", "screenPageViewsPerUser", "sessionConversionRate",
+    "sessionKeyEventRate", "sessionsPerUser", "userConversionRate", "userKeyEventRate", "wauPerMau",
+    # Colunas do Search Console
+    "CTR", "Posição Média"
+})
+# Métricas personalizadas de média ("averageCustomEvent:parametro")
+PREFIXOS_NAO_ADITIVOS = ("averageCustomEvent:",)
+
+
+def metrica_aditiva(nome: str) -> bool:
+    """Indica se uma métrica pode ser somada entre linhas (contagens sim, taxas e médias não)."""
+    return nome not in METRICAS_NAO_ADITIVAS and not nome.startswith(PREFIXOS_NAO_ADITIVOS)
+
+
+def percentual(valor, total) -> float:
+    """Participação percentual com duas casas decimais."""
+    if not total:
+        return 0.0
+    return round(valor * 100.0 / total, 2)
+
+
+def agregar_linhas(colunas, linhas, aditivas, ponderadas=None, razoes=None) -> dict:
+    """
+    Agrega um conjunto de linhas em um único registro.
+
+    Args:
+        colunas: Nomes das colunas
+        linhas: Linhas a agregar
+        aditivas: Colunas somadas diretamente
+        ponderadas: {coluna: coluna_peso} para médias ponderadas (ex: posição por impressões)
+        razoes: {coluna: (numerador, denominador)} recalculadas a partir das somas (ex: CTR)
+    """
+    ponderadas = ponderadas or {}
+    razoes = razoes or {}
+    indice = {coluna: i for i, coluna in enumerate(colunas)}
+
+    agregado = {}
+    for coluna in aditivas:
+        i = indice[coluna]
+        agregado[coluna] = sum(linha[i] for linha in linhas)
+
+    for coluna, peso in ponderadas.items():
+        i, j = indice[coluna], indice[peso]
+        soma_pesos = sum(linha[j] for linha in linhas)
+        ponderado = sum(linha[i] * linha[j] for linha in linhas)
+        agregado[coluna] = round(ponderado / soma_pesos, 2) if soma_pesos else 0.0
+
+    for coluna, (numerador, denominador) in razoes.items():
+        total_denominador = agregado.get(denominador)
+        if total_denominador is None:
+            total_denominador = sum(linha[indice[denominador]] for linha in linhas)
+        total_numerador = agregado.get(numerador)
+        if total_numerador is None:
+            total_numerador = sum(linha[indice[numerador]] for linha in linhas)
+        agregado[coluna] = round(total_numerador / total_denominador, 4) if total_denominador else 0.0
+
+    return agregado
+
+
+def resumir_tabela(
+    colunas,
+    linhas,
+    metrica: str,
+    colunas_dimensao=(),
+    top_k: int = TOP_K_PADRAO,
+    orcamento_linhas: int = None,
+    orcamento_bytes: int = None,
+    aditivas=None,
+    ponderadas=None,
+    razoes=None
+) -> dict:
+    """
+    Resume uma tabela em top-K + "outros" com participação no total.
+
+    Args:
+        colunas: Nomes das colunas
+        linhas: Linhas com métricas numéricas, alinhadas com colunas
+        metrica: Métrica usada no ranking e na participação
+        colunas_dimensao: Colunas de dimensão (recebem o rótulo "(outros)" no bucket da cauda)
+        top_k: Quantidade máxima de linhas no topo
+        orcamento_linhas: Máximo de linhas no resumo, incluindo o bucket "outros"
+        orcamento_bytes: Tamanho máximo do resumo serializado em JSON
+        aditivas: Métricas somáveis (padrão: todas as não-dimensões)
+        ponderadas: Médias ponderadas recalculadas no bucket "outros"
+        razoes: Razões recalculadas no bucket "outros"
+
+    Returns:
+        dict: Métrica de ranking, totais, linhas do topo, bucket "outros" e indicação de corte
+    """
+    colunas = list(colunas)
+    if metrica not in colunas:
+        raise ValueError(f"Métrica de ranking '{metrica}' não está entre as colunas: {', '.join(colunas)}")
+
+    dimensoes = list(colunas_dimensao)
+    metricas = [c for c in colunas if c not in dimensoes]
+    if aditivas is None:
+        aditivas = [c for c in metricas if c not in (ponderadas or {}) and c not in (razoes or {})]
+
+    i_metrica = colunas.index(metrica)
+    total = len(linhas)
+    totais = agregar_linhas(colunas, linhas, aditivas, ponderadas, razoes)
+    # Participação só faz sentido para métricas somáveis (não para taxas e médias)
+    total_metrica = totais.get(metrica) if metrica in aditivas else None
+
+    # Heap mantém só os K maiores índices: O(n log K) em vez de ordenar tudo
+    k = max(0, min(top_k, total))
+    if orcamento_linhas is not None and total > k:
+        k = max(0, min(k, orcamento_linhas - 1))
+    elif orcamento_linhas is not None:
+        k = max(0, min(k, orcamento_linhas))
+
+    ordenados = heapq.nlargest(k, range(total), key=lambda i: linhas[i][i_metrica])
+
+    def montar(quantidade):
+        escolhidos = ordenados[:quantidade]
+        top = []
+        for i in escolhidos:
+            registro = dict(zip(colunas, linhas[i]))
+            if total_metrica is not None:
+                registro["participacao"] = percentual(linhas[i][i_metrica], total_metrica)
+            top.append(registro)
+
+        outros = None
+        # O bucket "outros" também conta no orçamento de linhas: com orçamento 0, fica de fora
+        if quantidade < total and orcamento_linhas != 0:
+            usados = set(escolhidos)
+            cauda = [linha for i, linha in enumerate(linhas) if i not in usados]
+            outros = {dimensao: ROTULO_OUTROS for dimensao in dimensoes}
+            outros.update(agregar_linhas(colunas, cauda, aditivas, ponderadas, razoes))
+            if total_metrica is not None:
+                outros["participacao"] = percentual(outros[metrica], total_metrica)
+            outros["linhas_agrupadas"] = len(cauda)
+
+        return {
+            "metrica_ranking": metrica,
+            "total_linhas": total,
+            "totais": totais,
+            "top": top,
+            "outros": outros,
+            "truncado_por_orcamento": quantidade < min(top_k, total)
+        }
+
+    resumo = montar(k)
+    if orcamento_bytes is not None:
+        # Busca binária pelo maior K que cabe no orçamento de bytes
+        baixo, alto = 0, k
+        while baixo < alto:
+            meio = (baixo + alto + 1) // 2
+            if len(serializar_json(montar(meio))) <= orcamento_bytes:
+                baixo = meio
+            else:
+                alto = meio - 1
+        if baixo != k:
+            resumo = montar(baixo)
+
+    return resumo
+
+
+def normalizar_metricas(linhas, colunas, colunas_dimensao) -> list[list]:
+    """Converte as colunas de métrica (strings vindas do GA4) em números."""
+    dimensoes = set(colunas_dimensao)
+    indices = [i for i, coluna in enumerate(colunas) if coluna not in dimensoes]
+    convertidas = []
+    for linha in linhas:
+        linha = list(linha)
+        for i in indices:
+            linha[i] = converter_numero(linha[i])
+        convertidas.append(linha)
+    return convertidas
@@ -0,0 +1,435 @@
+"""
+Tabelas já consultadas, guardadas para novos recortes sem voltar ao serviço.
+
+Depois de uma consulta ampla, perguntas como "só Brasil", "ordene por
+cliques" ou "agrupe por dispositivo" são respondidas sobre a tabela em
+memória: cada resposta traz um tabela_id, e filtros, agrupamentos,
+agregações e ordenação são feitos localmente, sem gastar cota.
+
+As colunas ficam em formato colunar: dimensões codificadas por dicionário
+(um código inteiro por linha) e métricas como arrays numéricos. Com numpy
+as operações são vetorizadas; sem ele, as mesmas operações usam listas.
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:  # numpy é opcional; sem ele as operações usam listas
+    np = None
+
+from agents.columnar import LAYOUT_COLUNAR, converter_numero, montar_colunar
+from agents.summary import metrica_aditiva
+
+TABELAS_TTL_SEGUNDOS = int(os.getenv("TABELAS_TTL_SEGUNDOS", "1800"))
+TABELAS_MAX = int(os.getenv("TABELAS_MAX", "100"))
+# Soma das linhas de todas as tabelas guardadas
+TABELAS_MAX_LINHAS = int(os.getenv("TABELAS_MAX_LINHAS", "2000000"))
+LIMITE_PADRAO = 100
+
+OPERADORES = ("igual", "diferente", "contem", "começa com", "em", "maior", "maior_igual", "menor", "menor_igual")
+OPERADORES_NUMERICOS = ("maior", "maior_igual", "menor", "menor_igual")
+# "ponderada" e "razao" valem para as métricas que a origem sabe recalcular (ex: posição e CTR)
+FUNCOES_AGREGACAO = ("soma", "media", "min", "max", "contagem", "ponderada", "razao")
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"TABLES DEBUG: {message}", file=sys.stderr)
+
+
+class TabelaLocal:
+    """Tabela colunar: dimensões codificadas por dicionário e métricas numéricas."""
+
+    def __init__(self, colunas, colunas_dimensao, linhas, ponderadas=None, razoes=None):
+        self.colunas = list(colunas)
+        self.total_linhas = len(linhas)
+        self.ponderadas = dict(ponderadas or {})
+        self.razoes = dict(razoes or {})
+        self.dimensoes = {}
+        self.metricas = {}
+
+        dimensoes = set(colunas_dimensao)
+        for i, coluna in enumerate(self.colunas):
+            brutos = [linha[i] for linha in linhas]
+            numeros = None if coluna in dimensoes else [converter_numero(v) for v in brutos]
+            if numeros is not None and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in numeros):
+                self.metricas[coluna] = np.asarray(numeros) if np is not None else numeros
+                continue
+            # Colunas de métrica com texto (ex: "(not set)") também viram dimensão
+            distintos = {}
+            codigos = [distintos.setdefault(v, len(distintos)) for v in brutos]
+            self.dimensoes[coluna] = (np.asarray(codigos, dtype=np.int32) if np is not None else codigos, list(distintos))
+
+    def valores(self, coluna: str, indices=None) -> list:
+        """Valores decodificados da coluna, nas linhas indicadas (todas se None)."""
+        if coluna in self.dimensoes:
+            codigos, dicionario = self.dimensoes[coluna]
+            codigos = selecionar(codigos, indices)
+            return [dicionario[c] for c in (codigos.tolist() if np is not None else codigos)]
+        valores = selecionar(self.metricas[coluna], indices)
+        return valores.tolist() if np is not None else list(valores)
+
+    def descricao(self) -> dict:
+        return {
+            "colunas": self.colunas,
+            "dimensoes": [c for c in self.colunas if c in self.dimensoes],
+            "metricas": [c for c in self.colunas if c in self.metricas],
+            "total_linhas": self.total_linhas
+        }
+
+
+def selecionar(valores, indices):
+    """Subconjunto de uma coluna pelos índices (array numpy ou lista)."""
+    if indices is None:
+        return valores
+    if np is not None:
+        return valores[indices]
+    return [valores[i] for i in indices]
+
+
+def mascara_filtro(tabela: TabelaLocal, filtro: dict):
+    """Linhas que atendem ao filtro {"campo", "operador", "valor"}, como máscara booleana."""
+    campo = filtro.get("campo")
+    operador = filtro.get("operador", "igual")
+    valor = filtro.get("valor")
+    if campo not in tabela.colunas:
+        raise ValueError(f"Campo de filtro inexistente: '{campo}'")
+    if operador not in OPERADORES:
+        raise ValueError(f"Operador inválido: '{operador}'. Use um de: {', '.join(OPERADORES)}")
+
+    if campo in tabela.dimensoes:
+        # A condição é avaliada uma vez por valor distinto e aplicada aos códigos
+        if operador in OPERADORES_NUMERICOS:
+            raise ValueError(f"Operador '{operador}' só vale para métricas; '{campo}' é uma dimensão")
+        codigos, dicionario = tabela.dimensoes[campo]
+        texto = str(valor).lower()
+        lista = {str(x).lower() for x in valor} if isinstance(valor, list) else {texto}
+        aceitos = {
+            "igual": lambda v: str(v).lower() == texto,
+            "diferente": lambda v: str(v).lower() != texto,
+            "contem": lambda v: texto in str(v).lower(),
+            "começa com": lambda v: str(v).lower().startswith(texto),
+            "em": lambda v: str(v).lower() in lista
+        }[operador]
+        validos = [i for i, v in enumerate(dicionario) if aceitos(v)]
+        if np is not None:
+            return np.isin(codigos, np.asarray(validos, dtype=np.int32))
+        validos = set(validos)
+        return [c in validos for c in codigos]
+
+    valores = tabela.metricas[campo]
+    if operador in ("contem", "começa com"):
+        raise ValueError(f"Operador '{operador}' só vale para dimensões; '{campo}' é uma métrica")
+    if operador == "em":
+        alvos = [converter_numero(v) for v in (valor or [])]
+        return np.isin(valores, alvos) if np is not None else [v in alvos for v in valores]
+    alvo = converter_numero(valor)
+    if not isinstance(alvo, (int, float)):
+        raise ValueError(f"Valor numérico esperado para '{campo}': '{valor}'")
+    if np is not None:
+        return {
+            "igual": valores == alvo, "diferente": valores != alvo,
+            "maior": valores > alvo, "maior_igual": valores >= alvo,
+            "menor": valores < alvo, "menor_igual": valores <= alvo
+        }[operador]
+    comparar = {
+        "igual": lambda v: v == alvo, "diferente": lambda v: v != alvo,
+        "maior": lambda v: v > alvo, "maior_igual": lambda v: v >= alvo,
+        "menor": lambda v: v < alvo, "menor_igual": lambda v: v <= alvo
+    }[operador]
+    return [comparar(v) for v in valores]
+
+
+def indices_filtrados(tabela: TabelaLocal, filtros) -> object:
+    """Índices das linhas que atendem a todos os filtros (None = todas)."""
+    if not filtros:
+        return None
+    if np is not None:
+        mascara = np.ones(tabela.total_linhas, dtype=bool)
+        for filtro in filtros:
+            mascara &= mascara_filtro(tabela, filtro)
+        return np.flatnonzero(mascara)
+    mascara = [True] * tabela.total_linhas
+    for filtro in filtros:
+        mascara = [a and b for a, b in zip(mascara, mascara_filtro(tabela, filtro))]
+    return [i for i, ok in enumerate(mascara) if ok]
+
+
+def agregacoes_padrao(tabela: TabelaLocal, agrupar_por) -> list[dict]:
+    """Soma as métricas aditivas, pondera/recalcula as demais quando possível, senão média."""
+    agregacoes = []
+    for coluna in tabela.colunas:
+        if coluna not in tabela.metricas or coluna in agrupar_por:
+            continue
+        if coluna in tabela.ponderadas:
+            funcao = "ponderada"
+        elif coluna in tabela.razoes:
+            funcao = "razao"
+        else:
+            funcao = "soma" if metrica_aditiva(coluna) else "media"
+        agregacoes.append({"campo": coluna, "funcao": funcao})
+    return agregacoes
+
+
+def agrupar(tabela: TabelaLocal, indices, agrupar_por, agregacoes):
+    """
+    Agrupa as linhas selecionadas e calcula as agregações de cada grupo.
+
+    Returns:
+        tuple: (colunas, valores de cada coluna) do resultado agrupado, um item por grupo
+    """
+    for coluna in agrupar_por:
+        if coluna not in tabela.dimensoes:
+            raise ValueError(f"Só é possível agrupar por dimensões: '{coluna}'")
+    for agregacao in agregacoes:
+        funcao = agregacao.get("funcao", "soma")
+        campo = agregacao.get("campo")
+        if funcao not in FUNCOES_AGREGACAO:
+            raise ValueError(f"Função de agregação inválida: '{funcao}'. Use uma de: {', '.join(FUNCOES_AGREGACAO)}")
+        if funcao != "contagem" and campo not in tabela.metricas:
+            raise ValueError(f"Agregação precisa de uma métrica: '{campo}'")
+        if (funcao == "ponderada" and campo not in tabela.ponderadas) or (funcao == "razao" and campo not in tabela.razoes):
+            raise ValueError(f"'{campo}' não pode ser agregada com '{funcao}'")
+
+    # Cada grupo é uma combinação dos códigos das dimensões de agrupamento
+    codigos = [selecionar(tabela.dimensoes[c][0], indices) for c in agrupar_por]
+    total = tabela.total_linhas if indices is None else len(indices)
+    tamanhos = [len(tabela.dimensoes[c][1]) for c in agrupar_por]
+    if np is not None and math.prod(tamanhos) < 2 ** 62:
+        # Os códigos de cada linha viram um único inteiro, agrupado com np.unique em 1D
+        chave = np.zeros(total, dtype=np.int64)
+        for tamanho, coluna in zip(tamanhos, codigos):
+            chave = chave * tamanho + coluna
+        unicos, grupo = np.unique(chave, return_inverse=True)
+        grupo = grupo.reshape(-1)
+        total_grupos = len(unicos)
+        codigos_grupos = []
+        for tamanho in reversed(tamanhos):
+            codigos_grupos.insert(0, (unicos % tamanho).tolist())
+            unicos = unicos // tamanho
+    elif np is not None:
+        unicos, grupo = np.unique(np.column_stack(codigos), axis=0, return_inverse=True)
+        grupo = grupo.reshape(-1)
+        total_grupos = len(unicos)
+        codigos_grupos = [coluna.tolist() for coluna in unicos.T]
+    else:
+        posicao = {}
+        grupo = [posicao.setdefault(chave, len(posicao)) for chave in zip(*codigos)] if codigos else [0] * total
+        total_grupos = len(posicao) if codigos else int(total > 0)
+        codigos_grupos = [list(coluna) for coluna in zip(*posicao)] if posicao else [[] for _ in agrupar_por]
+
+    def somar(valores=None):
+        if np is not None:
+            pesos = None if valores is None else np.asarray(valores, dtype=float)
+            return np.bincount(grupo, weights=pesos, minlength=total_grupos).tolist()
+        somas = [0] * total_grupos
+        for g, v in zip(grupo, valores if valores is not None else [1] * total):
+            somas[g] += v
+        return somas
+
+    def coluna_metrica(coluna):
+        return selecionar(tabela.metricas[coluna], indices)
+
+    def produto(a, b):
+        return a * b if np is not None else [x * y for x, y in zip(a, b)]
+
+    contagens = somar()
+    resultados = {}
+    for agregacao in agregacoes:
+        funcao = agregacao.get("funcao", "soma")
+        campo = agregacao.get("campo")
+        nome = f"{funcao}_{campo}" if funcao in ("media", "min", "max") else (campo if campo and funcao != "contagem" else "contagem")
+        if funcao == "contagem":
+            valores = contagens
+        elif funcao == "soma":
+            valores = somar(coluna_metrica(campo))
+        elif funcao == "media":
+            valores = [s / c if c else 0.0 for s, c in zip(somar(coluna_metrica(campo)), contagens)]
+        elif funcao == "ponderada":
+            peso = tabela.ponderadas[campo]
+            pesos = somar(coluna_metrica(peso))
+            ponderados = somar(produto(coluna_metrica(campo), coluna_metrica(peso)))
+            valores = [round(s / p, 2) if p else 0.0 for s, p in zip(ponderados, pesos)]
+        elif funcao == "razao":
+            numerador, denominador = tabela.razoes[campo]
+            valores = [round(n / d, 4) if d else 0.0 for n, d in zip(somar(coluna_metrica(numerador)), somar(coluna_metrica(denominador)))]
+        else:
+            valores = extremos(grupo, coluna_metrica(campo), total_grupos, minimo=funcao == "min")
+        resultados[nome] = [inteiro_se_possivel(v) for v in (valores.tolist() if hasattr(valores, "tolist") else valores)]
+
+    dimensoes = [
+        [tabela.dimensoes[coluna][1][codigo] for codigo in codigos_coluna]
+        for coluna, codigos_coluna in zip(agrupar_por, codigos_grupos)
+    ]
+    return list(agrupar_por) + list(resultados), dimensoes + list(resultados.values())
+
+
+def extremos(grupo, valores, total_grupos: int, minimo: bool) -> list:
+    """Mínimo ou máximo de cada grupo."""
+    if np is not None:
+        saida = np.full(total_grupos, np.inf if minimo else -np.inf)
+        (np.minimum if minimo else np.maximum).at(saida, grupo, np.asarray(valores, dtype=float))
+        return saida
+    saida = [None] * total_grupos
+    escolher = min if minimo else max
+    for g, v in zip(grupo, valores):
+        saida[g] = v if saida[g] is None else escolher(saida[g], v)
+    return saida
+
+
+def inteiro_se_possivel(valor):
+    """Somas de contagens voltam como inteiros (bincount trabalha com float)."""
+    if isinstance(valor, float) and valor.is_integer() and abs(valor) < 2 ** 53:
+        return int(valor)
+    return valor
+
+
+def ordem_grupos(colunas, valores, ordenar_por: str, ordem: str = "desc") -> list[int]:
+    """Posições dos grupos na ordem pedida pela coluna indicada."""
+    if ordenar_por not in colunas:
+        raise ValueError(f"Coluna de ordenação inexistente: '{ordenar_por}'")
+    chave = valores[colunas.index(ordenar_por)]
+    return sorted(range(len(chave)), key=chave.__getitem__, reverse=ordem != "asc")
+
+
+def ordem_indices(tabela: TabelaLocal, indices, ordenar_por: str, ordem: str = "desc"):
+    """Índices das linhas selecionadas na ordem pedida, sem decodificar a tabela inteira."""
+    if ordenar_por not in tabela.colunas:
+        raise ValueError(f"Coluna de ordenação inexistente: '{ordenar_por}'")
+    if ordenar_por in tabela.dimensoes:
+        codigos, dicionario = tabela.dimensoes[ordenar_por]
+        # Posição de cada valor distinto na ordem alfabética, aplicada aos códigos
+        alfabetica = sorted(range(len(dicionario)), key=lambda c: str(dicionario[c]))
+        posicoes = [0] * len(dicionario)
+        for p, codigo in enumerate(alfabetica):
+            posicoes[codigo] = p
+        chave = np.asarray(posicoes)[codigos] if np is not None else [posicoes[c] for c in codigos]
+    else:
+        chave = tabela.metricas[ordenar_por]
+    if indices is None:
+        indices = np.arange(tabela.total_linhas) if np is not None else list(range(tabela.total_linhas))
+    if np is not None:
+        valores = np.asarray(chave)[indices]
+        ordenados = np.argsort(-valores if ordem != "asc" else valores, kind="stable")
+        return indices[ordenados]
+    return sorted(indices, key=lambda i: chave[i], reverse=ordem != "asc")
+
+
+def consultar_tabela(tabela: TabelaLocal, consulta: dict, layout: str = "linhas") -> dict:
+    """
+    Filtra, agrupa, agrega e ordena uma tabela local.
+
+    Args:
+        tabela: Tabela guardada
+        consulta: {"filtros", "agrupar_por", "agregacoes", "ordenar_por", "ordem", "limite"}
+        layout: Formato de "dados": "linhas" (padrão) ou "columnar"
+
+    Returns:
+        dict: Colunas, linhas filtradas/agrupadas (até o limite) e total antes do limite
+    """
+    filtros = consulta.get("filtros") or []
+    agrupar_por = consulta.get("agrupar_por") or []
+    agregacoes = consulta.get("agregacoes") or []
+    ordenar_por = consulta.get("ordenar_por")
+    ordem = consulta.get("ordem", "desc")
+    limite = int(consulta.get("limite", LIMITE_PADRAO))
+    if isinstance(agrupar_por, str):
+        agrupar_por = [agrupar_por]
+    if ordem not in ("asc", "desc"):
+        raise ValueError("ordem deve ser 'asc' ou 'desc'")
+
+    indices = indices_filtrados(tabela, filtros)
+
+    if agrupar_por or agregacoes:
+        colunas, valores = agrupar(tabela, indices, agrupar_por, agregacoes or agregacoes_padrao(tabela, agrupar_por))
+        total = len(valores[0]) if valores else 0
+        posicoes = ordem_grupos(colunas, valores, ordenar_por, ordem) if ordenar_por else range(total)
+        # Só os grupos dentro do limite viram linhas
+        linhas = [tuple(coluna[g] for coluna in valores) for g in posicoes[:limite]]
+    else:
+        colunas = tabela.colunas
+        if ordenar_por:
+            indices = ordem_indices(tabela, indices, ordenar_por, ordem)
+        total = tabela.total_linhas if indices is None else len(indices)
+        selecionados = indices[:limite] if indices is not None else (np.arange(min(limite, total)) if np is not None else list(range(min(limite, total))))
+        linhas = list(zip(*(tabela.valores(coluna, selecionados) for coluna in colunas)))
+
+    if layout == LAYOUT_COLUNAR:
+        dados = montar_colunar(colunas, linhas, colunas_dimensao=[c for c in colunas if c in tabela.dimensoes])
+    else:
+        dados = [dict(zip(colunas, linha)) for linha in linhas]
+    return {
+        "colunas": list(colunas),
+        "total_resultados": total,
+        "dados": dados
+    }
+
+
+class ArmazemTabelas:
+    """Tabelas locais por tabela_id, com expiração e limite total de linhas (LRU)."""
+
+    def __init__(self, ttl_segundos: int = TABELAS_TTL_SEGUNDOS, max_tabelas: int = TABELAS_MAX,
+                 max_linhas: int = TABELAS_MAX_LINHAS):
+        self.ttl_segundos = ttl_segundos
+        self.max_tabelas = max_tabelas
+        self.max_linhas = max_linhas
+        self._lock = threading.Lock()
+        self._tabelas = OrderedDict()
+        self._linhas = 0
+
+    def guardar(self, tabela_id: str, tabela: TabelaLocal, tenant: str = None, origem: dict = None) -> bool:
+        """Guarda a tabela; tabelas maiores que o limite total não são guardadas."""
+        if tabela.total_linhas > self.max_linhas:
+            log_debug(f"Tabela {tabela_id} com {tabela.total_linhas} linhas excede o limite; não guardada")
+            return False
+        with self._lock:
+            self._remover(tabela_id)
+            self._tabelas[tabela_id] = {
+                "tabela": tabela,
+                "tenant": tenant or "",
+                "origem": origem or {},
+                "expira_em": time.time() + self.ttl_segundos
+            }
+            self._linhas += tabela.total_linhas
+            while len(self._tabelas) > self.max_tabelas or self._linhas > self.max_linhas:
+                self._remover(next(iter(self._tabelas)))
+        return True
+
+    def _remover(self, tabela_id: str):
+        """Remove uma tabela (chamar com o lock)."""
+        entrada = self._tabelas.pop(tabela_id, None)
+        if entrada is not None:
+            self._linhas -= entrada["tabela"].total_linhas
+
+    def obter(self, tabela_id: str, tenant: str = None):
+        """Entrada da tabela, ou None se ausente, expirada ou de outro tenant."""
+        with self._lock:
+            entrada = self._tabelas.get(tabela_id)
+            if entrada is None or entrada["tenant"] != (tenant or ""):
+                return None
+            if entrada["expira_em"] < time.time():
+                self._remover(tabela_id)
+                return None
+            self._tabelas.move_to_end(tabela_id)
+            return entrada
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "tabelas": len(self._tabelas),
+                "linhas": self._linhas,
+                "max_tabelas": self.max_tabelas,
+                "max_linhas": self.max_linhas,
+                "ttl_segundos": self.ttl_segundos,
+                "vetorizado": np is not None
+            }
+
+
+# Instância compartilhada pelas rotas de consulta e de recorte local
+armazem_tabelas = ArmazemTabelas()
@@ -0,0 +1,338 @@
+"""
+Análise de séries diárias no servidor: tendência, anomalias e variações.
+
+Para achar quedas de tráfego, o GPT pedia séries por "date" e raciocinava
+sobre centenas de linhas de texto. Aqui a série diária já buscada é
+analisada de uma vez (média móvel, semana contra semana, ano contra ano,
+anomalias por z-score ou sazonais e os itens que mais contribuíram para a
+variação) e só o resumo volta na resposta, não a série.
+
+Dias sem dados valem 0 nas métricas somáveis; nas taxas e médias (CTR,
+posição, bounceRate) ficam vazios (NaN) e não entram nas médias, na
+tendência nem nas anomalias.
+
+Com numpy as operações são vetorizadas; sem ele, as mesmas contas usam listas.
+"""
+
+import math
+import re
+import sys
+from datetime import date, datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # numpy é opcional; sem ele as operações usam listas
+    np = None
+
+METODOS_ANOMALIA = ("sazonal", "zscore")
+# Semanas anteriores (mesmo dia da semana) que formam a base do método sazonal
+SEMANAS_BASE_SAZONAL = 4
+JANELA_ZSCORE = 28
+LIMIAR_Z_PADRAO = 3.0
+MAX_ANOMALIAS = 10
+# Deslocamento do ano anterior que mantém o dia da semana
+DIAS_ANO_ALINHADO = 364
+MAX_DIAS_SERIE = 1100
+# Métricas do Search Console aceitas (nome da API ou nome da coluna) e se são somáveis
+METRICAS_SEARCH_CONSOLE = {"clicks": "Cliques", "impressions": "Impressões", "ctr": "CTR", "position": "Posição Média"}
+METRICAS_SEARCH_CONSOLE_ADITIVAS = ("Cliques", "Impressões")
+# O Search Console publica os dados com 2 a 3 dias de atraso
+ATRASO_SEARCH_CONSOLE_DIAS = 3
+
+
+def log_debug(message):
+    """Função para log de depuração."""
+    print(f"TIMESERIES DEBUG: {message}", file=sys.stderr)
+
+
+def resolver_data(valor: str, hoje: date = None) -> date:
+    """Converte 'today', 'yesterday', 'NdaysAgo' ou 'YYYY-MM-DD' (ou 'YYYYMMDD') em date."""
+    hoje = hoje or date.today()
+    valor = (valor or "").strip()
+    if valor == "today":
+        return hoje
+    if valor == "yesterday":
+        return hoje - timedelta(days=1)
+    relativo = re.fullmatch(r"(\d+)daysAgo", valor)
+    if relativo:
+        return hoje - timedelta(days=int(relativo.group(1)))
+    return datetime.strptime(valor.replace("-", ""), "%Y%m%d").date()
+
+
+def preencher_serie(pontos: dict, inicio: date, fim: date, aditiva: bool = True) -> list[float]:
+    """
+    Valores diários de inicio a fim.
+
+    Dias sem dados (que as APIs omitem) valem 0 nas métricas somáveis; em
+    taxas e médias um dia sem dados não é zero, e fica NaN.
+    """
+    vazio = 0.0 if aditiva else math.nan
+    return [float(pontos.get(inicio + timedelta(days=i), vazio)) for i in range((fim - inicio).days + 1)]
+
+
+def fim_com_dados(pontos: dict, inicio: date, fim: date, atraso_dias: int, hoje: date = None) -> date:
+    """
+    Último dia a analisar: dias finais sem dados dentro da janela de atraso da fonte saem da série.
+
+    Esses dias ainda não foram publicados; contados como 0, virariam uma falsa queda.
+    """
+    hoje = hoje or date.today()
+    while fim > inicio and fim >= hoje - timedelta(days=atraso_dias) and fim not in pontos:
+        fim -= timedelta(days=1)
+    return fim
+
+
+def _presentes(valores) -> list:
+    """Valores do trecho sem os dias vazios (NaN)."""
+    return [v for v in valores if not math.isnan(v)]
+
+
+def _arredondar(valor, casas: int = 4):
+    """round() que mantém None e troca NaN por None (a resposta é JSON)."""
+    if valor is None or math.isnan(valor):
+        return None
+    return round(float(valor), casas)
+
+
+def agregar(valores, aditiva: bool):
+    """Soma (métricas somáveis) ou média (taxas e médias) dos dias com dados de um trecho da série (None se não houver)."""
+    if np is not None:
+        serie = np.asarray(valores, dtype=float)
+        valores = serie[~np.isnan(serie)]
+        total = float(valores.sum())
+    else:
+        valores = _presentes(valores)
+        total = float(sum(valores))
+    if not len(valores):
+        return 0.0 if aditiva else None
+    return total if aditiva else total / len(valores)
+
+
+def variacao(atual, anterior) -> dict:
+    """Valor atual, anterior, diferença e diferença percentual (None se o anterior for 0 ou faltar)."""
+    comparavel = atual is not None and anterior is not None
+    return {
+        "atual": _arredondar(atual),
+        "anterior": _arredondar(anterior),
+        "delta": round(atual - anterior, 4) if comparavel else None,
+        "delta_pct": round((atual - anterior) * 100.0 / anterior, 2) if comparavel and anterior else None
+    }
+
+
+def media_movel(valores, janela: int) -> list:
+    """Média dos dias com dados entre os últimos `janela` dias (None nos primeiros janela - 1 dias ou sem dados)."""
+    total = len(valores)
+    if janela > total:
+        return [None] * total
+    if np is not None:
+        serie = np.asarray(valores, dtype=float)
+        presentes = ~np.isnan(serie)
+        somas = np.concatenate(([0.0], np.cumsum(np.where(presentes, serie, 0.0))))
+        contagens = np.concatenate(([0], np.cumsum(presentes)))
+        somas, contagens = (somas[janela:] - somas[:-janela]).tolist(), (contagens[janela:] - contagens[:-janela]).tolist()
+        return [None] * (janela - 1) + [soma / n if n else None for soma, n in zip(somas, contagens)]
+    medias, soma, n = [None] * (janela - 1), 0.0, 0
+    for i, valor in enumerate(valores):
+        if not math.isnan(valor):
+            soma, n = soma + valor, n + 1
+        if i >= janela and not math.isnan(valores[i - janela]):
+            soma, n = soma - valores[i - janela], n - 1
+        if i >= janela - 1:
+            medias.append(soma / n if n else None)
+    return medias
+
+
+def tendencia(valores) -> dict:
+    """Inclinação da reta de mínimos quadrados (só dias com dados), por dia e em % da média por semana."""
+    if np is not None:
+        y = np.asarray(valores, dtype=float)
+        x = np.arange(len(y), dtype=float)
+        presentes = ~np.isnan(y)
+        x, y = x[presentes], y[presentes]
+        total = len(y)
+    else:
+        pontos = [(i, v) for i, v in enumerate(valores) if not math.isnan(v)]
+        total = len(pontos)
+    if total < 2:
+        return {"inclinacao_por_dia": 0.0, "variacao_semanal_pct": None, "direcao": "estavel"}
+    if np is not None:
+        media = float(y.mean())
+        inclinacao = float(np.dot(x - x.mean(), y - media) / np.dot(x - x.mean(), x - x.mean()))
+    else:
+        media_x, media = sum(i for i, _ in pontos) / total, sum(v for _, v in pontos) / total
+        inclinacao = sum((i - media_x) * (v - media) for i, v in pontos) / sum((i - media_x) ** 2 for i, _ in pontos)
+    semanal = inclinacao * 7 * 100.0 / media if media else None
+    direcao = "estavel" if semanal is None or abs(semanal) < 1 else ("alta" if semanal > 0 else "queda")
+    return {
+        "inclinacao_por_dia": round(inclinacao, 4),
+        "variacao_semanal_pct": round(semanal, 2) if semanal is not None else None,
+        "direcao": direcao
+    }
+
+
+def _bases(valores, metodo: str):
+    """
+    Primeiro dia avaliado e, para cada dia a partir dele, (média, desvio) da base de comparação.
+
+    Sazonal: o mesmo dia da semana nas SEMANAS_BASE_SAZONAL semanas anteriores.
+    z-score: os JANELA_ZSCORE dias anteriores.
+    Dias vazios ficam fora da base; uma base sem nenhum dia com dados vale NaN.
+    """
+    total = len(valores)
+    if metodo == "sazonal":
+        inicio = 7 * SEMANAS_BASE_SAZONAL
+        deslocamentos = [7 * k for k in range(1, SEMANAS_BASE_SAZONAL + 1)]
+    else:
+        inicio = JANELA_ZSCORE
+        deslocamentos = list(range(1, JANELA_ZSCORE + 1))
+    if total <= inicio:
+        return inicio, [], []
+    if np is not None:
+        serie = np.asarray(valores, dtype=float)
+        base = np.stack([serie[inicio - d:total - d] for d in deslocamentos])
+        contagens = (~np.isnan(base)).sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            medias = np.nansum(base, axis=0) / contagens
+            desvios = np.sqrt(np.nansum((base - medias) ** 2, axis=0) / contagens)
+        return inicio, medias, desvios
+    medias, desvios = [], []
+    for t in range(inicio, total):
+        base = _presentes([valores[t - d] for d in deslocamentos])
+        media = sum(base) / len(base) if base else math.nan
+        medias.append(media)
+        desvios.append(math.sqrt(sum((v - media) ** 2 for v in base) / len(base)) if base else math.nan)
+    return inicio, medias, desvios
+
+
+def anomalias(datas: list[date], valores, metodo: str = "sazonal", limiar: float = LIMIAR_Z_PADRAO,
+              max_itens: int = MAX_ANOMALIAS) -> dict:
+    """
+    Dias cujo valor se afasta da base em mais de `limiar` desvios, do maior |z| para o menor.
+
+    O desvio tem um piso de 1% da média da base, para que uma base quase
+    constante não transforme qualquer oscilação em anomalia. Dias vazios, ou
+    sem nenhum dia com dados na base, não são avaliados.
+    """
+    inicio, medias, desvios = _bases(valores, metodo)
+    encontradas = []
+    avaliados = 0
+    if len(medias):
+        if np is not None:
+            atuais = np.asarray(valores[inicio:], dtype=float)
+            medias = np.asarray(medias)
+            escala = np.maximum(np.asarray(desvios), np.maximum(np.abs(medias) * 0.01, 1e-9))
+            z = (atuais - medias) / escala
+            avaliados = int(np.count_nonzero(~np.isnan(z)))
+            with np.errstate(invalid="ignore"):
+                candidatos = np.flatnonzero(np.abs(z) >= limiar)
+            ordem = candidatos[np.argsort(-np.abs(z[candidatos]), kind="stable")]
+            z, medias, indices = z.tolist(), medias.tolist(), ordem.tolist()
+        else:
+            z = [
+                (valores[inicio + i] - media) / max(desvio, abs(media) * 0.01, 1e-9)
+                if not (math.isnan(media) or math.isnan(valores[inicio + i])) else math.nan
+                for i, (media, desvio) in enumerate(zip(medias, desvios))
+            ]
+            avaliados = len(_presentes(z))
+            indices = sorted((i for i, valor in enumerate(z) if abs(valor) >= limiar), key=lambda i: -abs(z[i]))
+        for i in indices[:max_itens]:
+            encontradas.append({
+                "data": datas[inicio + i].isoformat(),
+                "valor": round(float(valores[inicio + i]), 4),
+                "esperado": round(medias[i], 4),
+                "z": round(z[i], 2),
+                "direcao": "alta" if z[i] > 0 else "queda"
+            })
+    return {
+        "metodo": metodo,
+        "limiar_z": limiar,
+        "dias_avaliados": avaliados,
+        "total": len(indices) if len(medias) else 0,
+        "dias": encontradas
+    }
+
+
+def resumo_semanal(datas: list[date], valores, aditiva: bool) -> list[dict]:
+    """Série agregada em semanas de 7 dias contadas a partir do fim (a mais antiga pode ser parcial)."""
+    semanas = []
+    fim = len(valores)
+    while fim > 0:
+        inicio = max(0, fim - 7)
+        semanas.append({"inicio": datas[inicio].isoformat(), "dias": fim - inicio, "valor": _arredondar(agregar(valores[inicio:fim], aditiva))})
+        fim = inicio
+    return semanas[::-1]
+
+
+def contribuintes(atual: dict, anterior: dict, top: int = 10) -> dict:
+    """
+    Itens de uma dimensão que mais explicam a variação entre dois períodos.
+
+    Args:
+        atual: {valor da dimensão: métrica no período atual}
+        anterior: {valor da dimensão: métrica no período anterior}
+        top: Quantos itens retornar, pela maior variação absoluta
+    """
+    chaves = list(set(atual) | set(anterior))
+    if np is not None and chaves:
+        deltas = np.asarray([atual.get(c, 0.0) for c in chaves], dtype=float) - np.asarray([anterior.get(c, 0.0) for c in chaves], dtype=float)
+        total = float(deltas.sum())
+        ordem = np.argsort(-np.abs(deltas), kind="stable")[:top].tolist()
+        deltas = deltas.tolist()
+    else:
+        deltas = [atual.get(c, 0.0) - anterior.get(c, 0.0) for c in chaves]
+        total = sum(deltas)
+        ordem = sorted(range(len(chaves)), key=lambda i: -abs(deltas[i]))[:top]
+    return {
+        "delta_total": round(total, 4),
+        "itens": [
+            {
+                "valor": chaves[i],
+                "atual": round(atual.get(chaves[i], 0.0), 4),
+                "anterior": round(anterior.get(chaves[i], 0.0), 4),
+                "delta": round(deltas[i], 4),
+                "participacao_pct": round(deltas[i] * 100.0 / total, 2) + 0.0 if total else None
+            }
+            for i in ordem
+        ],
+        "itens_restantes": max(0, len(chaves) - top)
+    }
+
+
+def analisar_serie(inicio: date, valores, aditiva: bool = True, janela_media: int = 7, metodo: str = "sazonal",
+                   limiar: float = LIMIAR_Z_PADRAO, max_anomalias: int = MAX_ANOMALIAS, ano_anterior=None) -> dict:
+    """
+    Resumo compacto de uma série diária completa (um valor por dia a partir de inicio).
+
+    Args:
+        inicio: Data do primeiro valor
+        valores: Valores diários (veja preencher_serie)
+        aditiva: Se a métrica é somada (senão, é feita a média) nas janelas e semanas
+        janela_media: Dias da média móvel
+        metodo: "sazonal" (mesmo dia da semana nas semanas anteriores) ou "zscore" (dias anteriores)
+        limiar: |z| a partir do qual um dia é anomalia
+        max_anomalias: Máximo de dias anômalos listados
+        ano_anterior: Valores dos 7 dias equivalentes (364 dias antes) aos 7 últimos da série, se buscados
+    """
+    datas = [inicio + timedelta(days=i) for i in range(len(valores))]
+    medias = media_movel(valores, janela_media)
+    validas = [(d, m) for d, m in zip(datas, medias) if m is not None]
+    ultimos, anteriores = valores[-7:], valores[-14:-7]
+
+    return {
+        "periodo": {"inicio": datas[0].isoformat(), "fim": datas[-1].isoformat(), "dias": len(valores)},
+        "agregacao": "soma" if aditiva else "media",
+        "valor_periodo": _arredondar(agregar(valores, aditiva)),
+        "ultimo_dia": {"data": datas[-1].isoformat(), "valor": _arredondar(valores[-1])},
+        "media_movel": {
+            "janela_dias": janela_media,
+            "atual": round(validas[-1][1], 4) if validas else None,
+            "ha_7_dias": round(medias[-8], 4) if len(medias) >= 8 and medias[-8] is not None else None,
+            "minima": {"data": min(validas, key=lambda v: v[1])[0].isoformat(), "valor": round(min(v[1] for v in validas), 4)} if validas else None,
+            "maxima": {"data": max(validas, key=lambda v: v[1])[0].isoformat(), "valor": round(max(v[1] for v in validas), 4)} if validas else None
+        },
+        "tendencia": tendencia(valores),
+        "semana_contra_semana": variacao(agregar(ultimos, aditiva), agregar(anteriores, aditiva)) if len(valores) >= 14 else None,
+        "ano_contra_ano": variacao(agregar(ultimos, aditiva), agregar(ano_anterior, aditiva)) if ano_anterior is not None else None,
+        "anomalias": anomalias(datas, valores, metodo, limiar, max_anomalias),
+        "semanas": resumo_semanal(datas, valores, aditiva)
+    }
@@ -1,10 +1,48 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, has_request_context, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import os
 import json
+import queue
+from contextlib import ExitStack
+from functools import wraps
 from datetime import datetime, timedelta
 import sys
 
+from agents.admission import ADMISSAO_PROXIES_CONFIAVEIS, Sobrecarga, controle_admissao
+from agents.batching import agrupador_relatorios
+from agents.cache import (
+    assinatura_consulta, cache_resultados, consultar_com_cache, contador_consultas, resultado_com_erro, resultado_vencido
+)
+from agents.resilience import UPSTREAM_PRAZO_SEGUNDOS, PrazoExcedido, chamadas_upstream
+from agents.prewarm import AgendadorPreaquecimento
+from agents.realtime import REALTIME_INTERVALO_SEGUNDOS, REALTIME_MAX_LINHAS, LimitePollers, gerenciador_realtime
+from agents.credentials import listar_tenants, pool_clientes, renovador_tokens, tenant_configurado
+from agents.metadata import cache_metadados_ga4, mensagem_campos_invalidos, validar_campos
+from agents.portfolio import PORTFOLIO_MAX_PROPRIEDADES, propriedades_da_conta, relatorio_portfolio
+from agents.sharding import UNIDADES_FATIA
+from agents.tables import TabelaLocal, armazem_tabelas, consultar_tabela
+from agents.jobs import FilaJobsCheia, STATUS_FINAIS, gerenciador_jobs
+from agents.planner import (
+    MODO_AUTOMATICO, MODO_JOB, MODO_STREAMING, MODOS_EXECUCAO, PLANO_LINHAS_POR_PAGINA, planejador_consultas
+)
+from agents.exports import FORMATOS, TIPOS_MIME, formatos_disponiveis, gerenciador_exportacoes
+from agents.columnar import LAYOUT_COLUNAR, LAYOUTS_VALIDOS, converter_numero, montar_colunar
+from agents.comparison import DIMENSAO_PERIODO, comparar_periodos, nomes_periodos, validar_periodos
+from agents.summary import TOP_K_PADRAO, metrica_aditiva, normalizar_metricas, resumir_tabela
+from agents.timeseries import (
+    ATRASO_SEARCH_CONSOLE_DIAS, DIAS_ANO_ALINHADO, LIMIAR_Z_PADRAO, MAX_ANOMALIAS, MAX_DIAS_SERIE,
+    METODOS_ANOMALIA, METRICAS_SEARCH_CONSOLE, METRICAS_SEARCH_CONSOLE_ADITIVAS, analisar_serie,
+    contribuintes, fim_com_dados, preencher_serie, resolver_data
+)
+from agents.responses import (
+    LIMIAR_COMPRESSAO,
+    serializar_json,
+    calcular_etag,
+    etag_corresponde,
+    escolher_codificacao,
+    comprimir
+)
+
 # Importar os módulos de agentes do projeto original
 # Só importa se não estiver no modo de teste
 if not os.environ.get('SKIP_GOOGLE_INIT'):
@@ -12,18 +50,266 @@ if not os.environ.get('SKIP_GOOGLE_INIT'):
         listar_contas_ga4, 
         consulta_ga4, 
         consulta_ga4_pivot,
+        interpretar_resultado_ga4,
+        obter_metadados_ga4,
+        consulta_ga4_realtime,
+        estimar_linhas_ga4,
+        paginas_relatorio_ga4,
         init_analytics_client
     )
     from agents.search_console import (
         listar_sites_search_console,
         consulta_search_console_custom,
         verificar_propriedade_site_search_console,
+        estimar_linhas_search_console,
+        paginas_search_console,
         init_search_console_service
     )
+    from agents.landing_pages import relatorio_landing_pages
 
 app = Flask(__name__)
 CORS(app)
 
+agendador_preaquecimento = AgendadorPreaquecimento()
+
+def funcoes_consulta():
+    """Funções de consulta por tipo, usadas pelo cache e pelo pré-aquecimento."""
+    return {
+        "ga4_query": consulta_ga4,
+        "ga4_pivot": consulta_ga4_pivot,
+        "search_console_query": consulta_search_console_custom,
+        "ga4_estimativa": estimar_linhas_ga4,
+        "search_console_estimativa": estimar_linhas_search_console
+    }
+
+# API do Google usada por cada tipo de consulta, para o controle de admissão
+API_POR_TIPO = {
+    "ga4_query": "ga4",
+    "ga4_pivot": "ga4",
+    "search_console_query": "search_console",
+    "ga4_estimativa": "ga4",
+    "search_console_estimativa": "search_console"
+}
+
+def executar_consulta(tipo, argumentos):
+    """
+    Executa a consulta passando pelo cache e contando o acesso para o pré-aquecimento.
+    
+    Dentro de uma requisição a consulta tem prazo, hedging, resultado vencido em
+    caso de falha e precisa de vaga no controle de admissão (levanta Sobrecarga se
+    recusada); jobs e relatórios em segundo plano esperam o serviço sem prazo.
+    """
+    interativa = has_request_context()
+    try:
+        return consultar_com_cache(
+            tipo,
+            funcoes_consulta()[tipo],
+            argumentos,
+            prazo_segundos=UPSTREAM_PRAZO_SEGUNDOS if interativa else None,
+            admissao=(lambda: controle_admissao.admitir_upstream(API_POR_TIPO[tipo])) if interativa else None
+        )
+    except PrazoExcedido as e:
+        log_error(f"Consulta {tipo} sem resposta: {str(e)}")
+        return {"erro": str(e)} if tipo == "search_console_query" else f"[Erro] {str(e)}"
+
+def registrar_tabela(tipo, data, colunas, colunas_dimensao, linhas, ponderadas=None, razoes=None):
+    """
+    Guarda a tabela consultada para recortes locais e retorna seu tabela_id.
+    
+    O ID deriva da consulta (e do tenant), então repetir a mesma consulta
+    reaproveita o ID e não muda o ETag da resposta.
+    """
+    tenant = obter_tenant(data)
+    tabela_id = assinatura_consulta(f"tabela:{tipo}", {**data, "tenant": tenant})
+    tabela = TabelaLocal(colunas, colunas_dimensao, linhas, ponderadas=ponderadas, razoes=razoes)
+    if not armazem_tabelas.guardar(tabela_id, tabela, tenant=tenant, origem={"tipo": tipo}):
+        return None
+    return tabela_id
+
+def marcar_vencido(resposta):
+    """Acrescenta o aviso de resultado vencido, se a última consulta serviu um."""
+    aviso = resultado_vencido.get()
+    return {**resposta, "resultado_vencido": aviso} if aviso else resposta
+
+def obter_layout(data):
+    """Lê o layout de resposta do corpo ou da query string (padrão: linhas)."""
+    if data.get('layout'):
+        return data['layout']
+    return request.args.get('layout', 'linhas') if has_request_context() else 'linhas'
+
+def obter_tenant(data):
+    """Lê o tenant do corpo, da query string ou do cabeçalho X-Tenant-ID (padrão: nenhum)."""
+    if data.get('tenant'):
+        return data['tenant']
+    if has_request_context():
+        return request.args.get('tenant') or request.headers.get('X-Tenant-ID') or None
+    return None
+
+def mensagem_erro_tenant(tenant):
+    """Mensagem de erro para um tenant sem credenciais, ou None se o tenant for válido."""
+    if tenant and not tenant_configurado(tenant):
+        return f"Tenant '{tenant}' não encontrado"
+    return None
+
+def erro_tenant(tenant):
+    """Resposta 404 para tenant desconhecido, ou None se o tenant for válido."""
+    mensagem = mensagem_erro_tenant(tenant)
+    if mensagem:
+        return jsonify({
+            "erro": mensagem,
+            "sucesso": False
+        }), 404
+    return None
+
+def responder_json(payload, status=200):
+    """
+    Serializa o payload com ETag estável e compressão negociada.
+    
+    Retorna 304 quando o If-None-Match do cliente já corresponde ao conteúdo.
+    """
+    corpo = serializar_json(payload)
+    etag = calcular_etag(corpo)
+    
+    if status == 200 and etag_corresponde(request.headers.get('If-None-Match', ''), etag):
+        resposta = Response(status=304)
+        resposta.headers['ETag'] = etag
+        resposta.headers['Vary'] = 'Accept-Encoding'
+        return resposta
+    
+    resposta = Response(status=status, mimetype='application/json')
+    resposta.headers['ETag'] = etag
+    resposta.headers['Vary'] = 'Accept-Encoding'
+    
+    codificacao = escolher_codificacao(request.headers.get('Accept-Encoding', ''))
+    if codificacao and len(corpo) >= LIMIAR_COMPRESSAO:
+        corpo = comprimir(corpo, codificacao)
+        resposta.headers['Content-Encoding'] = codificacao
+    
+    resposta.set_data(corpo)
+    return resposta
+
+# Opções do resumo da resposta (top-K e orçamento de saída)
+OPCOES_RESUMO = ('metrica_ranking', 'top_k', 'orcamento_linhas', 'orcamento_bytes')
+# Máximo de linhas que o runReport do GA4 devolve em uma requisição
+GA4_MAX_LINHAS = 250000
+
+def mensagem_erro_resumo(data):
+    """Mensagem de erro para parâmetros do resumo fora do tipo ou da faixa, ou None."""
+    for campo, minimo in (('top_k', 0), ('orcamento_linhas', 0), ('orcamento_bytes', 1)):
+        valor = data.get(campo)
+        # bool é subclasse de int em Python: true/false do JSON não valem como números
+        if valor is not None and (isinstance(valor, bool) or not isinstance(valor, int) or valor < minimo):
+            return f"{campo} deve ser um inteiro maior ou igual a {minimo}"
+    if not isinstance(data.get('metrica_ranking', ''), str):
+        return "metrica_ranking deve ser o nome de uma métrica"
+    return None
+
+def mensagem_erro_nomes(campo, nomes):
+    """Mensagem de erro se nomes não for uma lista de nomes de campos (textos), ou None."""
+    if not isinstance(nomes, list) or not all(isinstance(nome, str) for nome in nomes):
+        return f"{campo} deve ser uma lista de nomes (textos)"
+    return None
+
+def mensagem_erro_limite(data):
+    """Mensagem de erro para um limite de linhas que não seja inteiro positivo, ou None."""
+    limite = data.get('limite')
+    # Mesma regra de mensagem_erro_resumo: bool e strings numéricas não valem
+    if limite is not None and (isinstance(limite, bool) or not isinstance(limite, int) or limite < 1):
+        return "limite deve ser um inteiro maior ou igual a 1"
+    return None
+
+def obter_parametros_resumo(data):
+    """Lê os parâmetros opcionais do resumo (top-K e orçamento de saída), já validados por mensagem_erro_resumo."""
+    return {
+        "metrica_ranking": data.get('metrica_ranking', ''),
+        "top_k": data.get('top_k', TOP_K_PADRAO),
+        "orcamento_linhas": data.get('orcamento_linhas'),
+        "orcamento_bytes": data.get('orcamento_bytes'),
+        "incluir_dados": data.get('incluir_dados', True)
+    }
+
+def mensagem_erro_layout(layout):
+    """Mensagem de erro para layouts não suportados."""
+    return f"layout inválido: '{layout}'. Use um de: {', '.join(LAYOUTS_VALIDOS)}"
+
+def erro_layout(layout):
+    """Resposta 400 para layouts não suportados."""
+    return jsonify({
+        "erro": mensagem_erro_layout(layout),
+        "sucesso": False
+    }), 400
+
+def opcoes_sem_streaming(data):
+    """
+    Opções pedidas que o streaming NDJSON não aplica: ele envia as linhas como
+    vêm da API, sem layout colunar, sem resumo top-K/orçamento e sem comparação de períodos.
+    """
+    opcoes = [nome for nome in OPCOES_RESUMO + ('periodos',) if data.get(nome) is not None]
+    if data.get('incluir_dados') is False:
+        opcoes.append('incluir_dados')
+    if obter_layout(data) == LAYOUT_COLUNAR:
+        opcoes.append('layout')
+    return opcoes
+
+def mensagem_erro_modo(data):
+    """Mensagem de erro para um modo_execucao desconhecido ou incompatível com as opções, ou None."""
+    modo = data.get('modo_execucao') or MODO_AUTOMATICO
+    if modo not in MODOS_EXECUCAO:
+        return f"modo_execucao inválido: '{modo}'. Use um de: {', '.join(MODOS_EXECUCAO)}"
+    opcoes = opcoes_sem_streaming(data) if modo == MODO_STREAMING else []
+    if opcoes:
+        return f"modo_execucao streaming não aplica: {', '.join(opcoes)}. Use inline ou job"
+    return None
+
+def identificar_cliente():
+    """
+    Cliente dos limites de admissão: o IP de origem.
+    
+    Cabeçalhos enviados pelo cliente podem ser forjados. Atrás de
+    ADMISSAO_PROXIES_CONFIAVEIS proxies, vale a entrada de X-Forwarded-For
+    acrescentada pelo proxy mais externo (contando da direita); as entradas
+    à esquerda dela vieram do próprio cliente e são ignoradas.
+    """
+    if ADMISSAO_PROXIES_CONFIAVEIS > 0:
+        encaminhados = [ip.strip() for ip in request.headers.get('X-Forwarded-For', '').split(',') if ip.strip()]
+        if len(encaminhados) >= ADMISSAO_PROXIES_CONFIAVEIS:
+            return encaminhados[-ADMISSAO_PROXIES_CONFIAVEIS]
+    return request.remote_addr or "desconhecido"
+
+def resposta_sobrecarga(erro):
+    """Resposta 429 com Retry-After para uma requisição recusada pelo controle de admissão."""
+    log_info(f"Requisição recusada ({erro.motivo}): {str(erro)}")
+    resposta = jsonify({
+        "erro": str(erro),
+        "sucesso": False,
+        "motivo": erro.motivo,
+        "retry_after": erro.retry_after
+    })
+    resposta.headers['Retry-After'] = str(erro.retry_after)
+    return resposta, 429
+
+def admitir(*apis):
+    """
+    Aplica os limites do cliente à rota e, nas rotas que chamam o Google
+    diretamente, ocupa uma vaga em cada API informada durante a requisição.
+    
+    Rotas que passam por executar_consulta pedem a vaga só quando a consulta
+    não está em cache, e tratam Sobrecarga elas mesmas.
+    """
+    def decorador(view):
+        @wraps(view)
+        def rota_admitida(*args, **kwargs):
+            try:
+                with ExitStack() as vagas:
+                    vagas.enter_context(controle_admissao.admitir_cliente(identificar_cliente()))
+                    for api in apis:
+                        vagas.enter_context(controle_admissao.admitir_upstream(api))
+                    return view(*args, **kwargs)
+            except Sobrecarga as e:
+                return resposta_sobrecarga(e)
+        return rota_admitida
+    return decorador
+
 def log_info(message):
     """Log de informações."""
     print(f"[INFO] {message}", file=sys.stderr)
@@ -43,14 +329,19 @@ def health_check():
     })
 
 @app.route('/ga4/accounts', methods=['GET'])
+@admitir("ga4")
 def get_ga4_accounts():
     """Lista contas do Google Analytics 4."""
     if os.environ.get('SKIP_GOOGLE_INIT'):
         return jsonify({"erro": "Modo de teste - Google APIs não disponíveis", "sucesso": False}), 503
     
+    tenant = obter_tenant({})
+    if erro_tenant(tenant):
+        return erro_tenant(tenant)
+    
     try:
         log_info("Solicitação para listar contas GA4")
-        resultado = listar_contas_ga4()
+        resultado = listar_contas_ga4(tenant=tenant)
         return jsonify(resultado)
     except Exception as e:
         log_error(f"Erro ao listar contas GA4: {str(e)}")
@@ -59,7 +350,527 @@ def get_ga4_accounts():
             "sucesso": False
         }), 500
 
+@app.route('/ga4/metadata', methods=['GET'])
+@admitir()
+def get_ga4_metadata():
+    """Dimensões e métricas disponíveis em uma propriedade GA4 (do cache de metadados)."""
+    if os.environ.get('SKIP_GOOGLE_INIT'):
+        return jsonify({"erro": "Modo de teste - Google APIs não disponíveis", "sucesso": False}), 503
+    
+    property_id = request.args.get('property_id')
+    if not property_id:
+        return jsonify({
+            "erro": "property_id é obrigatório",
+            "sucesso": False
+        }), 400
+    
+    tenant = obter_tenant({})
+    if erro_tenant(tenant):
+        return erro_tenant(tenant)
+    
+    metadados = cache_metadados_ga4.obter(property_id, tenant)
+    if metadados is None:
+        return jsonify({
+            "erro": "Metadados da propriedade indisponíveis no momento",
+            "sucesso": False
+        }), 502
+    
+    return responder_json({
+        "sucesso": True,
+        "property_id": property_id,
+        "dimensoes": sorted(metadados["dimensoes"]),
+        "metricas": sorted(metadados["metricas"]),
+        "personalizadas": metadados["personalizadas"],
+        "atualizado_em": datetime.fromtimestamp(metadados["carregado_em"]).strftime("%Y-%m-%dT%H:%M:%S")
+    })
+
+# Comentário SSE enviado quando não há eventos, para a conexão não ser fechada por proxies
+REALTIME_KEEPALIVE_SEGUNDOS = 15
+
+def lista_parametro(valor):
+    """Aceita lista JSON ou texto separado por vírgulas (query string)."""
+    if isinstance(valor, str):
+        return [v.strip() for v in valor.split(',') if v.strip()]
+    return [v.strip() for v in (valor or []) if v and v.strip()]
+
+def preparar_consulta_realtime(data):
+    """
+    Valida os parâmetros de tempo real e monta os argumentos de consulta_ga4_realtime.
+    
+    Returns:
+        tuple: (argumentos, mensagem de erro ou None)
+    """
+    property_id = data.get('property_id')
+    metricas = lista_parametro(data.get('metricas', 'activeUsers'))
+    if not property_id or not metricas:
+        return None, "property_id e metricas são obrigatórios"
+    
+    try:
+        minutos = int(data.get('minutos', 30))
+        limite = int(data.get('limite', 100))
+    except (TypeError, ValueError):
+        return None, "minutos e limite devem ser inteiros"
+    if not 1 <= minutos <= 60:
+        return None, "minutos deve estar entre 1 e 60"
+    if not 1 <= limite <= REALTIME_MAX_LINHAS:
+        return None, f"limite deve estar entre 1 e {REALTIME_MAX_LINHAS}"
+    
+    tenant = obter_tenant(data)
+    erro_tenant_consulta = mensagem_erro_tenant(tenant)
+    if erro_tenant_consulta:
+        return None, erro_tenant_consulta
+    
+    return {
+        "property_id": str(property_id),
+        "dimensoes": lista_parametro(data.get('dimensoes')),
+        "metricas": metricas,
+        "minutos": minutos,
+        "limite": limite,
+        "tenant": tenant
+    }, None
+
+def assinar_realtime(argumentos):
+    """Assina o poller compartilhado do relatório (um por tenant, propriedade e especificação)."""
+    return gerenciador_realtime.assinar(
+        assinatura_consulta("ga4_realtime", argumentos),
+        lambda: consulta_ga4_realtime(**argumentos)
+    )
+
+def evento_sse(evento):
+    """Formata um evento no protocolo Server-Sent Events."""
+    return f"event: {evento['tipo']}\ndata: {serializar_json(evento).decode('utf-8')}\n\n"
+
+@app.route('/ga4/realtime/stream', methods=['GET'])
+@admitir()
+def stream_ga4_realtime():
+    """Transmite o relatório em tempo real por Server-Sent Events, a partir do poller compartilhado."""
+    if os.environ.get('SKIP_GOOGLE_INIT'):
+        return jsonify({"erro": "Modo de teste - Google APIs não disponíveis", "sucesso": False}), 503
+    
+    argumentos, erro = preparar_consulta_realtime(request.args)
+    if erro:
+        return jsonify({
+            "erro": erro,
+            "sucesso": False
+        }), 400
+    
+    try:
+        poller, fila = assinar_realtime(argumentos)
+    except LimitePollers as e:
+        return jsonify({
+            "erro": str(e),
+            "sucesso": False
+        }), 503
+    
+    def gerar():
+        yield f"retry: {int(REALTIME_INTERVALO_SEGUNDOS * 1000)}\n\n"
+        while True:
+            try:
+                evento = fila.get(timeout=REALTIME_KEEPALIVE_SEGUNDOS)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            yield evento_sse(evento)
+    
+    log_info(f"Assinatura em tempo real: {argumentos['property_id']}, métricas: {argumentos['metricas']}")
+    resposta = Response(stream_with_context(gerar()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Cliente desconectou (mesmo antes do primeiro evento): o poller passa a espaçar
+    # as consultas se ficar sem assinantes. O servidor sempre fecha a resposta, já o
+    # finally do gerador não roda se ele nunca chegou a começar
+    resposta.call_on_close(lambda: poller.cancelar(fila))
+    return resposta
+
+@app.route('/ga4/realtime', methods=['POST'])
+@admitir()
+def query_ga4_realtime():
+    """Retrato atual do relatório em tempo real, servido pelo mesmo poller do streaming."""
+    if os.environ.get('SKIP_GOOGLE_INIT'):
+        return jsonify({"erro": "Modo de teste - Google APIs não disponíveis", "sucesso": False}), 503
+    
+    try:
+        argumentos, erro = preparar_consulta_realtime(request.get_json(silent=True) or {})
+        if erro:
+            return jsonify({
+                "erro": erro,
+                "sucesso": False
+            }), 400
+        
+        try:
+            poller, fila = assinar_realtime(argumentos)
+        except LimitePollers as e:
+            return jsonify({
+                "erro": str(e),
+                "sucesso": False
+            }), 503
+        
+        try:
+            evento = fila.get(timeout=UPSTREAM_PRAZO_SEGUNDOS)
+        except queue.Empty:
+            return jsonify({
+                "erro": "Sem resposta do GA4 em tempo real dentro do prazo",
+                "sucesso": False
+            }), 504
+        finally:
+            poller.cancelar(fila)
+        
+        if evento["tipo"] == "erro":
+            return jsonify({
+                "erro": evento["erro"],
+                "sucesso": False
+            }), 502
+        
+        return jsonify({
+            "sucesso": True,
+            "property_id": argumentos["property_id"],
+            **{chave: valor for chave, valor in evento.items() if chave != "tipo"}
+        })
+        
+    except Exception as e:
+        log_error(f"Erro na consulta GA4 em tempo real: {str(e)}")
+        return jsonify({
+            "erro": f"Erro interno: {str(e)}",
+            "sucesso": False
+        }), 500
+
+def validar_campos_ga4(property_id, dimensoes=(), metricas=(), tenant=None):
+    """
+    Confere dimensões e métricas com os metadados da propriedade, sem chamar o GA4.
+    
+    Retorna a mensagem de erro com sugestões, ou None se os campos forem
+    válidos ou se os metadados não estiverem disponíveis.
+    """
+    metadados = cache_metadados_ga4.obter(property_id, tenant)
+    if metadados is None:
+        return None
+    problemas = validar_campos(metadados, dimensoes, metricas)
+    return mensagem_campos_invalidos(problemas) if problemas else None
+
+def ler_filtro_ga4(filtros):
+    """Extrai campo, valor e condição do primeiro filtro GA4 (apenas um filtro é suportado)."""
+    filtro_campo = ""
+    filtro_valor = ""
+    filtro_condicao = "igual"
+    
+    if filtros and len(filtros) > 0:
+        primeiro_filtro = filtros[0]
+        filtro_campo = primeiro_filtro.get('campo', '')
+        filtro_valor = primeiro_filtro.get('valor', '')
+        filtro_condicao = primeiro_filtro.get('condicao', 'igual')
+    
+    return filtro_campo, filtro_valor, filtro_condicao
+
+def preparar_consulta_ga4(data):
+    """
+    Valida o corpo de /ga4/query e monta os argumentos de consulta_ga4.
+    
+    Returns:
+        tuple: (argumentos, mensagem de erro ou None)
+    """
+    property_id = data.get('property_id')
+    dimensoes = data.get('dimensoes', [])
+    metricas = data.get('metricas', [])
+    
+    if not property_id:
+        return None, "property_id é obrigatório"
+    
+    if not dimensoes:
+        return None, "dimensoes é obrigatório"
+    
+    if not metricas:
+        return None, "metricas é obrigatório"
+    
+    # Nomes que não são texto quebrariam o strip/join adiante com um 500
+    erro_nomes = mensagem_erro_nomes("dimensoes", dimensoes) or mensagem_erro_nomes("metricas", metricas)
+    if erro_nomes:
+        return None, erro_nomes
+    
+    tenant = obter_tenant(data)
+    erro_tenant_consulta = mensagem_erro_tenant(tenant)
+    if erro_tenant_consulta:
+        return None, erro_tenant_consulta
+    
+    layout = obter_layout(data)
+    if layout not in LAYOUTS_VALIDOS:
+        return None, mensagem_erro_layout(layout)
+    
+    erro_modo = mensagem_erro_modo(data)
+    if erro_modo:
+        return None, erro_modo
+    
+    erro_resumo = mensagem_erro_resumo(data)
+    if erro_resumo:
+        return None, erro_resumo
+    
+    erro_limite = mensagem_erro_limite(data)
+    if erro_limite:
+        return None, erro_limite
+    
+    # Parâmetros opcionais
+    limite = data.get('limite', 100)
+    periodos = data.get('periodos')
+    
+    if periodos is not None:
+        erro_periodos = validar_periodos(periodos)
+        if erro_periodos:
+            return None, erro_periodos
+        # Cada combinação de dimensões aparece uma vez por período (limite já validado como inteiro)
+        limite = min(limite * len(periodos), GA4_MAX_LINHAS)
+    
+    filtro_campo, filtro_valor, filtro_condicao = ler_filtro_ga4(data.get('filtros', []))
+    
+    erro_campos = validar_campos_ga4(property_id, dimensoes + [filtro_campo], metricas, tenant)
+    if erro_campos:
+        return None, erro_campos
+    
+    return {
+        "dimensao": ",".join(dimensoes),
+        "metrica": ",".join(metricas),
+        "periodo": data.get('data_inicio', '7daysAgo'),
+        "data_fim": data.get('data_fim', 'today'),
+        "filtro_campo": filtro_campo,
+        "filtro_valor": filtro_valor,
+        "filtro_condicao": filtro_condicao,
+        "property_id": property_id,
+        "limite": limite,
+        "periodos": periodos,
+        "tenant": tenant
+    }, None
+
+def processar_consulta_ga4(data, resultado_texto):
+    """
+    Converte o texto retornado por consulta_ga4 na resposta de /ga4/query.
+    
+    Returns:
+        tuple: (payload, status HTTP)
+    """
+    property_id = data.get('property_id')
+    dimensoes = data.get('dimensoes', [])
+    metricas = data.get('metricas', [])
+    data_inicio = data.get('data_inicio', '7daysAgo')
+    data_fim = data.get('data_fim', 'today')
+    periodos = data.get('periodos')
+    layout = obter_layout(data)
+    parametros_resumo = obter_parametros_resumo(data)
+    
+    # Processar resultado para JSON estruturado
+    if resultado_texto.startswith("[Erro]"):
+        return {
+            "erro": resultado_texto,
+            "sucesso": False
+        }, 500
+    
+    # Converter resultado texto em dados estruturados
+    cabecalhos, valores_linhas = interpretar_resultado_ga4(resultado_texto)
+    if not cabecalhos:
+        return {
+            "sucesso": True,
+            "dados": [],
+            "total_resultados": 0,
+            "periodo": f"{data_inicio} a {data_fim}",
+            "property_id": property_id
+        }, 200
+    
+    colunas_dimensao = [d.strip() for d in dimensoes]
+    tabela_id = registrar_tabela(
+        "ga4_query", data, cabecalhos,
+        colunas_dimensao + ([DIMENSAO_PERIODO] if DIMENSAO_PERIODO in cabecalhos else []),
+        valores_linhas
+    )
+    
+    try:
+        if periodos and DIMENSAO_PERIODO in cabecalhos:
+            return {**montar_resposta_periodos(
+                cabecalhos, valores_linhas, dimensoes, metricas, periodos,
+                property_id, parametros_resumo, layout
+            ), "tabela_id": tabela_id}, 200
+        
+        # Criar summary para o GPT: top-K pela métrica de ranking + cauda agrupada
+        linhas_numericas = normalizar_metricas(valores_linhas, cabecalhos, colunas_dimensao)
+        metricas_aditivas = [c for c in cabecalhos if c not in colunas_dimensao and metrica_aditiva(c)]
+        
+        resumo_top = resumir_tabela(
+            cabecalhos,
+            linhas_numericas,
+            parametros_resumo["metrica_ranking"] or metricas[0].strip(),
+            colunas_dimensao=colunas_dimensao,
+            top_k=parametros_resumo["top_k"],
+            orcamento_linhas=parametros_resumo["orcamento_linhas"],
+            orcamento_bytes=parametros_resumo["orcamento_bytes"],
+            aditivas=metricas_aditivas
+        )
+    except ValueError as e:
+        return {
+            "erro": str(e),
+            "sucesso": False
+        }, 400
+    
+    total_sessions = resumo_top["totais"].get('sessions', 0)
+    
+    resposta = {
+        "sucesso": True,
+        "resumo": {
+            "total_sessoes": total_sessions,
+            "periodo": f"{data_inicio} a {data_fim}",
+            "property_id": property_id,
+            **resumo_top
+        },
+        "total_resultados": len(valores_linhas),
+        "tabela_id": tabela_id,
+        "message": f"Consulta GA4 realizada com sucesso para {property_id}. Encontrados {len(valores_linhas)} resultados no período de {data_inicio} a {data_fim}."
+    }
+    
+    if parametros_resumo["incluir_dados"]:
+        if layout == LAYOUT_COLUNAR:
+            resposta["dados"] = montar_colunar(cabecalhos, valores_linhas, colunas_dimensao=colunas_dimensao)
+        else:
+            resposta["dados"] = [dict(zip(cabecalhos, valores)) for valores in valores_linhas]
+    
+    return resposta, 200
+
+# Campos de /search-console/query usados pela sondagem de tamanho
+CAMPOS_SONDAGEM_SEARCH_CONSOLE = ("site_url", "data_inicio", "data_fim", "dimensoes", "filtros", "query_filtro", "pagina_filtro", "tenant")
+
+def sondar_tamanho(fonte, argumentos):
+    """Estimativa do número de linhas pela sondagem (com cache), ou None se ela falhar."""
+    if fonte == "ga4":
+        tipo = "ga4_estimativa"
+        argumentos_sondagem = {chave: valor for chave, valor in argumentos.items() if chave != "limite"}
+    else:
+        tipo = "search_console_estimativa"
+        argumentos_sondagem = {campo: argumentos[campo] for campo in CAMPOS_SONDAGEM_SEARCH_CONSOLE}
+        argumentos_sondagem["marcos"] = planejador_consultas.marcos(argumentos["limite"])
+    estimativa = executar_consulta(tipo, argumentos_sondagem)
+    if resultado_com_erro(estimativa):
+        log_error(f"Sondagem {tipo} falhou: {estimativa.get('erro') if isinstance(estimativa, dict) else estimativa}")
+        return None
+    return estimativa
+
+def parametros_paginas(fonte, data, argumentos):
+    """Parâmetros de paginas_relatorio_ga4 / paginas_search_console equivalentes à consulta."""
+    if fonte == "search_console":
+        return argumentos
+    return {
+        "property_id": argumentos["property_id"],
+        "dimensoes": data['dimensoes'],
+        "metricas": data['metricas'],
+        "data_inicio": argumentos["periodo"],
+        "data_fim": argumentos["data_fim"],
+        "filtros": data.get('filtros', []),
+        "periodos": argumentos["periodos"],
+        "tenant": argumentos["tenant"]
+    }
+
+# Partes da resposta inline que o streaming não calcula (precisariam do resultado inteiro)
+OMITIDOS_STREAMING = ["resumo", "tabela_id"]
+
+def resposta_streaming(fonte, parametros, limite, plano):
+    """
+    Transmite o resultado em NDJSON, uma página da API por vez, sem montá-lo em memória.
+    
+    A primeira linha traz o plano, as colunas, os tipos e o que a resposta
+    inline teria e o streaming omite; depois vem uma linha (lista JSON) por
+    linha do resultado, e por fim {"tipo": "fim"} ou, se uma página falhar no
+    meio, {"tipo": "erro"}. A primeira página é buscada antes de responder,
+    para que erros iniciais ainda saiam com o status HTTP certo.
+    """
+    api = "ga4" if fonte == "ga4" else "search_console"
+    funcao_paginas = paginas_relatorio_ga4 if fonte == "ga4" else paginas_search_console
+    paginas = funcao_paginas(parametros, linhas_por_pagina=min(PLANO_LINHAS_POR_PAGINA, limite))
+    
+    def proxima():
+        # Cada página ocupa uma vaga na API, como as consultas interativas
+        with controle_admissao.admitir_upstream(api):
+            return next(paginas, None)
+    
+    try:
+        primeira = proxima()
+    except BaseException:
+        paginas.close()
+        raise
+    
+    def gerar():
+        pagina, enviadas, final = primeira, 0, None
+        try:
+            yield serializar_json({
+                "tipo": "inicio",
+                "plano": plano,
+                "colunas": pagina["colunas"] if pagina else [],
+                "tipos": pagina["tipos"] if pagina else {},
+                "total": pagina["total"] if pagina else 0,
+                "omitidos": OMITIDOS_STREAMING
+            }) + b"\n"
+            while pagina is not None:
+                linhas = pagina["linhas"][:limite - enviadas]
+                if linhas:
+                    yield b"".join(serializar_json(list(linha)) + b"\n" for linha in linhas)
+                enviadas += len(linhas)
+                if enviadas >= limite or pagina["proximo"] is None:
+                    break
+                try:
+                    pagina = proxima()
+                except Sobrecarga as e:
+                    final = {"tipo": "erro", "erro": str(e), "motivo": e.motivo, "retry_after": e.retry_after}
+                    break
+                except Exception as e:
+                    log_error(f"Página do streaming {fonte} falhou: {str(e)}")
+                    final = {"tipo": "erro", "erro": f"Erro interno: {str(e)}"}
+                    break
+        finally:
+            paginas.close()
+        yield serializar_json({**(final or {"tipo": "fim"}), "total_resultados": enviadas}) + b"\n"
+    
+    return Response(stream_with_context(gerar()), mimetype='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def resposta_job(tipo, data, plano):
+    """Entrega a consulta a um job em segundo plano e responde 202 com os links de acompanhamento."""
+    # Tenant e layout do cabeçalho e da query string são fixados: o worker não tem contexto de requisição
+    parametros = {**data, "tenant": obter_tenant(data), "layout": obter_layout(data)}
+    try:
+        job = gerenciador_jobs.submeter(tipo, TIPOS_JOB[tipo][1], parametros, parametros["tenant"])
+    except FilaJobsCheia as e:
+        return jsonify({
+            "erro": str(e),
+            "sucesso": False,
+            "plano": plano
+        }), 503
+    
+    log_info(f"Consulta {tipo} enviada ao job {job['job_id']} ({plano['linhas_estimadas']} linhas estimadas)")
+    return jsonify({
+        "sucesso": True,
+        "plano": plano,
+        "job": job,
+        "links": links_job(job['job_id']),
+        "message": "Resultado grande: a consulta segue em segundo plano. Acompanhe o job e busque o resultado nos links."
+    }), 202
+
+def executar_planejada(fonte, tipo, data, argumentos):
+    """
+    Planeja a consulta pelo tamanho estimado do resultado.
+    
+    Returns:
+        A resposta de streaming ou de job, ou None quando a consulta deve seguir inline
+    """
+    limite = argumentos["limite"]
+    plano = planejador_consultas.planejar(
+        limite,
+        data.get('modo_execucao') or MODO_AUTOMATICO,
+        lambda: sondar_tamanho(fonte, argumentos),
+        streaming_possivel=not opcoes_sem_streaming(data)
+    )
+    if plano["modo"] == MODO_STREAMING:
+        return resposta_streaming(fonte, parametros_paginas(fonte, data, argumentos), limite, plano)
+    if plano["modo"] == MODO_JOB:
+        return resposta_job(tipo, data, plano)
+    return None
+
 @app.route('/ga4/query', methods=['POST'])
+@admitir()
 def query_ga4_data():
     """Consulta dados do Google Analytics 4."""
     try:
@@ -72,114 +883,293 @@ def query_ga4_data():
                 "sucesso": False
             }), 400
         
-        property_id = data.get('property_id')
-        dimensoes = data.get('dimensoes', [])
-        metricas = data.get('metricas', [])
-        
-        if not property_id:
+        argumentos, erro = preparar_consulta_ga4(data)
+        if erro:
             return jsonify({
-                "erro": "property_id é obrigatório",
+                "erro": erro,
                 "sucesso": False
             }), 400
         
-        if not dimensoes:
+        log_info(f"Consulta GA4: {argumentos['property_id']}, dimensões: {data.get('dimensoes')}, métricas: {data.get('metricas')}")
+        
+        # Resultados grandes vão em streaming ou para um job
+        planejada = executar_planejada("ga4", "ga4_query", data, argumentos)
+        if planejada is not None:
+            return planejada
+        
+        # Executar consulta
+        resultado_texto = executar_consulta("ga4_query", argumentos)
+        
+        resposta, status = processar_consulta_ga4(data, resultado_texto)
+        if status != 200:
+            return jsonify(resposta), status
+        return responder_json(marcar_vencido(resposta))
+        
+    except Sobrecarga as e:
+        return resposta_sobrecarga(e)
+    except Exception as e:
+        log_error(f"Erro na consulta GA4: {str(e)}")
+        return jsonify({
+            "erro": f"Erro interno: {str(e)}",
+            "sucesso": False
+        }), 500
+
+@app.route('/ga4/portfolio', methods=['POST'])
+@admitir()
+def query_ga4_portfolio():
+    """Executa o mesmo relatório GA4 em várias propriedades e une os resultados."""
+    try:
+        data = request.get_json()
+        
+        if not data:
             return jsonify({
-                "erro": "dimensoes é obrigatório",
+                "erro": "Dados da requisição não fornecidos",
                 "sucesso": False
             }), 400
         
-        if not metricas:
+        if not data.get('dimensoes') or not data.get('metricas'):
             return jsonify({
-                "erro": "metricas é obrigatório",
+                "erro": "dimensoes e metricas são obrigatórios",
                 "sucesso": False
             }), 400
         
-        # Parâmetros opcionais
-        data_inicio = data.get('data_inicio', '7daysAgo')
-        data_fim = data.get('data_fim', 'today')
-        limite = data.get('limite', 100)
-        filtros = data.get('filtros', [])
+        erro_nomes = mensagem_erro_nomes("dimensoes", data['dimensoes']) or mensagem_erro_nomes("metricas", data['metricas'])
+        if erro_nomes:
+            return jsonify({
+                "erro": erro_nomes,
+                "sucesso": False
+            }), 400
         
-        log_info(f"Consulta GA4: {property_id}, dimensões: {dimensoes}, métricas: {metricas}")
+        if data.get('periodos') is not None:
+            return jsonify({
+                "erro": "periodos não é suportado no relatório de portfólio",
+                "sucesso": False
+            }), 400
         
-        # Processar filtros se existirem
-        filtro_campo = ""
-        filtro_valor = ""
-        filtro_condicao = "igual"
+        layout = obter_layout(data)
+        if layout not in LAYOUTS_VALIDOS:
+            return erro_layout(layout)
         
-        if filtros and len(filtros) > 0:
-            primeiro_filtro = filtros[0]
-            filtro_campo = primeiro_filtro.get('campo', '')
-            filtro_valor = primeiro_filtro.get('valor', '')
-            filtro_condicao = primeiro_filtro.get('condicao', 'igual')
+        tenant = obter_tenant(data)
+        if erro_tenant(tenant):
+            return erro_tenant(tenant)
         
-        # Executar consulta
-        resultado_texto = consulta_ga4(
-            dimensao=",".join(dimensoes),
-            metrica=",".join(metricas),
-            periodo=data_inicio,
-            data_fim=data_fim,
-            filtro_campo=filtro_campo,
-            filtro_valor=filtro_valor,
-            filtro_condicao=filtro_condicao,
-            property_id=property_id
-        )
+        if data.get('conta'):
+            catalogo = consultar_com_cache("ga4_accounts", listar_contas_ga4, {"tenant": tenant}, registrar=False)
+            if "erro" in catalogo:
+                return jsonify({
+                    "erro": catalogo["erro"],
+                    "sucesso": False
+                }), 500
+            propriedades = propriedades_da_conta(catalogo, data['conta'])
+            if not propriedades:
+                return jsonify({
+                    "erro": f"Conta '{data['conta']}' não encontrada ou sem propriedades",
+                    "sucesso": False
+                }), 404
+        else:
+            propriedades = [{"property_id": pid, "nome": ""} for pid in data.get('property_ids') or []]
         
-        # Processar resultado para JSON estruturado
-        if resultado_texto.startswith("[Erro]"):
+        if not propriedades:
             return jsonify({
-                "erro": resultado_texto,
+                "erro": "Informe property_ids ou conta",
                 "sucesso": False
-            }), 500
+            }), 400
         
-        # Converter resultado texto em dados estruturados
-        linhas = resultado_texto.split('\n')
-        if len(linhas) < 2:
+        if len(propriedades) > PORTFOLIO_MAX_PROPRIEDADES:
             return jsonify({
-                "sucesso": True,
-                "dados": [],
-                "total_resultados": 0,
-                "periodo": f"{data_inicio} a {data_fim}",
-                "property_id": property_id
-            })
+                "erro": f"Máximo de {PORTFOLIO_MAX_PROPRIEDADES} propriedades por relatório",
+                "sucesso": False
+            }), 400
         
-        cabecalhos = linhas[0].split(' | ')
-        dados = []
+        def consultar_propriedade(property_id):
+            # Cada propriedade é validada com os próprios metadados (dimensões personalizadas variam)
+            argumentos, erro = preparar_consulta_ga4({**data, "property_id": property_id, "tenant": tenant})
+            if erro:
+                return f"[Erro] {erro}"
+            # As propriedades rodam em threads sem o contexto da requisição: cada
+            # chamada ocupa a sua própria vaga do GA4, não uma vaga para o portfólio inteiro
+            try:
+                with controle_admissao.admitir_upstream("ga4"):
+                    return executar_consulta("ga4_query", argumentos)
+            except Sobrecarga as e:
+                return f"[Erro] {str(e)}"
         
-        for linha in linhas[1:]:
-            if linha.strip():
-                valores = linha.split(' | ')
-                if len(valores) == len(cabecalhos):
-                    registro = {}
-                    for i, cabecalho in enumerate(cabecalhos):
-                        registro[cabecalho] = valores[i]
-                    dados.append(registro)
+        log_info(f"Portfólio GA4: {len(propriedades)} propriedades, dimensões: {data.get('dimensoes')}, métricas: {data.get('metricas')}")
         
-        # Criar summary para o GPT
-        total_sessions = sum(int(d.get('sessions', 0)) for d in dados if 'sessions' in d)
-        top_countries = dados[:10] if dados else []
+        resultado = relatorio_portfolio(
+            propriedades,
+            consultar_propriedade,
+            interpretar_resultado_ga4,
+            metricas=data['metricas'],
+            layout=layout
+        )
         
-        return jsonify({
+        if resultado["propriedades_com_erro"] and len(resultado["propriedades_com_erro"]) == resultado["propriedades_consultadas"]:
+            return jsonify({
+                "erro": "A consulta falhou em todas as propriedades",
+                "sucesso": False,
+                "propriedades_com_erro": resultado["propriedades_com_erro"]
+            }), 502
+        
+        return responder_json({
             "sucesso": True,
-            "resumo": {
-                "total_sessoes": total_sessions,
-                "periodo": f"{data_inicio} a {data_fim}",
-                "property_id": property_id,
-                "top_paises": top_countries
-            },
-            "dados": dados,
-            "total_resultados": len(dados),
-            "message": f"Consulta GA4 realizada com sucesso para {property_id}. Encontrados {len(dados)} resultados no período de {data_inicio} a {data_fim}."
+            "periodo": f"{data.get('data_inicio', '7daysAgo')} a {data.get('data_fim', 'today')}",
+            **resultado
         })
         
     except Exception as e:
-        log_error(f"Erro na consulta GA4: {str(e)}")
+        log_error(f"Erro no portfólio GA4: {str(e)}")
         return jsonify({
             "erro": f"Erro interno: {str(e)}",
             "sucesso": False
         }), 500
 
+def montar_resposta_periodos(cabecalhos, valores_linhas, dimensoes, metricas, periodos, property_id, parametros_resumo, layout):
+    """
+    Monta a resposta de /ga4/query para vários períodos: resumo e dados por
+    período, mais a comparação de cada combinação de dimensões com deltas
+    em relação ao primeiro período.
+    """
+    nomes = nomes_periodos(periodos)
+    colunas_metrica = [m.strip() for m in metricas]
+    colunas_dimensao = [d.strip() for d in dimensoes]
+    comparacao = comparar_periodos(cabecalhos, valores_linhas, colunas_metrica, nomes)
+    
+    colunas = colunas_dimensao + colunas_metrica
+    metricas_aditivas = [m for m in colunas_metrica if metrica_aditiva(m)]
+    resumo_por_periodo = {}
+    dados_por_periodo = {}
+    for nome, registros in comparacao["por_periodo"].items():
+        linhas = [[registro[c] for c in colunas] for registro in registros]
+        resumo_por_periodo[nome] = resumir_tabela(
+            colunas,
+            linhas,
+            parametros_resumo["metrica_ranking"] or colunas_metrica[0],
+            colunas_dimensao=colunas_dimensao,
+            top_k=parametros_resumo["top_k"],
+            orcamento_linhas=parametros_resumo["orcamento_linhas"],
+            orcamento_bytes=parametros_resumo["orcamento_bytes"],
+            aditivas=metricas_aditivas
+        )
+        if layout == LAYOUT_COLUNAR:
+            dados_por_periodo[nome] = montar_colunar(colunas, linhas, colunas_dimensao=colunas_dimensao)
+        else:
+            dados_por_periodo[nome] = registros
+    
+    linhas_comparacao = comparacao["comparacao"]
+    if not parametros_resumo["incluir_dados"]:
+        linhas_comparacao = linhas_comparacao[:parametros_resumo["top_k"]]
+    
+    resposta = {
+        "sucesso": True,
+        "property_id": property_id,
+        "periodos": [
+            {"nome": nome, "data_inicio": p["data_inicio"], "data_fim": p["data_fim"]}
+            for nome, p in zip(nomes, periodos)
+        ],
+        "periodo_base": nomes[0],
+        "resumo": {
+            "totais": comparacao["totais"],
+            "por_periodo": resumo_por_periodo
+        },
+        "comparacao": linhas_comparacao,
+        "total_resultados": len(valores_linhas),
+        "message": f"Consulta GA4 realizada com sucesso para {property_id} em {len(nomes)} períodos, comparados com '{nomes[0]}'."
+    }
+    if parametros_resumo["incluir_dados"]:
+        resposta["dados"] = dados_por_periodo
+    return resposta
+
+def preparar_consulta_pivot(data):
+    """
+    Valida o corpo de /ga4/pivot e monta os argumentos de consulta_ga4_pivot.
+    
+    Returns:
+        tuple: (argumentos, mensagem de erro ou None)
+    """
+    property_id = data.get('property_id')
+    dimensao_principal = data.get('dimensao_principal')
+    dimensao_pivot = data.get('dimensao_pivot')
+    metricas = data.get('metricas', [])
+    
+    if not all([property_id, dimensao_principal, dimensao_pivot, metricas]):
+        return None, "property_id, dimensao_principal, dimensao_pivot e metricas são obrigatórios"
+    
+    if not isinstance(dimensao_principal, str) or not isinstance(dimensao_pivot, str):
+        return None, "dimensao_principal e dimensao_pivot devem ser textos (várias dimensões separadas por vírgula)"
+    
+    erro_nomes = mensagem_erro_nomes("metricas", metricas)
+    if erro_nomes:
+        return None, erro_nomes
+    
+    # Cada dimensão da lista separada por vírgula é validada e enviada ao GA4 por conta própria
+    dimensoes_principais = [d.strip() for d in dimensao_principal.split(",") if d.strip()]
+    dimensoes_pivot = [d.strip() for d in dimensao_pivot.split(",") if d.strip()]
+    if not dimensoes_principais or not dimensoes_pivot:
+        return None, "property_id, dimensao_principal, dimensao_pivot e metricas são obrigatórios"
+    
+    tenant = obter_tenant(data)
+    erro_tenant_consulta = mensagem_erro_tenant(tenant)
+    if erro_tenant_consulta:
+        return None, erro_tenant_consulta
+    
+    periodos = data.get('periodos')
+    if periodos is not None:
+        erro_periodos = validar_periodos(periodos)
+        if erro_periodos:
+            return None, erro_periodos
+    
+    filtro_campo, filtro_valor, filtro_condicao = ler_filtro_ga4(data.get('filtros', []))
+    
+    erro_campos = validar_campos_ga4(property_id, dimensoes_principais + dimensoes_pivot + [filtro_campo], metricas, tenant)
+    if erro_campos:
+        return None, erro_campos
+    
+    return {
+        "dimensao": ",".join(dimensoes_principais),
+        "dimensao_pivot": ",".join(dimensoes_pivot),
+        "metrica": ",".join(metricas),
+        "periodo": data.get('data_inicio', '7daysAgo'),
+        "data_fim": data.get('data_fim', 'today'),
+        "filtro_campo": filtro_campo,
+        "filtro_valor": filtro_valor,
+        "filtro_condicao": filtro_condicao,
+        "limite_linhas": data.get('limite_linhas', 30),
+        "property_id": property_id,
+        "periodos": periodos,
+        "tenant": tenant
+    }, None
+
+def processar_consulta_pivot(data, resultado):
+    """
+    Monta a resposta de /ga4/pivot a partir do texto de consulta_ga4_pivot.
+    
+    Returns:
+        tuple: (payload, status HTTP)
+    """
+    if resultado.startswith("[Erro]"):
+        return {
+            "erro": resultado,
+            "sucesso": False
+        }, 500
+    
+    periodos = data.get('periodos')
+    resposta = {
+        "sucesso": True,
+        "resultado": resultado,
+        "periodo": f"{data.get('data_inicio', '7daysAgo')} a {data.get('data_fim', 'today')}",
+        "property_id": data.get('property_id')
+    }
+    if periodos:
+        resposta["periodos"] = [
+            {"nome": nome, "data_inicio": p["data_inicio"], "data_fim": p["data_fim"]}
+            for nome, p in zip(nomes_periodos(periodos), periodos)
+        ]
+    return resposta, 200
+
 @app.route('/ga4/pivot', methods=['POST'])
+@admitir()
 def query_ga4_pivot():
     """Consulta pivot no Google Analytics 4."""
     try:
@@ -191,61 +1181,24 @@ def query_ga4_pivot():
                 "sucesso": False
             }), 400
         
-        property_id = data.get('property_id')
-        dimensao_principal = data.get('dimensao_principal')
-        dimensao_pivot = data.get('dimensao_pivot')
-        metricas = data.get('metricas', [])
-        
-        if not all([property_id, dimensao_principal, dimensao_pivot, metricas]):
+        argumentos, erro = preparar_consulta_pivot(data)
+        if erro:
             return jsonify({
-                "erro": "property_id, dimensao_principal, dimensao_pivot e metricas são obrigatórios",
+                "erro": erro,
                 "sucesso": False
             }), 400
         
-        data_inicio = data.get('data_inicio', '7daysAgo')
-        data_fim = data.get('data_fim', 'today')
-        limite_linhas = data.get('limite_linhas', 30)
-        filtros = data.get('filtros', [])
-        
-        log_info(f"Consulta GA4 Pivot: {property_id}, principal: {dimensao_principal}, pivot: {dimensao_pivot}")
-        
-        # Processar filtros
-        filtro_campo = ""
-        filtro_valor = ""
-        filtro_condicao = "igual"
-        
-        if filtros and len(filtros) > 0:
-            primeiro_filtro = filtros[0]
-            filtro_campo = primeiro_filtro.get('campo', '')
-            filtro_valor = primeiro_filtro.get('valor', '')
-            filtro_condicao = primeiro_filtro.get('condicao', 'igual')
-        
-        resultado = consulta_ga4_pivot(
-            dimensao=dimensao_principal,
-            dimensao_pivot=dimensao_pivot,
-            metrica=",".join(metricas),
-            periodo=data_inicio,
-            data_fim=data_fim,
-            filtro_campo=filtro_campo,
-            filtro_valor=filtro_valor,
-            filtro_condicao=filtro_condicao,
-            limite_linhas=limite_linhas,
-            property_id=property_id
-        )
+        log_info(f"Consulta GA4 Pivot: {argumentos['property_id']}, principal: {argumentos['dimensao']}, pivot: {argumentos['dimensao_pivot']}")
         
-        if resultado.startswith("[Erro]"):
-            return jsonify({
-                "erro": resultado,
-                "sucesso": False
-            }), 500
+        resultado = executar_consulta("ga4_pivot", argumentos)
         
-        return jsonify({
-            "sucesso": True,
-            "resultado": resultado,
-            "periodo": f"{data_inicio} a {data_fim}",
-            "property_id": property_id
-        })
+        resposta, status = processar_consulta_pivot(data, resultado)
+        if status != 200:
+            return jsonify(resposta), status
+        return responder_json(marcar_vencido(resposta))
         
+    except Sobrecarga as e:
+        return resposta_sobrecarga(e)
     except Exception as e:
         log_error(f"Erro na consulta GA4 Pivot: {str(e)}")
         return jsonify({
@@ -254,11 +1207,16 @@ def query_ga4_pivot():
         }), 500
 
 @app.route('/search-console/sites', methods=['GET'])
+@admitir("search_console")
 def get_search_console_sites():
     """Lista sites do Google Search Console."""
+    tenant = obter_tenant({})
+    if erro_tenant(tenant):
+        return erro_tenant(tenant)
+    
     try:
         log_info("Solicitação para listar sites do Search Console")
-        resultado = listar_sites_search_console()
+        resultado = listar_sites_search_console(tenant=tenant)
         return jsonify(resultado)
     except Exception as e:
         log_error(f"Erro ao listar sites do Search Console: {str(e)}")
@@ -267,7 +1225,87 @@ def get_search_console_sites():
             "sucesso": False
         }), 500
 
+def processar_consulta_search_console(data, resultado):
+    """
+    Guarda a tabela de consulta_search_console_custom para recortes locais.
+    
+    Returns:
+        dict: Resposta de /search-console/query, com tabela_id no lugar da tabela
+    """
+    if "tabela" not in resultado:
+        return resultado
+    # O resultado pode estar no cache: monta uma cópia sem a tabela
+    resposta = {chave: valor for chave, valor in resultado.items() if chave != "tabela"}
+    tabela = resultado["tabela"]
+    metrica_extra = "CTR" in tabela["colunas"]
+    resposta["tabela_id"] = registrar_tabela(
+        "search_console_query", data, tabela["colunas"], tabela["colunas_dimensao"], tabela["linhas"],
+        ponderadas={"Posição Média": "Impressões"} if metrica_extra else None,
+        razoes={"CTR": ("Cliques", "Impressões")} if metrica_extra else None
+    )
+    return resposta
+
+def preparar_consulta_search_console(data):
+    """
+    Valida o corpo de /search-console/query e monta os argumentos de consulta_search_console_custom.
+    
+    Returns:
+        tuple: (argumentos, mensagem de erro ou None)
+    """
+    site_url = data.get('site_url')
+    if not site_url:
+        return None, "site_url é obrigatório"
+    
+    tenant = obter_tenant(data)
+    erro_tenant_consulta = mensagem_erro_tenant(tenant)
+    if erro_tenant_consulta:
+        return None, erro_tenant_consulta
+    
+    layout = obter_layout(data)
+    if layout not in LAYOUTS_VALIDOS:
+        return None, mensagem_erro_layout(layout)
+    
+    erro_modo = mensagem_erro_modo(data)
+    if erro_modo:
+        return None, erro_modo
+    
+    erro_resumo = mensagem_erro_resumo(data)
+    if erro_resumo:
+        return None, erro_resumo
+    
+    erro_limite = mensagem_erro_limite(data)
+    if erro_limite:
+        return None, erro_limite
+    
+    fatiar_por = data.get('fatiar_por') or ""
+    if fatiar_por and fatiar_por not in UNIDADES_FATIA:
+        return None, f"fatiar_por inválido: '{fatiar_por}'. Use um de: {', '.join(UNIDADES_FATIA)}"
+    
+    parametros_resumo = obter_parametros_resumo(data)
+    
+    return {
+        "site_url": site_url,
+        "data_inicio": data.get('data_inicio', '30daysAgo'),
+        "data_fim": data.get('data_fim', 'today'),
+        "dimensoes": data.get('dimensoes', ['query']),
+        "metrica_extra": data.get('metrica_extra', True),
+        "filtros": data.get('filtros', []),
+        "limite": data.get('limite', 100),
+        "query_filtro": data.get('query_filtro', ''),
+        "pagina_filtro": data.get('pagina_filtro', ''),
+        "layout": layout,
+        "metrica_ranking": parametros_resumo["metrica_ranking"] or "Cliques",
+        "top_k": parametros_resumo["top_k"],
+        "orcamento_linhas": parametros_resumo["orcamento_linhas"],
+        "orcamento_bytes": parametros_resumo["orcamento_bytes"],
+        "incluir_dados": parametros_resumo["incluir_dados"],
+        "fatiar_por": fatiar_por,
+        "tenant": tenant,
+        "incluir_tabela": True
+    }, None
+
 @app.route('/search-console/query', methods=['POST'])
+@admitir()
 def query_search_console_data():
     """Consulta dados do Google Search Console."""
     try:
@@ -279,39 +1317,26 @@ def query_search_console_data():
                 "sucesso": False
             }), 400
         
-        site_url = data.get('site_url')
-        if not site_url:
+        argumentos, erro = preparar_consulta_search_console(data)
+        if erro:
             return jsonify({
-                "erro": "site_url é obrigatório",
+                "erro": erro,
                 "sucesso": False
             }), 400
         
-        # Parâmetros opcionais
-        data_inicio = data.get('data_inicio', '30daysAgo')
-        data_fim = data.get('data_fim', 'today')
-        dimensoes = data.get('dimensoes', ['query'])
-        metrica_extra = data.get('metrica_extra', True)
-        limite = data.get('limite', 100)
-        query_filtro = data.get('query_filtro', '')
-        pagina_filtro = data.get('pagina_filtro', '')
-        filtros_customizados = data.get('filtros', [])
+        log_info(f"Consulta Search Console: {argumentos['site_url']}, dimensões: {argumentos['dimensoes']}")
         
-        log_info(f"Consulta Search Console: {site_url}, dimensões: {dimensoes}")
+        # Resultados grandes vão em streaming ou para um job
+        planejada = executar_planejada("search_console", "search_console_query", data, argumentos)
+        if planejada is not None:
+            return planejada
         
-        resultado = consulta_search_console_custom(
-            site_url=site_url,
-            data_inicio=data_inicio,
-            data_fim=data_fim,
-            dimensoes=dimensoes,
-            metrica_extra=metrica_extra,
-            filtros=filtros_customizados,
-            limite=limite,
-            query_filtro=query_filtro,
-            pagina_filtro=pagina_filtro
-        )
+        resultado = executar_consulta("search_console_query", argumentos)
         
-        return jsonify(resultado)
+        return responder_json(marcar_vencido(processar_consulta_search_console(data, resultado)))
         
+    except Sobrecarga as e:
+        return resposta_sobrecarga(e)
     except Exception as e:
         log_error(f"Erro na consulta Search Console: {str(e)}")
         return jsonify({
@@ -320,6 +1345,7 @@ def query_search_console_data():
         }), 500
 
 @app.route('/search-console/verify', methods=['POST'])
+@admitir("search_console")
 def verify_search_console_site():
     """Verifica propriedade de site no Search Console."""
     try:
@@ -338,9 +1364,13 @@ def verify_search_console_site():
                 "sucesso": False
             }), 400
         
+        tenant = obter_tenant(data)
+        if erro_tenant(tenant):
+            return erro_tenant(tenant)
+        
         log_info(f"Verificando propriedade do site: {site_url}")
         
-        resultado = verificar_propriedade_site_search_console(site_url)
+        resultado = verificar_propriedade_site_search_console(site_url, tenant=tenant)
         return jsonify(resultado)
         
     except Exception as e:
@@ -350,6 +1380,757 @@ def verify_search_console_site():
             "sucesso": False
         }), 500
 
+@app.route('/reports/landing-pages', methods=['POST'])
+@admitir()
+def query_landing_pages_report():
+    """Relatório de landing pages combinando Search Console e GA4 em uma única chamada."""
+    try:
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({
+                "erro": "Dados da requisição não fornecidos",
+                "sucesso": False
+            }), 400
+        
+        property_id = data.get('property_id')
+        site_url = data.get('site_url')
+        if not property_id or not site_url:
+            return jsonify({
+                "erro": "property_id e site_url são obrigatórios",
+                "sucesso": False
+            }), 400
+        
+        layout = obter_layout(data)
+        if layout not in LAYOUTS_VALIDOS:
+            return erro_layout(layout)
+        
+        tenant = obter_tenant(data)
+        if erro_tenant(tenant):
+            return erro_tenant(tenant)
+        
+        erro_campos = (
+            mensagem_erro_nomes("metricas_ga4", data.get('metricas_ga4') or [])
+            or validar_campos_ga4(property_id, metricas=data.get('metricas_ga4') or [], tenant=tenant)
+        )
+        if erro_campos:
+            return jsonify({
+                "erro": erro_campos,
+                "sucesso": False
+            }), 400
+        
+        def consultar_fonte(tipo, argumentos):
+            # As duas fontes rodam em threads sem o contexto da requisição: como no
+            # portfólio, cada consulta ocupa a sua própria vaga da API
+            try:
+                with controle_admissao.admitir_upstream(API_POR_TIPO[tipo]):
+                    return executar_consulta(tipo, argumentos)
+            except Sobrecarga as e:
+                return {"erro": str(e)} if tipo == "search_console_query" else f"[Erro] {str(e)}"
+        
+        log_info(f"Relatório de landing pages: {property_id} + {site_url}")
+        
+        resultado = relatorio_landing_pages(
+            property_id=property_id,
+            site_url=site_url,
+            data_inicio=data.get('data_inicio', '28daysAgo'),
+            data_fim=data.get('data_fim', 'today'),
+            metricas_ga4=data.get('metricas_ga4'),
+            limite=data.get('limite', 1000),
+            tipo_juncao=data.get('tipo_juncao', 'completa'),
+            layout=layout,
+            tenant=tenant,
+            consultar=consultar_fonte
+        )
+        
+        if "erro" in resultado:
+            return jsonify({
+                "erro": resultado["erro"],
+                "sucesso": False
+            }), 500
+        
+        return responder_json(resultado)
+        
+    except Exception as e:
+        log_error(f"Erro no relatório de landing pages: {str(e)}")
+        return jsonify({
+            "erro": f"Erro interno: {str(e)}",
+            "sucesso": False
+        }), 500
+
+FONTES_SERIE = ("ga4", "search_console")
+
+def preparar_serie(data):
+    """
+    Valida o corpo de /reports/series e monta o plano da análise.
+    
+    Returns:
+        tuple: (plano, mensagem de erro ou None)
+    """
+    property_id = data.get('property_id')
+    site_url = data.get('site_url')
+    fonte = data.get('fonte') or ("search_console" if site_url and not property_id else "ga4")
+    if fonte not in FONTES_SERIE:
+        return None, f"fonte inválida: '{fonte}'. Use um de: {', '.join(FONTES_SERIE)}"
+    if fonte == "ga4" and not property_id:
+        return None, "property_id é obrigatório para a fonte ga4"
+    if fonte == "search_console" and not site_url:
+        return None, "site_url é obrigatório para a fonte search_console"
+    
+    tenant = obter_tenant(data)
+    erro_tenant_consulta = mensagem_erro_tenant(tenant)
+    if erro_tenant_consulta:
+        return None, erro_tenant_consulta
+    
+    try:
+        inicio = resolver_data(data.get('data_inicio', '90daysAgo'))
+        fim = resolver_data(data.get('data_fim', 'yesterday'))
+    except ValueError:
+        return None, "Datas inválidas: use YYYY-MM-DD, today, yesterday ou NdaysAgo"
+    dias = (fim - inicio).days + 1
+    if dias < 14:
+        return None, "O período precisa ter pelo menos 14 dias"
+    if dias > MAX_DIAS_SERIE:
+        return None, f"O período pode ter no máximo {MAX_DIAS_SERIE} dias"
+    
+    # bool é subclasse de int em Python: true/false do JSON não valem como números
+    inteiros = {}
+    for campo, padrao, maximo in (('janela_media', 7, 90), ('max_anomalias', MAX_ANOMALIAS, 100), ('top_contribuintes', 10, 100)):
+        valor = data.get(campo, padrao)
+        if isinstance(valor, bool) or not isinstance(valor, int) or not 1 <= valor <= maximo:
+            return None, f"{campo} deve ser um inteiro entre 1 e {maximo}"
+        inteiros[campo] = valor
+    metodo = data.get('metodo_anomalia', 'sazonal')
+    if metodo not in METODOS_ANOMALIA:
+        return None, f"metodo_anomalia inválido: '{metodo}'. Use um de: {', '.join(METODOS_ANOMALIA)}"
+    limiar = data.get('limiar_z', LIMIAR_Z_PADRAO)
+    if isinstance(limiar, bool) or not isinstance(limiar, (int, float)) or limiar <= 0:
+        return None, "limiar_z deve ser um número positivo"
+    comparar_ano = data.get('comparar_ano', True)
+    if not isinstance(comparar_ano, bool):
+        return None, "comparar_ano deve ser true ou false"
+    
+    dimensao = data.get('dimensao') or None
+    plano = {
+        "fonte": fonte,
+        "inicio": inicio,
+        "fim": fim,
+        "janela_media": inteiros['janela_media'],
+        "metodo": metodo,
+        "limiar": float(limiar),
+        "max_anomalias": inteiros['max_anomalias'],
+        "comparar_ano": comparar_ano,
+        "dimensao": dimensao,
+        "top_contribuintes": inteiros['top_contribuintes'],
+        "tenant": tenant
+    }
+    
+    if fonte == "ga4":
+        metrica = data.get('metrica', 'sessions')
+        filtro_campo, filtro_valor, filtro_condicao = ler_filtro_ga4(data.get('filtros', []))
+        erro_campos = validar_campos_ga4(property_id, ["date", dimensao or "", filtro_campo], [metrica], tenant)
+        if erro_campos:
+            return None, erro_campos
+        plano["aditiva"] = metrica_aditiva(metrica)
+        plano["consulta"] = {
+            "metrica": metrica,
+            "filtro_campo": filtro_campo,
+            "filtro_valor": filtro_valor,
+            "filtro_condicao": filtro_condicao,
+            "property_id": property_id,
+            "tenant": tenant
+        }
+    else:
+        nome = data.get('metrica', 'clicks')
+        metrica = METRICAS_SEARCH_CONSOLE.get(nome, nome)
+        if metrica not in METRICAS_SEARCH_CONSOLE.values():
+            return None, f"metrica inválida para o Search Console: '{nome}'. Use um de: {', '.join(METRICAS_SEARCH_CONSOLE)}"
+        plano["aditiva"] = metrica in METRICAS_SEARCH_CONSOLE_ADITIVAS
+        plano["consulta"] = {
+            "site_url": site_url,
+            "metrica_extra": True,
+            "filtros": data.get('filtros', []),
+            "query_filtro": data.get('query_filtro', ''),
+            "pagina_filtro": data.get('pagina_filtro', ''),
+            "layout": "linhas",
+            "metrica_ranking": "Cliques",
+            "top_k": TOP_K_PADRAO,
+            "orcamento_linhas": None,
+            "orcamento_bytes": None,
+            "incluir_dados": False,
+            "fatiar_por": "",
+            "tenant": tenant,
+            "incluir_tabela": True
+        }
+    plano["metrica"] = metrica
+    
+    if dimensao and not plano["aditiva"]:
+        return None, f"Contribuintes exigem uma métrica somável; '{metrica}' é taxa ou média"
+    return plano, None
+
+def valores_por_chave(plano, inicio, fim, dimensao, limite):
+    """
+    Soma da métrica por valor da dimensão entre inicio e fim, via executar_consulta (com cache).
+    
+    Returns:
+        tuple: ({valor da dimensão: métrica}, mensagem de erro ou None)
+    """
+    if plano["fonte"] == "ga4":
+        resultado = executar_consulta("ga4_query", {
+            **plano["consulta"],
+            "dimensao": dimensao,
+            "periodo": inicio.isoformat(),
+            "data_fim": fim.isoformat(),
+            "limite": limite,
+            "periodos": None
+        })
+        if resultado.startswith("[Erro]") or resultado.startswith("Erro:"):
+            return None, resultado
+        cabecalhos, linhas = interpretar_resultado_ga4(resultado)
+    else:
+        resultado = executar_consulta("search_console_query", {
+            **plano["consulta"],
+            "data_inicio": inicio.isoformat(),
+            "data_fim": fim.isoformat(),
+            "dimensoes": [dimensao],
+            "limite": limite
+        })
+        if "erro" in resultado:
+            return None, resultado["erro"]
+        tabela = resultado.get("tabela") or {"colunas": [], "linhas": []}
+        cabecalhos, linhas = tabela["colunas"], tabela["linhas"]
+    
+    if not linhas:
+        return {}, None
+    # A dimensão é a primeira coluna nas duas fontes
+    i_chave, i_metrica = 0, cabecalhos.index(plano["metrica"])
+    valores = {}
+    for linha in linhas:
+        numero = converter_numero(linha[i_metrica])
+        if isinstance(numero, (int, float)):
+            valores[linha[i_chave]] = valores.get(linha[i_chave], 0.0) + numero
+    return valores, None
+
+def serie_diaria(plano, inicio, fim, aparar_atraso=False):
+    """
+    Valores diários da métrica entre inicio e fim (veja preencher_serie para os dias sem dados).
+    
+    Com aparar_atraso, no Search Console os últimos dias ainda não publicados
+    (sem nenhuma linha) saem do fim da série.
+    
+    Returns:
+        tuple: (lista de valores, mensagem de erro ou None)
+    """
+    pontos, erro = valores_por_chave(plano, inicio, fim, "date", (fim - inicio).days + 1)
+    if erro:
+        return None, erro
+    pontos = {resolver_data(str(dia)): valor for dia, valor in pontos.items()}
+    if aparar_atraso and plano["fonte"] == "search_console":
+        fim = fim_com_dados(pontos, inicio, fim, ATRASO_SEARCH_CONSOLE_DIAS)
+    return preencher_serie(pontos, inicio, fim, aditiva=plano["aditiva"]), None
+
+@app.route('/reports/series', methods=['POST'])
+@admitir()
+def query_series_report():
+    """Análise de uma série diária (tendência, variações, anomalias e contribuintes) sem devolver a série."""
+    try:
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({
+                "erro": "Dados da requisição não fornecidos",
+                "sucesso": False
+            }), 400
+        
+        plano, erro = preparar_serie(data)
+        if erro:
+            return jsonify({
+                "erro": erro,
+                "sucesso": False
+            }), 400
+        
+        inicio, fim = plano["inicio"], plano["fim"]
+        log_info(f"Série {plano['fonte']}: {plano['metrica']} de {inicio} a {fim}")
+        vencidos = []
+        
+        valores, erro = serie_diaria(plano, inicio, fim, aparar_atraso=True)
+        vencidos.append(resultado_vencido.get())
+        if erro:
+            return jsonify({
+                "erro": erro,
+                "sucesso": False
+            }), 500
+        # Dias ainda não publicados saíram da série: o ano anterior e os contribuintes seguem o novo fim
+        fim = inicio + timedelta(days=len(valores) - 1)
+        
+        # Mesmos 7 dias do ano anterior, com o mesmo dia da semana
+        ano_anterior = None
+        if plano["comparar_ano"]:
+            deslocamento = timedelta(days=DIAS_ANO_ALINHADO)
+            ano_anterior, erro = serie_diaria(plano, fim - timedelta(days=6) - deslocamento, fim - deslocamento)
+            vencidos.append(resultado_vencido.get())
+            if erro:
+                log_error(f"Série do ano anterior indisponível: {erro}")
+        
+        resposta = {
+            "sucesso": True,
+            "fonte": plano["fonte"],
+            "metrica": plano["metrica"],
+            "dias_sem_dados_no_fim": (plano["fim"] - fim).days,
+            **analisar_serie(
+                inicio, valores, aditiva=plano["aditiva"], janela_media=plano["janela_media"],
+                metodo=plano["metodo"], limiar=plano["limiar"], max_anomalias=plano["max_anomalias"],
+                ano_anterior=ano_anterior
+            )
+        }
+        
+        # Contribuintes: últimos 7 dias contra os 7 anteriores, por valor da dimensão
+        if plano["dimensao"]:
+            atual_inicio, anterior_fim = fim - timedelta(days=6), fim - timedelta(days=7)
+            anterior_inicio = anterior_fim - timedelta(days=6)
+            atual, erro = valores_por_chave(plano, atual_inicio, fim, plano["dimensao"], 10000)
+            vencidos.append(resultado_vencido.get())
+            if not erro:
+                anterior, erro = valores_por_chave(plano, anterior_inicio, anterior_fim, plano["dimensao"], 10000)
+                vencidos.append(resultado_vencido.get())
+            if erro:
+                return jsonify({
+                    "erro": erro,
+                    "sucesso": False
+                }), 500
+            resposta["contribuintes"] = {
+                "dimensao": plano["dimensao"],
+                "periodo_atual": f"{atual_inicio.isoformat()} a {fim.isoformat()}",
+                "periodo_anterior": f"{anterior_inicio.isoformat()} a {anterior_fim.isoformat()}",
+                **contribuintes(atual, anterior, plano["top_contribuintes"])
+            }
+        
+        aviso = next((v for v in vencidos if v), None)
+        if aviso:
+            resposta["resultado_vencido"] = aviso
+        return responder_json(resposta)
+        
+    except Sobrecarga as e:
+        return resposta_sobrecarga(e)
+    except Exception as e:
+        log_error(f"Erro na análise da série: {str(e)}")
+        return jsonify({
+            "erro": f"Erro interno: {str(e)}",
+            "sucesso": False
+        }), 500
+
+def executar_job_ga4(data):
+    """Executa /ga4/query em segundo plano."""
+    argumentos, _ = preparar_consulta_ga4(data)
+    return processar_consulta_ga4(data, executar_consulta("ga4_query", argumentos))
+
+def executar_job_pivot(data):
+    """Executa /ga4/pivot em segundo plano."""
+    argumentos, _ = preparar_consulta_pivot(data)
+    return processar_consulta_pivot(data, executar_consulta("ga4_pivot", argumentos))
+
+def executar_job_search_console(data):
+    """Executa /search-console/query em segundo plano."""
+    argumentos, _ = preparar_consulta_search_console(data)
+    resultado = processar_consulta_search_console(data, executar_consulta("search_console_query", argumentos))
+    return resultado, 500 if "erro" in resultado else 200
+
+# Tipos de job: (validação do corpo, execução em segundo plano)
+TIPOS_JOB = {
+    "ga4_query": (preparar_consulta_ga4, executar_job_ga4),
+    "ga4_pivot": (preparar_consulta_pivot, executar_job_pivot),
+    "search_console_query": (preparar_consulta_search_console, executar_job_search_console)
+}
+
+def links_job(job_id):
+    """URLs de acompanhamento de um job."""
+    return {
+        "status": f"/jobs/{job_id}",
+        "resultado": f"/jobs/{job_id}/resultado"
+    }
+
+@app.route('/jobs', methods=['POST'])
+@admitir()
+def submit_job():
+    """Enfileira uma consulta longa para execução em segundo plano."""
+    try:
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({
+                "erro": "Dados da requisição não fornecidos",
+                "sucesso": False
+            }), 400
+        
+        tipo = data.get('tipo')
+        parametros = data.get('parametros') or {}
+        if tipo not in TIPOS_JOB:
+            return jsonify({
+                "erro": f"tipo inválido: '{tipo}'. Use um de: {', '.join(TIPOS_JOB)}",
+                "sucesso": False
+            }), 400
+        
+        # O tenant do cabeçalho é fixado nos parâmetros: o worker não tem contexto de requisição
+        parametros = {**parametros, "tenant": obter_tenant(parametros)}
+        
+        preparar, executar = TIPOS_JOB[tipo]
+        _, erro = preparar(parametros)
+        if erro:
+            return jsonify({
+                "erro": erro,
+                "sucesso": False
+            }), 400
+        
+        try:
+            job = gerenciador_jobs.submeter(tipo, executar, parametros, parametros["tenant"])
+        except FilaJobsCheia as e:
+            return jsonify({
+                "erro": str(e),
+                "sucesso": False
+            }), 503
+        
+        log_info(f"Job {job['job_id']} criado ({tipo})")
+        return jsonify({
+            "sucesso": True,
+            "job": job,
+            "links": links_job(job['job_id'])
+        }), 202
+        
+    except Exception as e:
+        log_error(f"Erro ao criar job: {str(e)}")
+        return jsonify({
+            "erro": f"Erro interno: {str(e)}",
+            "sucesso": False
+        }), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Status e progresso de um job do tenant."""
+    job = gerenciador_jobs.status(job_id, obter_tenant({}))
+    if job is None:
+        return jsonify({
+            "erro": "Job não encontrado ou expirado",
+            "sucesso": False
+        }), 404
+    
+    return jsonify({
+        "sucesso": True,
+        "job": job,
+        "links": links_job(job_id)
+    })
+
+@app.route('/jobs/<job_id>/resultado', methods=['GET'])
+def get_job_result(job_id):
+    """Resultado de um job finalizado do tenant."""
+    job, payload, status_http = gerenciador_jobs.resultado(job_id, obter_tenant({}))
+    if job is None:
+        return jsonify({
+            "erro": "Job não encontrado ou expirado",
+            "sucesso": False
+        }), 404
+    
+    if job["status"] not in STATUS_FINAIS:
+        return jsonify({
+            "erro": "Job ainda não finalizado",
+            "sucesso": False,
+            "job": job
+        }), 409
+    
+    if payload is None:
+        return jsonify({
+            "erro": job["mensagem"],
+            "sucesso": False,
+            "job": job
+        }), 410
+    
+    return responder_json(payload, status_http)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancela um job do tenant que ainda não começou."""
+    tenant = obter_tenant({})
+    if gerenciador_jobs.cancelar(job_id, tenant):
+        return jsonify({
+            "sucesso": True,
+            "job": gerenciador_jobs.status(job_id, tenant)
+        })
+    
+    if gerenciador_jobs.status(job_id, tenant) is None:
+        return jsonify({
+            "erro": "Job não encontrado ou expirado",
+            "sucesso": False
+        }), 404
+    
+    return jsonify({
+        "erro": "Job já em execução ou finalizado",
+        "sucesso": False
+    }), 409
+
+def preparar_exportacao(data):
+    """
+    Valida o corpo de POST /exports.
+    
+    Returns:
+        tuple: ((fonte, formato, parametros, tenant), mensagem de erro ou None)
+    """
+    fonte = data.get('fonte')
+    formato = data.get('formato', 'csv')
+    parametros = data.get('parametros') or {}
+    
+    if fonte not in ("ga4", "search_console"):
+        return None, f"fonte inválida: '{fonte}'. Use ga4 ou search_console"
+    if formato not in FORMATOS:
+        return None, f"formato inválido: '{formato}'. Use um de: {', '.join(FORMATOS)}"
+    if formato not in formatos_disponiveis():
+        return None, "O formato parquet requer o pacote pyarrow, que não está instalado"
+    
+    tenant = obter_tenant({"tenant": parametros.get('tenant') or data.get('tenant')})
+    erro_tenant_consulta = mensagem_erro_tenant(tenant)
+    if erro_tenant_consulta:
+        return None, erro_tenant_consulta
+    
+    if fonte == "ga4":
+        if not parametros.get('property_id') or not parametros.get('dimensoes') or not parametros.get('metricas'):
+            return None, "property_id, dimensoes e metricas são obrigatórios"
+        filtro_campo, _, _ = ler_filtro_ga4(parametros.get('filtros', []))
+        erro_campos = validar_campos_ga4(parametros['property_id'], parametros['dimensoes'] + [filtro_campo], parametros['metricas'], tenant)
+        if erro_campos:
+            return None, erro_campos
+        campos = ("property_id", "dimensoes", "metricas", "data_inicio", "data_fim", "filtros")
+    else:
+        if not parametros.get('site_url'):
+            return None, "site_url é obrigatório"
+        campos = ("site_url", "dimensoes", "data_inicio", "data_fim", "filtros", "query_filtro", "pagina_filtro")
+    
+    return (fonte, formato, {campo: parametros[campo] for campo in campos if campo in parametros}, tenant), None
+
+def executar_job_exportacao(data):
+    """Executa (ou retoma) uma exportação em segundo plano."""
+    exportacao = gerenciador_exportacoes.executar(data["export_id"])
+    status_http = {"concluido": 200, "executando": 409}.get(exportacao["status"], 500)
+    return {
+        "sucesso": status_http == 200,
+        "exportacao": exportacao,
+        "links": links_exportacao(data["export_id"])
+    }, status_http
+
+def links_exportacao(export_id):
+    """URLs de acompanhamento e download de uma exportação."""
+    return {
+        "status": f"/exports/{export_id}",
+        "arquivo": f"/exports/{export_id}/arquivo",
+        "retomar": f"/exports/{export_id}/retomar"
+    }
+
+def enfileirar_exportacao(exportacao):
+    """Submete a execução da exportação como job e monta a resposta 202."""
+    try:
+        job = gerenciador_jobs.submeter(
+            "exportacao", executar_job_exportacao, {"export_id": exportacao["export_id"]}, exportacao["tenant"]
+        )
+    except FilaJobsCheia as e:
+        return jsonify({
+            "erro": str(e),
+            "sucesso": False,
+            "exportacao": exportacao
+        }), 503
+    
+    return jsonify({
+        "sucesso": True,
+        "exportacao": exportacao,
+        "job": job,
+        "links": {**links_exportacao(exportacao["export_id"]), "job": f"/jobs/{job['job_id']}"}
+    }), 202
+
+@app.route('/exports', methods=['POST'])
+@admitir()
+def create_export():
+    """Cria uma exportação completa do GA4 ou do Search Console em CSV ou Parquet."""
+    if os.environ.get('SKIP_GOOGLE_INIT'):
+        return jsonify({"erro": "Modo de teste - Google APIs não disponíveis", "sucesso": False}), 503
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        preparado, erro = preparar_exportacao(data)
+        if erro:
+            return jsonify({
+                "erro": erro,
+                "sucesso": False
+            }), 400
+        
+        fonte, formato, parametros, tenant = preparado
+        exportacao = gerenciador_exportacoes.criar(fonte, formato, parametros, tenant)
+        log_info(f"Exportação {exportacao['export_id']} criada ({fonte}, {formato})")
+        return enfileirar_exportacao(exportacao)
+        
+    except Exception as e:
+        log_error(f"Erro ao criar exportação: {str(e)}")
+        return jsonify({
+            "erro": f"Erro interno: {str(e)}",
+            "sucesso": False
+        }), 500
+
+@app.route('/exports/<export_id>', methods=['GET'])
+def get_export(export_id):
+    """Manifesto da exportação: status, partes prontas, linhas e arquivo final."""
+    exportacao = gerenciador_exportacoes.obter(export_id, obter_tenant({}))
+    if exportacao is None:
+        return jsonify({
+            "erro": "Exportação não encontrada ou expirada",
+            "sucesso": False
+        }), 404
+    
+    return jsonify({
+        "sucesso": True,
+        "exportacao": exportacao,
+        "links": links_exportacao(export_id)
+    })
+
+@app.route('/exports/<export_id>/retomar', methods=['POST'])
+def resume_export(export_id):
+    """Retoma uma exportação interrompida ou com erro a partir do último checkpoint."""
+    exportacao = gerenciador_exportacoes.obter(export_id, obter_tenant({}))
+    if exportacao is None:
+        return jsonify({
+            "erro": "Exportação não encontrada ou expirada",
+            "sucesso": False
+        }), 404
+    
+    if exportacao["status"] in ("concluido", "executando"):
+        return jsonify({
+            "erro": f"Exportação já {'concluída' if exportacao['status'] == 'concluido' else 'em execução'}",
+            "sucesso": False,
+            "exportacao": exportacao
+        }), 409
+    
+    log_info(f"Retomando exportação {export_id} com {exportacao['partes_prontas']} partes prontas")
+    return enfileirar_exportacao(exportacao)
+
+@app.route('/exports/<export_id>/arquivo', methods=['GET'])
+def download_export(export_id):
+    """Arquivo final da exportação, com suporte a requisições Range (download retomável)."""
+    tenant = obter_tenant({})
+    caminho = gerenciador_exportacoes.caminho_arquivo(export_id, tenant)
+    if caminho is None:
+        exportacao = gerenciador_exportacoes.obter(export_id, tenant)
+        if exportacao is None:
+            return jsonify({
+                "erro": "Exportação não encontrada ou expirada",
+                "sucesso": False
+            }), 404
+        return jsonify({
+            "erro": "Exportação ainda não concluída",
+            "sucesso": False,
+            "exportacao": exportacao
+        }), 409
+    
+    formato = caminho.rsplit('.', 1)[-1]
+    return send_file(
+        caminho,
+        mimetype=TIPOS_MIME[formato],
+        as_attachment=True,
+        download_name=os.path.basename(caminho),
+        conditional=True
+    )
+
+@app.route('/tabelas/<tabela_id>', methods=['GET'])
+def get_tabela(tabela_id):
+    """Colunas e tamanho de uma tabela guardada para recortes locais."""
+    entrada = armazem_tabelas.obter(tabela_id, obter_tenant({}))
+    if entrada is None:
+        return jsonify({
+            "erro": "Tabela não encontrada ou expirada; refaça a consulta original",
+            "sucesso": False
+        }), 404
+    return jsonify({
+        "sucesso": True,
+        "tabela_id": tabela_id,
+        "origem": entrada["origem"]["tipo"],
+        **entrada["tabela"].descricao()
+    })
+
+@app.route('/tabelas/<tabela_id>/consulta', methods=['POST'])
+def query_tabela(tabela_id):
+    """Filtra, agrupa, agrega e ordena uma tabela já consultada, sem chamar o GA4 ou o Search Console."""
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        layout = obter_layout(data)
+        if layout not in LAYOUTS_VALIDOS:
+            return jsonify({
+                "erro": mensagem_erro_layout(layout),
+                "sucesso": False
+            }), 400
+        
+        entrada = armazem_tabelas.obter(tabela_id, obter_tenant(data))
+        if entrada is None:
+            return jsonify({
+                "erro": "Tabela não encontrada ou expirada; refaça a consulta original",
+                "sucesso": False
+            }), 404
+        
+        try:
+            resultado = consultar_tabela(entrada["tabela"], data, layout=layout)
+        except (ValueError, TypeError) as e:
+            return jsonify({
+                "erro": str(e),
+                "sucesso": False
+            }), 400
+        
+        return responder_json({
+            "sucesso": True,
+            "tabela_id": tabela_id,
+            **resultado
+        })
+        
+    except Exception as e:
+        log_error(f"Erro na consulta local da tabela {tabela_id}: {str(e)}")
+        return jsonify({
+            "erro": f"Erro interno: {str(e)}",
+            "sucesso": False
+        }), 500
+
+@app.route('/tenants', methods=['GET'])
+def get_tenants():
+    """Tenants com credenciais configuradas, estado do pool de clientes e renovação dos tokens."""
+    return jsonify({
+        "sucesso": True,
+        "tenants": listar_tenants(),
+        "pool_clientes": pool_clientes.estatisticas(),
+        "tokens": renovador_tokens.estatisticas()
+    })
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Estado do cache, consultas mais frequentes, pré-aquecimento e caminhos de hedging/vencidos."""
+    top = request.args.get('top', '10')
+    if not top.isdigit() or int(top) < 1:
+        return jsonify({
+            "erro": "top deve ser um inteiro maior ou igual a 1",
+            "sucesso": False
+        }), 400
+    
+    frequentes = [
+        {
+            "tipo": registro["tipo"],
+            "acessos": registro["acessos"],
+            "ultimo_acesso": datetime.fromtimestamp(registro["ultimo_acesso"]).strftime("%Y-%m-%dT%H:%M:%S"),
+            "argumentos": registro["argumentos"]
+        }
+        for registro in contador_consultas.mais_frequentes(int(top))
+    ]
+    return jsonify({
+        "sucesso": True,
+        "cache": cache_resultados.estatisticas(),
+        "consultas_frequentes": frequentes,
+        "preaquecimento": agendador_preaquecimento.estado(),
+        "upstream": chamadas_upstream.estatisticas(),
+        "realtime": gerenciador_realtime.estatisticas(),
+        "admissao": controle_admissao.estatisticas(),
+        "lotes_ga4": agrupador_relatorios.estatisticas(),
+        "planejador": planejador_consultas.estatisticas()
+    })
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({
@@ -371,6 +2152,14 @@ def internal_error(error):
         "sucesso": False
     }), 500
 
+if not os.environ.get('SKIP_GOOGLE_INIT'):
+    cache_metadados_ga4.carregador = obter_metadados_ga4
+    gerenciador_exportacoes.fontes = {
+        "ga4": paginas_relatorio_ga4,
+        "search_console": paginas_search_console
+    }
+    agendador_preaquecimento.iniciar(funcoes_consulta())
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('DEBUG', 'false').lower() == 'true'
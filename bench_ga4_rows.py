@@ -0,0 +1,94 @@
+"""
+Micro-benchmark da conversão de respostas do GA4: wrappers proto-plus x protobuf direto.
+
+Monta uma RunReportResponse sintética (sem chamar a API) e mede os dois
+caminhos de conversão usados pelas consultas: linhas em texto (consulta_ga4,
+pivot e tempo real) e linhas tipadas (paginas_relatorio_ga4, exportações).
+
+Uso:
+    python bench_ga4_rows.py [--linhas 100000] [--repeticoes 3]
+"""
+
+import argparse
+import time
+
+from google.analytics.data_v1beta.types import MetricType, RunReportResponse
+
+from agents.ga4_rows import linhas_tipadas, valores_texto
+
+
+def montar_resposta(n_linhas: int) -> RunReportResponse:
+    """Resposta com 2 dimensões e 3 métricas (inteira, decimal e inteira), como um relatório por página."""
+    mensagem = RunReportResponse.pb()()
+    for nome in ("country", "pagePath"):
+        mensagem.dimension_headers.add(name=nome)
+    for nome, tipo in (("sessions", MetricType.TYPE_INTEGER), ("bounceRate", MetricType.TYPE_FLOAT),
+                       ("screenPageViews", MetricType.TYPE_INTEGER)):
+        mensagem.metric_headers.add(name=nome, type_=tipo)
+    for i in range(n_linhas):
+        linha = mensagem.rows.add()
+        linha.dimension_values.add(value=("Brazil", "Chile", "Peru")[i % 3])
+        linha.dimension_values.add(value=f"/produtos/item-{i}")
+        linha.metric_values.add(value=str(i % 5000))
+        linha.metric_values.add(value=f"0.{i % 997:03d}")
+        linha.metric_values.add(value=str(i % 12000))
+    mensagem.row_count = n_linhas
+    return RunReportResponse.wrap(mensagem)
+
+
+def texto_proto_plus(response) -> list[list[str]]:
+    """Caminho anterior de consulta_ga4: acesso pelos wrappers proto-plus."""
+    return [
+        [d.value for d in row.dimension_values] + [m.value for m in row.metric_values]
+        for row in response.rows
+    ]
+
+
+def tipadas_proto_plus(response) -> list[tuple]:
+    """Caminho anterior de paginas_relatorio_ga4."""
+    inteiras = [h.type_ == MetricType.TYPE_INTEGER for h in response.metric_headers]
+    return [
+        tuple(v.value for v in row.dimension_values) + tuple(
+            int(v.value) if inteira else float(v.value)
+            for v, inteira in zip(row.metric_values, inteiras)
+        )
+        for row in response.rows
+    ]
+
+
+def medir(funcao, repeticoes: int) -> float:
+    """Melhor tempo, em segundos, entre as repetições."""
+    melhor = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        duracao = time.perf_counter() - inicio
+        melhor = duracao if melhor is None else min(melhor, duracao)
+    return melhor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--linhas", type=int, default=100000)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+
+    response = montar_resposta(args.linhas)
+    # Os dois caminhos precisam dar o mesmo resultado
+    assert texto_proto_plus(response) == valores_texto(response)
+    assert tipadas_proto_plus(response) == linhas_tipadas(response)[2]
+
+    print(f"Conversão de {args.linhas} linhas (melhor de {args.repeticoes})")
+    casos = [
+        ("texto", lambda: texto_proto_plus(response), lambda: valores_texto(response)),
+        ("tipadas", lambda: tipadas_proto_plus(response), lambda: linhas_tipadas(response))
+    ]
+    for nome, anterior, protobuf in casos:
+        t_anterior = medir(anterior, args.repeticoes)
+        t_protobuf = medir(protobuf, args.repeticoes)
+        print(f"  {nome:8s} proto-plus {t_anterior * 1000:9.1f} ms | protobuf {t_protobuf * 1000:8.1f} ms | "
+              f"{t_anterior / t_protobuf:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
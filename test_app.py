@@ -6,6 +6,8 @@ Este teste não requer credenciais do Google.
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Os testes limpam o cache: nunca o arquivo em disco real do host
+os.environ["CACHE_DISCO_CAMINHO"] = ""
 
 def test_basic_import():
     """Testa se os imports básicos funcionam."""
@@ -47,9 +49,27 @@ def test_app_creation():
             'GET /ga4/accounts',
             'POST /ga4/query',
             'POST /ga4/pivot',
+            'GET /ga4/metadata',
+            'POST /ga4/realtime',
+            'GET /ga4/realtime/stream',
+            'POST /ga4/portfolio',
             'GET /search-console/sites',
             'POST /search-console/query',
-            'POST /search-console/verify'
+            'POST /search-console/verify',
+            'POST /reports/landing-pages',
+            'POST /reports/series',
+            'POST /jobs',
+            'GET /jobs/<job_id>',
+            'GET /jobs/<job_id>/resultado',
+            'DELETE /jobs/<job_id>',
+            'POST /exports',
+            'GET /exports/<export_id>',
+            'POST /exports/<export_id>/retomar',
+            'GET /exports/<export_id>/arquivo',
+            'GET /tabelas/<tabela_id>',
+            'POST /tabelas/<tabela_id>/consulta',
+            'GET /tenants',
+            'GET /cache/stats'
         ]
         
         print(f"OK Encontradas {len(routes)} rotas:")
@@ -82,6 +102,1111 @@ def test_health_endpoint():
         print(f"ERROR Erro no teste do endpoint de saude: {e}")
         return False
 
+def test_columnar_layout():
+    """Testa a conversão para o layout colunar e a volta para linhas."""
+    from agents.columnar import montar_colunar, expandir_colunar
+    
+    colunas = ['country', 'sessions', 'engagementRate']
+    linhas = [
+        ['Brazil', '120', '0.5'],
+        ['Brazil', '80', '0.25'],
+        ['Brazil', '40', '0.75'],
+        ['Portugal', '10', '1'],
+    ]
+    tabela = montar_colunar(colunas, linhas, colunas_dimensao=['country'])
+    
+    assert tabela['tipos'] == ['string', 'integer', 'number']
+    assert tabela['dicionarios'] == {'country': ['Brazil', 'Portugal']}
+    assert tabela['valores'][0] == [0, 0, 0, 1]
+    assert tabela['valores'][1] == [120, 80, 40, 10]
+    assert expandir_colunar(tabela)[3] == {'country': 'Portugal', 'sessions': 10, 'engagementRate': 1}
+    print("OK Layout colunar com tipos e dicionário corretos")
+    return True
+
+def test_conditional_responses():
+    """Testa ETag estável e negociação de compressão."""
+    from agents.responses import serializar_json, calcular_etag, etag_corresponde, escolher_codificacao
+    
+    etag = calcular_etag(serializar_json({"b": 1, "a": [1, 2]}))
+    assert etag == calcular_etag(serializar_json({"a": [1, 2], "b": 1}))
+    assert etag_corresponde(f'"outro", {etag[2:]}', etag)
+    assert not etag_corresponde('"outro"', etag)
+    
+    assert escolher_codificacao("gzip;q=0.5, br") in ("br", "gzip")
+    assert escolher_codificacao("br;q=0, gzip") == "gzip"
+    assert escolher_codificacao("identity") is None
+    print("OK ETag estável e compressão negociada")
+    return True
+
+def test_summary_top_k():
+    """Testa o resumo top-K com cauda agrupada e orçamento de linhas."""
+    from agents.summary import resumir_tabela
+    
+    colunas = ['page', 'clicks', 'impressions', 'ctr']
+    linhas = [['/a', 50, 100, 0.5], ['/b', 30, 300, 0.1], ['/c', 15, 150, 0.1], ['/d', 5, 50, 0.1]]
+    resumo = resumir_tabela(
+        colunas, linhas, 'clicks',
+        colunas_dimensao=['page'],
+        top_k=3,
+        orcamento_linhas=3,
+        razoes={'ctr': ('clicks', 'impressions')}
+    )
+    
+    assert [linha['page'] for linha in resumo['top']] == ['/a', '/b']
+    assert resumo['top'][0]['participacao'] == 50.0
+    assert resumo['outros']['clicks'] == 20 and resumo['outros']['linhas_agrupadas'] == 2
+    assert resumo['outros']['ctr'] == 0.1
+    assert resumo['totais']['clicks'] == 100
+    assert resumo['truncado_por_orcamento']
+    # Orçamento zero: nem o bucket "outros" cabe
+    vazio = resumir_tabela(colunas, linhas, 'clicks', colunas_dimensao=['page'], orcamento_linhas=0)
+    assert vazio['top'] == [] and vazio['outros'] is None and vazio['truncado_por_orcamento']
+    
+    # userEngagementDuration é uma soma de segundos: entra somada no "outros" e nas agregações locais
+    from agents.summary import metrica_aditiva
+    from agents.tables import TabelaLocal, agregacoes_padrao
+    assert metrica_aditiva('userEngagementDuration') and metrica_aditiva('customEvent:valor')
+    assert not metrica_aditiva('averageSessionDuration') and not metrica_aditiva('sessionsPerUser')
+    assert not metrica_aditiva('averageCustomEvent:valor')
+    colunas = ['page', 'userEngagementDuration', 'averageSessionDuration']
+    linhas = [['/a', 600, 60.0], ['/b', 300, 30.0], ['/c', 100, 10.0]]
+    resumo = resumir_tabela(colunas, linhas, 'userEngagementDuration', colunas_dimensao=['page'], top_k=1,
+                            aditivas=[c for c in colunas[1:] if metrica_aditiva(c)])
+    assert resumo['outros']['userEngagementDuration'] == 400
+    tabela = TabelaLocal(colunas, ['page'], linhas)
+    assert agregacoes_padrao(tabela, []) == [
+        {"campo": "userEngagementDuration", "funcao": "soma"}, {"campo": "averageSessionDuration", "funcao": "media"}
+    ]
+    
+    # Parâmetros inválidos retornam 400 antes da consulta
+    os.environ['SKIP_GOOGLE_INIT'] = 'true'
+    import app as aplicacao
+    client = aplicacao.app.test_client()
+    corpo = {"property_id": "123", "dimensoes": ["pagePath"], "metricas": ["sessions"]}
+    for campo, valor in (("top_k", "abc"), ("orcamento_linhas", -1), ("orcamento_bytes", True)):
+        resposta = client.post('/ga4/query', json={**corpo, campo: valor})
+        assert resposta.status_code == 400 and campo in resposta.get_json()["erro"]
+    print("OK Resumo top-K com bucket 'outros' e orçamento")
+    return True
+
+def test_landing_page_join():
+    """Testa a normalização de URLs e o hash join do relatório de landing pages."""
+    from agents.landing_pages import normalizar_url, juntar_por_url
+    
+    assert normalizar_url("https://Example.com:443/blog?utm=x#topo", "example.com") == "example.com/blog/"
+    assert normalizar_url("/blog/", "example.com") == "example.com/blog/"
+    assert normalizar_url("(not set)", "example.com") is None
+    
+    indice_sc = {"example.com/blog/": {"Cliques": 10}, "example.com/sobre/": {"Cliques": 2}}
+    indice_ga4 = {"example.com/blog/": {"sessions": 40}}
+    completa = juntar_por_url(indice_sc, indice_ga4, "completa")
+    interna = juntar_por_url(indice_sc, indice_ga4, "interna")
+    
+    assert len(completa) == 2
+    assert interna == [{"pagina": "https://example.com/blog/", "Cliques": 10, "sessions": 40}]
+    
+    # Propriedade de domínio: o Search Console traz o subdomínio real, o GA4 só o caminho (o host vem de hostName)
+    from agents.columnar import montar_colunar
+    from agents.landing_pages import relatorio_landing_pages
+    consultas = []
+    def consultar(tipo, argumentos):
+        consultas.append(tipo)
+        if tipo == "search_console_query":
+            colunas = ["Página", "Cliques", "Impressões", "CTR", "Posição Média"]
+            return {"dados": montar_colunar(colunas, [["https://www.example.com/blog/", 10, 100, 0.1, 3.0]], ["Página"])}
+        return "hostName | landingPage | sessions\nwww.example.com | /blog/?utm=x | 40\n(not set) | /sobre | 5"
+    relatorio = relatorio_landing_pages("123", "sc-domain:example.com", metricas_ga4=["sessions"], consultar=consultar)
+    assert sorted(consultas) == ["ga4_query", "search_console_query"]
+    assert relatorio["dados"][0] == {
+        "pagina": "https://www.example.com/blog/", "Cliques": 10, "Impressões": 100, "CTR": 0.1, "Posição Média": 3.0, "sessions": 40
+    }
+    assert relatorio["dados"][1]["pagina"] == "https://example.com/sobre/"
+    print("OK Junção de landing pages por URL normalizada")
+    return True
+
+def test_period_comparison():
+    """Testa a separação por período e os deltas em relação ao período base."""
+    from agents.comparison import comparar_periodos, validar_periodos
+    
+    cabecalhos = ['country', 'dateRange', 'sessions']
+    linhas = [['BR', 'atual', '120'], ['BR', 'anterior', '100'], ['PT', 'anterior', '10']]
+    resultado = comparar_periodos(cabecalhos, linhas, ['sessions'], ['atual', 'anterior'])
+    
+    brasil = resultado['comparacao'][0]
+    assert brasil['country'] == 'BR'
+    assert brasil['sessions']['delta_anterior'] == 20
+    assert brasil['sessions']['variacao_pct_anterior'] == 20.0
+    assert resultado['totais']['sessions']['anterior'] == 110
+    assert len(resultado['por_periodo']['anterior']) == 2
+    assert validar_periodos([{"data_inicio": "7daysAgo"}])
+    assert "nome" in validar_periodos([{"data_inicio": "7daysAgo", "data_fim": "today", "nome": 2024}])
+    assert validar_periodos([{"data_inicio": 20240101, "data_fim": "today"}])
+    
+    # O limite vale por período, sem passar do máximo de linhas do GA4
+    os.environ['SKIP_GOOGLE_INIT'] = 'true'
+    import app as aplicacao
+    periodos = [{"data_inicio": "14daysAgo", "data_fim": "8daysAgo"}, {"data_inicio": "7daysAgo", "data_fim": "today"}]
+    corpo = {"property_id": "123", "dimensoes": ["country"], "metricas": ["sessions"], "periodos": periodos}
+    assert aplicacao.preparar_consulta_ga4({**corpo, "limite": 50})[0]["limite"] == 100
+    assert aplicacao.preparar_consulta_ga4({**corpo, "limite": 200000})[0]["limite"] == aplicacao.GA4_MAX_LINHAS
+    assert "limite" in aplicacao.preparar_consulta_ga4({**corpo, "limite": "50"})[1]
+    print("OK Comparação entre períodos com deltas")
+    return True
+
+def test_async_jobs():
+    """Testa o ciclo de vida de um job e o limite de armazenamento de resultados."""
+    import time
+    from agents.jobs import STATUS_FINAIS, GerenciadorJobs, reportar_progresso
+    
+    def tarefa(parametros):
+        reportar_progresso(0.5, "metade")
+        return {"valor": parametros["valor"]}, 200
+    
+    def aguardar(job_id):
+        for _ in range(200):
+            if gerenciador.status(job_id)["status"] in STATUS_FINAIS:
+                return
+            time.sleep(0.01)
+    
+    gerenciador = GerenciadorJobs(max_workers=1, max_bytes=40)
+    primeiro = gerenciador.submeter("teste", tarefa, {"valor": "a" * 10})
+    assert primeiro["status"] in ("pendente", "executando")
+    aguardar(primeiro["job_id"])
+    
+    job, payload, status_http = gerenciador.resultado(primeiro["job_id"])
+    assert job["status"] == "concluido" and job["progresso"] == 1.0
+    assert payload == {"valor": "a" * 10} and status_http == 200
+    
+    # O segundo resultado não cabe junto com o primeiro: o mais antigo é descartado
+    segundo = gerenciador.submeter("teste", tarefa, {"valor": "b" * 10})
+    aguardar(segundo["job_id"])
+    job, payload, _ = gerenciador.resultado(primeiro["job_id"])
+    assert job["status"] == "expirado" and payload is None
+    assert gerenciador.resultado(segundo["job_id"])[1] == {"valor": "b" * 10}
+    assert gerenciador.status("inexistente") is None
+    
+    # Jobs de um tenant não aparecem nem podem ser cancelados por outro (404 nas rotas)
+    os.environ['SKIP_GOOGLE_INIT'] = 'true'
+    import app as aplicacao
+    job = aplicacao.gerenciador_jobs.submeter("teste", tarefa, {"valor": "c"}, "cliente-a")
+    cliente = aplicacao.app.test_client()
+    for _ in range(200):
+        if aplicacao.gerenciador_jobs.status(job["job_id"], "cliente-a")["status"] in STATUS_FINAIS:
+            break
+        time.sleep(0.01)
+    outro = {"X-Tenant-ID": "cliente-b"}
+    assert cliente.get(f"/jobs/{job['job_id']}", headers=outro).status_code == 404
+    assert cliente.get(f"/jobs/{job['job_id']}/resultado", headers=outro).status_code == 404
+    assert cliente.delete(f"/jobs/{job['job_id']}", headers=outro).status_code == 404
+    assert cliente.get(f"/jobs/{job['job_id']}").status_code == 404
+    resposta = cliente.get(f"/jobs/{job['job_id']}/resultado", headers={"X-Tenant-ID": "cliente-a"})
+    assert resposta.status_code == 200 and resposta.get_json() == {"valor": "c"}
+    print("OK Jobs assíncronos com limite de armazenamento")
+    return True
+
+def test_query_cache_prewarm():
+    """Testa o cache por assinatura canônica e a rodada de pré-aquecimento."""
+    from agents.cache import assinatura_consulta, cache_resultados, consultar_com_cache
+    from agents.prewarm import AgendadorPreaquecimento, interpretar_horarios
+    
+    chamadas = []
+    def consulta(**argumentos):
+        chamadas.append(argumentos)
+        return "country | sessions\nBR | 10"
+    
+    cache_resultados.limpar()
+    argumentos = {"property_id": "teste-cache", "dimensao": "country", "metrica": "sessions"}
+    assert assinatura_consulta("ga4_query", argumentos) == assinatura_consulta("ga4_query", dict(reversed(argumentos.items())))
+    for _ in range(3):
+        assert consultar_com_cache("ga4_query", consulta, argumentos) == "country | sessions\nBR | 10"
+    assert len(chamadas) == 1
+    
+    # Erros não vão para o cache
+    assert consultar_com_cache("ga4_pivot", lambda **_: "[Erro] falhou", {"property_id": "erro"}) == "[Erro] falhou"
+    assert consultar_com_cache("ga4_pivot", lambda **_: "ok", {"property_id": "erro"}) == "ok"
+    
+    agendador = AgendadorPreaquecimento(horarios="25:00, 07:30,x")
+    assert agendador.horarios == [(7, 30)]
+    agendador.consultas = {"ga4_query": consulta}
+    # Consultas que terminam hoje venceriam antes do expediente: não são pré-aquecidas
+    hoje = {**argumentos, "data_fim": "today"}
+    for _ in range(2):
+        consultar_com_cache("ga4_query", consulta, hoje)
+    rodada = agendador.executar_rodada()
+    assert rodada["aquecidas"] == 1 and rodada["falhas"] == 0 and rodada["ignoradas_terminam_hoje"] == 1
+    assert len(chamadas) == 3
+    cache_resultados.limpar()
+    
+    os.environ['SKIP_GOOGLE_INIT'] = 'true'
+    import app as aplicacao
+    cliente = aplicacao.app.test_client()
+    assert cliente.get('/cache/stats?top=abc').status_code == 400
+    assert cliente.get('/cache/stats?top=0').status_code == 400
+    assert len(cliente.get('/cache/stats?top=1').get_json()["consultas_frequentes"]) == 1
+    print("OK Cache de consultas e pré-aquecimento")
+    return True
+
+def test_ga4_metadata_validation():
+    """Testa a validação local de campos GA4 e a atualização dos metadados vencidos."""
+    import time
+    from agents.metadata import CacheMetadados, validar_campos
+    
+    cargas = []
+    def carregar(property_id, tenant):
+        cargas.append(property_id)
+        return {"dimensoes": {"country": "País"}, "metricas": {"sessions": "Sessões"}, "personalizadas": []}
+    
+    cache = CacheMetadados(ttl_segundos=3600)
+    assert cache.obter("123") is None  # sem carregador, não valida
+    cache.carregador = carregar
+    metadados = cache.obter("properties/123")
+    assert cache.obter("123") is metadados and cargas == ["123"]
+    
+    problemas = validar_campos(metadados, ["contry", "sessions"], ["Sessions"])
+    assert problemas[0]["sugestoes"] == ["country"]
+    assert problemas[1]["tipo_correto"] == "métrica"
+    assert problemas[2]["sugestoes"] == ["sessions"]
+    assert validar_campos(metadados, ["country"], ["sessions"]) == []
+    
+    # Metadados vencidos são devolvidos na hora e recarregados em segundo plano
+    cache.ttl_segundos = 0
+    metadados["carregado_em"] -= 1
+    assert cache.obter("123") is metadados
+    for _ in range(100):
+        if len(cargas) == 2 and cache.obter("123") is not metadados:
+            break
+        time.sleep(0.01)
+    assert len(cargas) >= 2
+    
+    # No pivot, cada dimensão da lista separada por vírgula é validada
+    os.environ['SKIP_GOOGLE_INIT'] = 'true'
+    import app as aplicacao
+    original = aplicacao.cache_metadados_ga4
+    aplicacao.cache_metadados_ga4 = CacheMetadados()
+    aplicacao.cache_metadados_ga4.carregador = carregar
+    try:
+        corpo = {"property_id": "123", "dimensao_principal": "country, contry", "dimensao_pivot": "country", "metricas": ["sessions"]}
+        argumentos, erro = aplicacao.preparar_consulta_pivot(corpo)
+        assert argumentos is None and "contry" in erro
+        argumentos, erro = aplicacao.preparar_consulta_pivot({**corpo, "dimensao_principal": " country ,"})
+        assert erro is None and argumentos["dimensao"] == "country"
+        assert aplicacao.preparar_consulta_pivot({**corpo, "dimensao_pivot": ["country"]})[0] is None
+        assert "metricas" in aplicacao.preparar_consulta_pivot({**corpo, "metricas": [1]})[1]
+        
+        # Nomes que não são texto: 400 antes de qualquer strip/join
+        assert validar_campos(metadados, [1], ["sessions"])[0]["campo"] == "1"
+        consulta = {"property_id": "123", "dimensoes": ["country"], "metricas": ["sessions"]}
+        assert "dimensoes" in aplicacao.preparar_consulta_ga4({**consulta, "dimensoes": [1]})[1]
+        assert "metricas" in aplicacao.preparar_consulta_ga4({**consulta, "metricas": "sessions"})[1]
+        resposta = aplicacao.app.test_client().post('/ga4/query', json={**consulta, "dimensoes": [1]})
+        assert resposta.status_code == 400 and "dimensoes" in resposta.get_json()["erro"]
+    finally:
+        aplicacao.cache_metadados_ga4 = original
+    print("OK Validação local de campos GA4")
+    return True
+
+def test_search_console_rows():
+    """Testa a tabela compacta do Search Console e a formatação só na saída."""
+    os.environ['SKIP_GOOGLE_INIT'] = 'true'
+    from agents.search_console import montar_linhas_search_console, tabela_search_console
+    
+    rows = [
+        {"keys": ["seo", "https://example.com/"], "clicks": 5, "impressions": 100, "ctr": 0.05, "position": 3.456},
+        {"keys": ["analytics"], "clicks": 1, "impressions": 50, "ctr": 0.02, "position": 7}
+    ]
+    colunas, colunas_dimensao, linhas = tabela_search_console(rows, ["query", "page"], True)
+    assert colunas_dimensao == ["Consulta", "Página"]
+    assert linhas[0] == ("seo", "https://example.com/", 5, 100, 0.05, 3.456)
+    assert linhas[1][:2] == ("analytics", "")
+    
+    registros = montar_linhas_search_console(colunas, linhas, True)
+    assert registros[0] == {
+        "Consulta": "seo", "Página": "https://example.com/",
+        "Cliques": 5, "Impressões": 100, "CTR": "5.00%", "Posição Média": "3.46"
+    }
+    _, _, basicas = tabela_search_console(rows, ["query"], False)
+    assert basicas[0] == ("seo", 5, 100)
+    print("OK Tabela compacta do Search Console")
+    return True
+
+def test_portfolio_merge():
+    """Testa a união de várias propriedades com totais entre propriedades."""
+    from agents.portfolio import propriedades_da_conta, relatorio_portfolio
+    
+    def interpretar(texto):
+        linhas = [l.split(" | ") for l in texto.split("\n")]
+        return linhas[0], linhas[1:]
+    
+    respostas = {
+        "p1": "channel | sessions | bounceRate\nOrganic | 10 | 0.5\nDirect | 2 | 0.3",
+        "p2": "channel | sessions | bounceRate\nOrganic | 5 | 0.4",
+        "p3": "[Erro] Consulta GA4 falhou: boom"
+    }
+    catalogo = {"contas": [{"id_conta": "accounts/7", "nome_conta": "Rede", "propriedades": [
+        {"property_id": pid, "nome_propriedade": pid.upper()} for pid in respostas
+    ]}]}
+    propriedades = propriedades_da_conta(catalogo, "7")
+    assert propriedades == propriedades_da_conta(catalogo, "Rede") and len(propriedades) == 3
+    
+    resultado = relatorio_portfolio(propriedades + propriedades[:1], respostas.get, interpretar, ["sessions", "bounceRate"])
+    assert resultado["propriedades_consultadas"] == 3
+    assert [e["property_id"] for e in resultado["propriedades_com_erro"]] == ["p3"]
+    assert resultado["totais"] == {"sessions": 17}
+    assert resultado["totais_por_dimensao"][0] == {"channel": "Organic", "sessions": 15, "propriedades": 2}
+    assert resultado["dados"][0] == {"property_id": "p1", "propriedade": "P1", "channel": "Organic", "sessions": 10, "bounceRate": 0.5}
+    
+    # Cota esgotada é reconhecida pelo status gRPC, não por "quota" no texto do erro
+    from google.api_core.exceptions import InvalidArgument, ResourceExhausted
+    from agents import portfolio
+    from agents.resilience import mensagem_erro_upstream
+    erros = {
+        "q1": mensagem_erro_upstream("Consulta GA4 falhou", ResourceExhausted("Exhausted property tokens")),
+        "q2": mensagem_erro_upstream("Consulta GA4 falhou", InvalidArgument("quota dimension is not valid"))
+    }
+    try:
+        resultado = relatorio_portfolio([{"property_id": pid} for pid in erros], erros.get, interpretar, ["sessions"])
+        assert [e["cota_esgotada"] for e in resultado["propriedades_com_erro"]] == [True, False]
+        assert "q1" in portfolio._cota_esgotada_ate and "q2" not in portfolio._cota_esgotada_ate
+    finally:
+        portfolio._cota_esgotada_ate.pop("q1", None)
+    print("OK Portfólio de propriedades GA4")
+    return True
+
+def test_search_console_shards():
+    """Testa o fatiamento do período e a mescla das fatias do Search Console."""
+    from agents.sharding import fatiar_periodo, mesclar_linhas_search_console
+    
+    assert fatiar_periodo("2025-01-30", "2025-03-02", "mes") == [
+        ("2025-01-30", "2025-01-31"), ("2025-02-01", "2025-02-28"), ("2025-03-01", "2025-03-02")
+    ]
+    semanas = fatiar_periodo("2025-01-01", "2025-01-14", "semana")
+    assert semanas[0] == ("2025-01-01", "2025-01-05") and semanas[-1] == ("2025-01-13", "2025-01-14")
+    
+    fatia_1 = [{"keys": ["seo"], "clicks": 10, "impressions": 100, "ctr": 0.1, "position": 2.0}]
+    fatia_2 = [{"keys": ["seo"], "clicks": 5, "impressions": 300, "ctr": 0.0167, "position": 6.0},
+               {"keys": ["ga4"], "clicks": 1, "impressions": 10, "ctr": 0.1, "position": 9.0}]
+    mescladas = mesclar_linhas_search_console([fatia_1, fatia_2])
+    assert mescladas[0] == {"keys": ["seo"], "clicks": 15, "impressions": 400, "ctr": 15 / 400, "position": 5.0}
+    assert mescladas[1]["keys"] == ["ga4"]
+    print("OK Fatiamento de períodos do Search Console")
+    return True
+
+def test_tenant_client_pool():
+    """Testa as credenciais por tenant e o pool LRU de clientes."""
+    import json
+    from agents.credentials import PoolClientes, TenantDesconhecido, carregar_credenciais, listar_tenants, tenant_configurado
+    
+    os.environ["TENANT_CREDENTIALS"] = json.dumps({"acme": {"client_email": "a@x"}, "beta": {"client_email": "b@x"}})
+    try:
+        assert listar_tenants() == ["acme", "beta"]
+        assert carregar_credenciais("acme") == {"client_email": "a@x"}
+        assert tenant_configurado("acme") and not tenant_configurado("outro") and not tenant_configurado("../acme")
+        for tenant in ("outro", "../acme"):
+            try:
+                carregar_credenciais(tenant)
+                assert False, "tenant desconhecido deveria falhar"
+            except TenantDesconhecido:
+                pass
+        
+        pool = PoolClientes(max_clientes=2)
+        fechados = []
+        
+        class Cliente(dict):
+            def close(self):
+                fechados.append(self)
+        
+        fabrica = lambda credenciais: Cliente(email=credenciais["client_email"])
+        cliente = pool.obter("acme", "ga4_data", fabrica)
+        assert pool.obter("acme", "ga4_data", fabrica) is cliente
+        assert pool.obter("beta", "ga4_data", fabrica)["email"] == "b@x"
+        pool.obter("beta", "ga4_admin", fabrica)
+        estatisticas = pool.estatisticas()
+        assert estatisticas["clientes"] == ["beta:ga4_data", "beta:ga4_admin"]
+        assert (estatisticas["construidos"], estatisticas["reutilizados"], estatisticas["removidos"]) == (3, 1, 1)
+        # O cliente removido pode estar em uso por outra thread: não é fechado
+        assert fechados == []
+    finally:
+        del os.environ["TENANT_CREDENTIALS"]
+    print("OK Credenciais por tenant e pool de clientes")
+    return True
+
+def test_hedging_serve_stale():
+    """Testa a segunda tentativa em chamadas lentas e o resultado vencido em falhas."""
+    import time
+    from agents.cache import cache_resultados, consultar_com_cache, resultado_com_erro, resultado_vencido
+    from agents.resilience import ChamadasProtegidas, PrazoExcedido
+    
+    chamadas = ChamadasProtegidas(max_workers=4, atraso_min_segundos=0.05, min_amostras=3)
+    for _ in range(3):
+        chamadas.latencias.registrar("lenta", 0.01)
+    tentativas = []
+    
+    def consulta(valor):
+        tentativas.append(valor)
+        time.sleep(1.0 if len(tentativas) == 1 else 0.0)
+        return f"{valor} | {len(tentativas)}"
+    
+    inicio = time.monotonic()
+    assert chamadas.executar("lenta", consulta, {"valor": "x"}, resultado_com_erro, prazo_segundos=5) == "x | 2"
+    assert time.monotonic() - inicio < 0.8
+    assert chamadas.contadores["hedges_disparados"] == 1 and chamadas.contadores["hedges_vencedores"] == 1
+    try:
+        chamadas.executar("nova", lambda: time.sleep(0.5) or "ok", {}, resultado_com_erro, prazo_segundos=0.1)
+        assert False, "prazo deveria estourar"
+    except PrazoExcedido:
+        assert chamadas.contadores["prazos_excedidos"] == 1
+    
+    cache_resultados.limpar()
+    respostas = ["campo | valor\na | 1", "[Erro] Consulta GA4 falhou: 503"]
+    consultar = lambda **argumentos: respostas.pop(0)
+    assert consultar_com_cache("ga4_pivot", consultar, {"vencido": 1}, prazo_segundos=5) == "campo | valor\na | 1"
+    assert resultado_vencido.get() is None
+    # Novo dia (ou consulta forçada): o serviço falha e o último resultado bom é servido
+    assert consultar_com_cache("ga4_pivot", consultar, {"vencido": 1}, forcar=True, prazo_segundos=5) == "campo | valor\na | 1"
+    assert resultado_vencido.get()["motivo"] == "erro"
+    cache_resultados.limpar()
+    
+    # Períodos que terminam hoje (ou depois) ficam pouco tempo em cache
+    from datetime import date, timedelta
+    from agents.cache import CACHE_TTL_HOJE_SEGUNDOS, ttl_consulta
+    amanha = (date.today() + timedelta(days=1)).isoformat()
+    assert ttl_consulta({"data_fim": "today"}) == ttl_consulta({"data_fim": amanha}) == CACHE_TTL_HOJE_SEGUNDOS
+    assert ttl_consulta({"data_fim": "yesterday"}) is None and ttl_consulta({"data_fim": "2024-01-31"}) is None
+    assert ttl_consulta({"data_fim": "yesterday", "periodos": [{"data_inicio": "7daysAgo", "data_fim": "today"}]}) == CACHE_TTL_HOJE_SEGUNDOS
+    consultar_com_cache("ga4_pivot", lambda **argumentos: "campo | valor", {"data_fim": "today"})
+    expira_em = next(iter(cache_resultados._entradas.values()))[0]
+    assert expira_em - time.time() <= CACHE_TTL_HOJE_SEGUNDOS
+    cache_resultados.limpar()
+    print("OK Hedging e resultado vencido")
+    return True
+
+def test_local_table_queries():
+    """Testa filtros, agrupamento e ordenação locais sobre uma tabela já consultada."""
+    from agents.tables import ArmazemTabelas, TabelaLocal, consultar_tabela
+    
+    colunas = ["País", "Dispositivo", "Cliques", "Impressões", "CTR", "Posição Média"]
+    linhas = [
+        ("Brasil", "mobile", 10, 100, 0.1, 2.0),
+        ("Brasil", "desktop", 5, 300, 0.0167, 6.0),
+        ("Chile", "mobile", 1, 10, 0.1, 9.0),
+        ("Brasil", "mobile", 4, 50, 0.08, 3.0)
+    ]
+    tabela = TabelaLocal(colunas, colunas[:2], linhas, ponderadas={"Posição Média": "Impressões"},
+                         razoes={"CTR": ("Cliques", "Impressões")})
+    
+    brasil = consultar_tabela(tabela, {"filtros": [{"campo": "País", "valor": "brasil"}], "ordenar_por": "Cliques", "limite": 2})
+    assert brasil["total_resultados"] == 3 and [d["Cliques"] for d in brasil["dados"]] == [10, 5]
+    
+    por_dispositivo = consultar_tabela(tabela, {"agrupar_por": "Dispositivo", "ordenar_por": "Cliques"})
+    assert por_dispositivo["dados"][0] == {"Dispositivo": "mobile", "Cliques": 15, "Impressões": 160, "CTR": 0.0938, "Posição Média": 2.75}
+    
+    contagem = consultar_tabela(tabela, {
+        "filtros": [{"campo": "Impressões", "operador": "maior_igual", "valor": 50}],
+        "agrupar_por": ["País"],
+        "agregacoes": [{"funcao": "contagem"}, {"campo": "Cliques", "funcao": "max"}]
+    })
+    assert contagem["dados"] == [{"País": "Brasil", "contagem": 3, "max_Cliques": 10}]
+    try:
+        consultar_tabela(tabela, {"filtros": [{"campo": "País", "operador": "maior", "valor": 1}]})
+        assert False, "operador numérico em dimensão deveria falhar"
+    except ValueError:
+        pass
+    
+    armazem = ArmazemTabelas(max_linhas=6)
+    assert armazem.guardar("a", tabela, tenant="acme") and armazem.guardar("b", tabela)
+    # "a" sai pelo limite de linhas; "b" não é visível para outro tenant
+    assert armazem.obter("a", "acme") is None and armazem.obter("b") is not None and armazem.obter("b", "acme") is None
+    print("OK Recortes locais de tabelas")
+    return True
+
+def test_realtime_poller():
+    """Testa o poller compartilhado de tempo real: fan-out, só mudanças, espera e encerramento."""
+    import time
+    from agents.realtime import GerenciadorRealtime, PollerRealtime
+    
+    chamadas = []
+    def consultar():
+        chamadas.append(1)
+        return {"colunas": ["country", "activeUsers"], "linhas": [["BR", (len(chamadas) - 1) // 2]]}
+    
+    poller = PollerRealtime("relatorio", consultar, intervalo_segundos=1, intervalo_max_segundos=4)
+    a, b = poller.assinar(), poller.assinar()
+    poller.executar_rodada()
+    evento = a.get_nowait()
+    assert b.get_nowait() is evento and evento["dados"] == [{"country": "BR", "activeUsers": 0}]
+    # Resultado igual não é republicado; a mudança vai para os dois assinantes
+    poller.executar_rodada()
+    assert a.empty() and b.empty()
+    poller.executar_rodada()
+    assert a.get_nowait()["dados"][0]["activeUsers"] == 1 and b.get_nowait()["dados"][0]["activeUsers"] == 1
+    
+    # Sem assinantes o intervalo dobra até o máximo; um novo assinante o traz de volta
+    poller.cancelar(a)
+    poller.cancelar(b)
+    for _ in range(3):
+        poller.executar_rodada()
+    assert poller.intervalo == 4
+    poller.assinar()
+    assert poller.intervalo == 1
+    
+    # Um poller por relatório, encerrado quando fica ocioso
+    gerenciador = GerenciadorRealtime(max_pollers=1)
+    p1, fila1 = gerenciador.assinar("x", consultar)
+    p2, fila2 = gerenciador.assinar("x", consultar)
+    assert p1 is p2 and fila1.get(timeout=2) is fila2.get(timeout=2)
+    p1.ocioso_segundos = 0
+    p1.cancelar(fila1)
+    p1.cancelar(fila2)
+    p1.parar()
+    p1._thread.join(timeout=2)
+    assert gerenciador._remover(p1) and not gerenciador.estatisticas()["pollers"]
+    
+    # Cliente que desconecta antes do primeiro evento não deixa a assinatura presa
+    os.environ['SKIP_GOOGLE_INIT'] = 'true'
+    import app as aplicacao
+    assert "limite" in aplicacao.preparar_consulta_realtime({"property_id": "1", "limite": 10 ** 6})[1]
+    assert "limite" in aplicacao.preparar_consulta_realtime({"property_id": "1", "limite": 0})[1]
+    gerenciador = GerenciadorRealtime()
+    originais = {nome: getattr(aplicacao, nome) for nome in ("gerenciador_realtime", "consulta_ga4_realtime") if hasattr(aplicacao, nome)}
+    aplicacao.gerenciador_realtime = gerenciador
+    aplicacao.consulta_ga4_realtime = lambda **argumentos: {"colunas": ["activeUsers"], "linhas": []}
+    del os.environ['SKIP_GOOGLE_INIT']
+    try:
+        resposta = aplicacao.app.test_client().get('/ga4/realtime/stream?property_id=1')
+        poller = next(iter(gerenciador._pollers.values()))
+        assert resposta.status_code == 200 and poller.assinantes() == 1
+        resposta.close()
+        assert poller.assinantes() == 0
+        poller.parar()
+    finally:
+        os.environ['SKIP_GOOGLE_INIT'] = 'true'
+        for nome in ("gerenciador_realtime", "consulta_ga4_realtime"):
+            if nome in originais:
+                setattr(aplicacao, nome, originais[nome])
+            else:
+                delattr(aplicacao, nome)
+    print("OK Poller de tempo real")
+    return True
+
+def test_export_checkpoint_resume():
+    """Testa a exportação em partes, a retomada pelo checkpoint e o download com Range."""
+    import tempfile
+    os.environ['SKIP_GOOGLE_INIT'] = 'true'
+    import app as aplicacao
+    from agents.exports import GerenciadorExportacoes
+    
+    paginas_pedidas = []
+    falhar_em = [2]
+    def paginar(parametros, inicio, linhas_por_pagina):
+        for offset in range(inicio, 25, linhas_por_pagina):
+            paginas_pedidas.append(offset)
+            if falhar_em[0] is not None and offset >= falhar_em[0] * linhas_por_pagina:
+                raise RuntimeError("cota esgotada")
+            yield {
+                "colunas": ["Consulta", "Cliques"],
+                "tipos": {"Consulta": "texto", "Cliques": "inteiro"},
+                "linhas": [(f"q{i}", i) for i in range(offset, min(25, offset + linhas_por_pagina))],
+                "proximo": offset + linhas_por_pagina if offset + linhas_por_pagina < 25 else None,
+                "total": 25
+            }
+    
+    gerenciador = GerenciadorExportacoes(diretorio=tempfile.mkdtemp(), linhas_por_pagina=10)
+    gerenciador.fontes = {"search_console": paginar}
+    export_id = gerenciador.criar("search_console", "csv", {"site_url": "example.com"})["export_id"]
+    
+    falha = gerenciador.executar(export_id)
+    assert falha["status"] == "erro" and falha["partes_prontas"] == 2 and falha["proximo_inicio"] == 20
+    falhar_em[0] = None
+    concluida = gerenciador.executar(export_id)
+    # A retomada pede só a página que faltava
+    assert concluida["status"] == "concluido" and concluida["linhas"] == 25 and paginas_pedidas == [0, 10, 20, 20]
+    
+    original = aplicacao.gerenciador_exportacoes
+    aplicacao.gerenciador_exportacoes = gerenciador
+    try:
+        client = aplicacao.app.test_client()
+        arquivo = client.get(f'/exports/{export_id}/arquivo')
+        linhas = arquivo.data.decode('utf-8').splitlines()
+        assert arquivo.status_code == 200 and linhas[0] == "Consulta,Cliques" and linhas[1:] == [f"q{i},{i}" for i in range(25)]
+        parcial = client.get(f'/exports/{export_id}/arquivo', headers={"Range": "bytes=0-7"})
+        assert parcial.status_code == 206 and parcial.data == b"Consulta"
+        assert client.post(f'/exports/{export_id}/retomar').status_code == 409
+        assert client.get(f'/exports/{export_id}', headers={"X-Tenant-ID": "outro"}).status_code == 404
+    finally:
+        aplicacao.gerenciador_exportacoes = original
+    print("OK Exportação com checkpoint")
+    return True
+
+def test_admission_control():
+    """Testa a fila curta por API e os limites de taxa e concorrência por cliente."""
+    import threading
+    import time
+    from agents.admission import LimitesCliente, LimiteUpstream, Sobrecarga
+    
+    limite = LimiteUpstream("GA4", max_em_voo=1, max_fila=1, espera_max_segundos=0.5)
+    liberar = threading.Event()
+    def ocupar():
+        with limite.admitir():
+            liberar.wait(2)
+    ocupante = threading.Thread(target=ocupar)
+    ocupante.start()
+    while limite.em_voo < 1:
+        time.sleep(0.01)
+    
+    # Uma requisição espera na fila; a seguinte é recusada na hora
+    def esperar():
+        with limite.admitir():
+            pass
+    esperando = threading.Thread(target=esperar)
+    esperando.start()
+    while limite.na_fila < 1:
+        time.sleep(0.01)
+    try:
+        with limite.admitir():
+            assert False, "fila cheia deveria recusar"
+    except Sobrecarga as e:
+        assert e.motivo == "fila_cheia" and e.retry_after >= 1
+    liberar.set()
+    ocupante.join()
+    esperando.join()
+    estatisticas = limite.estatisticas()
+    assert estatisticas["esperaram"] == 1 and estatisticas["admitidas"] == 2 and estatisticas["em_voo"] == 0
+    
+    clientes = LimitesCliente(max_simultaneas=1, taxa_por_minuto=60, rajada=2)
+    with clientes.admitir("a"):
+        try:
+            with clientes.admitir("a"):
+                assert False, "segunda requisição simultânea deveria ser recusada"
+        except Sobrecarga as e:
+            assert e.motivo == "cliente_simultaneas"
+        with clientes.admitir("b"):
+            pass
+    # Recusas não gastam fichas: a segunda ficha de "a" ainda está disponível
+    with clientes.admitir("a"):
+        pass
+    try:
+        with clientes.admitir("a"):
+            pass
+        assert False, "rajada de 2 esgotada"
+    except Sobrecarga as e:
+        assert e.motivo == "cliente_taxa" and e.retry_after == 1
+    
+    # A vaga segue ocupada enquanto a chamada que passou do prazo continua no serviço
+    from agents.cache import cache_resultados, consultar_com_cache
+    from agents.resilience import PrazoExcedido
+    vaga = LimiteUpstream("GA4", max_em_voo=1)
+    try:
+        consultar_com_cache("ga4_pivot", lambda **argumentos: time.sleep(0.4) or "campo | valor", {"vaga": 1},
+                            prazo_segundos=0.05, admissao=vaga.admitir)
+        assert False, "prazo deveria estourar"
+    except PrazoExcedido:
+        assert vaga.em_voo == 1
+    time.sleep(0.6)
+    assert vaga.em_voo == 0
+    cache_resultados.limpar()
+    
+    # O cliente é o IP de origem; X-Forwarded-For só vale pela entrada do proxy confiável
+    os.environ['SKIP_GOOGLE_INIT'] = 'true'
+    import app as aplicacao
+    cabecalhos = {"X-Client-ID": "forjado", "X-Forwarded-For": "1.1.1.1, 203.0.113.9"}
+    with aplicacao.app.test_request_context(headers=cabecalhos, environ_base={"REMOTE_ADDR": "10.0.0.2"}):
+        assert aplicacao.identificar_cliente() == "10.0.0.2"
+        original = aplicacao.ADMISSAO_PROXIES_CONFIAVEIS
+        aplicacao.ADMISSAO_PROXIES_CONFIAVEIS = 1
+        try:
+            assert aplicacao.identificar_cliente() == "203.0.113.9"
+        finally:
+            aplicacao.ADMISSAO_PROXIES_CONFIAVEIS = original
+    print("OK Controle de admissão")
+    return True
+
+def test_token_refresh():
+    """Testa a renovação dos tokens em segundo plano antes de expirarem."""
+    import gc
+    from datetime import datetime, timedelta, timezone
+    from agents.credentials import RenovadorTokens
+    
+    class Credenciais:
+        def __init__(self, validade_segundos, falhar=False):
+            self.token = None
+            self.expiry = None
+            self.validade_segundos = validade_segundos
+            self.falhar = falhar
+            self.trocas = 0
+        
+        def refresh(self, requisicao):
+            if self.falhar:
+                raise RuntimeError("invalid_grant")
+            self.trocas += 1
+            self.token = f"token-{self.trocas}"
+            self.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=self.validade_segundos)
+    
+    renovador = RenovadorTokens(antecedencia_segundos=600, espera_falha_segundos=30, requisicao=object())
+    curta, longa, quebrada = Credenciais(300), Credenciais(3600), Credenciais(3600, falhar=True)
+    renovador._thread = False  # sem thread: as rodadas são executadas pelo teste
+    for nome, credenciais in (("a:ga4_data", curta), ("b:search_console", longa), ("c:ga4_data", quebrada)):
+        assert renovador.acompanhar(nome, credenciais) is credenciais
+    
+    # Sem token, todas são renovadas na primeira rodada; a falha é repetida depois de 30s
+    espera = renovador.executar_rodada()
+    assert (curta.token, longa.token, quebrada.token) == ("token-1", "token-1", None)
+    assert 1 <= espera <= 30
+    # Nada perto de expirar: ninguém é renovado (o token de 5 min espera a metade da validade)
+    renovador.executar_rodada()
+    assert (curta.trocas, longa.trocas) == (1, 1)
+    longa.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=500)
+    renovador.executar_rodada()
+    assert (curta.trocas, longa.trocas) == (1, 2) and longa.token == "token-2"
+    
+    estatisticas = renovador.estatisticas()
+    assert (estatisticas["renovacoes"], estatisticas["falhas"]) == (3, 1)
+    assert estatisticas["latencia_p95_segundos"] is not None
+    por_nome = {c["nome"]: c for c in estatisticas["credenciais"]}
+    assert por_nome["c:ga4_data"]["ultimo_erro"] == "invalid_grant"
+    assert 3000 < por_nome["b:search_console"]["expira_em_segundos"] <= 3600
+    
+    # Credenciais de clientes descartados deixam de ser renovadas
+    del quebrada, credenciais
+    gc.collect()
+    renovador.executar_rodada()
+    assert [c["nome"] for c in renovador.estatisticas()["credenciais"]] == ["a:ga4_data", "b:search_console"]
+    print("OK Renovação de tokens em segundo plano")
+    return True
+
+def test_report_batching():
+    """Testa o agrupamento de relatórios simultâneos em chamadas em lote."""
+    import threading
+    from google.api_core.exceptions import InvalidArgument, ResourceExhausted
+    from agents.batching import AgrupadorRelatorios
+    
+    agrupador = AgrupadorRelatorios(janela_ms=200, max_lote=3)
+    lotes, individuais = [], []
+    
+    def individual(pedido):
+        individuais.append(pedido)
+        return f"resposta {pedido}"
+    
+    def em_lote(pedidos):
+        lotes.append(list(pedidos))
+        if "invalido" in pedidos:
+            raise InvalidArgument("Field invalido is not a valid dimension")
+        if "sem_cota" in pedidos:
+            raise ResourceExhausted("Exhausted property tokens")
+        return [f"resposta {p}" for p in pedidos]
+    
+    def executar(pedido, chave):
+        try:
+            return agrupador.executar(chave, pedido, individual, em_lote)
+        except ResourceExhausted as e:
+            return e
+    
+    def disparar(pedidos, chave=lambda p: "p1"):
+        respostas = {}
+        threads = [
+            threading.Thread(target=lambda p=p: respostas.__setitem__(p, executar(p, chave(p))))
+            for p in pedidos
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return respostas
+    
+    # 4 pedidos da mesma propriedade: um lote cheio de 3 e um pedido sozinho
+    respostas = disparar(["a", "b", "c", "d"])
+    assert respostas == {p: f"resposta {p}" for p in "abcd"}
+    assert [len(lote) for lote in lotes] == [3] and len(individuais) == 1
+    # Propriedades diferentes não se misturam
+    lotes.clear(); individuais.clear()
+    disparar(["x1", "x2", "y1"], chave=lambda p: p[0])
+    assert sorted(map(sorted, lotes)) == [["x1", "x2"]] and individuais == ["y1"]
+    # Um pedido inválido derruba o lote; cada um repete sozinho e só ele falha na API
+    lotes.clear(); individuais.clear()
+    respostas = disparar(["ok", "invalido"])
+    assert len(lotes) == 1 and sorted(individuais) == ["invalido", "ok"]
+    assert respostas["ok"] == "resposta ok"
+    # Cota esgotada é do lote inteiro: o erro vai para todos, sem repetir um a um
+    lotes.clear(); individuais.clear()
+    respostas = disparar(["ok", "sem_cota"])
+    assert len(lotes) == 1 and individuais == []
+    assert all(isinstance(resposta, ResourceExhausted) for resposta in respostas.values())
+    
+    estatisticas = agrupador.estatisticas()
+    assert (estatisticas["lotes"], estatisticas["chamadas_evitadas"], estatisticas["falhas_lote"]) == (2, 3, 2)
+    # Janela 0: sem espera e sem lotes
+    assert AgrupadorRelatorios(janela_ms=0).executar("p1", "z", individual, em_lote) == "resposta z"
+    print("OK Agrupamento de relatórios em lote")
+    return True
+
+def test_shared_disk_cache():
+    """Testa o cache em disco compartilhado entre workers e mantido entre reinícios."""
+    import subprocess
+    import tempfile
+    import time
+    from agents.cache import CacheResultados
+    from agents.disk_cache import CacheDisco
+    
+    with tempfile.TemporaryDirectory() as diretorio:
+        caminho = os.path.join(diretorio, "cache.sqlite3")
+        # Outro processo (worker) busca e guarda o resultado
+        subprocess.run([sys.executable, "-c", (
+            "from agents.cache import CacheResultados; from agents.disk_cache import CacheDisco; "
+            f"CacheResultados(disco=CacheDisco({caminho!r})).guardar('a:hoje', {{'linhas': [[1, 2]]}}, 'a')"
+        )], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        
+        assert os.stat(caminho).st_mode & 0o777 == 0o600
+        worker = CacheResultados(disco=CacheDisco(caminho))
+        assert worker.obter("a:hoje") == {"linhas": [[1, 2]]}
+        assert worker.obter("a:hoje") == {"linhas": [[1, 2]]}
+        estatisticas = worker.estatisticas()
+        assert (estatisticas["acertos"], estatisticas["acertos_disco"]) == (2, 1)
+        
+        # Expirado não é acerto, mas ainda serve como último resultado bom
+        disco = CacheDisco(caminho)
+        disco.guardar("b:hoje", "campo | valor", time.time() - 1, "b")
+        assert CacheResultados(disco=disco).obter("b:hoje") is None
+        assert CacheResultados(disco=disco).obter_ultimo("b")[1] == "campo | valor"
+        # O resultado de um novo dia substitui o do anterior
+        disco.guardar("b:amanha", "campo | valor\nx | 1", time.time() + 60, "b")
+        assert disco.estatisticas()["entradas"] == 2
+        
+        # Acima do tamanho máximo, saem os menos acessados
+        pequeno = CacheDisco(caminho, max_mb=0.01)
+        for i in range(20):
+            pequeno.guardar(f"grande{i}:hoje", os.urandom(1000).hex(), time.time() + 60, f"grande{i}")
+        estatisticas = pequeno.estatisticas()
+        assert estatisticas["bytes"] <= estatisticas["max_bytes"] and estatisticas["descartes"] > 0
+        assert pequeno.obter("grande19:hoje") is not None
+        assert pequeno.obter("a:hoje") is None
+        pequeno.limpar()
+        assert disco.estatisticas()["entradas"] == 0
+    print("OK Cache em disco compartilhado")
+    return True
+
+def test_timeseries_analysis():
+    """Testa a análise de séries diárias: variações, média móvel, anomalias e contribuintes."""
+    from datetime import date, timedelta
+    import math
+    from agents.timeseries import analisar_serie, contribuintes, fim_com_dados, preencher_serie, resolver_data
+    
+    inicio = date(2024, 1, 1)  # segunda-feira
+    # Dias úteis valem 100 e fins de semana 40; em 20/03 o tráfego cai para 10; 10/02 não veio da API
+    pontos = {inicio + timedelta(days=i): (100 if (inicio + timedelta(days=i)).weekday() < 5 else 40) for i in range(91)}
+    pontos[date(2024, 3, 20)] = 10
+    del pontos[date(2024, 2, 10)]
+    valores = preencher_serie(pontos, inicio, date(2024, 3, 31))
+    assert len(valores) == 91 and valores[40] == 0.0
+    
+    resumo = analisar_serie(inicio, valores, janela_media=7, ano_anterior=[100] * 5 + [40] * 2)
+    assert resumo["periodo"] == {"inicio": "2024-01-01", "fim": "2024-03-31", "dias": 91}
+    assert resumo["media_movel"]["atual"] == round(580 / 7, 4)
+    assert resumo["semana_contra_semana"] == {"atual": 580.0, "anterior": 490.0, "delta": 90.0, "delta_pct": 18.37}
+    assert resumo["ano_contra_ano"]["delta_pct"] == 0.0
+    # A sazonalidade semanal não é anomalia; o dia sem dados e a queda de 20/03 são (maior |z| primeiro)
+    assert [dia["data"] for dia in resumo["anomalias"]["dias"]] == ["2024-02-10", "2024-03-20"]
+    assert resumo["anomalias"]["dias"][1]["direcao"] == "queda" and resumo["anomalias"]["dias"][1]["esperado"] == 100.0
+    assert len(resumo["semanas"]) == 13 and resumo["semanas"][-1]["valor"] == 580.0
+    # Taxas são comparadas pela média, não pela soma
+    assert analisar_serie(inicio, [0.5] * 14, aditiva=False)["semana_contra_semana"]["atual"] == 0.5
+    # Em taxas, o dia sem dados fica vazio: não vira 0 nem anomalia, e sai das médias
+    taxas = preencher_serie({dia: 0.5 for dia in pontos}, inicio, date(2024, 3, 31), aditiva=False)
+    assert math.isnan(taxas[40])
+    resumo_taxa = analisar_serie(inicio, taxas, aditiva=False)
+    assert resumo_taxa["valor_periodo"] == 0.5 and resumo_taxa["tendencia"]["inclinacao_por_dia"] == 0.0
+    assert resumo_taxa["semanas"][5]["valor"] == 0.5 and resumo_taxa["anomalias"]["total"] == 0
+    assert resumo_taxa["anomalias"]["dias_avaliados"] == 62
+    # Dias finais ainda não publicados pelo Search Console saem da série; lacunas antigas, não
+    assert fim_com_dados(pontos, inicio, date(2024, 4, 3), 3, hoje=date(2024, 4, 3)) == date(2024, 3, 31)
+    assert fim_com_dados(pontos, inicio, date(2024, 4, 3), 3, hoje=date(2024, 5, 1)) == date(2024, 4, 3)
+    # Pelo z-score dos 28 dias anteriores, que misturam dias úteis e fins de semana, a base varia
+    # mais e só o dia zerado passa do limiar
+    por_zscore = analisar_serie(inicio, valores, metodo="zscore")["anomalias"]
+    assert por_zscore["dias_avaliados"] == 63 and [dia["data"] for dia in por_zscore["dias"]] == ["2024-02-10"]
+    
+    principais = contribuintes({"BR": 50, "CL": 30, "PE": 5}, {"BR": 80, "CL": 28, "AR": 10}, top=2)
+    assert principais["delta_total"] == -33.0 and principais["itens_restantes"] == 2
+    assert [(item["valor"], item["delta"]) for item in principais["itens"]] == [("BR", -30.0), ("AR", -10.0)]
+    assert resolver_data("yesterday", hoje=date(2024, 3, 1)) == date(2024, 2, 29)
+    assert resolver_data("20240105") == resolver_data("2024-01-05") == date(2024, 1, 5)
+    
+    # Parâmetros fora do tipo ou da faixa são recusados antes de consultar
+    os.environ['SKIP_GOOGLE_INIT'] = 'true'
+    import app as aplicacao
+    corpo = {"site_url": "https://example.com/", "data_inicio": "2024-01-01", "data_fim": "2024-03-31"}
+    assert aplicacao.preparar_serie(corpo)[1] is None
+    for campo, valor in (("max_anomalias", 0), ("max_anomalias", "5"), ("top_contribuintes", 10 ** 6),
+                         ("janela_media", True), ("comparar_ano", "false"), ("limiar_z", True)):
+        plano, erro = aplicacao.preparar_serie({**corpo, campo: valor})
+        assert plano is None and campo in erro
+    print("OK Análise de séries diárias")
+    return True
+
+def test_query_planner():
+    """Testa o planejador: inline sem sondagem, streaming NDJSON e entrega a um job pelo tamanho estimado."""
+    import json
+    import time
+    os.environ['SKIP_GOOGLE_INIT'] = 'true'
+    import app as aplicacao
+    from agents.analytics import interpretar_resultado_ga4
+    from agents.cache import cache_resultados
+    from agents.jobs import STATUS_FINAIS
+    from agents.admission import ControleAdmissao
+    from agents.planner import PlanejadorConsultas
+    
+    planejador = PlanejadorConsultas(limiar_streaming=100, limiar_job=1000)
+    sondagens = []
+    def sondar():
+        sondagens.append(True)
+        return {"linhas": 500, "exato": True}
+    # Limite pequeno não paga a sondagem
+    assert planejador.planejar(50, sondar=sondar)["modo"] == "inline" and not sondagens
+    assert planejador.planejar(5000, sondar=sondar) == {"modo": "streaming", "motivo": "sondagem", "linhas_estimadas": 500, "estimativa_exata": True}
+    assert planejador.planejar(5000, sondar=lambda: {"linhas": 10 ** 6, "exato": True})["modo"] == "job"
+    # Sem estimativa vale o pior caso; o modo pedido pelo cliente prevalece
+    assert planejador.planejar(5000, sondar=lambda: None)["modo"] == "job"
+    assert planejador.planejar(5000, "inline", sondar=sondar)["modo"] == "inline" and len(sondagens) == 1
+    assert planejador.marcos(500) == [100] and planejador.marcos(5000) == [100, 1000]
+    
+    total = {"linhas": 250}
+    def estimar(**argumentos):
+        sondagens.append(argumentos)
+        return {"linhas": total["linhas"], "exato": True}
+    paginas_pedidas = []
+    def paginar(parametros, inicio=0, linhas_por_pagina=50000):
+        for offset in range(inicio, total["linhas"], linhas_por_pagina):
+            paginas_pedidas.append(offset)
+            fim = min(total["linhas"], offset + linhas_por_pagina)
+            yield {
+                "colunas": ["pagePath", "sessions"],
+                "tipos": {"pagePath": "texto", "sessions": "inteiro"},
+                "linhas": [(f"/p{i}", i) for i in range(offset, fim)],
+                "proximo": fim if fim < total["linhas"] else None,
+                "total": total["linhas"]
+            }
+    
+    globais = {
+        "planejador_consultas": planejador,
+        # Limites de taxa próprios: as requisições dos testes anteriores não contam contra este
+        "controle_admissao": ControleAdmissao(),
+        "PLANO_LINHAS_POR_PAGINA": 40,
+        "estimar_linhas_ga4": estimar,
+        "paginas_relatorio_ga4": paginar,
+        "consulta_ga4": lambda **argumentos: "pagePath | sessions\n/p0 | 10",
+        "interpretar_resultado_ga4": interpretar_resultado_ga4,
+        # Sem as APIs do Google, as demais funções de consulta nem são importadas
+        "consulta_ga4_pivot": None,
+        "consulta_search_console_custom": None,
+        "estimar_linhas_search_console": None
+    }
+    originais = {nome: getattr(aplicacao, nome) for nome in globais if hasattr(aplicacao, nome)}
+    for nome, valor in globais.items():
+        setattr(aplicacao, nome, valor)
+    try:
+        cache_resultados.limpar()
+        client = aplicacao.app.test_client()
+        corpo = {"property_id": "properties/planner", "dimensoes": ["pagePath"], "metricas": ["sessions"]}
+        sondagens.clear()
+        
+        # Limite pequeno: resposta inline de sempre, sem sondagem
+        inline = client.post('/ga4/query', json={**corpo, "limite": 10})
+        assert inline.status_code == 200 and inline.get_json()["total_resultados"] == 1 and not sondagens
+        
+        # 250 linhas, limite 200: streaming em páginas de 40, cortado no limite
+        stream = client.post('/ga4/query', json={**corpo, "limite": 200})
+        linhas = [json.loads(linha) for linha in stream.data.decode('utf-8').splitlines()]
+        assert stream.status_code == 200 and stream.mimetype == "application/x-ndjson"
+        assert linhas[0]["tipo"] == "inicio" and linhas[0]["plano"]["linhas_estimadas"] == 200
+        assert linhas[0]["colunas"] == ["pagePath", "sessions"] and linhas[1] == ["/p0", 0] and len(linhas) == 202
+        assert linhas[-1] == {"tipo": "fim", "total_resultados": 200} and paginas_pedidas == [0, 40, 80, 120, 160]
+        assert len(sondagens) == 1 and "limite" not in sondagens[0]
+        assert linhas[0]["omitidos"] == ["resumo", "tabela_id"]
+        
+        # Opções que o streaming não aplica: 400 se o streaming foi pedido; no automático, vai para um job
+        recusada = client.post('/ga4/query', json={**corpo, "limite": 200, "layout": "columnar", "modo_execucao": "streaming"})
+        assert recusada.status_code == 400 and "layout" in recusada.get_json()["erro"]
+        com_resumo = client.post('/ga4/query', json={**corpo, "limite": 200, "top_k": 3})
+        assert com_resumo.status_code == 202 and com_resumo.get_json()["plano"]["motivo"] == "opcoes_sem_streaming"
+        job_resumo = com_resumo.get_json()["job"]["job_id"]
+        for _ in range(200):
+            if client.get(f'/jobs/{job_resumo}').get_json()["job"]["status"] in STATUS_FINAIS:
+                break
+            time.sleep(0.01)
+        
+        # Resultado maior que o limiar de job: 202 com os links do job (a sondagem do período anterior está em cache)
+        total["linhas"] = 50000
+        entregue = client.post('/ga4/query', json={**corpo, "limite": 20000, "data_inicio": "90daysAgo"})
+        assert entregue.status_code == 202 and entregue.get_json()["plano"]["modo"] == "job"
+        job_id = entregue.get_json()["job"]["job_id"]
+        for _ in range(200):
+            if client.get(f'/jobs/{job_id}').get_json()["job"]["status"] in STATUS_FINAIS:
+                break
+            time.sleep(0.01)
+        resultado = client.get(f'/jobs/{job_id}/resultado')
+        assert resultado.status_code == 200 and resultado.get_json()["total_resultados"] == 1
+        
+        assert client.post('/ga4/query', json={**corpo, "modo_execucao": "turbo"}).status_code == 400
+        invalido = client.post('/ga4/query', json={**corpo, "limite": "50"})
+        assert invalido.status_code == 400 and "limite" in invalido.get_json()["erro"]
+        for limite in (True, 0, 2.5):
+            assert "limite" in aplicacao.preparar_consulta_ga4({**corpo, "limite": limite})[1]
+        estatisticas = client.get('/cache/stats').get_json()["planejador"]
+        assert (estatisticas["inline"], estatisticas["streaming"], estatisticas["job"]) == (3, 2, 4)
+    finally:
+        for nome in globais:
+            if nome in originais:
+                setattr(aplicacao, nome, originais[nome])
+            else:
+                delattr(aplicacao, nome)
+    print("OK Planejador de consultas")
+    return True
+
+def test_ga4_row_conversion():
+    """Testa a leitura das linhas do GA4 direto do protobuf, igual ao caminho proto-plus."""
+    import agents.analytics as analytics
+    from google.analytics.data_v1beta.types import MetricType, RunReportResponse
+    from agents.ga4_rows import cabecalhos, linhas_tipadas, mensagem_protobuf, valores_texto
+    
+    response = RunReportResponse(
+        dimension_headers=[{"name": "country"}],
+        metric_headers=[{"name": "sessions", "type_": MetricType.TYPE_INTEGER}, {"name": "bounceRate", "type_": MetricType.TYPE_FLOAT}],
+        rows=[
+            {"dimension_values": [{"value": pais}], "metric_values": [{"value": str(sessoes)}, {"value": "0.25"}]}
+            for pais, sessoes in (("Brazil", 30), ("Chile", 20), ("Peru", 10))
+        ],
+        row_count=3
+    )
+    # A mensagem protobuf é a mesma por trás do wrapper; uma mensagem protobuf passa direto
+    assert mensagem_protobuf(response) is RunReportResponse.pb(response)
+    assert mensagem_protobuf(mensagem_protobuf(response)) is RunReportResponse.pb(response)
+    assert cabecalhos(response) == (["country"], ["sessions", "bounceRate"])
+    assert valores_texto(response) == [
+        [d.value for d in row.dimension_values] + [m.value for m in row.metric_values] for row in response.rows
+    ]
+    assert valores_texto(response, 1) == [["Brazil", "30", "0.25"]]
+    colunas, tipos, linhas = linhas_tipadas(response)
+    assert tipos == {"country": "texto", "sessions": "inteiro", "bounceRate": "decimal"}
+    assert linhas[2] == ("Peru", 10, 0.25) and isinstance(linhas[2][1], int)
+    
+    # consulta_ga4 monta o mesmo texto de antes a partir do protobuf
+    pedidos = []
+    class Cliente:
+        def run_report(self, request):
+            pedidos.append(request)
+            return response
+    original = analytics.cliente_ga4
+    analytics.cliente_ga4 = lambda tenant=None: Cliente()
+    try:
+        texto = analytics.consulta_ga4(property_id="123", limite=2)
+        # A paginação ordena por todas as dimensões, para limit/offset serem estáveis entre páginas
+        paginas = list(analytics.paginas_relatorio_ga4({"property_id": "123", "dimensoes": ["country", " city"], "metricas": ["sessions"]}))
+    finally:
+        analytics.cliente_ga4 = original
+    assert texto == "country | sessions | bounceRate\nBrazil | 30 | 0.25\nChile | 20 | 0.25"
+    assert len(paginas) == 1 and paginas[0]["total"] == 3
+    assert [o.dimension.dimension_name for o in pedidos[-1].order_bys] == ["country", "city"]
+    print("OK Conversão de linhas do GA4 pelo protobuf")
+    return True
+
 def main():
     """Executa todos os testes."""
     print("Iniciando testes da aplicacao DexGPT...\n")
@@ -89,7 +1214,30 @@ def main():
     tests = [
         ("Import basico", test_basic_import),
         ("Criacao da aplicacao", test_app_creation),
-        ("Endpoint de saude", test_health_endpoint)
+        ("Endpoint de saude", test_health_endpoint),
+        ("Layout colunar", test_columnar_layout),
+        ("Respostas condicionais", test_conditional_responses),
+        ("Resumo top-K", test_summary_top_k),
+        ("Junção de landing pages", test_landing_page_join),
+        ("Comparação entre períodos", test_period_comparison),
+        ("Jobs assíncronos", test_async_jobs),
+        ("Cache e pré-aquecimento", test_query_cache_prewarm),
+        ("Metadados GA4", test_ga4_metadata_validation),
+        ("Linhas do Search Console", test_search_console_rows),
+        ("Portfólio GA4", test_portfolio_merge),
+        ("Fatias do Search Console", test_search_console_shards),
+        ("Pool de clientes por tenant", test_tenant_client_pool),
+        ("Hedging e resultado vencido", test_hedging_serve_stale),
+        ("Recortes locais de tabelas", test_local_table_queries),
+        ("Poller de tempo real", test_realtime_poller),
+        ("Exportação com checkpoint", test_export_checkpoint_resume),
+        ("Controle de admissão", test_admission_control),
+        ("Renovação de tokens", test_token_refresh),
+        ("Agrupamento em lote", test_report_batching),
+        ("Cache em disco compartilhado", test_shared_disk_cache),
+        ("Análise de séries", test_timeseries_analysis),
+        ("Planejador de consultas", test_query_planner),
+        ("Conversão de linhas do GA4", test_ga4_row_conversion)
     ]
     
     results = []